@@ -0,0 +1,82 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of discussions listing on an user index.
+
+Compare latency of the single search of discussions summaries used to
+build a page of discussions with the former way (terms aggregation then
+one search per discussion for its last message), for different page sizes.
+
+Needs a running elasticsearch with messages indexed for the user and
+discussions summaries built (see rebuild_discussions command).
+
+Usage:
+    bench_discussions.py [-c caliopen.yaml] [-n loops] -u user_id
+                         [-s 10,20,50,100]
+
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import os
+import time
+
+from caliopen_storage.config import Configuration
+
+here = os.path.dirname(os.path.abspath(__file__))
+default_conf = os.path.join(here, '../../src/backend/configs/'
+                                  'caliopen.yaml.template')
+
+
+def list_n_plus_one(dim, limit):
+    """Build a page of discussions with one request per discussion."""
+    from elasticsearch_dsl import A
+
+    search = dim._prepare_search(). \
+        filter("range", importance_level={'gte': -10, 'lte': 10})
+    agg = A('terms', field='discussion_id',
+            order={'last_message': 'desc'}, size=limit * 2,
+            shard_size=limit * 2)
+    search.aggs.bucket('discussions', agg) \
+        .metric('last_message', 'max', field='date_insert')
+    result = search.execute()
+    buckets = result.aggregations.discussions.buckets[:limit]
+    return [dim.get_last_message(x['key'], -10, 10, True) for x in buckets]
+
+
+def list_single(dim, limit):
+    """Build a page of discussions with a single request."""
+    return dim.list_discussions(limit=limit)[0]
+
+
+def timeit(func, dim, limit, loops):
+    best = None
+    for i in range(loops):
+        start = time.time()
+        func(dim, limit)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(user_id, sizes, loops):
+    from caliopen_main.discussion.store import DiscussionIndexManager
+
+    dim = DiscussionIndexManager(user_id)
+    print('{:>6} {:>12} {:>12}'.format('size', 'n+1 (ms)', 'single (ms)'))
+    for size in sizes:
+        legacy = timeit(list_n_plus_one, dim, size, loops)
+        single = timeit(list_single, dim, size, loops)
+        print('{:>6} {:>12.1f} {:>12.1f}'.
+              format(size, legacy * 1000, single * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', dest='conffile', default=default_conf)
+    parser.add_argument('-n', dest='loops', type=int, default=5)
+    parser.add_argument('-u', dest='user_id', required=True)
+    parser.add_argument('-s', dest='sizes', default='10,20,50,100')
+    args = parser.parse_args()
+    Configuration.load(args.conffile, 'global')
+    run(args.user_id, [int(x) for x in args.sizes.split(',')], args.loops)
@@ -0,0 +1,93 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of mail parsing on devtools fixtures.
+
+Each mail is parsed with MailMessage then its properties are read as the
+inbound delivery does (qualification, lookups, privacy features). With -H
+only headers based properties are read, as mailbox import or discussion
+lookups do.
+
+Usage:
+    bench_mail_parse.py [-c caliopen.yaml] [-n loops] [-H] [paths...]
+
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import os
+import time
+
+from caliopen_storage.config import Configuration
+
+here = os.path.dirname(os.path.abspath(__file__))
+default_conf = os.path.join(here, '../../src/backend/configs/'
+                                  'caliopen.yaml.template')
+default_paths = [os.path.join(here, '../fixtures/raw_emails'),
+                 os.path.join(here, '../fixtures/mbox')]
+
+
+def load_mails(paths):
+    """Return raw content of all files found under paths."""
+    mails = []
+    for path in paths:
+        for root, dirs, files in os.walk(path):
+            for name in sorted(files):
+                with open(os.path.join(root, name)) as f:
+                    mails.append(f.read())
+    return mails
+
+
+def process(mail):
+    """Read properties like inbound qualification does."""
+    mail.subject
+    mail.body_html
+    mail.body_plain
+    mail.date
+    mail.size
+    mail.external_references
+    mail.lookup_discussion_sequence()
+    mail.participants
+    mail.extra_parameters
+    mail.headers.get('Received', [])
+    # signature and encryption features
+    [x for x in mail.attachments if x.content_type.startswith('multipart')]
+    [x for x in mail.attachments if 'encrypted' in x.content_type]
+    mail.attachments
+
+
+def process_headers(mail):
+    """Read headers based properties only."""
+    mail.subject
+    mail.date
+    mail.external_references
+    mail.lookup_discussion_sequence()
+    mail.participants
+    mail.headers
+
+
+def run(loops, paths, headers_only=False):
+    from caliopen_main.message.parsers.mail import MailMessage
+
+    mails = load_mails(paths)
+    func = process_headers if headers_only else process
+    best = None
+    for i in range(loops):
+        start = time.time()
+        for raw in mails:
+            func(MailMessage(raw))
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('{} mails, best of {}: {:.3f} s ({:.2f} ms/mail)'.
+          format(len(mails), loops, best, best * 1000 / len(mails)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', dest='conffile', default=default_conf)
+    parser.add_argument('-n', dest='loops', type=int, default=3)
+    parser.add_argument('-H', dest='headers_only', action='store_true')
+    parser.add_argument('paths', nargs='*', default=default_paths)
+    args = parser.parse_args()
+    Configuration.load(args.conffile, 'global')
+    run(args.loops, args.paths, args.headers_only)
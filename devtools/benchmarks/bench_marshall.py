@@ -0,0 +1,112 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of caliopen objects marshalling.
+
+Build a message with many participants and attachments then time its
+creation and its dict and db (un)marshalling. No storage is needed.
+
+Mutable attributes of an object loaded from db are copied, to find their
+in place changes, only when first read: unmarshall_db times a load of an
+object only returned, unmarshall_db_read a load followed by a read of all
+its attributes.
+
+Usage:
+    bench_marshall.py [-c caliopen.yaml] [-n loops] [-p participants]
+
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import datetime
+import os
+import timeit
+import uuid
+
+import pytz
+
+from caliopen_storage.config import Configuration
+
+here = os.path.dirname(os.path.abspath(__file__))
+default_conf = os.path.join(here, '../../src/backend/configs/'
+                                  'caliopen.yaml.template')
+
+
+def build_document(nb_participants):
+    """Return a message document in its dict form."""
+    participants = [{'address': 'user{}@caliopen.local'.format(i),
+                     'contact_ids': [str(uuid.uuid4())],
+                     'label': 'User {}'.format(i),
+                     'protocol': 'email',
+                     'type': 'To'} for i in range(nb_participants)]
+    attachments = [{'content_type': 'text/plain',
+                    'file_name': 'file{}.txt'.format(i),
+                    'is_inline': False,
+                    'size': 1024,
+                    'url': 'attachment/{}'.format(i)}
+                   for i in range(nb_participants / 4)]
+    return {'message_id': str(uuid.uuid4()),
+            'user_id': str(uuid.uuid4()),
+            'discussion_id': str(uuid.uuid4()),
+            'date': datetime.datetime.now(tz=pytz.utc),
+            'date_insert': datetime.datetime.now(tz=pytz.utc),
+            'subject': 'benchmark',
+            'body_plain': 'some text ' * 100,
+            'is_unread': True,
+            'importance_level': 5,
+            'tags': ['inbox', 'work'],
+            'participants': participants,
+            'attachments': attachments,
+            'pi': {'technic': 10, 'comportment': 20, 'context': 30,
+                   'version': 1},
+            'privacy_features': {'is_spam': 'False'}}
+
+
+def run(loops, nb_participants):
+    from caliopen_main.message.objects.message import Message
+
+    document = build_document(nb_participants)
+    message = Message(user_id=document['user_id'])
+    message.unmarshall_dict(document)
+
+    def unmarshall():
+        obj = Message(user_id=document['user_id'])
+        obj.unmarshall_dict(document)
+
+    def marshall_dict():
+        message.marshall_dict()
+
+    def marshall_db():
+        message._db = None
+        message.marshall_db()
+
+    def unmarshall_db():
+        obj = Message(user_id=document['user_id'])
+        obj._db = message._db
+        obj.unmarshall_db()
+
+    def unmarshall_db_read():
+        obj = Message(user_id=document['user_id'])
+        obj._db = message._db
+        obj.unmarshall_db()
+        for name in obj._attrs:
+            getattr(obj, name, None)
+
+    marshall_db()
+    for name, func in [('unmarshall_dict', unmarshall),
+                       ('marshall_dict', marshall_dict),
+                       ('marshall_db', marshall_db),
+                       ('unmarshall_db', unmarshall_db),
+                       ('unmarshall_db_read', unmarshall_db_read)]:
+        best = min(timeit.repeat(func, number=loops, repeat=3))
+        print('{:<20} {:>8.1f} us/call'.format(name, best * 1e6 / loops))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', dest='conffile', default=default_conf)
+    parser.add_argument('-n', dest='loops', type=int, default=1000)
+    parser.add_argument('-p', dest='participants', type=int, default=40)
+    args = parser.parse_args()
+    Configuration.load(args.conffile, 'global')
+    run(args.loops, args.participants)
@@ -0,0 +1,90 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of recipients suggestion on an user index.
+
+Compare latency of the completion suggester on indexed recipients with
+the former lookup (prefix and ngram queries on messages participants and
+contacts), for different prefixes.
+
+Needs a running elasticsearch with messages and contacts indexed for the
+user and recipients index built (see rebuild_recipients command).
+
+Usage:
+    bench_suggest.py [-c caliopen.yaml] [-n loops] -u user_id
+                     [-p jo,john,john.d]
+
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import os
+import time
+
+from caliopen_storage.config import Configuration
+
+here = os.path.dirname(os.path.abspath(__file__))
+default_conf = os.path.join(here, '../../src/backend/configs/'
+                                  'caliopen.yaml.template')
+
+
+def suggest_lookup(manager, prefix):
+    """Suggest recipients as done by the former lookup."""
+    participants = {'bool': {'should': [
+        {'prefix': {'participants.label': prefix}},
+        {'prefix': {'participants.address.raw': prefix}},
+        {'term': {'participants.address.parts': prefix}}]}}
+    names = {'bool': {'should': [
+        {'prefix': {x: {'value': prefix, 'boost': 3}}}
+        for x in ('given_name', 'given_name.normalized',
+                  'family_name', 'family_name.normalized')]}}
+    emails = {'bool': {'should': [
+        {'prefix': {'emails.label': {'value': prefix, 'boost': 2}}},
+        {'prefix': {'emails.address.raw': {'value': prefix, 'boost': 2}}},
+        {'term': {'emails.address.parts': {'value': prefix, 'boost': 2}}}]}}
+    query = {'bool': {'should': [
+        {'nested': {'path': 'participants', 'query': participants,
+                    'inner_hits': {'size': 1}}},
+        names,
+        {'nested': {'path': 'emails', 'query': emails, 'inner_hits': {}}}]}}
+    body = {'query': query, '_source': ['title'], 'size': 30}
+    return manager.proxy.search(index=manager.index, body=body)
+
+
+def suggest_completion(manager, prefix):
+    """Suggest recipients with the completion suggester."""
+    return manager.suggest(prefix)
+
+
+def timeit(func, manager, prefix, loops):
+    best = None
+    for i in range(loops):
+        start = time.time()
+        func(manager, prefix)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(user_id, prefixes, loops):
+    from caliopen_main.contact.store import RecipientIndexManager
+
+    manager = RecipientIndexManager(user_id)
+    print('{:>12} {:>12} {:>16}'.
+          format('prefix', 'lookup (ms)', 'completion (ms)'))
+    for prefix in prefixes:
+        legacy = timeit(suggest_lookup, manager, prefix, loops)
+        completion = timeit(suggest_completion, manager, prefix, loops)
+        print('{:>12} {:>12.1f} {:>16.1f}'.
+              format(prefix, legacy * 1000, completion * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', dest='conffile', default=default_conf)
+    parser.add_argument('-n', dest='loops', type=int, default=5)
+    parser.add_argument('-u', dest='user_id', required=True)
+    parser.add_argument('-p', dest='prefixes', default='j,jo,john,john.d')
+    args = parser.parse_args()
+    Configuration.load(args.conffile, 'global')
+    run(args.user_id, args.prefixes.split(','), args.loops)
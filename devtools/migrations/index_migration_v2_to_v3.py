@@ -3,6 +3,9 @@ from __future__ import absolute_import, print_function, unicode_literals
 import logging
 from caliopen_main.contact.objects.contact import Contact
 from caliopen_main.message.objects.message import Message
+from caliopen_main.discussion.store.discussion_index import \
+    IndexedDiscussion
+from caliopen_main.contact.store import IndexedRecipient
 
 log = logging.getLogger(__name__)
 
@@ -11,6 +14,8 @@ class IndexMigrator(object):
     def __init__(self, client=None, mappings_version=None):
         self.es_client = client
         self.types = (Contact(), Message())
+        # document types not related to a core object
+        self.doc_types = (IndexedDiscussion, IndexedRecipient)
         self.mappings_version = mappings_version
 
     def run(self):
@@ -45,6 +50,30 @@ class IndexMigrator(object):
         log.warn("{} operations completed\n    OK : {}\n    Errors: {}".format(
             count, ok, errors))
 
+    def migration_target(self, index):
+        """Return (alias, new index) of an index, None if not to migrate."""
+        if index.startswith('.') or \
+                index.endswith('_' + self.mappings_version):
+            return None
+        alias = index[:-3]
+        return alias, alias + "_" + self.mappings_version
+
+    def swap(self, alias, old_index, new_index):
+        """Move alias to new index and delete old one, can be retried."""
+        log.warn(
+            "Moving alias {} from {} to {}".format(alias, old_index, new_index))
+        if self.es_client.indices.exists_alias(index=old_index, name=alias):
+            # both actions are applied atomically
+            self.es_client.indices.update_aliases(body={"actions": [
+                {"remove": {"index": old_index, "alias": alias}},
+                {"add": {"index": new_index, "alias": alias}}
+            ]})
+        elif not self.es_client.indices.exists_alias(index=new_index,
+                                                     name=alias):
+            self.es_client.indices.put_alias(index=new_index, name=alias)
+        if self.es_client.indices.exists(index=old_index):
+            self.delete_old_index(old_index)
+
     def create_new_index(self, index):
         """Creates user index and setups mappings."""
         log.warn('Creating new index {}'.format(index))
@@ -94,6 +123,8 @@ class IndexMigrator(object):
         # PUT mappings for each type
         for kls in self.types:
             kls._index_class().create_mapping(index)
+        for kls in self.doc_types:
+            kls.build_mapping().save(using=self.es_client, index=index)
 
     def copy_old_to_new(self, old, new):
         log.warn("Copying data from {} to {}".format(old, new))
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Put mappings of document types added to v3 user indexes.
+
+A document written into an index without the mapping of its type gets a
+dynamic one, conflicting with the expected mapping later (fields used
+for sort or completion have a wrong type). Run this migration on existing
+indexes before upgrading the listener and the API that write these
+documents. Indexes of new users get these mappings at creation.
+
+Indexes where documents have already been written with a dynamic mapping
+are reported, they must be reindexed into a new index.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+import logging
+from caliopen_main.discussion.store.discussion_index import \
+    IndexedDiscussion
+from caliopen_main.contact.store import IndexedRecipient
+
+log = logging.getLogger(__name__)
+
+
+class IndexMigrator(object):
+    def __init__(self, client=None, mappings_version=None):
+        self.es_client = client
+        self.doc_types = (IndexedDiscussion, IndexedRecipient)
+        self.mappings_version = mappings_version
+
+    def run(self):
+        indexes = [x for x in self.es_client.indices.get("_all")
+                   if not x.startswith('.')]
+        log.warn("found {} indexes".format(len(indexes)))
+        errors = []
+        for index in indexes:
+            for kls in self.doc_types:
+                try:
+                    kls.build_mapping().save(using=self.es_client,
+                                             index=index)
+                except Exception as exc:
+                    log.error("failed to put mapping {} in {} : {}".
+                              format(kls.doc_type, index, exc))
+                    errors.append(index)
+        log.warn("{} indexes completed\n    OK : {}\n    Errors: {}".format(
+            len(indexes), len(indexes) - len(set(errors)), len(set(errors))))
@@ -27,6 +27,10 @@ function do_backend_tests {
     export CALIOPEN_BASEDIR=${PROJECT_DIRECTORY}
     nosetests -sv src/backend/main/py.main/caliopen_main/tests
     nosetests -sv src/backend/components/py.pi/caliopen_pi/tests
+    nosetests -sv src/backend/main/py.storage/caliopen_storage/tests
+    nosetests -sv src/backend/interfaces/NATS/py.client/caliopen_nats/tests
+    nosetests -sv src/backend/interfaces/REST/py.server/caliopen_api/tests
+    nosetests -sv src/backend/tools/py.CLI/caliopen_cli/tests
 }
 
 function do_frontend_tests {
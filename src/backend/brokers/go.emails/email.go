@@ -215,10 +215,23 @@ func (b *EmailBroker) SaveIndexSentEmail(ack *DeliveryAck) error {
 	err = b.Store.UpdateMessage(ack.EmailMessage.Message, fields)
 	if err != nil {
 		log.WithError(err).Warn("[Email Broker] Store.UpdateMessage operation failed")
+	} else {
+		// raw email is collected by garbage collection if not linked
+		err = b.Store.LinkRawMessage(ack.EmailMessage.Message.User_id, m.Raw_msg_id, ack.EmailMessage.Message.Message_id)
+		if err != nil {
+			log.WithError(err).Warn("[Email Broker] Store.LinkRawMessage operation failed")
+		}
 	}
 	err = b.Index.UpdateMessage(ack.EmailMessage.Message, fields)
 	if err != nil {
 		log.WithError(err).Warn("[Email Broker] Index.UpdateMessage operation failed")
+	} else {
+		// sent message is no more a draft, its discussion summary is computed again
+		natsMessage := fmt.Sprintf(Nats_message_tmpl, Nats_message_update,
+			ack.EmailMessage.Message.Message_id.String(), ack.EmailMessage.Message.User_id.String())
+		if err = b.NatsConn.Publish(Nats_messageAction_topic, []byte(natsMessage)); err != nil {
+			log.WithError(err).Warn("[Email Broker] publishing message update failed")
+		}
 	}
 
 	// if needed :
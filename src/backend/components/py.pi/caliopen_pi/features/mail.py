@@ -89,17 +89,17 @@ class InboundMailFeature(object):
     def mail_agent(self):
         """Get the mailer used for this message."""
         # XXX normalize better and more ?
-        return self.message.mail.get('X-Mailer', '').lower()
+        return self.message.header_mail.get('X-Mailer', '').lower()
 
     @property
     def transport_signature(self):
         """Get the transport signature if any."""
-        return self.message.mail.get('DKIM-Signature')
+        return self.message.header_mail.get('DKIM-Signature')
 
     @property
     def spam_informations(self):
         """Return a global spam_score and related features."""
-        spam = SpamScorer(self.message.mail)
+        spam = SpamScorer(self.message.header_mail)
         return {'spam_score': spam.score,
                 'spam_method': spam.method,
                 'is_spam': spam.is_spam}
@@ -107,7 +107,7 @@ class InboundMailFeature(object):
     @property
     def is_internal(self):
         """Return true if it's an internal message."""
-        from_ = self.message.mail.get('From')
+        from_ = self.message.header_mail.get('From')
         for domain in self.internal_domains:
             if domain in from_:
                 return True
@@ -171,7 +171,7 @@ class InboundMailFeature(object):
         for part, contact in participants:
             if contact:
                 known_contacts.append(contact)
-                if contact.public_key:
+                if contact.public_keys:
                     known_public_key += 1
         if len(participants) == len(known_contacts):
             # XXX
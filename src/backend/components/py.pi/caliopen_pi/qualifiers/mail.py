@@ -41,8 +41,15 @@ class UserMessageQualifier(object):
     }
 
     def __init__(self, user):
-        """Create a new instance of an user message qualifier."""
+        """
+        Create a new instance of an user message qualifier.
+
+        Contacts and discussions lookups are kept for the qualifier life,
+        so that messages of a batch share them.
+        """
         self.user = user
+        self._contacts = {}
+        self._discussions = {}
 
     def _get_tags(self, message):
         """Evaluate user rules to get all tags for a mail."""
@@ -58,11 +65,16 @@ class UserMessageQualifier(object):
         """Process lookup sequence to find discussion to associate."""
         log.debug('Lookup sequence %r' % sequence)
         for prop in sequence:
+            key = (prop[0], prop[1])
+            if key in self._discussions:
+                return self._discussions[key]
             try:
                 kls = self._lookups[prop[0]]
                 log.debug('Will lookup %s with value %s' %
                           (prop[0], prop[1]))
-                return kls.get(self.user, prop[1])
+                lookup = kls.get(self.user, prop[1])
+                self._discussions[key] = lookup
+                return lookup
             except NotFound:
                 log.debug('Lookup type %s with value %s failed' %
                           (prop[0], prop[1]))
@@ -78,8 +90,18 @@ class UserMessageQualifier(object):
                 'discussion_id': message.discussion_id
             }
             lookup = kls.create(self.user, **params)
+            self._discussions[(prop[0], prop[1])] = lookup
             log.debug('Create lookup %r' % lookup)
 
+    def resolve_contacts(self, addresses):
+        """Lookup contacts of addresses not yet resolved, all at once."""
+        addresses = [x for x in addresses if x not in self._contacts]
+        if addresses:
+            contacts = Contact.lookup_many(self.user, addresses,
+                                           public_keys=True)
+            for address in addresses:
+                self._contacts[address] = contacts.get(address)
+
     def get_participant(self, message, participant):
         """Try to find a related contact and return a Participant instance."""
         p = Participant()
@@ -89,7 +111,11 @@ class UserMessageQualifier(object):
         p.protocol = message.message_type
         log.debug('Will lookup contact {} for user {}'.
                   format(participant.address, self.user.user_id))
-        c = Contact.lookup(self.user, participant.address)
+        if participant.address in self._contacts:
+            c = self._contacts[participant.address]
+        else:
+            c = Contact.lookup(self.user, participant.address)
+            self._contacts[participant.address] = c
         if c:
             p.contact_ids = [c.contact_id]
         return p, c
@@ -116,13 +142,16 @@ class UserMessageQualifier(object):
         new_message.importance_level = 0  # XXX tofix on parser
         new_message.external_references = message.external_references
 
+        self.resolve_contacts([x.address for x in message.participants])
         participants = []
         for p in message.participants:
             participant, contact = self.get_participant(message, p)
             new_message.participants.append(participant)
             participants.append((participant, contact))
 
-        for a in message.attachments:
+        # attachments stored out of raw message, by content hash
+        detached = {x.index: x for x in raw.detached_parts or []}
+        for i, a in enumerate(message.attachments):
             attachment = Attachment()
             attachment.content_type = a.content_type
             attachment.file_name = a.filename
@@ -130,6 +159,10 @@ class UserMessageQualifier(object):
             attachment.mime_boundary = a.mime_boundary
             if hasattr(a, "is_inline"):
                 attachment.is_inline = a.is_inline
+            if i in detached:
+                attachment.url = detached[i].url
+                attachment.content_hash = detached[i].content_hash
+                attachment.size = detached[i].size
             new_message.attachments.append(attachment)
 
         # Compute PI !!
@@ -11,6 +11,7 @@ type Attachment struct {
 	Size         int    `cql:"size"             json:"size"`
 	URL          string `cql:"url"              json:"url"`           // ObjectStore url for temporary file (draft)
 	MimeBoundary string `cql:"mime_boundary"    json:"mime_boundary"` // for attachments embedded in raw messages
+	ContentHash  string `cql:"content_hash"     json:"content_hash"`  // sha256 of content stored in ObjectStore
 }
 
 func (a *Attachment) UnmarshalMap(input map[string]interface{}) error {
@@ -32,5 +33,8 @@ func (a *Attachment) UnmarshalMap(input map[string]interface{}) error {
 	if mimeBoundary, ok := input["mime_boundary"].(string); ok {
 		a.MimeBoundary = mimeBoundary
 	}
+	if contentHash, ok := input["content_hash"].(string); ok {
+		a.ContentHash = contentHash
+	}
 	return nil //TODO: error handling
 }
@@ -17,16 +17,20 @@ const (
 	GnuSocialProtocol = "GNUsocial"
 	MastodonProtocol  = "mastodon"
 
-	TimeISO8601      = "2006-01-02T15:04:05-07:00"
-	TimeUTCmicro     = "2006-01-02T15:04:05.999999"
-	RFC3339Milli     = "2006-01-02T15:04:05.000Z07:00"
-	MessageType      = "message"
-	ContactType      = "contact"
-	MessageIndexType = "indexed_message"
-	ContactIndexType = "indexed_contact"
+	TimeISO8601        = "2006-01-02T15:04:05-07:00"
+	TimeUTCmicro       = "2006-01-02T15:04:05.999999"
+	RFC3339Milli       = "2006-01-02T15:04:05.000Z07:00"
+	MessageType        = "message"
+	ContactType        = "contact"
+	MessageIndexType   = "indexed_message"
+	ContactIndexType   = "indexed_contact"
+	RecipientIndexType = "indexed_recipient"
 
 	//nats related constants
 	Nats_message_tmpl = "{\"order\":\"%s\", \"message_id\":\"%s\", \"user_id\":\"%s\"}"
+	// topic notifying messages changes, for discussions summaries to be computed again
+	Nats_messageAction_topic = "messageAction"
+	Nats_message_update      = "message_update"
 
 	//participant types
 	ParticipantBcc     = "Bcc"
@@ -297,6 +297,7 @@ func (msg *Message) UnmarshalCQLMap(input map[string]interface{}) error {
 			a.Size, _ = attachment["size"].(int)
 			a.URL, _ = attachment["url"].(string)
 			a.MimeBoundary, _ = attachment["mime_boundary"].(string)
+			a.ContentHash, _ = attachment["content_hash"].(string)
 			msg.Attachments = append(msg.Attachments, a)
 		}
 	}
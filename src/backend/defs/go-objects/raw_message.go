@@ -11,7 +11,8 @@ type RawMessage struct {
 	Raw_msg_id UUID   `cql:"raw_msg_id"        json:"raw_msg_id"`
 	Raw_data   string `cql:"raw_data"          json:"raw_data"` //could be empty if raw message is too large to be stored in db
 	Raw_Size   uint64 `cql:"raw_size"          json:"raw_size"`
-	URI        string `cql:"uri"               json:"uri"` //object's location if message is too large to be stored in db
+	URI        string `cql:"uri"               json:"uri"`   //object's location if message is too large to be stored in db
+	Codec      string `cql:"codec"             json:"codec"` //compression codec of raw_data, empty if not compressed
 }
 
 // unmarshal a map[string]interface{} that must owns all Message fields
@@ -28,4 +29,7 @@ func (msg *RawMessage) UnmarshalCQLMap(input map[string]interface{}) {
 	if uri, ok := input["uri"].(string); ok {
 		msg.URI = uri
 	}
+	if codec, ok := input["codec"].(string); ok {
+		msg.Codec = codec
+	}
 }
@@ -3,43 +3,280 @@
 from __future__ import absolute_import, print_function, unicode_literals
 import logging
 import uuid
+from collections import namedtuple
 
 import datetime
 import pytz
+from cassandra.cqlengine.query import BatchQuery, BatchType
+from concurrent.futures import ThreadPoolExecutor
+
 from caliopen_storage.exception import NotFound
-from caliopen_main.message.core import RawMessage
+from caliopen_storage.store import BulkIndexWriter
+from caliopen_main.message.core import RawMessage, UserRawLookup
 from caliopen_main.message.objects.message import Message
+from caliopen_main.discussion.core import DiscussionSummary
+from caliopen_main.contact.store import RecipientIndexManager
 from caliopen_pi.qualifiers import UserMessageQualifier
 
 log = logging.getLogger(__name__)
 
+# number of raw messages fetched at same time by a batch delivery
+DEFAULT_FETCH_CONCURRENCY = 10
+
+DeliveryResult = namedtuple('DeliveryResult',
+                            ['raw_msg_id', 'message', 'error'])
+
+
+def detach_attachments(raw):
+    """
+    Store attachments of a raw message out of it, on first delivery.
+
+    A failure is only logged, raw message is then kept whole.
+    """
+    try:
+        raw.detach_attachments()
+    except Exception:
+        log.exception('Detach of attachments of raw message {} failed'.
+                      format(raw.raw_msg_id))
+
 
 class UserMessageDelivery(object):
     """User message delivery processing."""
 
-    def __init__(self, user):
-        """Create a new UserMessageDelivery belong to an user."""
+    def __init__(self, user, index_writer=None):
+        """
+        Create a new UserMessageDelivery belong to an user.
+
+        If an index_writer (BulkIndexWriter) is given, messages indexation
+        is queued into it and caller is responsible to flush it.
+        """
         self.user = user
+        self.index_writer = index_writer
+
+    def _get_message(self, message_id):
+        obj = Message(self.user.user_id, message_id=message_id)
+        obj.get_db()
+        obj.unmarshall_db()
+        return obj
 
     def process_raw(self, raw_msg_id):
-        """Process a raw message for an user, ie makes it a rich 'message'."""
+        """
+        Process a raw message for an user, ie makes it a rich 'message'.
+
+        A raw message is delivered once to an user: if same content was
+        already delivered (redelivery, re-import), existing message is
+        returned. Without an index_writer, message, discussion summary
+        and recipients documents are indexed with one bulk request.
+        """
         raw = RawMessage.get(raw_msg_id)
         if not raw:
             log.error('Raw message <{}> not found'.format(raw_msg_id))
             raise NotFound
         log.debug('Retrieved raw message {}'.format(raw_msg_id))
 
+        # same content may have been stored before, reference this one
+        raw = raw.canonical()
+        detach_attachments(raw)
+        lookup = UserRawLookup.lookup(self.user.user_id, raw.raw_msg_id)
+        if lookup and lookup.message_id:
+            log.info('Raw message {} already delivered as message {}'.
+                     format(raw.raw_msg_id, lookup.message_id))
+            return self._get_message(lookup.message_id)
+
         qualifier = UserMessageQualifier(self.user)
         message = qualifier.process_inbound(raw)
 
         # store and index message
+        obj = self._new_message(message)
+        obj.save_db()
+        if not UserRawLookup.link(self.user.user_id, raw.raw_msg_id,
+                                  obj.message_id):
+            # concurrently delivered
+            obj._db.delete()
+            lookup = UserRawLookup.lookup(self.user.user_id, raw.raw_msg_id)
+            return self._get_message(lookup.message_id)
+        writer = self.index_writer or BulkIndexWriter()
+        obj.marshall_index()
+        obj.save_index(writer=writer)
+        DiscussionSummary(self.user.user_id, writer=writer). \
+            add_message(obj)
+        RecipientIndexManager(self.user.user_id). \
+            add_participants(obj.participants,
+                             exclude_contact=self.user.contact_id,
+                             writer=writer)
+        if self.index_writer is None:
+            writer.flush()
+            message_id = str(obj.message_id)
+            for result in writer.errors:
+                if result.id == message_id:
+                    raise Exception('Indexation failed: {}'.
+                                    format(result.error))
+        return obj
+
+    def _new_message(self, message):
+        """Build a Message object, ready to save, from a new message."""
         obj = Message(self.user)
         obj.unmarshall_dict(message.to_native())
         obj.user_id = uuid.UUID(self.user.user_id)
         obj.message_id = uuid.uuid4()
         obj.date_insert = datetime.datetime.now(tz=pytz.utc)
         obj.marshall_db()
-        obj.save_db()
-        obj.marshall_index()
-        obj.save_index()
         return obj
+
+    def _fetch_raws(self, raw_msg_ids, concurrency):
+        """
+        Fetch raw messages and their content concurrently.
+
+        Return a list of (raw, error) in same order than raw_msg_ids.
+        A failed fetch of raw messages fails the whole batch.
+        """
+        raws = RawMessage.get_many(raw_msg_ids, concurrency=concurrency)
+
+        def load(raw):
+            if raw is None:
+                return None, NotFound('Raw message not found')
+            try:
+                # content of large messages is read from object store
+                raw.raw_data
+                raw = raw.canonical()
+                detach_attachments(raw)
+                return raw, None
+            except Exception as exc:
+                log.exception('Fetch of raw message {} failed'.
+                              format(raw.raw_msg_id))
+                return None, exc
+
+        workers = min(concurrency, len(raws)) or 1
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            return list(executor.map(load, raws))
+        finally:
+            executor.shutdown()
+
+    def _save_many(self, objs):
+        """
+        Save messages using an unlogged batch.
+
+        Messages of an user share the same partition, so batch is applied
+        at once. If batch fails, messages are saved one by one to know
+        which ones failed. Return a list of errors (None on success).
+        """
+        if not objs:
+            return []
+        try:
+            with BatchQuery(batch_type=BatchType.Unlogged) as batch:
+                for obj in objs:
+                    obj._db.batch(batch).save()
+            return [None] * len(objs)
+        except Exception as exc:
+            log.warn('Batch save of {} messages failed: {}'.
+                     format(len(objs), exc))
+        finally:
+            for obj in objs:
+                obj._db.batch(None)
+        return [obj.save_db() for obj in objs]
+
+    def process_batch(self, raw_msg_ids,
+                      concurrency=DEFAULT_FETCH_CONCURRENCY):
+        """
+        Process many raw messages for the user in one pass.
+
+        Raw messages are fetched concurrently, contacts and discussions
+        lookups are shared by all messages, messages are saved in one
+        batch and indexed using bulk requests. A failure only affects
+        its message: return a list of DeliveryResult in same order than
+        raw_msg_ids, with either the delivered message or the error.
+        """
+        results = [DeliveryResult(x, None, None) for x in raw_msg_ids]
+        if not raw_msg_ids:
+            return results
+        fetched = self._fetch_raws(raw_msg_ids, concurrency)
+        qualifier = UserMessageQualifier(self.user)
+
+        created = []
+        duplicates = []
+        first = {}
+        for i, (raw, error) in enumerate(fetched):
+            if error is not None:
+                results[i] = results[i]._replace(error=error)
+                continue
+            if raw.raw_msg_id in first:
+                # same content twice in this batch
+                duplicates.append((i, first[raw.raw_msg_id]))
+                continue
+            first[raw.raw_msg_id] = i
+            try:
+                lookup = UserRawLookup.lookup(self.user.user_id,
+                                              raw.raw_msg_id)
+                if lookup and lookup.message_id:
+                    log.info('Raw message {} already delivered as '
+                             'message {}'.format(raw.raw_msg_id,
+                                                 lookup.message_id))
+                    obj = self._get_message(lookup.message_id)
+                    results[i] = results[i]._replace(message=obj)
+                    continue
+                message = qualifier.process_inbound(raw)
+                created.append((i, raw, message, self._new_message(message)))
+            except Exception as exc:
+                log.exception('Qualification of raw message {} failed'.
+                              format(raw.raw_msg_id))
+                results[i] = results[i]._replace(error=exc)
+
+        errors = self._save_many([x[3] for x in created])
+        linked = []
+        for (i, raw, message, obj), error in zip(created, errors):
+            if error is not None:
+                results[i] = results[i]._replace(error=error)
+                continue
+            try:
+                if UserRawLookup.link(self.user.user_id, raw.raw_msg_id,
+                                      obj.message_id):
+                    linked.append(i)
+                else:
+                    # concurrently delivered
+                    obj._db.delete()
+                    lookup = UserRawLookup.lookup(self.user.user_id,
+                                                  raw.raw_msg_id)
+                    obj = self._get_message(lookup.message_id)
+                results[i] = results[i]._replace(message=obj)
+            except Exception as exc:
+                log.exception('Link of raw message {} failed'.
+                              format(raw.raw_msg_id))
+                results[i] = results[i]._replace(error=exc)
+
+        self._index_many(results, linked)
+        for i, j in duplicates:
+            results[i] = results[j]._replace(raw_msg_id=raw_msg_ids[i])
+        return results
+
+    def _index_many(self, results, positions):
+        """
+        Index messages created by a batch using bulk requests.
+
+        Messages that failed to be indexed are kept in results along
+        with the indexation error.
+        """
+        if not positions:
+            return
+        writer = self.index_writer or BulkIndexWriter()
+        summaries = DiscussionSummary(self.user.user_id, writer=writer)
+        recipients = RecipientIndexManager(self.user.user_id)
+        for i in positions:
+            obj = results[i].message
+            obj.marshall_index()
+            obj.save_index(writer=writer)
+            summaries.add_message(obj)
+            recipients.add_participants(obj.participants,
+                                        exclude_contact=self.user.contact_id,
+                                        writer=writer)
+        if self.index_writer is not None:
+            # caller is responsible to flush it
+            return
+        writer.flush()
+        failed = {x.id: x.error for x in writer.errors}
+        for i in positions:
+            message_id = str(results[i].message.message_id)
+            if message_id in failed:
+                error = Exception('Indexation failed: {}'.
+                                  format(failed[message_id]))
+                results[i] = results[i]._replace(error=error)
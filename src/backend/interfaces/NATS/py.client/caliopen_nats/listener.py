@@ -3,6 +3,8 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import argparse
+import datetime
+import signal
 import sys
 import logging
 
@@ -13,11 +15,16 @@ from nats.io import Client as Nats
 from caliopen_storage.config import Configuration
 from caliopen_storage.helpers.connection import connect_storage
 
+from caliopen_nats.workers import WorkerPool, WORKER_POOL_OPTIONS
+
 log = logging.getLogger(__name__)
 
+# (client, subscription id, subscriber) of started subscriptions
+subscriptions = []
+
 
 @tornado.gen.coroutine
-def inbound_handler(config):
+def inbound_handler(config, pool):
     """Inbound message NATS handler."""
     client = Nats()
     server = 'nats://{}:{}'.format(config['host'], config['port'])
@@ -26,16 +33,22 @@ def inbound_handler(config):
     opts = {"servers": servers}
     yield client.connect(**opts)
 
-    # create and register subscriber(s)
-    inbound_email_sub = subscribers.InboundEmail(client)
-    future = client.subscribe("inboundSMTP", "SMTPqueue",
-                              inbound_email_sub.handler)
+    # create and register subscriber(s), delivering by batch if configured
+    batch = config.get('inbound_batch') or {}
+    if batch.get('size', 1) > 1:
+        inbound_email_sub = subscribers.InboundEmailBatch(
+            client, pool=pool, batch_size=batch['size'],
+            max_delay=batch.get('max_delay', 0.5))
+    else:
+        inbound_email_sub = subscribers.InboundEmail(client, pool=pool)
+    sid = yield client.subscribe("inboundSMTP", "SMTPqueue",
+                                 inbound_email_sub.handler)
+    subscriptions.append((client, sid, inbound_email_sub))
     log.info("nats subscription started for inboundSMTP")
-    future.result()
 
 
 @tornado.gen.coroutine
-def contact_update_handler(config):
+def contact_update_handler(config, pool):
     """NATS handler for contact update events."""
     client = Nats()
     server = 'nats://{}:{}'.format(config['host'], config['port'])
@@ -45,11 +58,50 @@ def contact_update_handler(config):
     yield client.connect(**opts)
 
     # create and register subscriber(s)
-    contact_subscriber = subscribers.ContactAction(client)
-    future = client.subscribe("contactAction", "contactQueue",
-                              contact_subscriber.handler)
+    contact_subscriber = subscribers.ContactAction(client, pool=pool)
+    sid = yield client.subscribe("contactAction", "contactQueue",
+                                 contact_subscriber.handler)
+    subscriptions.append((client, sid, contact_subscriber))
     log.info("nats subscription started for contactAction")
-    future.result()
+
+
+@tornado.gen.coroutine
+def message_update_handler(config, pool):
+    """NATS handler for message update events."""
+    client = Nats()
+    server = 'nats://{}:{}'.format(config['host'], config['port'])
+    servers = [server]
+
+    opts = {"servers": servers}
+    yield client.connect(**opts)
+
+    # create and register subscriber(s)
+    message_subscriber = subscribers.MessageAction(client, pool=pool)
+    sid = yield client.subscribe("messageAction", "messageQueue",
+                                 message_subscriber.handler)
+    subscriptions.append((client, sid, message_subscriber))
+    log.info("nats subscription started for messageAction")
+
+
+@tornado.gen.coroutine
+def shutdown(pool, timeout):
+    """Stop subscriptions, wait for running tasks then stop the loop."""
+    log.info('Stopping listener, waiting for {} tasks'.format(pool.inflight))
+    for client, sid, subscriber in subscriptions:
+        yield client.unsubscribe(sid)
+        if hasattr(subscriber, 'flush_all'):
+            subscriber.flush_all()
+    try:
+        yield tornado.gen.with_timeout(datetime.timedelta(seconds=timeout),
+                                       pool.drain())
+    except tornado.gen.TimeoutError:
+        log.warn('{} tasks not done after {}s'.
+                 format(pool.inflight, timeout))
+    pool.log_stats()
+    pool.shutdown()
+    for client in set(x[0] for x in subscriptions):
+        yield client.close()
+    tornado.ioloop.IOLoop.current().stop()
 
 
 if __name__ == '__main__':
@@ -64,7 +116,26 @@ if __name__ == '__main__':
     import subscribers
 
     connect_storage()
-    inbound_handler(Configuration('global').get('message_queue'))
-    contact_update_handler(Configuration('global').get('message_queue'))
+    config = Configuration('global').get('message_queue')
+    options = dict(WORKER_POOL_OPTIONS)
+    options.update(config.get('workers') or {})
     loop_instance = tornado.ioloop.IOLoop.instance()
+    pool = WorkerPool.from_config(options, io_loop=loop_instance)
+    log.info('Processing messages with {} {} workers'.
+             format(pool.size, pool.mode))
+
+    def on_signal(signum, frame):
+        loop_instance.add_callback_from_signal(shutdown, pool,
+                                               options['drain_timeout'])
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    if options['metrics_interval']:
+        tornado.ioloop.PeriodicCallback(
+            pool.log_stats, options['metrics_interval'] * 1000,
+            io_loop=loop_instance).start()
+
+    inbound_handler(config, pool)
+    contact_update_handler(config, pool)
+    message_update_handler(config, pool)
     loop_instance.start()
@@ -1,60 +1,193 @@
 # -*- coding: utf-8 -*-
-"""Caliopen inbound nats message handler."""
+"""
+Caliopen inbound nats message handler.
+
+Handlers are called on the listener IOLoop, processing of messages is
+submitted to a WorkerPool (tasks are module functions, so that they can
+run in a process pool). Tasks of an user are run in order, replies are
+published from the IOLoop once task is done.
+"""
 from __future__ import absolute_import, print_function, unicode_literals
 
 import logging
 import json
 
+import tornado.ioloop
+
+from caliopen_storage.store import BulkIndexWriter
 from caliopen_main.user.core import User
 from caliopen_main.contact.objects import Contact
+from caliopen_main.contact.core import contact_resolutions
+from caliopen_main.contact.store import RecipientIndexManager
+from caliopen_main.message.objects.message import Message
+from caliopen_main.discussion.core import DiscussionSummary
 
 from caliopen_nats.delivery import UserMessageDelivery
+from caliopen_nats.workers import WorkerPool, PoolClosed
 from caliopen_pi.qualifiers import ContactMessageQualifier
 
 log = logging.getLogger(__name__)
 
 
+def deliver_raw(user_id, raw_msg_id):
+    """Deliver a raw message to an user, indexing it with bulk requests."""
+    user = User.get(user_id)
+    with BulkIndexWriter() as writer:
+        message = UserMessageDelivery(user, index_writer=writer). \
+            process_raw(raw_msg_id)
+    message_id = str(message.message_id)
+    for result in writer.errors:
+        if result.id == message_id:
+            raise Exception('Indexation failed: {}'.format(result.error))
+
+
+def deliver_raw_batch(user_id, raw_msg_ids):
+    """
+    Deliver raw messages to an user.
+
+    Return the error message of each delivery, None on success.
+    """
+    user = User.get(user_id)
+    results = UserMessageDelivery(user).process_batch(raw_msg_ids)
+    return [str(getattr(x.error, 'message', x.error)) if x.error else None
+            for x in results]
+
+
+def update_contact(user_id, contact_id):
+    """Process messages related to an updated contact."""
+    contact_resolutions.invalidate(user_id)
+    user = User.get(user_id)
+    contact = Contact(user.user_id, contact_id=contact_id)
+    contact.get_db()
+    contact.unmarshall_db()
+    qualifier = ContactMessageQualifier(user)
+    log.info('Will process update for contact {0} of user {1}'.
+             format(contact.contact_id, user.user_id))
+    qualifier.process(contact)
+    RecipientIndexManager(user.user_id).set_contact(contact)
+
+
+def refresh_discussion(user_id, message_id):
+    """Compute summary of the discussion of a changed message again."""
+    message = Message(user_id, message_id=message_id)
+    message.get_db()
+    message.unmarshall_db()
+    DiscussionSummary(user_id).refresh(message.discussion_id)
+
+
 class BaseHandler(object):
     """Base class for NATS message handlers."""
 
-    def __init__(self, nats_cnx):
-        """Create a new inbound messsage handler from a nats connection."""
+    def __init__(self, nats_cnx, pool=None):
+        """
+        Create a new inbound messsage handler from a nats connection.
+
+        Messages are processed by pool, or inline if not given.
+        """
         self.natsConn = nats_cnx
+        self.pool = pool or WorkerPool(mode='inline')
+
+    def submit(self, key, func, args, callback=None):
+        """Submit a task to pool, return a future to apply backpressure."""
+        try:
+            return self.pool.submit(key, func, args, callback)
+        except PoolClosed:
+            log.warn('Listener is stopping, drop {} task'.
+                     format(func.__name__))
 
 
 class InboundEmail(BaseHandler):
     """Inbound message class handler."""
 
-    def process_raw(self, msg, payload):
-        """Process an inbound raw message."""
-        nats_error = {
-            'error': '',
-            'message': 'inbound email message process failed'
-        }
-        nats_success = {
-            'message': 'OK : inbound email message proceeded'
-        }
-        user = User.get(payload['user_id'])
-        deliver = UserMessageDelivery(user)
-        try:
-            deliver.process_raw(payload['message_id'])
+    def reply(self, msg, error=None):
+        """Reply to a process_raw order with its delivery status."""
+        if error is None:
+            nats_success = {
+                'message': 'OK : inbound email message proceeded'
+            }
             self.natsConn.publish(msg.reply, json.dumps(nats_success))
-        except Exception as exc:
-            log.error("deliver process failed : {}".format(exc))
-            nats_error['error'] = str(exc.message)
+        else:
+            log.error("deliver process failed : {}".format(error))
+            nats_error = {
+                'error': str(getattr(error, 'message', error)),
+                'message': 'inbound email message process failed'
+            }
             self.natsConn.publish(msg.reply, json.dumps(nats_error))
-            return exc
+
+    def process_raw(self, msg, payload):
+        """Process an inbound raw message."""
+        def done(result, exc):
+            self.reply(msg, exc)
+
+        return self.submit(payload['user_id'], deliver_raw,
+                           (payload['user_id'], payload['message_id']),
+                           done)
 
     def handler(self, msg):
         """Handle an process_raw nats messages."""
         payload = json.loads(msg.data)
         log.info('Get payload order {}'.format(payload['order']))
         if payload['order'] == "process_raw":
-            self.process_raw(msg, payload)
+            return self.process_raw(msg, payload)
         else:
             log.warn('Unhandled payload type {}'.format(payload['order']))
 
 
+class InboundEmailBatch(InboundEmail):
+    """
+    Inbound message handler delivering messages by batch.
+
+    process_raw orders are buffered per user, then delivered at once when
+    batch_size orders are buffered for an user or max_delay seconds after
+    the first one. Each order is replied with its own delivery status.
+    """
+
+    def __init__(self, nats_cnx, pool=None, batch_size=20, max_delay=0.5,
+                 io_loop=None):
+        super(InboundEmailBatch, self).__init__(nats_cnx, pool=pool)
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.io_loop = io_loop or tornado.ioloop.IOLoop.current()
+        self._orders = {}
+        self._timeouts = {}
+
+    def process_raw(self, msg, payload):
+        """Buffer an inbound raw message order."""
+        user_id = payload['user_id']
+        orders = self._orders.setdefault(user_id, [])
+        orders.append((msg, payload))
+        if len(orders) >= self.batch_size:
+            return self.flush(user_id)
+        elif user_id not in self._timeouts:
+            self._timeouts[user_id] = \
+                self.io_loop.call_later(self.max_delay, self.flush, user_id)
+
+    def flush(self, user_id):
+        """Deliver buffered orders of an user."""
+        timeout = self._timeouts.pop(user_id, None)
+        if timeout is not None:
+            self.io_loop.remove_timeout(timeout)
+        orders = self._orders.pop(user_id, [])
+        if not orders:
+            return
+        raw_msg_ids = [payload['message_id'] for msg, payload in orders]
+        log.info('Deliver batch of {} messages for user {}'.
+                 format(len(orders), user_id))
+
+        def done(errors, exc):
+            errors = errors or [exc] * len(orders)
+            for (msg, payload), error in zip(orders, errors):
+                self.reply(msg, error)
+
+        return self.submit(user_id, deliver_raw_batch,
+                           (user_id, raw_msg_ids), done)
+
+    def flush_all(self):
+        """Deliver all buffered orders."""
+        for user_id in list(self._orders):
+            self.flush(user_id)
+
+
 class ContactAction(BaseHandler):
     """Handler for contact action message."""
 
@@ -63,20 +196,33 @@ class ContactAction(BaseHandler):
         # XXX validate payload structure
         if 'user_id' not in payload or 'contact_id' not in payload:
             raise Exception('Invalid contact_update structure')
-        user = User.get(payload['user_id'])
-        contact = Contact(user.user_id, contact_id=payload['contact_id'])
-        contact.get_db()
-        contact.unmarshall_db()
-        qualifier = ContactMessageQualifier(user)
-        log.info('Will process update for contact {0} of user {1}'.
-                 format(contact.contact_id, user.user_id))
-        qualifier.process(contact)
+        return self.submit(payload['user_id'], update_contact,
+                           (payload['user_id'], payload['contact_id']))
 
     def handler(self, msg):
         """Handle an process_raw nats messages."""
         payload = json.loads(msg.data)
         # log.info('Get payload order {}'.format(payload['order']))
         if payload['order'] == "contact_update":
-            self.process_update(msg, payload)
+            return self.process_update(msg, payload)
+        else:
+            log.warn('Unhandled payload type {}'.format(payload['order']))
+
+
+class MessageAction(BaseHandler):
+    """Handler for message action message, published by Go services."""
+
+    def process_update(self, msg, payload):
+        """Process a message update message."""
+        if 'user_id' not in payload or 'message_id' not in payload:
+            raise Exception('Invalid message_update structure')
+        return self.submit(payload['user_id'], refresh_discussion,
+                           (payload['user_id'], payload['message_id']))
+
+    def handler(self, msg):
+        """Handle a message_update nats messages."""
+        payload = json.loads(msg.data)
+        if payload['order'] == "message_update":
+            return self.process_update(msg, payload)
         else:
             log.warn('Unhandled payload type {}'.format(payload['order']))
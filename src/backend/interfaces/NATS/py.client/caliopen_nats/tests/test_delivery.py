@@ -0,0 +1,195 @@
+"""Test batch delivery of raw messages to an user."""
+
+import unittest
+import os
+import uuid
+
+import mock
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+from caliopen_storage.store.bulk import BulkItemResult
+from caliopen_nats.delivery import UserMessageDelivery
+
+
+class FakeMessage(object):
+
+    def __init__(self, message_id=None):
+        self.message_id = message_id or uuid.uuid4()
+        self.participants = []
+        self._db = mock.Mock()
+        self.save_db = mock.Mock(return_value=None)
+
+    def marshall_index(self):
+        pass
+
+    def save_index(self, writer):
+        writer.indexed.append(self.message_id)
+
+
+class FakeWriter(object):
+
+    def __init__(self):
+        self.indexed = []
+        self.errors = []
+        self.flushed = False
+
+    def flush(self):
+        self.flushed = True
+        return []
+
+
+def raw(raw_msg_id):
+    return mock.Mock(raw_msg_id=raw_msg_id)
+
+
+class TestProcessBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.user = mock.Mock(user_id=str(uuid.uuid4()), contact_id=None)
+        self.delivery = UserMessageDelivery(self.user)
+        self.writer = FakeWriter()
+        self.lookups = {}
+        self.linked = {}
+        prefix = 'caliopen_nats.delivery.'
+        patches = [
+            mock.patch(prefix + 'BulkIndexWriter', return_value=self.writer),
+            mock.patch(prefix + 'DiscussionSummary'),
+            mock.patch(prefix + 'RecipientIndexManager'),
+            mock.patch(prefix + 'UserMessageQualifier'),
+            mock.patch(prefix + 'UserRawLookup.lookup',
+                       side_effect=lambda user_id, raw_msg_id:
+                       self.lookups.get(raw_msg_id)),
+            mock.patch(prefix + 'UserRawLookup.link',
+                       side_effect=lambda user_id, raw_msg_id, message_id:
+                       self.linked.get(raw_msg_id, True)),
+            mock.patch.object(UserMessageDelivery, '_fetch_raws'),
+            mock.patch.object(UserMessageDelivery, '_new_message',
+                              side_effect=lambda message: FakeMessage()),
+            mock.patch.object(UserMessageDelivery, '_get_message',
+                              side_effect=FakeMessage),
+            mock.patch.object(UserMessageDelivery, '_save_many',
+                              side_effect=lambda objs: [None] * len(objs))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        from caliopen_nats import delivery
+        self.qualifier = delivery.UserMessageQualifier.return_value
+
+    def fetched(self, *raws):
+        UserMessageDelivery._fetch_raws.return_value = \
+            [(x, None) for x in raws]
+
+    def test_same_raw_twice(self):
+        self.fetched(raw('r1'), raw('r1'), raw('r2'))
+        results = self.delivery.process_batch(['a', 'b', 'c'])
+        self.assertEqual(self.qualifier.process_inbound.call_count, 2)
+        self.assertEqual([x.raw_msg_id for x in results], ['a', 'b', 'c'])
+        self.assertIs(results[0].message, results[1].message)
+        self.assertIsNot(results[0].message, results[2].message)
+        self.assertEqual(len(self.writer.indexed), 2)
+
+    def test_already_delivered(self):
+        message_id = uuid.uuid4()
+        self.lookups['r1'] = mock.Mock(message_id=message_id)
+        self.fetched(raw('r1'))
+        results = self.delivery.process_batch(['a'])
+        self.assertEqual(results[0].message.message_id, message_id)
+        self.assertIsNone(results[0].error)
+        self.assertFalse(self.qualifier.process_inbound.called)
+        self.assertEqual(self.writer.indexed, [])
+
+    def test_concurrently_linked(self):
+        message_id = uuid.uuid4()
+        self.fetched(raw('r1'))
+        # lookup is found once link failed
+        self.linked['r1'] = False
+        lookups = [None, mock.Mock(message_id=message_id)]
+        from caliopen_nats import delivery
+        delivery.UserRawLookup.lookup.side_effect = \
+            lambda user_id, raw_msg_id: lookups.pop(0)
+        new = FakeMessage()
+        UserMessageDelivery._new_message.side_effect = lambda message: new
+        results = self.delivery.process_batch(['a'])
+        # new row is deleted, existing message returned and not indexed
+        self.assertTrue(new._db.delete.called)
+        self.assertEqual(results[0].message.message_id, message_id)
+        self.assertEqual(self.writer.indexed, [])
+
+    def test_fetch_and_save_errors(self):
+        error = Exception('save failed')
+        self.fetched(raw('r1'), raw('r2'))
+        UserMessageDelivery._fetch_raws.return_value.insert(
+            1, (None, Exception('not found')))
+        UserMessageDelivery._save_many.side_effect = \
+            lambda objs: [None, error]
+        results = self.delivery.process_batch(['a', 'b', 'c'])
+        self.assertIsNone(results[0].error)
+        self.assertEqual(str(results[1].error), 'not found')
+        self.assertIs(results[2].error, error)
+        self.assertEqual(self.writer.indexed, [results[0].message.message_id])
+
+    def test_indexing_errors(self):
+        self.fetched(raw('r1'), raw('r2'))
+        messages = [FakeMessage(), FakeMessage()]
+        UserMessageDelivery._new_message.side_effect = \
+            lambda message: messages.pop(0)
+
+        def flush():
+            self.writer.errors.append(
+                BulkItemResult('index', 'user', str(self.writer.indexed[1]),
+                               False, 400, 'mapper_parsing_exception'))
+            return []
+
+        self.writer.flush = flush
+        results = self.delivery.process_batch(['a', 'b'])
+        self.assertIsNone(results[0].error)
+        self.assertIn('mapper_parsing_exception', str(results[1].error))
+        # message is kept along with its error
+        self.assertIsNotNone(results[1].message)
+
+
+class TestSaveMany(unittest.TestCase):
+
+    def setUp(self):
+        user = mock.Mock(user_id=str(uuid.uuid4()))
+        self.delivery = UserMessageDelivery(user)
+
+    @mock.patch('caliopen_nats.delivery.BatchQuery')
+    def test_batch(self, batch_query):
+        objs = [FakeMessage(), FakeMessage()]
+        self.assertEqual(self.delivery._save_many(objs), [None, None])
+        for obj in objs:
+            obj._db.batch.return_value.save.assert_called_once_with()
+            self.assertFalse(obj.save_db.called)
+            # batch is detached from rows
+            self.assertEqual(obj._db.batch.call_args_list[-1],
+                             mock.call(None))
+
+    @mock.patch('caliopen_nats.delivery.BatchQuery')
+    def test_fallback_to_single_writes(self, batch_query):
+        batch_query.return_value.__exit__.side_effect = \
+            Exception('batch too large')
+        error = Exception('write timeout')
+        objs = [FakeMessage(), FakeMessage()]
+        objs[1].save_db.return_value = error
+        self.assertEqual(self.delivery._save_many(objs), [None, error])
+        for obj in objs:
+            obj.save_db.assert_called_once_with()
+            self.assertEqual(obj._db.batch.call_args_list[-1],
+                             mock.call(None))
+
+    def test_nothing_to_save(self):
+        self.assertEqual(self.delivery._save_many([]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
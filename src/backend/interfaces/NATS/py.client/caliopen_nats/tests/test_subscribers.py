@@ -0,0 +1,55 @@
+"""Test processing of contact actions by listener subscribers."""
+
+import json
+import unittest
+import os
+import uuid
+
+import mock
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+from caliopen_main.contact.core import contact_resolutions
+from caliopen_nats.subscribers import ContactAction, update_contact
+
+
+class TestContactAction(unittest.TestCase):
+
+    def setUp(self):
+        self.user_id = str(uuid.uuid4())
+        self.patch = mock.patch.object(contact_resolutions, 'ttl', 60)
+        self.patch.start()
+        contact_resolutions.clear()
+        contact_resolutions.set(uuid.UUID(self.user_id), {'a@x.org': None})
+
+    def tearDown(self):
+        contact_resolutions.clear()
+        self.patch.stop()
+
+    @mock.patch('caliopen_nats.subscribers.RecipientIndexManager')
+    @mock.patch('caliopen_nats.subscribers.ContactMessageQualifier')
+    @mock.patch('caliopen_nats.subscribers.Contact')
+    @mock.patch('caliopen_nats.subscribers.User')
+    def test_update_invalidates_resolutions(self, *mocks):
+        update_contact(self.user_id, str(uuid.uuid4()))
+        self.assertEqual(contact_resolutions.get(self.user_id, ['a@x.org']),
+                         ({}, ['a@x.org']))
+
+    def test_contact_update_submitted(self):
+        handler = ContactAction(mock.Mock(), mock.Mock())
+        contact_id = str(uuid.uuid4())
+        msg = mock.Mock(data=json.dumps({'order': 'contact_update',
+                                         'user_id': self.user_id,
+                                         'contact_id': contact_id}))
+        with mock.patch.object(handler, 'submit') as submit:
+            handler.handler(msg)
+        submit.assert_called_once_with(self.user_id, update_contact,
+                                       (self.user_id, contact_id))
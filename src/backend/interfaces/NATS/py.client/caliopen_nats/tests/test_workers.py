@@ -0,0 +1,173 @@
+"""Test ordering, backpressure and drain of listener worker pool."""
+
+import os
+import threading
+import time
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+from caliopen_nats.workers import WorkerPool, PoolClosed
+
+
+class Recorder(object):
+    """Record tasks runs, checking tasks of a key never overlap."""
+
+    def __init__(self):
+        self.runs = []
+        self.results = []
+        self.overlaps = 0
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def task(self, key, value, delay=0):
+        with self._lock:
+            if key in self._running:
+                self.overlaps += 1
+            self._running.add(key)
+        time.sleep(delay)
+        with self._lock:
+            self._running.discard(key)
+            self.runs.append((key, value))
+        return value
+
+    def callback(self, result, exc):
+        self.results.append((result, exc))
+
+
+def fail():
+    raise ValueError('task failed')
+
+
+class PoolTestMixin(object):
+
+    mode = None
+
+    def setUp(self):
+        super(PoolTestMixin, self).setUp()
+        self.recorder = Recorder()
+
+    def make_pool(self, **kwargs):
+        pool = WorkerPool(mode=self.mode, io_loop=self.io_loop, **kwargs)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    @gen_test
+    def test_order_by_key(self):
+        pool = self.make_pool(size=4, max_inflight=100)
+        for i in range(5):
+            for key in ('a', 'b'):
+                # first tasks are the slowest ones
+                delay = 0.01 * (5 - i) if self.mode == 'thread' else 0
+                yield pool.submit(key, self.recorder.task,
+                                  (key, i, delay))
+        yield pool.drain()
+        for key in ('a', 'b'):
+            values = [v for k, v in self.recorder.runs if k == key]
+            self.assertEqual(values, range(5))
+        self.assertEqual(self.recorder.overlaps, 0)
+
+    @gen_test
+    def test_callback(self):
+        pool = self.make_pool()
+        yield pool.submit('a', self.recorder.task, ('a', 1),
+                          callback=self.recorder.callback)
+        yield pool.submit('a', fail, callback=self.recorder.callback)
+        yield pool.drain()
+        self.assertEqual(self.recorder.results[0], (1, None))
+        result, exc = self.recorder.results[1]
+        self.assertIsNone(result)
+        self.assertIsInstance(exc, ValueError)
+        stats = pool.stats()
+        self.assertEqual(stats['tasks']['fail']['failed'], 1)
+        self.assertEqual(stats['tasks']['task']['processed'], 1)
+
+    @gen_test
+    def test_drain(self):
+        pool = self.make_pool()
+        for i in range(3):
+            yield pool.submit(None, self.recorder.task, ('a', i))
+        drained = pool.drain()
+        self.assertRaises(PoolClosed, pool.submit, None,
+                          self.recorder.task, ('a', 3))
+        yield drained
+        self.assertEqual(sorted(self.recorder.runs),
+                         [('a', 0), ('a', 1), ('a', 2)])
+        self.assertEqual(pool.inflight, 0)
+        self.assertEqual(pool.running, 0)
+
+    @gen_test
+    def test_drain_idle_pool(self):
+        pool = self.make_pool()
+        drained = pool.drain()
+        self.assertTrue(drained.done())
+        yield drained
+        self.assertRaises(PoolClosed, pool.submit, 'a', fail)
+
+
+class TestInlinePool(PoolTestMixin, AsyncTestCase):
+
+    mode = 'inline'
+
+    @gen_test
+    def test_backpressure(self):
+        pool = self.make_pool(max_inflight=2)
+        self.assertTrue(pool.submit('a', self.recorder.task,
+                                    ('a', 0)).done())
+        # task is run but its end is only handled by the IOLoop
+        accepted = pool.submit('a', self.recorder.task, ('a', 1))
+        self.assertFalse(accepted.done())
+        self.assertEqual(pool.inflight, 2)
+        yield accepted
+        self.assertLess(pool.inflight, 2)
+        yield pool.drain()
+
+
+class TestThreadPool(PoolTestMixin, AsyncTestCase):
+
+    mode = 'thread'
+
+    def blocked(self, event, value):
+        event.wait(5)
+        return value
+
+    @gen_test
+    def test_backpressure(self):
+        pool = self.make_pool(size=2, max_inflight=2)
+        event = threading.Event()
+        self.assertTrue(pool.submit('a', self.blocked,
+                                    (event, 0)).done())
+        accepted = pool.submit('b', self.blocked, (event, 1))
+        self.assertFalse(accepted.done())
+        self.assertEqual(pool.running, 2)
+        # still not accepted while tasks are blocked
+        yield gen.sleep(0.05)
+        self.assertFalse(accepted.done())
+        event.set()
+        yield accepted
+        self.assertLess(pool.inflight, 2)
+        yield pool.drain()
+
+    @gen_test
+    def test_drain_releases_waiters(self):
+        pool = self.make_pool(size=1, max_inflight=1)
+        event = threading.Event()
+        accepted = pool.submit('a', self.blocked, (event, 0))
+        self.assertFalse(accepted.done())
+        drained = pool.drain()
+        # a subscription waiting for the pool is released to stop
+        self.assertTrue(accepted.done())
+        self.assertFalse(drained.done())
+        event.set()
+        yield drained
+        self.assertEqual(pool.inflight, 0)
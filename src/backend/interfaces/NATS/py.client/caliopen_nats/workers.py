@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Caliopen NATS listener worker pool.
+
+Messages received by subscriptions are processed by a pool of threads or
+processes, so that storage accesses do not block the IOLoop. Pool is
+configured by ``message_queue.workers`` configuration key::
+
+    message_queue:
+        workers:
+            mode: thread        # thread, process or inline
+            size: 4
+            max_inflight: 16
+            drain_timeout: 30
+            metrics_interval: 60
+
+Tasks sharing a key (an user id) run one after the other, in submission
+order. Number of accepted and not finished tasks is bounded: once
+max_inflight is reached, the future returned by :meth:`WorkerPool.submit`
+is resolved only when a task ends, so that a subscription callback
+yielding it stops reading messages.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+import os
+import time
+from collections import deque
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from tornado.concurrent import Future
+import tornado.ioloop
+
+from caliopen_storage.helpers.connection import connect_storage
+
+log = logging.getLogger(__name__)
+
+# worker pool options that can be set in configuration,
+# with their default values.
+WORKER_POOL_OPTIONS = {
+    'mode': 'thread',
+    'size': 4,
+    'max_inflight': None,
+    'drain_timeout': 30,
+    'metrics_interval': 60,
+}
+
+_storage_pid = None
+
+
+def _run_in_process(func, args):
+    """Run a task in a worker process, with its own storage connections."""
+    global _storage_pid
+    if _storage_pid != os.getpid():
+        connect_storage()
+        _storage_pid = os.getpid()
+    return func(*args)
+
+
+class PoolClosed(Exception):
+    """Raised when a task is submitted to a draining pool."""
+
+    pass
+
+
+class InlineExecutor(object):
+    """Executor running tasks in caller thread, as listener used to do."""
+
+    def submit(self, func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class TaskMetrics(object):
+    """Processing counters and latencies of a kind of task."""
+
+    def __init__(self):
+        self.processed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def add(self, wait, elapsed, failed=False):
+        self.processed += 1
+        if failed:
+            self.failed += 1
+        self.total_wait += wait
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    def to_dict(self):
+        count = self.processed or 1
+        return {
+            'processed': self.processed,
+            'failed': self.failed,
+            'avg_wait': self.total_wait / count,
+            'avg_time': self.total_time / count,
+            'max_time': self.max_time,
+        }
+
+
+class _Task(object):
+
+    def __init__(self, key, func, args, callback):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.callback = callback
+        self.queued = time.time()
+        self.started = None
+
+    @property
+    def name(self):
+        return self.func.__name__
+
+
+class WorkerPool(object):
+    """Run tasks in a pool of workers, keeping order of tasks by key."""
+
+    def __init__(self, mode='thread', size=4, max_inflight=None,
+                 io_loop=None):
+        if mode == 'thread':
+            self.executor = ThreadPoolExecutor(max_workers=size)
+        elif mode == 'process':
+            self.executor = ProcessPoolExecutor(max_workers=size)
+        elif mode == 'inline':
+            self.executor = InlineExecutor()
+            size = 1
+        else:
+            raise ValueError('Unknown worker pool mode {}'.format(mode))
+        self.mode = mode
+        self.size = size
+        self.max_inflight = max_inflight or size * 4
+        self.io_loop = io_loop or tornado.ioloop.IOLoop.current()
+        self.inflight = 0
+        self.running = 0
+        self.metrics = {}
+        self._queues = {}
+        self._waiters = deque()
+        self._closed = False
+        self._drained = None
+
+    @classmethod
+    def from_config(cls, conf, io_loop=None):
+        """Build a pool from ``message_queue.workers`` configuration."""
+        options = dict(WORKER_POOL_OPTIONS)
+        options.update(conf or {})
+        return cls(mode=options['mode'], size=options['size'],
+                   max_inflight=options['max_inflight'], io_loop=io_loop)
+
+    @property
+    def queue_depth(self):
+        """Number of accepted tasks waiting for a worker."""
+        return self.inflight - self.running
+
+    def submit(self, key, func, args=(), callback=None):
+        """
+        Queue execution of func(*args) in a worker.
+
+        Tasks with same key, if not None, are run in submission order.
+        callback is called on IOLoop with (result, exception) once task
+        is done, func, args and result must be picklable for a process
+        pool. Return a future resolved when pool accepts more tasks.
+        """
+        if self._closed:
+            raise PoolClosed('Worker pool is draining')
+        task = _Task(key, func, args, callback)
+        self.inflight += 1
+        if key is None:
+            self._start(task)
+        elif key in self._queues:
+            # a task with same key is running
+            self._queues[key].append(task)
+        else:
+            self._queues[key] = deque()
+            self._start(task)
+        future = Future()
+        if self.inflight < self.max_inflight:
+            future.set_result(None)
+        else:
+            self._waiters.append(future)
+        return future
+
+    def _start(self, task):
+        task.started = time.time()
+        self.running += 1
+        if self.mode == 'process':
+            future = self.executor.submit(_run_in_process, task.func,
+                                          task.args)
+        else:
+            future = self.executor.submit(task.func, *task.args)
+        self.io_loop.add_future(future, lambda x: self._done(task, x))
+
+    def _done(self, task, future):
+        elapsed = time.time() - task.started
+        self.running -= 1
+        self.inflight -= 1
+        exc = future.exception()
+        result = None if exc else future.result()
+        if exc:
+            log.error('Task {} failed: {!r}'.format(task.name, exc))
+        metrics = self.metrics.setdefault(task.name, TaskMetrics())
+        metrics.add(task.started - task.queued, elapsed, exc is not None)
+        if task.callback:
+            try:
+                task.callback(result, exc)
+            except Exception:
+                log.exception('Callback of task {} failed'.
+                              format(task.name))
+
+        if task.key is not None:
+            queue = self._queues[task.key]
+            if queue:
+                self._start(queue.popleft())
+            else:
+                del self._queues[task.key]
+        while self._waiters and self.inflight < self.max_inflight:
+            self._waiters.popleft().set_result(None)
+        if self._drained and not self.inflight:
+            self._drained.set_result(None)
+
+    def drain(self):
+        """
+        Stop accepting tasks and wait for accepted ones.
+
+        Return a future resolved once all tasks are done.
+        """
+        self._closed = True
+        if self._drained is None:
+            self._drained = Future()
+            if not self.inflight:
+                self._drained.set_result(None)
+        while self._waiters:
+            self._waiters.popleft().set_result(None)
+        return self._drained
+
+    def shutdown(self):
+        """Release workers."""
+        self.executor.shutdown(wait=False)
+
+    def stats(self):
+        """Return pool gauges and metrics of each kind of task."""
+        stats = {
+            'mode': self.mode,
+            'size': self.size,
+            'inflight': self.inflight,
+            'running': self.running,
+            'queue_depth': self.queue_depth,
+            'tasks': {}
+        }
+        for name, metrics in self.metrics.items():
+            stats['tasks'][name] = metrics.to_dict()
+        return stats
+
+    def log_stats(self):
+        """Log pool metrics."""
+        stats = self.stats()
+        log.info('Worker pool: {} running, {} queued'.
+                 format(stats['running'], stats['queue_depth']))
+        for name, metrics in sorted(stats['tasks'].items()):
+            log.info('Task {name}: {processed} processed ({failed} failed), '
+                     'avg wait {avg_wait:.3f}s, avg time {avg_time:.3f}s, '
+                     'max time {max_time:.3f}s'.
+                     format(name=name, **metrics))
@@ -21,6 +21,8 @@ requires = [
     'caliopen_storage',
     'caliopen_main'
     ]
+if sys.version_info < (3, 2):
+    requires.append('futures')
 
 tests_require = []
 if sys.version_info < (3, 3):
@@ -21,3 +21,7 @@ class Api(object):
     def get_offset(self):
         """Return pagination offset from request else 0."""
         return int(self.request.params.get('offset', 0))
+
+    def get_cursor(self):
+        """Return pagination cursor from request, None if not paginated."""
+        return self.request.params.get('cursor')
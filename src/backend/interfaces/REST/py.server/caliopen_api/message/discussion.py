@@ -2,8 +2,10 @@ import logging
 
 from cornice.resource import resource, view
 
+from caliopen_storage.exception import InvalidCursor
 from caliopen_main.discussion.core.discussion import MainView
 from ..base import Api
+from ..base.exception import ValidationError
 from pyramid.httpexceptions import HTTPBadRequest, HTTPMovedPermanently
 
 log = logging.getLogger(__name__)
@@ -26,13 +28,16 @@ class Discussion(Api):
             raise HTTPBadRequest
 
         view = MainView()
-        result = view.get(self.user, pi_range[0], pi_range[1],
-                          il_range[0], il_range[1],
-                          limit=self.get_limit(),
-                          offset=self.get_offset())
+        try:
+            result = view.get(self.user, pi_range[0], pi_range[1],
+                              il_range[0], il_range[1],
+                              limit=self.get_limit(),
+                              offset=self.get_offset(),
+                              cursor=self.get_cursor())
+        except InvalidCursor as exc:
+            raise ValidationError(exc)
 
-        return {'discussions': result['discussions'],
-                'total': result['total']}
+        return result
 
     @view(renderer='json', permission='authenticated')
     def get(self):
@@ -47,7 +52,7 @@ class Discussion(Api):
         #
         # indexed_discussion = dim.get_by_id(discussion_id)
         # if indexed_discussion:
-        #     resp = build_discussion(discussion, indexed_discussion)
+        #     resp = build_discussion(self.user, indexed_discussion)
         # else:
         #     raise ResourceNotFound(
         #         'Discussion {} not found in index'.format(discussion_id))
@@ -142,6 +142,27 @@ class Raw(Api):
         # XXX how to check privacy_index ?
         raw_msg_id = self.request.matchdict.get('raw_msg_id')
         raw = RawMessage.get_for_user(self.user.user_id, raw_msg_id)
-        if raw:
+        if not raw:
+            raise ResourceNotFound('No such message')
+        if not raw.in_object_store and not self.request.range:
             return raw.raw_data
-        raise ResourceNotFound('No such message')
+        # stream content, large messages are never fully read in memory
+        response = self.request.response
+        response.content_type = b'text/plain'
+        size = raw.raw_size
+        offset, length = 0, None
+        if self.request.range and size:
+            content_range = self.request.range.content_range(size)
+            if not content_range:
+                response.status = 416
+                response.headers['Content-Range'] = \
+                    'bytes */{}'.format(size)
+                return response
+            offset = content_range.start
+            length = content_range.stop - content_range.start
+            response.status = 206
+            response.content_range = content_range
+        response.app_iter = raw.stream(offset=offset, length=length)
+        if size:
+            response.content_length = length if length is not None else size
+        return response
@@ -0,0 +1,102 @@
+"""Test ranged reads of raw messages."""
+
+import unittest
+import os
+
+import mock
+from pyramid import testing
+from pyramid.request import Request
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+from caliopen_api.message.message import Raw
+
+DATA = b''.join(chr(ord('a') + x % 26) for x in range(100))
+
+
+class FakeRaw(object):
+
+    raw_size = len(DATA)
+    raw_data = DATA
+
+    def __init__(self, in_object_store=False):
+        self.in_object_store = in_object_store
+        self.streamed = []
+
+    def stream(self, offset=0, length=None):
+        self.streamed.append((offset, length))
+        end = offset + length if length is not None else None
+        return iter([DATA[offset:end]])
+
+
+class TestRawRange(unittest.TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def get(self, raw, range=None):
+        headers = {'Range': range} if range else {}
+        request = Request.blank('/raws/1', headers=headers)
+        request.registry = self.config.registry
+        request.matchdict = {'raw_msg_id': '1'}
+        user = mock.Mock(user_id='user')
+        with mock.patch('caliopen_api.message.message.RawMessage.'
+                        'get_for_user', return_value=raw), \
+                mock.patch.object(Request, 'authenticated_userid', user):
+            return Raw(request).get()
+
+    def test_full_content(self):
+        self.assertEqual(self.get(FakeRaw()), DATA)
+
+    def test_object_store_streamed(self):
+        raw = FakeRaw(in_object_store=True)
+        response = self.get(raw)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_length, 100)
+        self.assertEqual(response.body, DATA)
+        self.assertEqual(raw.streamed, [(0, None)])
+
+    def test_range(self):
+        for in_object_store in (False, True):
+            raw = FakeRaw(in_object_store)
+            response = self.get(raw, 'bytes=10-19')
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(str(response.content_range), 'bytes 10-19/100')
+            self.assertEqual(response.content_length, 10)
+            self.assertEqual(response.body, DATA[10:20])
+            self.assertEqual(raw.streamed, [(10, 10)])
+
+    def test_open_ended_range(self):
+        raw = FakeRaw()
+        response = self.get(raw, 'bytes=90-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(str(response.content_range), 'bytes 90-99/100')
+        self.assertEqual(response.body, DATA[90:])
+        response = self.get(FakeRaw(), 'bytes=-5')
+        self.assertEqual(str(response.content_range), 'bytes 95-99/100')
+        self.assertEqual(response.body, DATA[95:])
+
+    def test_unsatisfiable_range(self):
+        raw = FakeRaw()
+        response = self.get(raw, 'bytes=200-300')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers['Content-Range'], 'bytes */100')
+        self.assertEqual(raw.streamed, [])
+
+    def test_malformed_range_ignored(self):
+        self.assertEqual(self.get(FakeRaw(), 'bytes=abc'), DATA)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,7 +17,7 @@ from caliopen_main.contact.core import (Contact as CoreContact,
 
 from caliopen_main.contact.objects.contact import Contact as ContactObject
 
-from caliopen_main.contact.returns import (ReturnContact,
+from caliopen_main.contact.returns import (build_contacts,
                                            ReturnAddress, ReturnEmail,
                                            ReturnIM, ReturnPhone,
                                            ReturnOrganization,
@@ -54,16 +54,8 @@ class Contact(Api):
                          'offset': self.get_offset()}
         log.debug('Filter parameters {}'.format(filter_params))
         results = CoreContact._model_class.search(self.user, **filter_params)
-        data = []
-        for item in results:
-            try:
-                c = ReturnContact.build(
-                    CoreContact.get(self.user, item.contact_id)). \
-                    serialize()
-                data.append(c)
-            except Exception as exc:
-                log.error("unable to serialize contact : {}".format(exc))
-
+        data = [x.serialize()
+                for x in build_contacts(self.user, results.hits)]
         return {'contacts': data, 'total': results.hits.total}
 
     @view(renderer='json', permission='authenticated')
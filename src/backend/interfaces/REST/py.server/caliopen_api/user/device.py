@@ -8,6 +8,7 @@ from pyramid.response import Response
 from caliopen_main.user.objects.device import Device as ObjectDevice
 from caliopen_main.user.core import Device as CoreDevice
 from caliopen_main.user.parameters import NewDevice
+from caliopen_storage.exception import InvalidCursor
 from cornice.resource import resource, view
 
 from ..base import Api
@@ -46,11 +47,24 @@ class DeviceAPI(Api):
 
     @view(renderer='json', permission='authenticated')
     def collection_get(self):
-        """Return list of user devices."""
-        objects = ObjectDevice.list_db(self.user.user_id)
+        """Return list of user devices, one page when a cursor is given."""
+        cursor = self.get_cursor()
+        if cursor is None:
+            objects = ObjectDevice.list_db(self.user.user_id)
+            next_cursor = None
+        else:
+            try:
+                result = CoreDevice.find(self.user, limit=self.get_limit(),
+                                         cursor=cursor, total=False)
+            except InvalidCursor as exc:
+                raise ValidationError(exc)
+            objects = [ObjectDevice.from_db(self.user.user_id, x.model)
+                       for x in result['objects']]
+            next_cursor = result['next_cursor']
         devices = [x.marshall_dict() for x in objects]
         log.debug('Devices are : {}'.format(devices))
-        return {'devices': devices, 'count': len(devices)}
+        return {'devices': devices, 'count': len(devices),
+                'next_cursor': next_cursor}
 
     @view(renderer='json', permission='authenticated')
     def get(self):
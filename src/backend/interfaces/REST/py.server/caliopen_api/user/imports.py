@@ -4,12 +4,10 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 import logging
 
-from caliopen_main.contact.core import Contact as CoreContact
-
 from cornice.resource import resource, view
-from pyramid.response import Response
 
-from caliopen_main.contact.parsers import parse_vcards, read_file
+from caliopen_main.contact.importer import ContactImporter
+from caliopen_main.contact.parsers import iter_vcards
 
 from ..base.exception import (ValidationError,
                               Unprocessable)
@@ -36,18 +34,19 @@ class ContactImport(Api):
             raise ValidationError(exc)
 
         data = self.request.POST['file'].file
-        vcards = read_file(data, False)
-        try:
-            new_contacts = parse_vcards(vcards)
-        except Exception as exc:
-            log.error('Syntax error: {}'.format(exc))
-            raise ValidationError(exc)
-        try:
-            for i in new_contacts:
-                CoreContact.create(self.user, i)
-        except Exception as exc:
-            log.error(
-                'File valid but we can create the new contact: {}'.format(exc))
-            raise Unprocessable(detail=exc.message)
 
-        return Response(status=200)
+        def progress(report):
+            log.debug('Import for user {}: {} contacts created of {} vcards'.
+                      format(self.user.user_id, report.created, report.total))
+
+        importer = ContactImporter(self.user, on_progress=progress)
+        report = importer.import_vcards(iter_vcards(data))
+        if not report.total:
+            raise ValidationError('No vcard found in file')
+        if not report.created:
+            detail = report.errors[0]['message'] if report.errors else None
+            log.error('File valid but we can create the new contacts: {}'.
+                      format(detail))
+            raise Unprocessable(detail=detail)
+        # partial failures are listed in report
+        return report.to_dict()
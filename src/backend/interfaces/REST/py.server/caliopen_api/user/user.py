@@ -12,9 +12,11 @@ from ..base.context import DefaultContext
 from .util import create_token
 
 from ..base import Api
-from ..base.exception import AuthenticationError, NotAcceptable, Unprocessable
+from ..base.exception import (AuthenticationError, NotAcceptable,
+                              Unprocessable, ValidationError)
 
-from caliopen_main.user.core import User
+from caliopen_storage.exception import InvalidCursor
+from caliopen_main.user.core import User, RemoteIdentity
 from caliopen_main.user.parameters import NewUser, NewRemoteIdentity, Settings
 from caliopen_main.user.returns.user import ReturnUser, ReturnRemoteIdentity
 from caliopen_main.contact.parameters import NewContact, NewEmail
@@ -145,6 +147,23 @@ class MeUserAPI(Api):
 class RemoteIdentityAPI(Api):
     """User remote identities dead simple API."""
 
+    @view(renderer='json',
+          permission='authenticated')
+    def collection_get(self):
+        """List remote identities of user, by offset or by cursor."""
+        user = self.request.authenticated_userid
+        try:
+            result = RemoteIdentity.find(user, limit=self.get_limit(),
+                                         offset=self.get_offset(),
+                                         cursor=self.get_cursor())
+        except InvalidCursor as exc:
+            raise ValidationError(exc)
+        identities = [ReturnRemoteIdentity.build(x).serialize()
+                      for x in result['objects']]
+        return {'remote_identities': identities,
+                'total': result['total'],
+                'next_cursor': result.get('next_cursor')}
+
     @view(renderer='json',
           permission='authenticated')
     def collection_post(self):
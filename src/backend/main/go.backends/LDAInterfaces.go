@@ -18,6 +18,7 @@ type LDAStore interface {
 	CreateMessage(msg *Message) error
 
 	StoreRawMessage(msg RawMessage) (err error)
+	LinkRawMessage(user_id, raw_msg_id, message_id UUID) error       // references raw message from user message built with it
 	UpdateMessage(msg *Message, fields map[string]interface{}) error // 'fields' are the struct fields names that have been modified
 	CreateThreadLookup(user_id, discussion_id UUID, external_msg_id string) error
 
@@ -31,10 +31,74 @@ type (
 		Date string `json:"date"`
 		Type string `json:"type"`
 	}
+
+	returnedRecipient struct {
+		Address    string `json:"address"`
+		Contact_id string `json:"contact_id"`
+		Label      string `json:"label"`
+		Protocol   string `json:"protocol"`
+	}
 )
 
+const recipientsSuggestSize = 10
+
 // build ES queries and responses for finding relevant recipients when an user compose a message
+// recipients are suggested from the completion index of user's recipients,
+// falling back to a lookup into messages and contacts if it has not been built.
 func (es *ElasticSearchBackend) RecipientsSuggest(user_id, query_string string) (suggests []RecipientSuggestion, err error) {
+	suggests, err = es.completionSuggest(user_id, query_string)
+	if err == nil && len(suggests) > 0 {
+		return
+	}
+	return es.lookupSuggest(user_id, query_string)
+}
+
+// completionSuggest queries the completion suggester of indexed recipients,
+// suggestions being ranked by their weight (messages count and contact).
+func (es *ElasticSearchBackend) completionSuggest(user_id, query_string string) (suggests []RecipientSuggestion, err error) {
+	suggests = []RecipientSuggestion{}
+	suggester := elastic.NewCompletionSuggester("recipients").
+		Field("suggest").
+		Prefix(query_string).
+		Size(recipientsSuggestSize)
+	result, err := es.Client.Search().
+		Index(user_id).
+		Type(RecipientIndexType).
+		Suggester(suggester).
+		Size(0).
+		Do(context.TODO())
+	if err != nil {
+		log.WithError(err).Warn("[Elasticsearch] failed to suggest recipients from completion index.")
+		return
+	}
+	for _, suggestion := range result.Suggest["recipients"] {
+		for _, option := range suggestion.Options {
+			if option.Source == nil {
+				continue
+			}
+			var recipient returnedRecipient
+			if e := json.Unmarshal(*option.Source, &recipient); e != nil {
+				log.WithError(e).Warn("[Elasticsearch] failed to extract recipient")
+				continue
+			}
+			suggest := RecipientSuggestion{
+				Address:    recipient.Address,
+				Contact_Id: recipient.Contact_id,
+				Label:      recipient.Label,
+				Protocol:   recipient.Protocol,
+				Source:     "participant",
+			}
+			if recipient.Contact_id != "" {
+				suggest.Source = "contact"
+			}
+			suggests = append(suggests, suggest)
+		}
+	}
+	return
+}
+
+// lookupSuggest looks for recipients into messages participants and contacts.
+func (es *ElasticSearchBackend) lookupSuggest(user_id, query_string string) (suggests []RecipientSuggestion, err error) {
 	suggests = []RecipientSuggestion{}
 	q_string := query_string
 	// build nested queries for participants lookup
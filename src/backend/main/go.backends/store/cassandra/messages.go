@@ -59,6 +59,9 @@ func (cb *CassandraBackend) UpdateMessage(msg *Message, fields map[string]interf
 	return err
 }
 
+// DeleteMessage must also remove the user_raw_lookup row of the message and
+// decrement raw_message_refcount, as python backend does, otherwise its raw
+// message is never garbage collected.
 func (cb *CassandraBackend) DeleteMessage(msg *Message) error {
 	return errors.New("[CassandraBackend] DeleteMessage not yet implemented")
 }
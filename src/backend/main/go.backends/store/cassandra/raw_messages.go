@@ -5,12 +5,15 @@
 package store
 
 import (
+	"bytes"
+	"compress/zlib"
+	"encoding/base64"
 	"errors"
+	"fmt"
 	obj "github.com/CaliOpen/Caliopen/src/backend/defs/go-objects"
-	log "github.com/Sirupsen/logrus"
 	"github.com/gocassa/gocassa"
 	"github.com/gocql/gocql"
-	"io"
+	"io/ioutil"
 )
 
 func (cb *CassandraBackend) StoreRawMessage(msg obj.RawMessage) (err error) {
@@ -43,6 +46,20 @@ func (cb *CassandraBackend) StoreRawMessage(msg obj.RawMessage) (err error) {
 	return
 }
 
+// LinkRawMessage records that a user message has been built from a raw message
+// and increments raw message references count, so that raw message is kept
+// by garbage collection. Linking twice the same message is a no-op.
+func (cb *CassandraBackend) LinkRawMessage(user_id, raw_msg_id, message_id UUID) error {
+	existing := map[string]interface{}{}
+	applied, err := cb.Session.Query(`INSERT INTO user_raw_lookup (user_id, raw_msg_id, message_id) VALUES (?, ?, ?) IF NOT EXISTS`,
+		user_id.String(), raw_msg_id.String(), message_id.String()).MapScanCAS(existing)
+	if err != nil || !applied {
+		return err
+	}
+	return cb.Session.Query(`UPDATE raw_message_refcount SET refcount = refcount + 1 WHERE raw_msg_id = ?`,
+		raw_msg_id.String()).Exec()
+}
+
 // returns a RawMessage object, with 'raw_data' property always filled
 // (even if raw_data was stored outside of cassandra)
 func (cb *CassandraBackend) GetRawMessage(raw_message_id string) (message obj.RawMessage, err error) {
@@ -55,21 +72,86 @@ func (cb *CassandraBackend) GetRawMessage(raw_message_id string) (message obj.Ra
 	}
 	message.UnmarshalCQLMap(m)
 
+	// raw_data may have been compressed by python backend
+	if message.Codec != "" && len(message.Raw_data) > 0 {
+		if message.Codec != "zlib" {
+			return obj.RawMessage{}, fmt.Errorf("[cassandra.GetRawMessage] : unsupported codec %s", message.Codec)
+		}
+		reader, e := zlib.NewReader(bytes.NewReader([]byte(message.Raw_data)))
+		if e != nil {
+			return obj.RawMessage{}, e
+		}
+		defer reader.Close()
+		raw_data, e := ioutil.ReadAll(reader)
+		if e != nil {
+			return obj.RawMessage{}, e
+		}
+		message.Raw_data = string(raw_data)
+		message.Codec = ""
+	}
+
 	// check if raw_data is filled or if we need to get it from object store
 	if message.URI != "" && len(message.Raw_data) == 0 {
 		reader, e := cb.ObjectsStore.GetObject(message.URI)
 		if e != nil {
 			return obj.RawMessage{}, e
 		}
-		raw_data := make([]byte, message.Raw_Size)
-		s, e := reader.Read(raw_data)
-		if s == 0 || e != io.EOF {
+		raw_data, e := ioutil.ReadAll(reader)
+		if e != nil {
 			return obj.RawMessage{}, e
 		}
-		if uint64(s) != message.Raw_Size {
-			log.Warnf("[cassandra.GetRawMessage] : Read %d bytes from Object Store, expected %d.", s, message.Raw_Size)
-		}
 		message.Raw_data = string(raw_data)
 	}
+
+	// attachments may have been cut out of raw_data by python backend
+	if parts, ok := m["detached_parts"].([]map[string]interface{}); ok && len(parts) > 0 {
+		raw_data, e := cb.attachDetachedParts(message.Raw_data, parts)
+		if e != nil {
+			return obj.RawMessage{}, e
+		}
+		message.Raw_data = raw_data
+	}
 	return
 }
+
+// attachDetachedParts puts back into raw data the base64 bodies of parts
+// stored in object store by their content hash, as python backend does.
+// Parts are ordered by offset, which is a position in data.
+func (cb *CassandraBackend) attachDetachedParts(data string, parts []map[string]interface{}) (string, error) {
+	var raw bytes.Buffer
+	position := int64(0)
+	for _, part := range parts {
+		offset, _ := part["offset"].(int64)
+		url, _ := part["url"].(string)
+		lineLength, _ := part["line_length"].(int)
+		newline, _ := part["newline"].(string)
+		suffix, _ := part["suffix"].(string)
+		if offset < position || offset > int64(len(data)) || lineLength <= 0 {
+			return "", fmt.Errorf("[cassandra.GetRawMessage] : inconsistent detached part %s", url)
+		}
+		reader, err := cb.ObjectsStore.GetObject(url)
+		if err != nil {
+			return "", err
+		}
+		content, err := ioutil.ReadAll(reader)
+		if err != nil {
+			return "", err
+		}
+		raw.WriteString(data[position:offset])
+		encoded := base64.StdEncoding.EncodeToString(content)
+		for i := 0; i < len(encoded); i += lineLength {
+			if i > 0 {
+				raw.WriteString(newline)
+			}
+			end := i + lineLength
+			if end > len(encoded) {
+				end = len(encoded)
+			}
+			raw.WriteString(encoded[i:end])
+		}
+		raw.WriteString(suffix)
+		position = offset
+	}
+	raw.WriteString(data[position:])
+	return raw.String(), nil
+}
@@ -60,6 +60,8 @@ func (rest *RESTfacility) AddAttachment(user_id, message_id, filename, content_t
 		return "", err
 	}
 
+	rest.notifyMessageUpdate(user_id, message_id)
+
 	attachmentPath = fmt.Sprintf("%s/attachments/%d", message_id, attchmntIndex)
 	return
 }
@@ -91,6 +93,9 @@ func (rest *RESTfacility) DeleteAttachment(user_id, message_id string, attchmtIn
 	}
 	//update index
 	err = rest.index.UpdateMessage(msg, fields)
+	if err == nil {
+		rest.notifyMessageUpdate(user_id, message_id)
+	}
 
 	//remove temporary file from object store
 	err = rest.store.DeleteAttachment(attachment_uri)
@@ -115,9 +120,9 @@ func (rest *RESTfacility) OpenAttachment(user_id, message_id string, attchmtInde
 	size = msg.Attachments[attchmtIndex].Size
 
 	// create a Reader
-	// either from object store (draft context)
+	// either from object store (draft context or content stored by hash)
 	// or from raw message's mime part (non-draft context)
-	if msg.Is_draft {
+	if msg.Is_draft || msg.Attachments[attchmtIndex].ContentHash != "" {
 		attachment, e := rest.store.GetAttachment(msg.Attachments[attchmtIndex].URL)
 		if e != nil {
 			return "", 0, nil, e
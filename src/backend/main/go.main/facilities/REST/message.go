@@ -5,8 +5,10 @@
 package REST
 
 import (
+	"fmt"
 	. "github.com/CaliOpen/Caliopen/src/backend/defs/go-objects"
 	m "github.com/CaliOpen/Caliopen/src/backend/main/go.main/messages"
+	log "github.com/Sirupsen/logrus"
 )
 
 func (rest *RESTfacility) SetMessageUnread(user_id, message_id string, status bool) (err error) {
@@ -17,9 +19,20 @@ func (rest *RESTfacility) SetMessageUnread(user_id, message_id string, status bo
 	}
 
 	err = rest.index.SetMessageUnread(user_id, message_id, status)
+	if err == nil {
+		rest.notifyMessageUpdate(user_id, message_id)
+	}
 	return err
 }
 
+// publishes a message update on NATS for its discussion summary to be computed again
+func (rest *RESTfacility) notifyMessageUpdate(user_id, message_id string) {
+	natsMessage := fmt.Sprintf(Nats_message_tmpl, Nats_message_update, message_id, user_id)
+	if err := rest.nats_conn.Publish(Nats_messageAction_topic, []byte(natsMessage)); err != nil {
+		log.WithError(err).Warnf("[RESTfacility] failed to publish update of message %s", message_id)
+	}
+}
+
 func (rest *RESTfacility) GetRawMessage(raw_message_id string) (raw_message []byte, err error) {
 	raw_msg, err := rest.store.GetRawMessage(raw_message_id)
 	if err != nil {
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""Helper decorators."""
+from __future__ import absolute_import, unicode_literals
+
+
+class cached_property(object):
+    """
+    Property computed on first access then stored on the instance.
+
+    Value is kept in instance __dict__, so next accesses do not call
+    the decorated method anymore. Deleting the attribute resets it.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+        self.__name__ = func.__name__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.__name__] = self.func(instance)
+        return value
@@ -1,5 +1,6 @@
 import zope.interface
 
+import copy
 import types
 import uuid
 import datetime
@@ -12,6 +13,7 @@ from caliopen_main.common.interfaces import (IO, storage)
 from elasticsearch import exceptions as ESexceptions
 
 from caliopen_storage.core.base import CoreMetaClass
+from caliopen_storage.store.model import DEFAULT_CONCURRENCY
 import logging
 
 log = logging.getLogger(__name__)
@@ -28,35 +30,14 @@ class CaliopenObject(object):
 
     def __init__(self, **kwargs):
         # TODO: type check and kwargs consistency check
+        plan = get_marshall_plan(self.__class__)
         for k, v in kwargs.items():
-            if k in self._attrs:
-                if isinstance(self._attrs[k], list):
-                    setattr(self, k, [])
-                    att_list = getattr(self, k)
-                    if isinstance(v, list):
-                        for item in v:
-                            if issubclass(self._attrs[k][0], CaliopenObject):
-                                att_list.append(self._attrs[k][0](**item))
-                            else:
-                                att_list.append(item)
-                    else:
-                        if issubclass(self._attrs[k][0], CaliopenObject):
-                            att_list.append(self._attrs[k][0](**v))
-                        else:
-                            att_list.append(v)
-                elif issubclass(self._attrs[k], CaliopenObject):
-                    setattr(self, k, self._attrs[k][0](v))
-                else:
-                    setattr(self, k, v)
+            if k in plan.init:
+                setattr(self, k, plan.init[k](v))
 
-        for attr, attrtype in self._attrs.items():
+        for attr, default in plan.init_defaults:
             if not hasattr(self, attr):
-                if isinstance(attrtype, list):
-                    setattr(self, attr, [])
-                elif isinstance(attrtype, dict):
-                    setattr(self, attr, {})
-                else:
-                    setattr(self, attr, None)
+                setattr(self, attr, default())
 
     def keys(self):
         """returns a list of current attributes"""
@@ -76,28 +57,18 @@ class ObjectDictifiable(CaliopenObject):
     """Object that can marshall/unmarshall to/from python dict"""
     zope.interface.implements(IO.DictIO)
 
+    def _values(self):
+        """Return attributes values set on self, by name."""
+        return vars(self)
+
     def marshall_dict(self, **options):
         """output a dict representation of self 'public' attributes"""
-
+        to_dict = get_marshall_plan(self.__class__).to_dict
         self_dict = {}
-        for att, val in vars(self).items():
-            if not att.startswith("_") and val is not None:
-                if isinstance(self._attrs[att], types.ListType):
-                    lst = []
-                    if len(att) > 0:
-                        if issubclass(self._attrs[att][0], ObjectDictifiable):
-                            for item in val:
-                                lst.append(item.marshall_dict())
-                        else:
-                            lst = val
-                        self_dict[att] = lst
-                    else:
-                        self_dict[att] = lst
-                elif issubclass(self._attrs[att], ObjectDictifiable):
-                    self_dict[att] = val.marshall_dict()
-                else:
-                    self_dict[att] = val
-
+        for att, val in self._values().items():
+            if val is not None and not att.startswith("_"):
+                convert = to_dict[att]
+                self_dict[att] = convert(val) if convert else val
         return self_dict
 
     def unmarshall_dict(self, document, **options):
@@ -105,23 +76,15 @@ class ObjectDictifiable(CaliopenObject):
 
         all self.attrs are reset if not in document
         """
-        for attr, attrtype in self._attrs.items():
-            if attr in document and document[attr] is not None:
-                unmarshall_item(document, attr, self, attrtype,
-                                is_creation=False)
+        plan = get_marshall_plan(self.__class__)
+        from_dict = plan.from_dict
+        for attr, default in plan.dict_defaults:
+            # document may be a cql user type, not a dict
+            value = document[attr] if attr in document else None
+            if value is not None:
+                setattr(self, attr, from_dict[attr](value, False))
             else:
-                if isinstance(attrtype, types.ListType):
-                    setattr(self, attr, [])
-                elif issubclass(attrtype, types.DictType):
-                    setattr(self, attr, {})
-                elif issubclass(attrtype, types.BooleanType):
-                    setattr(self, attr, False)
-                elif issubclass(attrtype, types.StringType):
-                    setattr(self, attr, "")
-                elif issubclass(attrtype, types.IntType):
-                    setattr(self, attr, 0)
-                else:
-                    setattr(self, attr, None)
+                setattr(self, attr, default())
 
 
 class ObjectJsonDictifiable(ObjectDictifiable):
@@ -167,6 +130,82 @@ class ObjectStorable(ObjectJsonDictifiable):
     _relations = None  # related tables into cassandra
     _lookup_class = None  #
     _lookup_values = None  # tables keys, values for lookups
+    _changes = None  # attributes set since loaded from db, None if not loaded
+    _clean = None  # mutable attributes values when first read since loaded
+    _unread = None  # mutable attributes not read since loaded from db
+
+    def __setattr__(self, name, value):
+        changes = self.__dict__.get('_changes')
+        if changes is not None and name in self._attrs:
+            changes.add(name)
+            unread = self.__dict__.get('_unread')
+            if unread:
+                unread.pop(name, None)
+        super(ObjectStorable, self).__setattr__(name, value)
+
+    def __getattr__(self, name):
+        # only called for a mutable attribute not read since loaded, its
+        # value is put back in place with a snapshot to find in place changes
+        unread = self.__dict__.get('_unread')
+        if not unread or name not in unread:
+            raise AttributeError(name)
+        value = self.__dict__[name] = unread.pop(name)
+        plan = get_marshall_plan(self.__class__)
+        self._clean[name] = self._snapshot(plan, name)
+        return value
+
+    def _values(self):
+        values = vars(self)
+        if self._unread:
+            values = dict(values)
+            values.update(self._unread)
+        return values
+
+    def _snapshot(self, plan, att):
+        value = getattr(self, att, None)
+        convert = plan.to_dict[att]
+        if convert is not None and value is not None:
+            return convert(value)
+        return copy.deepcopy(value)
+
+    @property
+    def changed_attributes(self):
+        """
+        Attributes changed since object was loaded from db, None if unknown.
+
+        Mutable attributes (lists, dicts, nested objects) modified in place
+        are found by comparing them with their value when first read, those
+        never read since loaded can not have been modified.
+        """
+        if self._changes is None:
+            return None
+        changes = set(self._changes)
+        plan = get_marshall_plan(self.__class__)
+        for att, clean in self._clean.items():
+            if att not in changes and self._snapshot(plan, att) != clean:
+                changes.add(att)
+        return changes
+
+    def clear_changes(self):
+        """
+        Consider current attributes values as stored ones.
+
+        Mutable attributes are copied only when first read, as most loaded
+        objects are only returned, never modified.
+        """
+        plan = get_marshall_plan(self.__class__)
+        values = self.__dict__
+        unread = dict(self._unread or {})
+        unread.update((x, values.pop(x)) for x in plan.mutable
+                      if x in values)
+        self._unread = unread
+        self._clean = {}
+        self._changes = set()
+
+    def mark_changed(self, *names):
+        """Flag attributes modified in place, a list append for example."""
+        if self._changes is not None:
+            self._changes.update(names)
 
     def get_db(self, **options):
         """Get a core object from database and put it in self._db attribute"""
@@ -236,45 +275,26 @@ class ObjectStorable(ObjectJsonDictifiable):
         smart update into the db
         """
 
+        changes = self.changed_attributes
         if not isinstance(self._db, self._model_class):
             self._db = self._model_class()
+            changes = None
 
-        self_keys = self._attrs.keys()
-        for att in self._db.keys():
-            if not att.startswith("_") and att in self_keys:
-                # TODO : manage protected attrs
-                # (ie attributes that user should not be able to change)
-                if isinstance(self._attrs[att], list):
-                    # TODO : manage change within list to only elem changed
-                    # (use builtin set() collection ?)
-                    if issubclass(self._attrs[att][0], CaliopenObject):
-                        setattr(self._db, att,
-                                [self._attrs[att][0]._model_class(
-                                    **x.marshall_dict())
-                                    for x in getattr(self, att)])
-                    else:
-                        setattr(self._db, att, getattr(self, att))
-                else:
-                    if issubclass(self._attrs[att], datetime.datetime) and \
-                            getattr(self, att) is not None:
-                        # datetime in cqlengine are 'naive', ours are 'aware'
-                        setattr(self._db, att,
-                                getattr(self, att).replace(tzinfo=None))
-                    else:
-                        self_att = self._attrs[att]
-                        get_att = getattr(self, att)
-                        if issubclass(self_att, CaliopenObject):
-                            if get_att is not None:
-                                setattr(self._db, att, self_att._model_class(
-                                    **get_att.marshall_dict()))
-                        else:
-                            setattr(self._db, att, get_att)
+        plan = get_marshall_plan(self.__class__)
+        for att, convert in plan.db_converters(self._db):
+            if changes is not None and att not in changes:
+                # unchanged since loaded from self._db
+                continue
+            value = convert(getattr(self, att))
+            if value is not _SKIP:
+                setattr(self._db, att, value)
 
     def unmarshall_db(self, **options):
         """squash self.attrs with db representation"""
 
         if isinstance(self._db, self._model_class):
             self.unmarshall_dict(dict(self._db))
+            self.clear_changes()
         else:
             log.warn('Invalid model class, expect {}, have {}'.
                      format(self._db.__class__, self._model_class.__class__))
@@ -290,13 +310,37 @@ class ObjectUser(ObjectStorable):
         self.user_id = user_id
         super(ObjectUser, self).__init__(**params)
 
+    @classmethod
+    def from_db(cls, user_id, model):
+        """Return an unmarshalled object from a model instance."""
+        obj = cls(user_id)
+        obj._db = model
+        obj.unmarshall_db()
+        return obj
+
     @classmethod
     def list_db(cls, user_id):
         """List all objects that belong to an user."""
         models = cls._model_class.filter(user_id=user_id)
+        return [cls.from_db(user_id, x) for x in models]
+
+    @classmethod
+    def get_many(cls, user, obj_ids, concurrency=DEFAULT_CONCURRENCY):
+        """
+        Get many objects belonging to an user, fetched concurrently.
+
+        Return a list of unmarshalled objects in same order than obj_ids,
+        with None for each id not found. Raise error of first failed query.
+        """
+        params = [{'user_id': user.user_id, cls._pkey_name: x}
+                  for x in obj_ids]
+        models = cls._model_class.get_many(params, concurrency=concurrency)
         objects = []
         for model in models:
-            obj = cls(user_id)
+            if model is None:
+                objects.append(None)
+                continue
+            obj = cls(user.user_id)
             obj._db = model
             obj.unmarshall_db()
             objects.append(obj)
@@ -312,7 +356,8 @@ class ObjectUser(ObjectStorable):
             param = {}
 
         try:
-            self._db = self._model_class.get(user_id=self.user_id, **param)
+            self._db = self._model_class.get_cached(user_id=self.user_id,
+                                                    **param)
         except NotFound:
             raise NotFound('%s %s not found for user %s' %
                            (self.__class__.__name__,
@@ -489,8 +534,11 @@ class ObjectIndexable(ObjectUser):
             else:
                 raise exc
 
-    def save_index(self, wait_for=False, **options):
-        if wait_for:
+    def save_index(self, wait_for=False, writer=None, **options):
+        """Save self._index document, or queue it into a bulk writer."""
+        if writer is not None:
+            writer.index(self._index)
+        elif wait_for:
             self._index.save(using=self._index_class.client(),
                              refresh="wait_for")
         else:
@@ -512,12 +560,18 @@ class ObjectIndexable(ObjectUser):
 
         return None
 
-    def update_index(self, wait_for=False, **options):
-        """get indexed doc from elastic and update it with self attrs
+    def update_index(self, wait_for=False, writer=None, **options):
+        """update indexed doc with self attrs
 
-        if indexed doc doesn't exist, create it
-        else update changed fields only
+        when object has been loaded from db, only attributes changed since
+        are sent as a partial update, else indexed doc is fetched from
+        elastic and compared with self attrs. if indexed doc doesn't exist,
+        create it
         """
+        changes = self.changed_attributes
+        if changes is not None:
+            return self._update_index_changes(changes, wait_for, writer)
+
         self.get_index()
         if self._index is not None:
             try:
@@ -536,6 +590,37 @@ class ObjectIndexable(ObjectUser):
             # for some reasons, index doc not found... create one from scratch
             self.create_index()
 
+    def _update_index_changes(self, changes, wait_for=False, writer=None):
+        """send changed attributes mapped in index as a partial update"""
+        plan = get_marshall_plan(self.__class__)
+        fields = {}
+        for att in plan.index_attributes(self._index_class):
+            if att in changes:
+                value = getattr(self, att)
+                convert = plan.to_dict[att]
+                fields[att] = convert(value) \
+                    if convert and value is not None else value
+        if not fields:
+            return
+
+        obj_id = getattr(self, self._pkey_name)
+        if writer is not None:
+            doc = self._index_class(meta={'id': obj_id,
+                                          'index': self.user_id})
+            writer.update(doc, fields)
+            return
+        params = {'refresh': 'wait_for'} if wait_for else {}
+        try:
+            self._index_class.client(). \
+                update(index=self.user_id,
+                       doc_type=self._index_class._doc_type.name,
+                       id=obj_id, body={'doc': fields}, **params)
+        except ESexceptions.NotFoundError:
+            # for some reasons, index doc not found... create one from scratch
+            self.create_index()
+        except Exception as exc:
+            log.info("update index failed: {}".format(exc))
+
     def marshall_index(self, **options):
         """squash self._index with self 'public' attributes
 
@@ -566,23 +651,20 @@ class ObjectIndexable(ObjectUser):
         # with attributes from self
         update_sibling = self.__class__(user_id=self.user_id)
 
-        m = self._index._doc_type.mapping.to_dict()
-        for att in m[self._index._doc_type.name]["properties"]:
-            if not att.startswith("_") and att in index_sibling.keys():
-                if update:
-                    if getattr(self, att) != getattr(index_sibling, att):
-                        setattr(update_sibling, att, getattr(self, att))
-                else:
+        plan = get_marshall_plan(self.__class__)
+        for att in plan.index_attributes(self._index):
+            if update:
+                if getattr(self, att) != getattr(index_sibling, att):
                     setattr(update_sibling, att, getattr(self, att))
+            else:
+                setattr(update_sibling, att, getattr(self, att))
 
         update_dict = update_sibling.marshall_dict()
 
+        # do not try to set a property directly
+        properties = plan.index_properties(self._index_class)
         for k, v in update_dict.iteritems():
-            if k in self._index_class.__dict__:
-                # do not try to set a property directly
-                if not isinstance(getattr(self._index_class, k), property):
-                    setattr(self._index, k, v)
-            else:
+            if k not in properties:
                 setattr(self._index, k, v)
 
         if update:
@@ -624,41 +706,212 @@ def unmarshall_item(document, key, target_object, target_attr_type,
     :param is_creation: if true, we are in the context of the creation of an obj
     :return: nothing, target object is modified in-place
     """
+    convert = _from_dict_converter(target_attr_type)
+    setattr(target_object, key, convert(document[key], is_creation))
 
-    if isinstance(target_attr_type, list):
-        lst = []
-        if issubclass(target_attr_type[0], ObjectDictifiable):
-            for item in document[key]:
-                sub_obj = target_attr_type[0]()
-                sub_obj.unmarshall_dict(item)
-                if is_creation and isinstance(sub_obj, ObjectStorable):
-                    sub_obj.set_uuid()
-                lst.append(sub_obj)
-        elif issubclass(target_attr_type[0], uuid.UUID):
-            for item in document[key]:
-                sub_obj = uuid.UUID(str(item))
-                lst.append(sub_obj)
-        else:
-            lst = document[key]
-        setattr(target_object, key, lst)
-
-    elif issubclass(target_attr_type, ObjectDictifiable):
-        sub_obj = target_attr_type()
-        sub_obj.unmarshall_dict(document[key])
-        setattr(target_object, key, sub_obj)
-
-    elif issubclass(target_attr_type, uuid.UUID):
-        setattr(target_object, key, uuid.UUID(str(document[key])))
-
-    elif issubclass(target_attr_type, datetime.datetime):
-        if document[key] is not None \
-                and document[key].tzinfo is None:
-            setattr(target_object, key, document[key].replace(tzinfo=
-                                                              pytz.utc))
-        else:
-            setattr(target_object, key, document[key])
+
+# Marshalling plans.
+#
+# What to do with an attribute only depends on its declared type in
+# _attrs, converters are built once per class instead of checking
+# these types on each attribute of each (un)marshalling call.
+
+_SKIP = object()  # db converter result when attribute must not be set
+
+_from_dict_converters = {}
+
+
+def _constant(value):
+    return lambda: value
+
+
+def _identity(value, is_creation):
+    return value
+
+
+def _from_dict_converter(attr_type):
+    """Return function(value, is_creation) casting a dict value."""
+    if isinstance(attr_type, list):
+        cache_key = ('list', attr_type[0])
     else:
-        new_attr = document[key]
-        if hasattr(target_attr_type, "validate"):
-            new_attr = target_attr_type().validate(document[key])
-        setattr(target_object, key, new_attr)
+        cache_key = attr_type
+    convert = _from_dict_converters.get(cache_key)
+    if convert is None:
+        convert = _build_from_dict_converter(attr_type)
+        _from_dict_converters[cache_key] = convert
+    return convert
+
+
+def _build_from_dict_converter(attr_type):
+    if isinstance(attr_type, list):
+        item_type = attr_type[0]
+        if issubclass(item_type, ObjectDictifiable):
+            storable = issubclass(item_type, ObjectStorable)
+
+            def convert(value, is_creation):
+                lst = []
+                for item in value:
+                    sub_obj = item_type()
+                    sub_obj.unmarshall_dict(item)
+                    if is_creation and storable:
+                        sub_obj.set_uuid()
+                    lst.append(sub_obj)
+                return lst
+            return convert
+        if issubclass(item_type, uuid.UUID):
+            return lambda value, is_creation: \
+                [uuid.UUID(str(x)) for x in value]
+        return _identity
+
+    if issubclass(attr_type, ObjectDictifiable):
+        def convert(value, is_creation):
+            sub_obj = attr_type()
+            sub_obj.unmarshall_dict(value)
+            return sub_obj
+        return convert
+    if issubclass(attr_type, uuid.UUID):
+        return lambda value, is_creation: uuid.UUID(str(value))
+    if issubclass(attr_type, datetime.datetime):
+        def convert(value, is_creation):
+            if value is not None and value.tzinfo is None:
+                return value.replace(tzinfo=pytz.utc)
+            return value
+        return convert
+    if hasattr(attr_type, "validate"):
+        return lambda value, is_creation: attr_type().validate(value)
+    return _identity
+
+
+def _build_init_converter(attr_type):
+    """Return function(value) casting a constructor keyword argument."""
+    if isinstance(attr_type, list):
+        item_type = attr_type[0]
+        if issubclass(item_type, CaliopenObject):
+            def convert(value):
+                if isinstance(value, list):
+                    return [item_type(**x) for x in value]
+                return [item_type(**value)]
+            return convert
+        return lambda value: list(value) if isinstance(value, list) \
+            else [value]
+    if issubclass(attr_type, CaliopenObject):
+        return lambda value: attr_type(**value) \
+            if isinstance(value, dict) else value
+    return lambda value: value
+
+
+def _build_to_dict_converter(attr_type):
+    """Return function(value) for marshall_dict, None if value is kept."""
+    if isinstance(attr_type, list):
+        if issubclass(attr_type[0], ObjectDictifiable):
+            return lambda value: [x.marshall_dict() for x in value]
+        return None
+    if issubclass(attr_type, ObjectDictifiable):
+        return lambda value: value.marshall_dict()
+    return None
+
+
+def _build_to_db_converter(attr_type):
+    """Return function(value) for marshall_db, _SKIP to not set value."""
+    if isinstance(attr_type, list):
+        item_type = attr_type[0]
+        if issubclass(item_type, CaliopenObject):
+            model_class = item_type._model_class
+            return lambda value: [model_class(**x.marshall_dict())
+                                  for x in value]
+        return lambda value: value
+    if issubclass(attr_type, datetime.datetime):
+        # datetime in cqlengine are 'naive', ours are 'aware'
+        return lambda value: value.replace(tzinfo=None) \
+            if value is not None else value
+    if issubclass(attr_type, CaliopenObject):
+        def convert(value):
+            if value is None:
+                return _SKIP
+            return attr_type._model_class(**value.marshall_dict())
+        return convert
+    return lambda value: value
+
+
+def _default_value(attr_type):
+    """Return factory of value for an attribute missing from a document."""
+    if isinstance(attr_type, types.ListType):
+        return list
+    if issubclass(attr_type, types.DictType):
+        return dict
+    if issubclass(attr_type, types.BooleanType):
+        return _constant(False)
+    if issubclass(attr_type, types.StringType):
+        return _constant("")
+    if issubclass(attr_type, types.IntType):
+        return _constant(0)
+    return _constant(None)
+
+
+class MarshallPlan(object):
+    """Converters for attributes of a CaliopenObject class."""
+
+    def __init__(self, kls):
+        self.attrs = kls._attrs
+        self.init = {}
+        self.init_defaults = []
+        self.from_dict = {}
+        self.dict_defaults = []
+        self.to_dict = {}
+        self.to_db = {}
+        # attributes that can be modified in place
+        self.mutable = []
+        for name, attr_type in self.attrs.items():
+            is_list = isinstance(attr_type, list)
+            if is_list or issubclass(attr_type, (types.DictType,
+                                                 ObjectDictifiable)):
+                self.mutable.append(name)
+            self.init[name] = _build_init_converter(attr_type)
+            self.init_defaults.append((name, list if is_list
+                                       else _constant(None)))
+            self.from_dict[name] = _from_dict_converter(attr_type)
+            self.dict_defaults.append((name, _default_value(attr_type)))
+            self.to_dict[name] = _build_to_dict_converter(attr_type)
+            self.to_db[name] = _build_to_db_converter(attr_type)
+        self._db_converters = {}
+        self._index_attributes = {}
+        self._index_properties = {}
+
+    def db_converters(self, model):
+        """Return (attribute, converter) to set on a cql model instance."""
+        model_class = model.__class__
+        converters = self._db_converters.get(model_class)
+        if converters is None:
+            converters = [(x, self.to_db[x]) for x in model.keys()
+                          if not x.startswith("_") and x in self.attrs]
+            self._db_converters[model_class] = converters
+        return converters
+
+    def index_attributes(self, document):
+        """Return attributes mapped by an index document or class."""
+        doc_type = document._doc_type
+        attributes = self._index_attributes.get(doc_type.name)
+        if attributes is None:
+            mapping = doc_type.mapping.to_dict()
+            attributes = [x for x in mapping[doc_type.name]["properties"]
+                          if not x.startswith("_") and x in self.attrs]
+            self._index_attributes[doc_type.name] = attributes
+        return attributes
+
+    def index_properties(self, index_class):
+        """Return names of properties defined by an index class."""
+        properties = self._index_properties.get(index_class)
+        if properties is None:
+            properties = set(x for x in index_class.__dict__
+                             if isinstance(getattr(index_class, x), property))
+            self._index_properties[index_class] = properties
+        return properties
+
+
+def get_marshall_plan(kls):
+    """Return marshalling plan of an object class, built on first use."""
+    plan = kls.__dict__.get('_marshall_plan')
+    if plan is None or plan.attrs is not kls._attrs:
+        plan = MarshallPlan(kls)
+        setattr(kls, '_marshall_plan', plan)
+    return plan
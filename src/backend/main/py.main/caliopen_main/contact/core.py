@@ -3,10 +3,15 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import logging
+import threading
+import time
 import uuid
 import datetime
+from collections import OrderedDict
+
 import pytz
 import phonenumbers
+from cassandra.cqlengine.query import BatchQuery, BatchType
 
 from .store import (Contact as ModelContact,
                     ContactLookup as ModelContactLookup,
@@ -14,13 +19,89 @@ from .store import (Contact as ModelContact,
                     Organization, Email, IM, PostalAddress,
                     Phone, SocialIdentity)
 from .store.contact_index import IndexedContact
+from .store.recipient_index import RecipientIndexManager
 from caliopen_main.common.store.tag import ResourceTag
+from caliopen_storage.config import Configuration
 from caliopen_storage.core import BaseCore, BaseUserCore
 from caliopen_storage.core.mixin import MixinCoreRelation, MixinCoreNested
+from caliopen_storage.store.model import DEFAULT_CONCURRENCY
 from caliopen_main.pi.objects import PIModel
 
 log = logging.getLogger(__name__)
 
+# maximum number of values of a lookup IN query
+LOOKUP_IN_SIZE = 100
+
+
+class ContactResolutionCache(object):
+    """
+    Per user cache of contact ids resolved for addresses.
+
+    Addresses without contact are cached too. Mappings of max_users users
+    are kept in process for ttl seconds, those of an user are dropped when
+    one of its contacts is created, deleted or updated. Configured by
+    ``cache.contact_resolution`` key (max_users, ttl), a ttl of 0
+    disable it. Users are keyed by the string of their id, as user ids
+    are given either as UUID or as string.
+    """
+
+    def __init__(self, max_users=1000, ttl=60):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls):
+        conf = Configuration('global').get('cache.contact_resolution') or {}
+        return cls(max_users=conf.get('max_users', 1000),
+                   ttl=conf.get('ttl', 60))
+
+    def get(self, user_id, addresses):
+        """
+        Return cached contact ids of addresses.
+
+        Return a tuple of a dict address -> contact id (None if address
+        has no contact) and the list of addresses not in cache.
+        """
+        if not self.ttl:
+            return {}, list(addresses)
+        user_id = str(user_id)
+        with self._lock:
+            entry = self._users.pop(user_id, None)
+            if entry is None or entry[0] < time.time():
+                return {}, list(addresses)
+            self._users[user_id] = entry
+            mapping = entry[1]
+            found = {x: mapping[x] for x in addresses if x in mapping}
+        return found, [x for x in addresses if x not in found]
+
+    def set(self, user_id, mapping):
+        """Cache contact ids of addresses for an user."""
+        if not self.ttl:
+            return
+        user_id = str(user_id)
+        with self._lock:
+            entry = self._users.pop(user_id, None)
+            if entry is None or entry[0] < time.time():
+                entry = (time.time() + self.ttl, {})
+            entry[1].update(mapping)
+            self._users[user_id] = entry
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Drop cached addresses of an user."""
+        with self._lock:
+            self._users.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+contact_resolutions = ContactResolutionCache.from_config()
+
 
 class ContactLookup(BaseUserCore):
 
@@ -103,8 +184,10 @@ class Contact(BaseUserCore, MixinCoreRelation, MixinCoreNested):
 
     @property
     def user(self):
-        from caliopen_main.user.core import User
-        return User.get(self.user_id)
+        if '_user' not in self.__dict__:
+            from caliopen_main.user.core import User
+            self._user = User.get(self.user_id)
+        return self._user
 
     @classmethod
     def _compute_title(cls, contact):
@@ -124,17 +207,23 @@ class Contact(BaseUserCore, MixinCoreRelation, MixinCoreNested):
                   format(type, value))
         lookup = ContactLookup.create(self.user, value=value, type=type,
                                       contact_ids=[self.contact_id])
+        contact_resolutions.invalidate(self.user_id)
         return lookup
 
-    def _create_lookups(self):
-        """Create lookups for a contact using its nested attributes."""
+    def _lookup_items(self):
+        """Yield (type, value) of lookups of a contact nested attributes."""
         for attr_name, obj in self._lookup_values.items():
             nested = getattr(self, attr_name)
             if nested:
                 for attr in nested:
                     lookup_value = attr[obj['value']]
                     if lookup_value:
-                        self._create_lookup(obj['type'], lookup_value)
+                        yield obj['type'], lookup_value
+
+    def _create_lookups(self):
+        """Create lookups for a contact using its nested attributes."""
+        for type, value in self._lookup_items():
+            self._create_lookup(type, value)
 
     @classmethod
     def normalize_phones(cls, phones):
@@ -148,17 +237,8 @@ class Contact(BaseUserCore, MixinCoreRelation, MixinCoreNested):
                 pass
 
     @classmethod
-    def create(cls, user, contact, **related):
-        # XXX do sanity check about only one primary for related objects
-        # XXX check no extra arguments in related than relations
-
-        contact.validate()
-        for k, v in related.iteritems():
-            if k in cls._relations:
-                [x.validate() for x in v]
-            else:
-                raise Exception('Invalid argument to contact.create : %s' % k)
-
+    def _build_attrs(cls, contact):
+        """Return model attributes of a new contact from a NewContact."""
         contact_id = uuid.uuid4()
         if not contact.title:
             title = cls._compute_title(contact)
@@ -202,10 +282,33 @@ class Contact(BaseUserCore, MixinCoreRelation, MixinCoreNested):
                                                     Organization),
                  'tags': contact.tags,
                  'pi': pi}
+        return attrs
+
+    @classmethod
+    def create(cls, user, contact, index_writer=None, **related):
+        """
+        Create a new contact for user from a NewContact parameter.
 
+        If index_writer (a BulkIndexWriter) is given, contact indexation
+        is queued into it instead of being done immediately.
+        """
+        # XXX do sanity check about only one primary for related objects
+        # XXX check no extra arguments in related than relations
+
+        contact.validate()
+        for k, v in related.iteritems():
+            if k in cls._relations:
+                [x.validate() for x in v]
+            else:
+                raise Exception('Invalid argument to contact.create : %s' % k)
+
+        attrs = cls._build_attrs(contact)
+        attrs['_index_writer'] = index_writer
         core = super(Contact, cls).create(user, **attrs)
         log.debug('Created contact %s' % core.contact_id)
         core._create_lookups()
+        RecipientIndexManager(user.user_id). \
+            set_contact(core, writer=index_writer, created=True)
         # Create relations
         related_cores = {}
         for k, v in related.iteritems():
@@ -218,25 +321,164 @@ class Contact(BaseUserCore, MixinCoreRelation, MixinCoreNested):
                     log.debug('Created related core %r' % new_core)
         return core
 
+    @classmethod
+    def _save_many(cls, user, cores):
+        """
+        Save contacts and their lookups using an unlogged batch.
+
+        Rows of an user share the same partition key. If batch fails,
+        contacts are saved one by one to know which ones failed. Return a
+        list of errors (None on success).
+        """
+        def rows(core):
+            lookups = [ModelContactLookup(user_id=user.user_id, value=value,
+                                          type=type,
+                                          contact_ids=[core.model.contact_id])
+                       for type, value in core._lookup_items()]
+            return [core.model] + lookups
+
+        try:
+            with BatchQuery(batch_type=BatchType.Unlogged) as batch:
+                for core in cores:
+                    for row in rows(core):
+                        row.batch(batch).save()
+            return [None] * len(cores)
+        except Exception as exc:
+            log.warn('Batch save of {} contacts failed: {}'.
+                     format(len(cores), exc))
+        finally:
+            for core in cores:
+                core.model.batch(None)
+        errors = []
+        for core in cores:
+            # model was marked persisted when added to failed batch
+            core.model._is_persisted = False
+            try:
+                for row in rows(core):
+                    row.save()
+                errors.append(None)
+            except Exception as exc:
+                log.error('Save of contact {} failed: {}'.
+                          format(core.contact_id, exc))
+                errors.append(exc)
+        return errors
+
+    @classmethod
+    def create_many(cls, user, contacts, index_writer):
+        """
+        Create many contacts for user from NewContact parameters.
+
+        Contacts and their lookups are written with one batch, their
+        indexation is queued into index_writer (a BulkIndexWriter) and
+        caller is responsible to flush it. A failure only affects its
+        contact: return a list of (contact, error) in same order than
+        contacts.
+        """
+        results = [None] * len(contacts)
+        cores = []
+        for position, contact in enumerate(contacts):
+            try:
+                contact.validate()
+                attrs = cls._build_attrs(contact)
+            except Exception as exc:
+                results[position] = (None, exc)
+                continue
+            attrs = {k: v for k, v in attrs.items()
+                     if k in cls._model_class._columns}
+            model = cls._model_class(user_id=user.user_id, **attrs)
+            cores.append((position, cls(model)))
+        errors = cls._save_many(user, [x[1] for x in cores])
+        contact_resolutions.invalidate(user.user_id)
+        recipients = RecipientIndexManager(user.user_id)
+        for (position, core), error in zip(cores, errors):
+            if error is None:
+                core.model.create_index(writer=index_writer)
+                recipients.set_contact(core, writer=index_writer,
+                                       created=True)
+            results[position] = (core if error is None else None, error)
+        return results
+
     @classmethod
     def lookup(cls, user, value):
-        lookups = ContactLookup._model_class.filter(user_id=user.user_id,
-                                                    value=value)
-        if lookups and lookups[0].contact_ids:
-            # XXX how to manage many contacts
-            return cls.get(user, lookups[0].contact_ids[0])
-        # XXX something else to do ?
-        return None
+        return cls.lookup_many(user, [value]).get(value)
+
+    @classmethod
+    def _resolve(cls, user, addresses):
+        """Return a dict address -> contact id (or None) of addresses."""
+        mapping, missing = contact_resolutions.get(user.user_id, addresses)
+        if not missing:
+            return mapping
+        found = {}
+        for i in range(0, len(missing), LOOKUP_IN_SIZE):
+            values = missing[i:i + LOOKUP_IN_SIZE]
+            lookups = ContactLookup._model_class. \
+                filter(user_id=user.user_id, value__in=values)
+            for lookup in lookups:
+                # XXX how to manage many contacts
+                if lookup.contact_ids and lookup.value not in found:
+                    found[lookup.value] = lookup.contact_ids[0]
+        resolved = {x: found.get(x) for x in missing}
+        contact_resolutions.set(user.user_id, resolved)
+        mapping.update(resolved)
+        return mapping
+
+    @classmethod
+    def lookup_many(cls, user, addresses, public_keys=False,
+                    concurrency=DEFAULT_CONCURRENCY):
+        """
+        Return contacts related to many addresses.
+
+        Lookups are read with IN queries (or from resolution cache) then
+        contacts are fetched concurrently, with their public keys if
+        asked. Return a dict address -> Contact, None for addresses
+        without contact.
+        """
+        addresses = list(set(x for x in addresses if x))
+        if not addresses:
+            return {}
+        mapping = cls._resolve(user, addresses)
+        contact_ids = list(set(x for x in mapping.values() if x))
+        contacts = {}
+        for contact in cls.get_many(user, contact_ids,
+                                    concurrency=concurrency):
+            if contact is not None:
+                contact._user = user
+                contacts[contact.contact_id] = contact
+        if public_keys:
+            cls.prefetch_public_keys(contacts.values(),
+                                     concurrency=concurrency)
+        return {address: contacts.get(str(contact_id)) if contact_id else None
+                for address, contact_id in mapping.items()}
+
+    @classmethod
+    def prefetch_public_keys(cls, contacts, concurrency=DEFAULT_CONCURRENCY):
+        """Fetch public keys of many contacts concurrently."""
+        contacts = list(contacts)
+        keys = [{'user_id': x.user_id, 'contact_id': x.contact_id}
+                for x in contacts]
+        results = PublicKey._model_class.find_many(keys,
+                                                   concurrency=concurrency)
+        for contact, rows in zip(contacts, results):
+            contact._public_keys = [PublicKey(x) for x in rows]
 
     def delete(self):
         if self.user.contact_id == self.contact_id:
             raise Exception("Can't delete contact related to user")
-        return super(Contact, self).delete()
+        contact_resolutions.invalidate(self.user_id)
+        deleted = super(Contact, self).delete()
+        try:
+            RecipientIndexManager(self.user_id).unset_contact(self.contact_id)
+        except Exception as exc:
+            log.warn('Update of recipients of contact {} failed: {}'.
+                     format(self.contact_id, exc))
+        return deleted
 
     @property
     def public_keys(self):
         """Return detailed public keys."""
-        return self._expand_relation('public_keys')
+        if '_public_keys' not in self.__dict__:
+            self._public_keys = self._expand_relation('public_keys')
+        return self._public_keys
 
     # MixinCoreRelation methods
     def add_organization(self, organization):
@@ -277,7 +519,9 @@ class Contact(BaseUserCore, MixinCoreRelation, MixinCoreNested):
 
     def add_public_key(self, key):
         # XXX Compute fingerprint and check key validity
+        self.__dict__.pop('_public_keys', None)
         return self._add_relation('public_keys', key)
 
     def delete_public_key(self, key_id):
+        self.__dict__.pop('_public_keys', None)
         return self._delete_relation('public_keys', key_id)
\ No newline at end of file
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Caliopen contacts import.
+
+Contacts are imported from a stream of parsed vcards: each card is parsed
+when read, then contacts are created by batches (one cassandra batch and
+bulk indexation per batch), so that memory used does not depend on the
+number of imported contacts.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+
+from caliopen_storage.config import Configuration
+from caliopen_storage.store import BulkIndexWriter
+
+from .core import Contact
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 50
+# number of failures detailed in report
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportReport(object):
+    """Progress and failures of a contacts import."""
+
+    def __init__(self):
+        self.total = 0
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, position, stage, error):
+        """Record failure of card at position (starting at 1)."""
+        self.failed += 1
+        log.warn('Import of vcard #{} failed during {}: {}'.
+                 format(position, stage, error))
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            message = getattr(error, 'message', None) or str(error)
+            self.errors.append({'position': position, 'stage': stage,
+                                'message': '{}'.format(message)})
+
+    def to_dict(self):
+        return {'total': self.total,
+                'created': self.created,
+                'failed': self.failed,
+                'errors': self.errors}
+
+
+class ContactImporter(object):
+    """
+    Import parsed vcards as contacts of an user.
+
+    on_progress is called with the ImportReport after each batch.
+    """
+
+    def __init__(self, user, batch_size=None, on_progress=None):
+        conf = Configuration('global').get('contact.import', {}) or {}
+        self.user = user
+        self.batch_size = batch_size or \
+            conf.get('batch_size', DEFAULT_BATCH_SIZE)
+        self.on_progress = on_progress
+
+    def _create_batch(self, batch, writer, report):
+        positions = [x[0] for x in batch]
+        contacts = [x[1] for x in batch]
+        results = Contact.create_many(self.user, contacts, writer)
+        for position, (core, error) in zip(positions, results):
+            if error is None:
+                report.created += 1
+            else:
+                report.add_error(position, 'creation', error)
+
+    def import_vcards(self, parsed_vcards):
+        """
+        Import an iterable of ParsedVCard, return an ImportReport.
+
+        Failure of a card (parsing, validation or storage) does not stop
+        import, it is recorded in report.
+        """
+        report = ImportReport()
+        batch = []
+        # failed indexations are logged by writer, contacts are stored
+        with BulkIndexWriter() as writer:
+            for parsed in parsed_vcards:
+                report.total += 1
+                if parsed.error is not None:
+                    report.add_error(report.total, 'parsing', parsed.error)
+                    continue
+                batch.append((report.total, parsed.contact))
+                if len(batch) >= self.batch_size:
+                    self._create_batch(batch, writer, report)
+                    batch = []
+                    if self.on_progress:
+                        self.on_progress(report)
+            if batch:
+                self._create_batch(batch, writer, report)
+        if self.on_progress:
+            self.on_progress(report)
+        log.info('Imported {} contacts of {} vcards for user {}, {} failed'.
+                 format(report.created, report.total, self.user.user_id,
+                        report.failed))
+        return report
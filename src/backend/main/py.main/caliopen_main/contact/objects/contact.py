@@ -12,6 +12,7 @@ from ..store.contact import (Contact as ModelContact,
                              ContactLookup as ModelContactLookup,
                              PublicKey as ModelPublicKey)
 from ..store.contact_index import IndexedContact
+from ..store.recipient_index import RecipientIndexManager
 from ..parameters import Contact as ParamContact
 
 from .email import Email
@@ -111,6 +112,21 @@ class Contact(ObjectIndexable):
             self.delete_index()
         except Exception as exc:
             raise exc
+        try:
+            RecipientIndexManager(self.user_id).unset_contact(self.contact_id)
+        except Exception as exc:
+            log.warn('Update of recipients of contact {} failed: {}'.
+                     format(self.contact_id, exc))
+
+    def apply_patch(self, patch, **options):
+        """Apply patch, then update recipients of contact if indexed."""
+        super(Contact, self).apply_patch(patch, **options)
+        if options.get('index'):
+            try:
+                RecipientIndexManager(self.user_id).set_contact(self)
+            except Exception as exc:
+                log.warn('Update of recipients of contact {} failed: {}'.
+                         format(self.contact_id, exc))
 
     @classmethod
     def _compute_title(cls, contact):
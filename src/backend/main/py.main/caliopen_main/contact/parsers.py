@@ -18,8 +18,13 @@ from caliopen_main.common.parameters.types import PhoneNumberType
 from caliopen_main.common.parameters.types import InternetAddressType
 
 import os
+from collections import namedtuple
+
 import vobject
 
+# a parsed vcard, with either the NewContact or the parsing error
+ParsedVCard = namedtuple('ParsedVCard', ['contact', 'error'])
+
 
 def validate_email(val):
     """Validate email value."""
@@ -241,3 +246,60 @@ def read_directory(directory):
                 for v in vcards_tmp:
                     vcards.append(v)
     return vcards
+
+
+def iter_vcard_blocks(stream):
+    """
+    Yield text of each top level vcard of a stream.
+
+    Stream is read line by line, only one card is kept in memory.
+    """
+    lines = []
+    depth = 0
+    for line in stream:
+        # folded lines start with a space, they can not be BEGIN or END
+        name = line.split(':', 1)[0].upper()
+        if name == 'BEGIN':
+            depth += 1
+        if depth:
+            lines.append(line)
+        if name == 'END' and depth:
+            depth -= 1
+            if not depth:
+                yield ''.join(lines)
+                lines = []
+    if lines:
+        # not closed card, reported as invalid by its parsing
+        yield ''.join(lines)
+
+
+def iter_vcards(stream):
+    """
+    Parse vcards of a stream one at a time.
+
+    Yield a ParsedVCard for each card, an invalid card does not stop
+    parsing of next ones.
+    """
+    for block in iter_vcard_blocks(stream):
+        try:
+            parsed = ParsedVCard(parse_vcard(vobject.readOne(block)), None)
+        except Exception as exc:
+            parsed = ParsedVCard(None, exc)
+        yield parsed
+
+
+def iter_vcard_files(paths):
+    """Parse vcards of .vcf or .vcard files one at a time."""
+    for path in paths:
+        ext = path.split('.')[-1]
+        if ext == 'vcard' or ext == 'vcf':
+            with open(path, 'r') as fh:
+                for parsed in iter_vcards(fh):
+                    yield parsed
+
+
+def iter_vcard_directory(directory):
+    """Parse vcards of files of a directory one at a time."""
+    files = [os.path.join(directory, f) for f in sorted(os.listdir(directory))
+             if os.path.isfile(os.path.join(directory, f))]
+    return iter_vcard_files(files)
@@ -1,9 +1,16 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, print_function, unicode_literals
 
-from caliopen_storage.parameters import ReturnCoreObject
+import logging
+
+from cassandra.cqlengine import columns
+
+from caliopen_storage.parameters import ReturnCoreObject, ReturnIndexObject
+from caliopen_storage.store.model import DEFAULT_CONCURRENCY
 
 from .core import Contact, PublicKey
+from .store import Contact as ModelContact
+from .store.contact_index import IndexedContact
 from .parameters import (Contact as ContactParam,
                          ShortContact as ContactShortParam,
                          Email as EmailParam,
@@ -14,6 +21,8 @@ from .parameters import (Contact as ContactParam,
                          PostalAddress as PostalAddressParam,
                          SocialIdentity as SocialIdentityParam)
 
+log = logging.getLogger(__name__)
+
 
 class ReturnContact(ReturnCoreObject):
 
@@ -21,6 +30,12 @@ class ReturnContact(ReturnCoreObject):
     _return_class = ContactParam
 
 
+class ReturnIndexContact(ReturnIndexObject):
+
+    _index_class = IndexedContact
+    _return_class = ContactParam
+
+
 class ReturnShortContact(ReturnCoreObject):
 
     _core_class = Contact
@@ -61,3 +76,90 @@ class ReturnSocialIdentity(ReturnCoreObject):
 class ReturnOrganization(ReturnCoreObject):
 
     _return_class = OrganizationParam
+
+
+def index_has_contact_fields():
+    """Check if contact index maps all returned fields but relations."""
+    doc_type = IndexedContact._doc_type
+    mapped = doc_type.mapping.to_dict()[doc_type.name]['properties']
+    fields = set(ContactParam._fields) - set(Contact._relations) - \
+        {'contact_id', 'user_id'}
+    return fields.issubset(mapped)
+
+
+def _user_type_fields():
+    """Return fields of user defined type columns of contact model."""
+    fields = {}
+    for name, column in ModelContact._columns.items():
+        if isinstance(column, columns.List):
+            column = column.sub_types[0]
+        if isinstance(column, columns.UserDefinedType):
+            fields[name] = list(column.user_type._fields)
+    return fields
+
+
+def _fill_user_types(entry):
+    """
+    Set null fields of nested objects of an indexed contact to None.
+
+    Null fields are not indexed, they are set back so that defaults of
+    returned parameters apply as for contacts read from storage.
+    """
+    for name, fields in _user_type_fields().items():
+        values = entry.get(name)
+        if isinstance(values, dict):
+            values = [values]
+        for value in values or []:
+            for field in fields:
+                value.setdefault(field, None)
+
+
+def _build_from_index(user, hits, concurrency):
+    """Build returned contacts from documents, fetch their public keys."""
+    keys = [{'user_id': user.user_id, 'contact_id': hit.meta.id}
+            for hit in hits]
+    public_keys = PublicKey._model_class.find_many(keys,
+                                                   concurrency=concurrency)
+    for hit, rows in zip(hits, public_keys):
+        entry = hit.to_dict()
+        _fill_user_types(entry)
+        entry['contact_id'] = hit.meta.id
+        entry['user_id'] = user.user_id
+        entry['public_keys'] = [PublicKey(x).to_dict() for x in rows]
+        yield hit.meta.id, ReturnIndexContact, entry
+
+
+def _build_from_storage(user, hits, concurrency):
+    """Build returned contacts fetched from storage with their keys."""
+    ids = [hit.meta.id for hit in hits]
+    cores = Contact.get_many(user, ids, concurrency=concurrency)
+    Contact.prefetch_public_keys([x for x in cores if x is not None],
+                                 concurrency=concurrency)
+    for contact_id, core in zip(ids, cores):
+        if core is None:
+            log.warn('Contact {} not found'.format(contact_id))
+            continue
+        yield contact_id, ReturnContact, core
+
+
+def build_contacts(user, hits, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Build returned contacts from hits of a contacts search.
+
+    When contact index maps every returned field, contacts are built from
+    indexed documents and their public keys fetched concurrently. Else
+    contacts and their keys are fetched concurrently from storage.
+    Contacts that can not be built are skipped.
+    """
+    if index_has_contact_fields():
+        builders = _build_from_index(user, hits, concurrency)
+    else:
+        builders = _build_from_storage(user, hits, concurrency)
+    contacts = []
+    for contact_id, kls, source in builders:
+        try:
+            contacts.append(kls.build(source))
+        except Exception as exc:
+            log.error('Unable to build contact {}: {}'.
+                      format(contact_id, exc))
+    return contacts
@@ -4,8 +4,10 @@ from __future__ import absolute_import, print_function, unicode_literals
 from .contact import Contact, IndexedContact, ContactLookup
 from .contact import Organization, PostalAddress
 from .contact import Email, IM, Phone, SocialIdentity, PublicKey
+from .recipient_index import IndexedRecipient, RecipientIndexManager
 
 
 __all__ = ['Contact', 'ContactLookup', 'IndexedContact',
            'Organization', 'PostalAddress',
-           'Email', 'IM', 'Phone', 'SocialIdentity', 'PublicKey']
+           'Email', 'IM', 'Phone', 'SocialIdentity', 'PublicKey',
+           'IndexedRecipient', 'RecipientIndexManager']
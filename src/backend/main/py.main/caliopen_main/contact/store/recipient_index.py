@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""Caliopen recipients suggestion index classes.
+
+Each address an user can write to, from its contacts or seen as a message
+participant, is indexed once in a recipient document with a completion
+field. Recipients are suggested with a completion suggester, using a
+prefix index much smaller than ngrams of every address of every document.
+
+Suggestions are ranked by completion weight: number of messages the
+address participated in, plus a weight for addresses of a contact
+depending on contact privacy indexes.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+
+from elasticsearch_dsl import (Mapping, Keyword, Integer, Completion,
+                               analyzer)
+from caliopen_storage.store.model import BaseIndexDocument
+from caliopen_main.message.store.message_index import IndexedMessage
+
+from .contact import Contact
+
+log = logging.getLogger(__name__)
+
+# weight of being a contact, in number of messages
+CONTACT_WEIGHT = 100
+# elasticsearch default max_input_length of completion fields
+MAX_INPUT_LENGTH = 50
+DEFAULT_SUGGEST_SIZE = 10
+
+# count a message where recipient is a participant
+RECIPIENT_ADD_SCRIPT = """
+def s = ctx._source;
+s.message_count += 1;
+if (s.label == null && params.label != null) {
+    s.label = params.label;
+    s.suggest.input = params.input;
+}
+s.suggest.weight = s.message_count + s.contact_weight;
+"""
+
+# set (or unset when contact_id is null) contact of a recipient
+RECIPIENT_CONTACT_SCRIPT = """
+def s = ctx._source;
+s.contact_id = params.contact_id;
+s.contact_weight = params.contact_weight;
+if (params.label != null) {
+    s.label = params.label;
+    s.suggest.input = params.input;
+}
+if (s.message_count == 0 && s.contact_id == null) {
+    ctx.op = 'delete';
+} else {
+    s.suggest.weight = s.message_count + s.contact_weight;
+}
+"""
+
+
+def recipient_id(protocol, address):
+    """Return id of recipient document of an address."""
+    return '{}:{}'.format(protocol or 'email', address.lower())
+
+
+def suggest_inputs(address, label=None):
+    """Return completion inputs of an address with its label."""
+    inputs = [address]
+    local_part = address.split('@')[0]
+    if local_part != address:
+        inputs.append(local_part)
+    if label:
+        words = label.split()
+        inputs.append(label)
+        # match any word of a label, not only the first one
+        inputs.extend(words[1:])
+    unique = []
+    for value in inputs:
+        value = value.strip()[:MAX_INPUT_LENGTH]
+        if value and value not in unique:
+            unique.append(value)
+    return unique
+
+
+def contact_weight(pi):
+    """Return ranking weight of a contact with privacy indexes pi."""
+    if not pi:
+        return CONTACT_WEIGHT
+    values = [getattr(pi, x, 0) or 0
+              for x in ('technic', 'comportment', 'context')]
+    return CONTACT_WEIGHT + sum(values) // len(values)
+
+
+def contact_addresses(contact):
+    """Return (protocol, address) of emails and ims of a contact."""
+    addresses = [('email', x.address) for x in contact.emails or []
+                 if x.address]
+    addresses.extend((x.protocol or x.type, x.address)
+                     for x in contact.ims or [] if x.address)
+    return addresses
+
+
+class IndexedRecipient(BaseIndexDocument):
+    """Address an user can write to, with its completion field."""
+
+    doc_type = 'indexed_recipient'
+
+    address = Keyword()
+    protocol = Keyword()
+    label = Keyword()
+    contact_id = Keyword()
+    contact_weight = Integer()
+    message_count = Integer()
+    suggest = Completion()
+
+    @classmethod
+    def build_mapping(cls):
+        """Generate the mapping definition for recipients."""
+        m = Mapping(cls.doc_type)
+        m.meta('_all', enabled=False)
+        m.field('address', 'keyword')
+        m.field('protocol', 'keyword')
+        m.field('label', 'keyword')
+        m.field('contact_id', 'keyword')
+        m.field('contact_weight', 'integer')
+        m.field('message_count', 'integer')
+        m.field('suggest', 'completion', analyzer=analyzer('simple'))
+        return m
+
+    @classmethod
+    def update_action(cls, index, protocol, address, script, params,
+                      upsert):
+        """Return a bulk scripted update action of a recipient."""
+        return {
+            '_op_type': 'update',
+            '_index': index,
+            '_type': cls.doc_type,
+            '_id': recipient_id(protocol, address),
+            '_retry_on_conflict': 3,
+            'script': {'lang': 'painless', 'inline': script,
+                       'params': params},
+            'upsert': upsert,
+        }
+
+
+class RecipientIndexManager(object):
+    """Maintain and query recipients suggestion index of an user."""
+
+    def __init__(self, user_id):
+        self.index = str(user_id)
+        self.proxy = BaseIndexDocument.client()
+
+    def _write(self, action, writer):
+        if writer is not None:
+            writer.add(action)
+            return
+        self.proxy.update(index=action['_index'], doc_type=action['_type'],
+                          id=action['_id'], retry_on_conflict=3,
+                          body={'script': action['script'],
+                                'upsert': action['upsert']})
+
+    def add_participants(self, participants, exclude_contact=None,
+                         writer=None):
+        """
+        Count a message for each of its participants.
+
+        Participants related to exclude_contact (user own contact) are
+        not suggested. Updates are queued into writer if given.
+        """
+        seen = set()
+        for participant in participants:
+            address = getattr(participant, 'address', None)
+            contact_ids = [str(x) for x in
+                           getattr(participant, 'contact_ids', None) or []]
+            if not address or address in seen or \
+                    (exclude_contact and str(exclude_contact) in contact_ids):
+                continue
+            seen.add(address)
+            label = getattr(participant, 'label', None)
+            if label == address:
+                label = None
+            protocol = getattr(participant, 'protocol', None) or 'email'
+            inputs = suggest_inputs(address, label)
+            upsert = {
+                'address': address,
+                'protocol': protocol,
+                'label': label,
+                'contact_id': None,
+                'contact_weight': 0,
+                'message_count': 1,
+                'suggest': {'input': inputs, 'weight': 1},
+            }
+            params = {'label': label, 'input': inputs}
+            action = IndexedRecipient.update_action(
+                self.index, protocol, address, RECIPIENT_ADD_SCRIPT, params,
+                upsert)
+            self._write(action, writer)
+
+    def _detach_contact(self, contact_id, keep=()):
+        """Unset contact of its recipients, but keep ones."""
+        query = {'bool': {'filter': {'term': {'contact_id': contact_id}},
+                          'must_not': [{'ids': {'values': list(keep)}}]}}
+        params = {'contact_id': None, 'contact_weight': 0, 'label': None}
+        body = {'query': query,
+                'script': {'lang': 'painless',
+                           'inline': RECIPIENT_CONTACT_SCRIPT,
+                           'params': params}}
+        self.proxy.update_by_query(index=self.index,
+                                   doc_type=IndexedRecipient.doc_type,
+                                   body=body, conflicts='proceed')
+
+    def set_contact(self, contact, writer=None, created=False):
+        """
+        Index addresses of a created or changed contact.
+
+        Recipients that are no more addresses of a changed contact are
+        detached from it.
+        """
+        contact_id = str(contact.contact_id)
+        label = contact.title or None
+        weight = contact_weight(contact.pi)
+        addresses = contact_addresses(contact)
+        if not created:
+            keep = [recipient_id(protocol, address)
+                    for protocol, address in addresses]
+            self._detach_contact(contact_id, keep=keep)
+        for protocol, address in addresses:
+            inputs = suggest_inputs(address, label)
+            upsert = {
+                'address': address,
+                'protocol': protocol,
+                'label': label,
+                'contact_id': contact_id,
+                'contact_weight': weight,
+                'message_count': 0,
+                'suggest': {'input': inputs, 'weight': weight},
+            }
+            params = {'contact_id': contact_id, 'contact_weight': weight,
+                      'label': label, 'input': inputs}
+            action = IndexedRecipient.update_action(
+                self.index, protocol, address, RECIPIENT_CONTACT_SCRIPT,
+                params, upsert)
+            self._write(action, writer)
+
+    def unset_contact(self, contact_id):
+        """Detach recipients of a deleted contact."""
+        self._detach_contact(str(contact_id))
+
+    def rebuild(self, writer, exclude_contact=None):
+        """
+        Index recipients again from contacts and indexed messages.
+
+        Updates are queued into writer (a BulkIndexWriter). Return number
+        of indexed contacts and messages.
+        """
+        IndexedRecipient.create_mapping(self.index)
+        self.proxy.delete_by_query(index=self.index,
+                                   doc_type=IndexedRecipient.doc_type,
+                                   body={'query': {'match_all': {}}},
+                                   conflicts='proceed')
+        contacts = 0
+        for contact in Contact.filter(user_id=self.index):
+            if str(contact.contact_id) == str(exclude_contact):
+                continue
+            self.set_contact(contact, writer=writer, created=True)
+            contacts += 1
+        messages = 0
+        search = IndexedMessage.search(using=self.proxy, index=self.index). \
+            source(['participants'])
+        for message in search.scan():
+            self.add_participants(message.participants or [],
+                                  exclude_contact=exclude_contact,
+                                  writer=writer)
+            messages += 1
+        return contacts, messages
+
+    def suggest(self, prefix, size=DEFAULT_SUGGEST_SIZE):
+        """
+        Suggest recipients starting with prefix, best ranked first.
+
+        Return a list of dict with address, label, protocol, contact_id
+        and source ('contact' or 'participant') of suggestion.
+        """
+        body = {
+            'suggest': {
+                'recipients': {
+                    'prefix': prefix,
+                    'completion': {'field': 'suggest', 'size': size},
+                }
+            },
+            '_source': ['address', 'label', 'protocol', 'contact_id'],
+        }
+        result = self.proxy.search(index=self.index,
+                                   doc_type=IndexedRecipient.doc_type,
+                                   body=body)
+        suggestions = []
+        for option in result['suggest']['recipients'][0]['options']:
+            source = option['_source']
+            source['source'] = 'contact' if source.get('contact_id') \
+                else 'participant'
+            suggestions.append(source)
+        return suggestions
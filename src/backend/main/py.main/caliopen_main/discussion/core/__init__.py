@@ -4,9 +4,10 @@ from __future__ import absolute_import, print_function, unicode_literals
 from .discussion import MainView, Discussion, ReturnDiscussion
 from .discussion import DiscussionListLookup, DiscussionRecipientLookup
 from .discussion import DiscussionThreadLookup
+from .summary import DiscussionSummary
 
 __all__ = [
     'Discussion', 'MainView', 'ReturnDiscussion',
     'DiscussionListLookup', 'DiscussionRecipientLookup',
-    'DiscussionThreadLookup'
+    'DiscussionThreadLookup', 'DiscussionSummary'
 ]
@@ -16,7 +16,8 @@ from ..store.discussion import \
      DiscussionRecipientLookup as ModelRecipientLookup,
      DiscussionThreadLookup as ModelThreadLookup,
      Discussion as ModelDiscussion)
-from ..store.discussion_index import DiscussionIndexManager as DIM
+from ..store.discussion_index import (DiscussionIndexManager as DIM,
+                                      IndexedDiscussion)
 
 from caliopen_main.discussion.parameters import Discussion as DiscussionParam
 from caliopen_main.message.parameters.participant import Participant
@@ -55,22 +56,22 @@ class DiscussionThreadLookup(BaseUserCore):
     _pkey_name = 'external_root_msg_id'
 
 
-def build_discussion(core, index):
-    """Temporary build of output Discussion return parameter."""
+def build_discussion(user, index):
+    """Build output Discussion return parameter from index only."""
     discuss = DiscussionParam()
-    discuss.user_id = core.user_id
-    discuss.discussion_id = core.discussion_id
-    discuss.date_insert = core.date_insert
-    discuss.date_update = index.last_message.date_insert
+    discuss.user_id = user.user_id
+    discuss.discussion_id = index.discussion_id
+    discuss.date_insert = index.date_insert
+    discuss.date_update = index.date_update
     # TODO : excerpt from plain or html body
-    discuss.excerpt = index.last_message.body_plain[:100]
+    discuss.excerpt = index.excerpt[:100]
     discuss.total_count = index.total_count
 
     # TODO
     # discussion.privacy_index = index_message.privacy_index
     # XXX Only last message recipient at this time
 
-    for part in index.last_message.participants:
+    for part in index.participants:
         participant = Participant()
         participant.address = part['address']
         try:
@@ -90,22 +91,31 @@ def build_discussion(core, index):
 
 
 class MainView(object):
-    """Build main view return structure from index messages."""
+    """Build main view return structure from discussions summaries."""
 
     def build_responses(self, user, discussions):
-        """Build list of responses using core and related index message."""
+        """Build list of responses from indexed discussions."""
         for discussion in discussions:
-            try:
-                core = Discussion.get(user, discussion.discussion_id)
-            except NotFound:
-                continue
-            if core:
-                yield build_discussion(core, discussion)
-
-    def get(self, user, min_pi, max_pi, min_il, max_il, limit, offset):
-        """Build the main view results."""
-        # XXX use of correct pagination and correct datasource (index)
+            if discussion.has_messages:
+                yield build_discussion(user, discussion)
+
+    def get(self, user, min_pi, max_pi, min_il, max_il, limit, offset,
+            cursor=None):
+        """
+        Build the main view results.
+
+        When a cursor is given (empty one for first page), discussions are
+        paginated using their summaries and a next_cursor is returned.
+        """
         dim = DIM(user.user_id)
+        if cursor is not None:
+            discussions, total, next_cursor = \
+                dim.page_discussions(limit=limit, cursor=cursor,
+                                     min_pi=min_pi, max_pi=max_pi,
+                                     min_il=min_il, max_il=max_il)
+            responses = self.build_responses(user, discussions)
+            return {'discussions': list(responses), 'total': total,
+                    'next_cursor': next_cursor}
         discussions, total = dim.list_discussions(limit=limit, offset=offset,
                                                   min_pi=min_pi, max_pi=max_pi,
                                                   min_il=min_il, max_il=max_il)
@@ -117,6 +127,8 @@ class Discussion(BaseUserCore):
     """Discussion core object."""
 
     _model_class = ModelDiscussion
+    # summaries are indexed by DiscussionSummary, not with discussions
+    _index_class = IndexedDiscussion
 
     _pkey_name = 'discussion_id'
 
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Caliopen core discussion summary.
+
+Summary of a discussion (counts, importance levels range and last message)
+is stored with the discussion and mirrored in an IndexedDiscussion
+document, so that discussions can be listed with a single search request.
+
+It is updated incrementally when a message is added to a discussion and
+computed again from indexed messages when a message is changed or
+deleted, index being refreshed by these operations. Messages changed by
+the Go API and email broker are notified on the messageAction NATS topic
+for the listener to compute their discussion summary again.
+
+Each summary is stored with a version, updated with a conditional write
+(read, change, then write if version did not change), so that concurrent
+changes of a summary by the API and the listener are not lost.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+import time
+import uuid
+
+from cassandra.cqlengine import connection
+from cassandra.cqlengine.query import LWTException
+from elasticsearch import NotFoundError, ConflictError
+
+from ..store.discussion import Discussion as ModelDiscussion
+from ..store.discussion_index import (DiscussionIndexManager as DIM,
+                                      IndexedDiscussion, to_timestamp,
+                                      to_isoformat, count_attachments,
+                                      last_message_summary)
+from caliopen_main.message.store.participant import \
+    Participant as ModelParticipant
+
+log = logging.getLogger(__name__)
+
+PARTICIPANT_FIELDS = ['address', 'contact_ids', 'label', 'protocol', 'type']
+# conditional updates of a summary before giving up
+MAX_CHANGE_ATTEMPTS = 10
+
+
+def to_uuid(value):
+    if value is None or isinstance(value, uuid.UUID):
+        return value
+    return uuid.UUID(str(value))
+
+
+def initial_version():
+    """
+    Return first version of a summary, current time in microseconds.
+
+    It is greater than versions of summary documents indexed before
+    summaries were versioned.
+    """
+    return int(time.time() * 1000000)
+
+
+def build_participant(participant):
+    """Build a participant user type from an indexed one."""
+    values = {k: participant.get(k) for k in PARTICIPANT_FIELDS}
+    values['contact_ids'] = [to_uuid(x) for x in values['contact_ids'] or []]
+    return ModelParticipant(**values)
+
+
+class DiscussionSummary(object):
+    """Maintain stored and indexed summaries of discussions of an user."""
+
+    def __init__(self, user_id, writer=None):
+        """
+        Create a summary manager for an user.
+
+        If a writer (BulkIndexWriter) is given, summary documents are
+        queued into it and caller is responsible to flush it.
+        """
+        self.user_id = to_uuid(user_id)
+        self.index = str(user_id)
+        self.writer = writer
+        self._discussions = {}
+
+    def _load(self, discussion_id):
+        """
+        Read a stored discussion, with its summary version set.
+
+        Discussions stored without summary version get one, or are
+        created if not found, using conditional writes.
+        """
+        discussion = ModelDiscussion.filter(
+            user_id=self.user_id, discussion_id=discussion_id).first()
+        version = initial_version()
+        if discussion is None:
+            try:
+                return ModelDiscussion.if_not_exists(). \
+                    create(user_id=self.user_id,
+                           discussion_id=discussion_id,
+                           summary_version=version)
+            except LWTException:
+                return self._load(discussion_id)
+        if discussion.summary_version is None:
+            query = 'UPDATE {} SET summary_version = %s ' \
+                    'WHERE user_id = %s AND discussion_id = %s ' \
+                    'IF summary_version = null'. \
+                format(ModelDiscussion.column_family_name())
+            connection.get_session(). \
+                execute(query, (version, self.user_id, discussion_id))
+            return self._load(discussion_id)
+        return discussion
+
+    def _get(self, discussion_id):
+        """Return stored discussion, a new one if not found."""
+        discussion_id = to_uuid(discussion_id)
+        if discussion_id not in self._discussions:
+            self._discussions[discussion_id] = self._load(discussion_id)
+        return self._discussions[discussion_id]
+
+    def _change(self, discussion_id, change):
+        """
+        Apply change function to a stored discussion summary and save it.
+
+        Summary is saved only if not changed since read, by a conditional
+        update on its version. Otherwise it is read again and change is
+        applied again. Return saved discussion, None if it was changed
+        concurrently too many times.
+        """
+        discussion_id = to_uuid(discussion_id)
+        for attempt in range(MAX_CHANGE_ATTEMPTS):
+            discussion = self._get(discussion_id)
+            version = discussion.summary_version
+            change(discussion)
+            discussion.summary_version = version + 1
+            try:
+                discussion.iff(summary_version=version).save()
+                return discussion
+            except LWTException:
+                log.debug('Summary of discussion {} changed concurrently'.
+                          format(discussion_id))
+                self._discussions.pop(discussion_id, None)
+        log.error('Summary of discussion {} not saved after {} attempts'.
+                  format(discussion_id, MAX_CHANGE_ATTEMPTS))
+        return None
+
+    def _index(self, discussion):
+        """
+        Index a discussion summary.
+
+        Summary version is used as document version, so that a summary
+        indexed late does not overwrite a more recent one.
+        """
+        participants = []
+        for participant in discussion.participants or []:
+            values = {k: getattr(participant, k) for k in PARTICIPANT_FIELDS}
+            values['contact_ids'] = [str(x)
+                                     for x in values['contact_ids'] or []]
+            participants.append(values)
+        last_message_id = discussion.last_message_id
+        if last_message_id:
+            last_message_id = str(last_message_id)
+        source = {
+            'discussion_id': str(discussion.discussion_id),
+            'date_insert': to_timestamp(discussion.date_insert),
+            'last_message_date': to_timestamp(discussion.last_message_date),
+            'total_count': discussion.total_count,
+            'unread_count': discussion.unread_count,
+            'attachment_count': discussion.attachment_count,
+            'importance_level_min': discussion.importance_level_min,
+            'importance_level_max': discussion.importance_level_max,
+            'last_message': {
+                'message_id': last_message_id,
+                'subject': discussion.subject,
+                'excerpt': discussion.excerpt,
+                'date_insert': to_isoformat(discussion.last_message_date),
+                'participants': participants,
+            }
+        }
+        action = {'_op_type': 'index',
+                  '_index': self.index,
+                  '_type': IndexedDiscussion.doc_type,
+                  '_id': source['discussion_id'],
+                  '_version': discussion.summary_version,
+                  '_version_type': 'external',
+                  '_source': source}
+        if self.writer is not None:
+            self.writer.add(action)
+            return
+        try:
+            IndexedDiscussion.client(). \
+                index(index=self.index, doc_type=action['_type'],
+                      id=action['_id'], body=source,
+                      version=action['_version'], version_type='external')
+        except ConflictError:
+            log.debug('More recent summary of discussion {} indexed'.
+                      format(discussion.discussion_id))
+
+    def _clear(self, discussion_id):
+        """
+        Reset summary of a discussion without messages.
+
+        Discussion is kept, lookups may still reference it.
+        """
+        def clear(discussion):
+            discussion.total_count = 0
+            discussion.unread_count = 0
+            discussion.attachment_count = 0
+            discussion.importance_level_min = None
+            discussion.importance_level_max = None
+            discussion.last_message_id = None
+            discussion.last_message_date = None
+            discussion.participants = []
+
+        discussion = self._change(discussion_id, clear)
+        if discussion is None:
+            return
+        try:
+            IndexedDiscussion.client(). \
+                delete(index=self.index, doc_type=IndexedDiscussion.doc_type,
+                       id=str(discussion.discussion_id),
+                       version=discussion.summary_version,
+                       version_type='external')
+        except (NotFoundError, ConflictError):
+            pass
+
+    def add_message(self, message):
+        """
+        Add a new message, with its index document built, to its discussion.
+
+        Message must not be already counted in discussion summary.
+        """
+        if not message.discussion_id:
+            return
+        source = message._index.to_dict()
+        source['message_id'] = str(message.message_id)
+        il = message.importance_level or 0
+        date = message.date_insert
+
+        def add(discussion):
+            discussion.total_count = (discussion.total_count or 0) + 1
+            if message.is_unread:
+                discussion.unread_count = (discussion.unread_count or 0) + 1
+            discussion.attachment_count = \
+                (discussion.attachment_count or 0) + \
+                count_attachments(source.get('attachments'))
+            if discussion.importance_level_min is None or \
+                    il < discussion.importance_level_min:
+                discussion.importance_level_min = il
+            if discussion.importance_level_max is None or \
+                    il > discussion.importance_level_max:
+                discussion.importance_level_max = il
+            if discussion.date_insert is None or \
+                    to_timestamp(date) < to_timestamp(discussion.date_insert):
+                discussion.date_insert = date
+            if discussion.last_message_date is None or \
+                    to_timestamp(date) >= \
+                    to_timestamp(discussion.last_message_date):
+                self._set_last_message(discussion,
+                                       last_message_summary(source))
+                discussion.last_message_date = date
+
+        discussion = self._change(message.discussion_id, add)
+        if discussion is not None:
+            self._index(discussion)
+
+    def _set_last_message(self, discussion, message):
+        discussion.last_message_id = to_uuid(message['message_id'])
+        discussion.subject = message['subject']
+        discussion.excerpt = message['excerpt']
+        discussion.participants = [build_participant(x)
+                                   for x in message['participants']]
+
+    def _update(self, discussion_id, summary):
+        """Set summary of a stored discussion from a DiscussionIndex."""
+        def update(discussion):
+            self._set_summary(discussion, summary)
+
+        discussion = self._change(discussion_id, update)
+        if discussion is not None:
+            self._index(discussion)
+        return discussion
+
+    def _set_summary(self, discussion, summary):
+        discussion.total_count = summary.total_count
+        discussion.unread_count = summary.unread_count
+        discussion.attachment_count = summary.attachment_count
+        discussion.importance_level_min = summary.importance_level_min
+        discussion.importance_level_max = summary.importance_level_max
+        discussion.date_insert = summary.date_insert
+        discussion.last_message_date = summary.last_message_date
+        self._set_last_message(discussion, {
+            'message_id': summary.last_message_id,
+            'subject': summary.subject,
+            'excerpt': summary.excerpt,
+            'participants': summary.participants})
+
+    def refresh(self, discussion_id):
+        """Compute summary of a discussion again from indexed messages."""
+        if not discussion_id:
+            return
+        summary = DIM(self.index).get_by_id(str(discussion_id))
+        if summary is None:
+            log.debug('No more messages in discussion {}'.
+                      format(discussion_id))
+            self._clear(discussion_id)
+            return
+        self._update(discussion_id, summary)
+
+    def rebuild(self):
+        """
+        Compute summaries of all discussions again from indexed messages.
+
+        Return the number of summarized discussions.
+        """
+        IndexedDiscussion.create_mapping(self.index)
+        count = 0
+        for summary in DIM(self.index).iter_discussions():
+            self._update(summary.discussion_id, summary)
+            # do not keep all discussions of user in memory
+            self._discussions.pop(to_uuid(summary.discussion_id), None)
+            count += 1
+        return count
@@ -4,6 +4,7 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 from cassandra.cqlengine import columns
 from caliopen_storage.store.model import BaseModel
+from caliopen_main.message.store.participant import Participant
 
 
 class Discussion(BaseModel):
@@ -17,6 +18,17 @@ class Discussion(BaseModel):
     # privacy_index = columns.Integer()
     importance_level = columns.Integer()
     excerpt = columns.Text()
+    # summary, updated when messages are added, changed or deleted
+    total_count = columns.Integer(default=0)
+    unread_count = columns.Integer(default=0)
+    attachment_count = columns.Integer(default=0)
+    importance_level_min = columns.Integer()
+    importance_level_max = columns.Integer()
+    last_message_id = columns.UUID()
+    last_message_date = columns.DateTime()
+    subject = columns.Text()
+    participants = columns.List(columns.UserDefinedType(Participant))
+    summary_version = columns.BigInt()  # for conditional summary updates
 
 
 class DiscussionListLookup(BaseModel):
@@ -1,21 +1,110 @@
 # -*- coding: utf-8 -*-
 """Caliopen disccions index classes.
 
-Discussions are not really indexed, they are result of messages aggregations.
+Discussions are result of messages aggregations. Aggregations are used to
+compute the summary of a discussion (counts, importance levels range and
+last message), that is stored with the discussion and mirrored in a
+summary document (IndexedDiscussion) of user index.
 
-So there is not direct document mapping, only helpers to find discussions
-and build a suitable representation for displaying.
+Discussions are listed from these summary documents only, using a single
+search request paginated by offset or by cursor.
 
 """
 from __future__ import absolute_import, print_function, unicode_literals
+import calendar
+import datetime
+import json
 import logging
 
-from elasticsearch_dsl import A
-from caliopen_storage.store.model import BaseIndexDocument
+import pytz
+
+from elasticsearch_dsl import A, Mapping, Keyword, Date, Integer, Object
+from caliopen_storage.exception import InvalidCursor
+from caliopen_storage.store.model import (BaseIndexDocument, encode_cursor,
+                                          decode_cursor)
 from caliopen_main.message.store.message_index import IndexedMessage
 
 log = logging.getLogger(__name__)
 
+# message fields needed to display a discussion
+LAST_MESSAGE_FIELDS = ['date_insert', 'body_plain', 'participants',
+                       'discussion_id', 'subject']
+EXCERPT_SIZE = 200
+# discussions summarized by each request of a rebuild
+REBUILD_PARTITION_SIZE = 500
+
+
+def to_timestamp(date):
+    """Return a datetime as milliseconds since epoch."""
+    if date is None:
+        return 0
+    return calendar.timegm(date.utctimetuple()) * 1000 + \
+        date.microsecond // 1000
+
+
+def from_timestamp(value):
+    """Return an utc datetime from milliseconds since epoch."""
+    if value is None:
+        return None
+    return datetime.datetime.fromtimestamp(value / 1000.0, tz=pytz.utc)
+
+
+def count_attachments(attachments):
+    """Return number of non inline attachments."""
+    return len([x for x in attachments or [] if not x.get('is_inline')])
+
+
+def last_message_summary(message):
+    """Return last message part of a summary from a message source."""
+    return {
+        'message_id': message.get('message_id'),
+        'subject': message.get('subject'),
+        'excerpt': (message.get('body_plain') or '')[:EXCERPT_SIZE],
+        'date_insert': message.get('date_insert'),
+        'participants': message.get('participants') or [],
+    }
+
+
+def to_isoformat(date):
+    """Return an utc datetime, naive ones from Cassandra too, as string."""
+    if date is None:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=pytz.utc)
+    return date.isoformat()
+
+
+class IndexedDiscussion(BaseIndexDocument):
+    """Summary document of a discussion, mirror of the stored one."""
+
+    doc_type = 'indexed_discussion'
+
+    discussion_id = Keyword()
+    date_insert = Date()
+    last_message_date = Date()
+    total_count = Integer()
+    unread_count = Integer()
+    attachment_count = Integer()
+    importance_level_min = Integer()
+    importance_level_max = Integer()
+    last_message = Object(enabled=False)
+
+    @classmethod
+    def build_mapping(cls):
+        """Generate the mapping definition for discussion summaries."""
+        m = Mapping(cls.doc_type)
+        m.meta('_all', enabled=False)
+        m.field('discussion_id', 'keyword')
+        m.field('date_insert', 'date')
+        m.field('last_message_date', 'date')
+        m.field('total_count', 'integer')
+        m.field('unread_count', 'integer')
+        m.field('attachment_count', 'integer')
+        m.field('importance_level_min', 'integer')
+        m.field('importance_level_max', 'integer')
+        m.field('last_message', Object(enabled=False))
+        return m
+
 
 class DiscussionIndex(object):
     """Informations from index about a discussion."""
@@ -23,11 +112,68 @@ class DiscussionIndex(object):
     total_count = 0
     unread_count = 0
     attachment_count = 0
-    last_message = None
+    importance_level_min = 0
+    importance_level_max = 0
+    date_insert = None
+    date_update = None
+    last_message_date = None
+    last_message_id = None
+    subject = None
+    excerpt = ''
+    participants = []
 
     def __init__(self, id):
         self.discussion_id = id
 
+    @classmethod
+    def from_bucket(cls, bucket):
+        """Build from a discussion bucket of a discussions aggregation."""
+        discussion = cls(bucket['key'])
+        discussion.total_count = bucket['doc_count']
+        discussion.unread_count = bucket['unread']['doc_count']
+        discussion.attachment_count = \
+            bucket['attachments']['not_inline']['doc_count']
+        discussion.importance_level_min = int(bucket['il_min']['value'] or 0)
+        discussion.importance_level_max = int(bucket['il_max']['value'] or 0)
+        discussion.date_insert = \
+            from_timestamp(bucket['first_message']['value'])
+        discussion.last_message_date = \
+            from_timestamp(bucket['last_message']['value'])
+        hits = bucket['last_message_hit']['hits']['hits']
+        if hits:
+            message = hits[0]['_source']
+            message['message_id'] = hits[0]['_id']
+            discussion._set_last_message(last_message_summary(message))
+        return discussion
+
+    @classmethod
+    def from_summary(cls, hit):
+        """Build from an IndexedDiscussion document source."""
+        discussion = cls(hit['discussion_id'])
+        discussion.total_count = hit['total_count']
+        discussion.unread_count = hit['unread_count']
+        discussion.attachment_count = hit['attachment_count']
+        discussion.importance_level_min = hit['importance_level_min']
+        discussion.importance_level_max = hit['importance_level_max']
+        discussion.date_insert = from_timestamp(hit['date_insert'])
+        discussion.last_message_date = \
+            from_timestamp(hit['last_message_date'])
+        discussion._set_last_message(hit.get('last_message'))
+        return discussion
+
+    def _set_last_message(self, message):
+        if not message:
+            return
+        self.date_update = message['date_insert']
+        self.last_message_id = message.get('message_id')
+        self.subject = message.get('subject')
+        self.excerpt = message['excerpt']
+        self.participants = message['participants']
+
+    @property
+    def has_messages(self):
+        return self.date_update is not None
+
 
 class DiscussionIndexManager(object):
     """Manager for building discussions from index storage layer."""
@@ -42,29 +188,30 @@ class DiscussionIndexManager(object):
                                        index=self.index)
         return search
 
-    def __search_ids(self, limit, offset, min_pi, max_pi, min_il, max_il):
-        """Search discussions ids as a bucket aggregation."""
-        search = self._prepare_search(). \
-            filter("range", importance_level={'gte': min_il, 'lte': max_il})
-        # Do bucket term aggregation, sorted by last_message date
-        size = offset + (limit * 2)
-        agg = A('terms', field='discussion_id',
-                order={'last_message': 'desc'}, size=size, shard_size=size)
-        search.aggs.bucket('discussions', agg) \
-            .metric('last_message', 'max', field='date_insert')
-        result = search.execute()
-        if hasattr(result, 'aggregations'):
-            # Something found
-            buckets = result.aggregations.discussions.buckets
-            # XXX Ugly but don't find a way to paginate on bucket aggregation
-            buckets = buckets[offset:offset + limit]
-            total = result.aggregations.discussions.sum_other_doc_count
-            # remove last_message for now as it doesn't have relevant attrs
-            for discussion in buckets:
-                del discussion["last_message"]
-            return buckets, total
-        log.debug('No result found on index {}'.format(self.index))
-        return {}, 0
+    def _add_discussion_aggs(self, agg):
+        """Add aggregations needed to summarize discussions to a bucket."""
+        agg.metric('first_message', 'min', field='date_insert')
+        agg.metric('last_message', 'max', field='date_insert')
+        agg.metric('il_min', 'min', field='importance_level')
+        agg.metric('il_max', 'max', field='importance_level')
+        agg.metric('last_message_hit', 'top_hits', size=1,
+                   sort=[{'date_insert': {'order': 'desc'}}],
+                   _source={'includes': LAST_MESSAGE_FIELDS})
+        agg.bucket('unread', 'filter', term={'is_unread': True})
+        agg.bucket('attachments', 'nested', path='attachments') \
+            .bucket('not_inline', 'filter',
+                    term={'attachments.is_inline': False})
+        return agg
+
+    def _search_summaries(self, min_il, max_il):
+        """Prepare a search of discussions summaries, last updated first."""
+        search = IndexedDiscussion.search(using=self.proxy, index=self.index)
+        # discussions having messages in importance levels range
+        return search. \
+            filter('range', importance_level_min={'lte': max_il}). \
+            filter('range', importance_level_max={'gte': min_il}). \
+            sort({'last_message_date': {'order': 'desc'}},
+                 {'discussion_id': {'order': 'desc'}})
 
     def get_last_message(self, discussion_id, min_il, max_il, include_draft):
         """Get last message of a given discussion."""
@@ -85,18 +232,62 @@ class DiscussionIndexManager(object):
     def list_discussions(self, limit=10, offset=0, min_pi=0, max_pi=0,
                          min_il=-10, max_il=10):
         """Build a list of limited number of discussions."""
-        list, total = self.__search_ids(limit, offset, min_pi, max_pi, min_il,
-                                        max_il)
-        discussions = []
-        for discus in list:
-            message = self.get_last_message(discus['key'], min_il, max_il, True)
-            discussion = DiscussionIndex(discus['key'])
-            discussion.total_count = discus['doc_count']
-            discussion.last_message = message
-            # XXX build others values from index
-            discussions.append(discussion)
-        # XXX total do not work completly, hack a bit
-        return discussions, total + len(discussions)
+        search = self._search_summaries(min_il, max_il)
+        search = search.extra(from_=offset, size=limit)
+        result = search.execute().to_dict()
+        discussions = [DiscussionIndex.from_summary(x['_source'])
+                       for x in result['hits']['hits']]
+        return discussions, result['hits']['total']
+
+    def page_discussions(self, limit=10, cursor=None, min_pi=0, max_pi=0,
+                         min_il=-10, max_il=10):
+        """
+        Return a page of discussions, using summary documents.
+
+        Discussions are sorted by last message date then id, cursor is
+        the one returned with previous page (None for first page).
+        Return a tuple (discussions, total, next_cursor), next_cursor is
+        None on last page.
+        """
+        search = self._search_summaries(min_il, max_il)
+        search = search.extra(size=limit)
+        after = decode_cursor(cursor)
+        if after:
+            try:
+                search = search.extra(search_after=json.loads(after))
+            except ValueError as exc:
+                raise InvalidCursor('Invalid cursor {!r}: {}'.
+                                    format(cursor, exc))
+        result = search.execute().to_dict()
+        hits = result['hits']['hits']
+        discussions = [DiscussionIndex.from_summary(x['_source'])
+                       for x in hits]
+        next_cursor = None
+        if len(hits) == limit:
+            next_cursor = encode_cursor(json.dumps(hits[-1]['sort']))
+        return discussions, result['hits']['total'], next_cursor
+
+    def iter_discussions(self):
+        """
+        Summarize all discussions of index from their messages.
+
+        Discussions are aggregated by partitions of terms, yield a
+        DiscussionIndex for each one.
+        """
+        search = self._prepare_search()[:0]
+        search.aggs.metric('total', 'cardinality', field='discussion_id')
+        total = search.execute().to_dict()['aggregations']['total']['value']
+        partitions = total // REBUILD_PARTITION_SIZE + 1
+        for partition in range(partitions):
+            search = self._prepare_search()[:0]
+            agg = A('terms', field='discussion_id',
+                    include={'partition': partition,
+                             'num_partitions': partitions},
+                    size=REBUILD_PARTITION_SIZE * 2)
+            self._add_discussion_aggs(search.aggs.bucket('discussions', agg))
+            result = search.execute().to_dict()
+            for x in result['aggregations']['discussions']['buckets']:
+                yield DiscussionIndex.from_bucket(x)
 
     def message_belongs_to(self, discussion_id, message_id):
         """Search if a message belongs to a discussion"""
@@ -105,16 +296,15 @@ class DiscussionIndexManager(object):
         return str(msg.discussion_id) == str(discussion_id)
 
     def get_by_id(self, discussion_id):
-        """Return a single discussion by discussion_id"""
-
-        result = self._prepare_search() \
-            .filter("match", discussion_id=discussion_id) \
-            .execute()
-        if not result.hits:
+        """Summarize a single discussion by discussion_id from its messages"""
+        search = self._prepare_search() \
+            .filter("match", discussion_id=discussion_id)
+        search = search[:0]
+        agg = A('terms', field='discussion_id', size=1)
+        self._add_discussion_aggs(search.aggs.bucket('discussions', agg))
+        result = search.execute().to_dict()
+        buckets = result.get('aggregations', {}). \
+            get('discussions', {}).get('buckets')
+        if not buckets:
             return None
-
-        message = self.get_last_message(discussion_id, 0, 100, True)
-        discussion = DiscussionIndex(discussion_id)
-        discussion.total_count = result.hits.total
-        discussion.last_message = message
-        return discussion
+        return DiscussionIndex.from_bucket(buckets[0])
@@ -1,5 +1,8 @@
-from .raw import RawMessage, UserRawLookup
+from .raw import RawMessage, UserRawLookup, content_hash
+from .attachment import (AttachmentRefcount, AttachmentStore,
+                         get_attachment_store)
 
 __all__ = [
-    'RawMessage', 'UserRawLookup'
+    'RawMessage', 'UserRawLookup', 'content_hash',
+    'AttachmentRefcount', 'AttachmentStore', 'get_attachment_store'
 ]
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Caliopen core attachment content storage.
+
+Content of received attachments is stored once in object store, using its
+sha256 as object name, whatever the number of raw messages containing it.
+Non inline base64 parts are cut out of stored raw messages, which keep
+where and how to put them back (see :func:`detach_parts`), and messages
+keep the object url, size and hash of their attachments.
+
+A counter of references is kept for each content hash, incremented when a
+raw message is stored without it and decremented when this raw message is
+deleted. Unreferenced objects are removed by :meth:`AttachmentStore.collect`.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import base64
+import datetime
+import hashlib
+import logging
+import re
+import tempfile
+import time
+
+import pytz
+
+from caliopen_storage.core import BaseCore
+from caliopen_storage.config import Configuration
+from caliopen_storage.store import get_object_store, build_uri, parse_uri
+
+from ..store import AttachmentRefcount as ModelAttachmentRefcount
+from ..parsers.mail import MailAttachment, MailMessage, walk_part_bodies
+
+log = logging.getLogger(__name__)
+
+# decoded content bigger than this is spooled on disk before upload
+SPOOL_MAX_SIZE = 1024 * 1024
+# unreferenced objects younger than this are kept by garbage collection
+DEFAULT_GRACE_PERIOD = 3600  # seconds
+# decoded attachments smaller than this are kept in raw messages
+DEFAULT_MIN_SIZE = 16 * 1024
+
+_base64_line = re.compile(r'^[A-Za-z0-9+/]*={0,2}$')
+
+
+class AttachmentRefcount(BaseCore):
+    """Number of references to a stored attachment content."""
+
+    _model_class = ModelAttachmentRefcount
+    _pkey_name = 'content_hash'
+
+    @classmethod
+    def incr(cls, content_hash, value=1):
+        """Add value to the counter of content_hash."""
+        cls._model_class(content_hash=content_hash).update(refcount=value)
+
+    @classmethod
+    def count(cls, content_hash):
+        """Return number of references to content_hash."""
+        counter = cls._model_class.filter(content_hash=content_hash).first()
+        return counter.refcount if counter else 0
+
+
+class StoredAttachment(object):
+    """Reference to an attachment content stored in object store."""
+
+    def __init__(self, url, content_hash, size):
+        self.url = url
+        self.content_hash = content_hash
+        self.size = size
+
+
+class _HashingWriter(object):
+    """File like object computing hash and size of data written into it."""
+
+    def __init__(self, output):
+        self.output = output
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        self.output.write(data)
+
+
+class AttachmentStore(object):
+    """Store attachments content in object store, keyed by content hash."""
+
+    def __init__(self, store, bucket, grace_period=DEFAULT_GRACE_PERIOD,
+                 min_size=DEFAULT_MIN_SIZE):
+        self.store = store
+        self.bucket = bucket
+        self.grace_period = grace_period
+        self.min_size = min_size
+
+    @classmethod
+    def from_config(cls):
+        """
+        Build a store from object_store configuration.
+
+        Return None if no ``attachments`` bucket is configured.
+        """
+        conf = Configuration('global').get('object_store') or {}
+        bucket = (conf.get('buckets') or {}).get('attachments')
+        if not bucket:
+            return None
+        grace = conf.get('attachments_grace_period', DEFAULT_GRACE_PERIOD)
+        min_size = conf.get('attachments_min_size', DEFAULT_MIN_SIZE)
+        return cls(get_object_store(), bucket, grace_period=grace,
+                   min_size=min_size)
+
+    def url(self, content_hash):
+        """Return object store url of a content."""
+        return build_uri(self.bucket, content_hash)
+
+    def exists(self, content_hash):
+        """
+        Check if a content is in object store, and not about to be collected.
+
+        Objects older than half the grace period are reported missing, so
+        that they are stored again, which renews them.
+        """
+        stat = self.store.stat(self.bucket, content_hash)
+        if stat is None:
+            return False
+        renew = time.time() - self.grace_period / 2
+        return time.mktime(stat.last_modified) > renew
+
+    def put(self, attachment):
+        """
+        Store content of a MailAttachment and reference it once.
+
+        Payload is decoded into a spooled temporary file while computing
+        its hash, then sent to object store only if this content is not
+        already known. Return a StoredAttachment.
+        """
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as tmp:
+            writer = _HashingWriter(tmp)
+            attachment.write_to(writer)
+            content_hash = writer.hash.hexdigest()
+            # reference content before upload, so that a concurrent
+            # garbage collection do not remove it
+            AttachmentRefcount.incr(content_hash)
+            try:
+                if not self.exists(content_hash):
+                    tmp.seek(0)
+                    self.store.put(self.bucket, content_hash, tmp,
+                                   writer.size, attachment.content_type)
+                    log.debug('Stored attachment {} ({} bytes)'.
+                              format(content_hash, writer.size))
+            except Exception:
+                AttachmentRefcount.incr(content_hash, -1)
+                raise
+        return StoredAttachment(self.url(content_hash), content_hash,
+                                writer.size)
+
+    def release(self, content_hash):
+        """Remove a reference to a content."""
+        AttachmentRefcount.incr(content_hash, -1)
+
+    def read(self, url):
+        """Read a stored content fully in memory."""
+        return self.store.read(*parse_uri(url))
+
+    def collect(self, dry_run=False):
+        """
+        Remove unreferenced contents from object store.
+
+        Objects without references are removed once older than
+        grace_period, to not race with raw messages being stored: a
+        content referenced again is stored again when older than half
+        of it, so it is checked again just before removal. Counters are
+        kept, Cassandra does not allow to reuse deleted counters. Return
+        the list of removed content hashes.
+        """
+        limit = datetime.datetime.now(tz=pytz.utc) - \
+            datetime.timedelta(seconds=self.grace_period)
+        removed = []
+        for obj in self.store.list(self.bucket):
+            if obj.last_modified and obj.last_modified > limit:
+                continue
+            if AttachmentRefcount.count(obj.object_name) > 0:
+                continue
+            stat = self.store.stat(self.bucket, obj.object_name)
+            if stat is None or time.mktime(stat.last_modified) > \
+                    time.time() - self.grace_period:
+                continue
+            log.info('Removing unreferenced attachment {}'.
+                     format(obj.object_name))
+            if not dry_run:
+                self.store.remove(self.bucket, obj.object_name)
+            removed.append(obj.object_name)
+        return removed
+
+
+_attachment_store = None
+
+
+def get_attachment_store():
+    """Return configured AttachmentStore, None if not configured."""
+    global _attachment_store
+    if _attachment_store is None:
+        _attachment_store = AttachmentStore.from_config() or False
+    return _attachment_store or None
+
+
+class DetachedPart(object):
+    """
+    A base64 part cut out of a raw message, to store in object store.
+
+    index is the one of the attachment in MailMessage.attachments.
+    """
+
+    def __init__(self, index, offset, line_length, newline, suffix,
+                 attachment):
+        self.index = index
+        self.offset = offset
+        self.line_length = line_length
+        self.newline = newline
+        self.suffix = suffix
+        self.attachment = attachment
+
+
+def encode_part(content, line_length, newline):
+    """Return base64 body of a part, as laid out in its raw message."""
+    encoded = base64.b64encode(content)
+    return newline.join(encoded[i:i + line_length]
+                        for i in range(0, len(encoded), line_length))
+
+
+def _layout(body):
+    """
+    Return (line_length, newline, suffix, size) of a base64 body.
+
+    Return None if body is not canonical base64 laid out in lines of
+    same length, the only ones encoded back identically by encode_part.
+    """
+    data = body.rstrip(b'\r\n')
+    suffix = body[len(data):]
+    newline = b'\r\n' if b'\r\n' in body else b'\n'
+    lines = data.split(newline)
+    line_length = len(lines[0])
+    if not line_length or line_length % 4 or len(lines[-1]) % 4 or \
+            len(lines[-1]) > line_length:
+        return None
+    for line in lines[:-1]:
+        if len(line) != line_length or b'=' in line or \
+                not _base64_line.match(line):
+            return None
+    last = lines[-1][-4:]
+    if not _base64_line.match(lines[-1]) or b'=' in lines[-1][:-4] or \
+            base64.b64encode(base64.b64decode(last)) != last:
+        # unused bits of last group are not zero
+        return None
+    size = len(data.replace(newline, b'')) // 4 * 3 - last.count(b'=')
+    return line_length, newline, suffix, size
+
+
+def detach_parts(raw, min_size=DEFAULT_MIN_SIZE):
+    """
+    Find parts of a raw mail to store out of it.
+
+    Non inline attachments encoded in base64 are detached, if their
+    decoded size is at least min_size and if their body is laid out as
+    encode_part does, so that it is encoded back byte for byte. Return
+    (data, parts): raw without body of detached parts and a list of
+    DetachedPart, whose attachment (a MailAttachment) is to be stored.
+    """
+    attachments = MailMessage(raw).attachments
+    leaves = [x for x in walk_part_bodies(raw)
+              if MailAttachment.is_attachment(x[0])]
+    if len(leaves) != len(attachments):
+        log.warn('Mime structure not understood, attachments not detached')
+        return raw, []
+    chunks = []
+    parts = []
+    position = 0
+    detached_size = 0
+    for index, ((part, boundary, start, end), attachment) in \
+            enumerate(zip(leaves, attachments)):
+        found = MailAttachment(part, boundary)
+        if (found.content_type, found.filename) != \
+                (attachment.content_type, attachment.filename):
+            log.warn('Mime structure not understood, attachments not '
+                     'detached')
+            return raw, []
+        encoding = part.get('Content-Transfer-Encoding', '').strip().lower()
+        if found.is_inline or encoding != 'base64':
+            continue
+        layout = _layout(raw[start:end])
+        if layout is None or layout[3] < min_size:
+            continue
+        line_length, newline, suffix, size = layout
+        chunks.append(raw[position:start])
+        position = end
+        parts.append(DetachedPart(index, start - detached_size,
+                                  line_length, newline, suffix, found))
+        detached_size += end - start
+    if not parts:
+        return raw, []
+    chunks.append(raw[position:])
+    return b''.join(chunks), parts
+
+
+def attach_parts(data, parts, read):
+    """
+    Put detached parts back into a raw mail.
+
+    parts are stored descriptions of detached parts (offset, url,
+    line_length, newline, suffix), read returns content of an url.
+    """
+    chunks = []
+    position = 0
+    for part in sorted(parts, key=lambda x: x.offset):
+        chunks.append(data[position:part.offset])
+        chunks.append(encode_part(read(part.url), part.line_length,
+                                  part.newline))
+        chunks.append(part.suffix)
+        position = part.offset
+    chunks.append(data[position:])
+    return b''.join(chunks)
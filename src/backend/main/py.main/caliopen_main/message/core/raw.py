@@ -2,26 +2,47 @@
 """Caliopen core raw message class."""
 from __future__ import absolute_import, print_function, unicode_literals
 
+import datetime
+import hashlib
+import io
+import time
 import uuid
 import logging
 
-from minio import Minio
-from minio.error import ResponseError
-import urlparse
+import pytz
 
-from minio import Minio
-from minio.error import ResponseError
+from cassandra.cqlengine import connection
+from cassandra.cqlengine.query import LWTException
+from cassandra.query import SimpleStatement
 
 from caliopen_storage.core import BaseUserCore, BaseCore
 from caliopen_storage.exception import NotFound
 from caliopen_storage.config import Configuration
+from caliopen_storage.helpers.compression import (get_codec, encode, decode,
+                                                  DEFAULT_MIN_SIZE)
+from caliopen_storage.store import get_object_store, build_uri, parse_uri
+from caliopen_storage.store.object_store import DEFAULT_CHUNK_SIZE
 
 from ..store import (RawMessage as ModelRaw,
-                     UserRawLookup as ModelUserRawLookup)
+                     RawMessagePart as ModelRawPart,
+                     RawMessageHash as ModelRawHash,
+                     RawMessageRefcount as ModelRawRefcount,
+                     RawMessageMigration as ModelRawMigration,
+                     UserRawLookup as ModelUserRawLookup,
+                     Message as ModelMessage)
 from caliopen_main.message.parsers.mail import MailMessage
+from .attachment import (AttachmentRefcount, get_attachment_store,
+                         detach_parts, attach_parts)
+from caliopen_main.common.helpers.decorators import cached_property
 
 log = logging.getLogger(__name__)
 
+# unreferenced raw messages younger than this are kept by garbage collection
+DEFAULT_GRACE_PERIOD = 7 * 86400  # seconds
+
+# migration linking existing messages to their raw message
+LINK_MIGRATION = 'user_raw_lookup'
+
 
 class RawMessage(BaseCore):
     """
@@ -34,94 +55,336 @@ class RawMessage(BaseCore):
     _pkey_name = 'raw_msg_id'
 
     @classmethod
-    def create(cls, raw):
-        """Create raw message."""
+    def encode(cls, raw):
+        """
+        Compress raw data using configured codec.
+
+        Return a (codec name, data) tuple, as stored in database.
+        """
+        conf = Configuration('global').get('object_store.raw_compression')
+        conf = conf or {}
+        codec = get_codec(conf.get('codec'), **(conf.get('options') or {}))
+        return encode(raw, codec,
+                      min_size=conf.get('min_size', DEFAULT_MIN_SIZE))
+
+    @classmethod
+    def create(cls, raw, encoded=None):
+        """
+        Create raw message, or return the one stored with same content.
+
+        Raw data is compressed using configured codec, encoded can be
+        given if result of encode(raw) is already known.
+        """
+        digest = content_hash(raw)
+        existing = cls.by_hash(digest)
+        if existing:
+            log.debug('Reuse raw message {} with same content'.
+                      format(existing.raw_msg_id))
+            return existing
         key = uuid.uuid4()
         size = len(raw)
-        return super(RawMessage, cls).create(raw_msg_id=key,
-                                             raw_data=raw,
-                                             raw_size=size)
+        codec, data = encoded or cls.encode(raw)
+        raw_msg = super(RawMessage, cls).create(raw_msg_id=key,
+                                                raw_data=data,
+                                                raw_size=size,
+                                                codec=codec,
+                                                content_hash=digest)
+        canonical = raw_msg.register_hash()
+        if canonical is not raw_msg:
+            # same content stored concurrently
+            raw_msg.model.delete()
+        return canonical
 
     @classmethod
-    def get(cls, raw_msg_id):
+    def by_hash(cls, digest):
+        """Return raw message stored for a content hash, or None."""
+        lookup = ModelRawHash.filter(content_hash=digest).first()
+        if lookup is None:
+            return None
+        try:
+            return cls.get(lookup.raw_msg_id)
+        except NotFound:
+            return None
+
+    def register_hash(self):
         """
-        Get raw message from db or ObjectStorage service
+        Register raw message as the one stored for its content hash.
 
-        :param raw_msg_id:
-        :return: a RawMessage or NotFound exception
+        Return the registered raw message, self or the one registered
+        first for same content.
         """
         try:
-            raw_msg = super(RawMessage, cls).get(raw_msg_id)
-        except Exception as exc:
-            log.warn(exc)
-            raise NotFound
+            ModelRawHash.if_not_exists(). \
+                create(content_hash=self.model.content_hash,
+                       raw_msg_id=self.model.raw_msg_id)
+            return self
+        except LWTException as exc:
+            raw_msg_id = exc.existing.get('raw_msg_id')
+        if raw_msg_id == self.model.raw_msg_id:
+            return self
+        try:
+            return RawMessage.get(raw_msg_id)
+        except NotFound:
+            # registered raw message have been collected
+            ModelRawHash.create(content_hash=self.model.content_hash,
+                                raw_msg_id=self.model.raw_msg_id)
+            return self
 
-        if raw_msg.raw_data == "" and raw_msg.uri != "":
-            # means raw message data have been stored in object store
-            # need to retrieve raw_data from it
-            url = urlparse.urlsplit(raw_msg.uri)
-            path = url.path.strip("/")
-            if url.scheme == 's3':
-                minioConf = Configuration("global").get("object_store")
-                minioClient = Minio(minioConf["endpoint"],
-                                    access_key=minioConf["access_key"],
-                                    secret_key=minioConf["secret_key"],
-                                    secure=False,
-                                    region=minioConf["location"])
-                try:
-                    resp = minioClient.get_object(url.netloc, path)
-                except Exception as exc:
-                    log.warn(exc)
-                    raise NotFound
-                # resp is a urllib3.response.HTTPResponse class
-                try:
-                    raw_msg.raw_data = resp.data
-                except Exception as exc:
-                    log.warn(exc)
-                    raise NotFound
-            else:
-                log.warn("raw message uri scheme not implemented")
-                raise NotFound
+    def canonical(self):
+        """
+        Return raw message to reference for this content.
+
+        Content hash is computed for raw messages stored without it
+        (by brokers), then same content always resolve to the first
+        stored raw message.
+        """
+        if not self.model.content_hash:
+            self.model.update(content_hash=content_hash(self.raw_data))
+        return self.register_hash()
+
+    @classmethod
+    def incr_refcount(cls, raw_msg_id, value=1):
+        """Add value to the number of references to a raw message."""
+        ModelRawRefcount(raw_msg_id=raw_msg_id).update(refcount=value)
 
-        return raw_msg
+    @classmethod
+    def refcount(cls, raw_msg_id):
+        """Return number of user messages referencing a raw message."""
+        counter = ModelRawRefcount.filter(raw_msg_id=raw_msg_id).first()
+        return counter.refcount if counter else 0
+
+    def delete(self):
+        """Delete raw message, its hash and object store content."""
+        # no more reused for new messages with same content
+        digest = self.model.content_hash
+        if digest:
+            lookup = ModelRawHash.filter(content_hash=digest).first()
+            if lookup and lookup.raw_msg_id == self.model.raw_msg_id:
+                lookup.delete()
+        if self.in_object_store:
+            get_object_store().remove(*self._object_location())
+        for part in self.model.detached_parts or []:
+            AttachmentRefcount.incr(part.content_hash, -1)
+        return self.model.delete()
+
+    def _claim_detach(self):
+        """Mark raw message as being detached, False if already done."""
+        query = 'UPDATE {} SET detached = false WHERE raw_msg_id = %s ' \
+                'IF detached = null'.format(ModelRaw.column_family_name())
+        result = connection.get_session(). \
+            execute(query, (self.model.raw_msg_id,))
+        return result.was_applied
+
+    def detach_attachments(self):
+        """
+        Store attachments in object store and cut them out of raw data.
+
+        Done once for a raw message, by the first delivery of it: the
+        stored raw data is replaced by a copy without body of detached
+        parts, reassembled when read. raw_size and content_hash are
+        those of the original raw message. Return True if parts have
+        been detached.
+        """
+        store = get_attachment_store()
+        if store is None or self.model.detached is not None:
+            return False
+        if not self._claim_detach():
+            return False
+        data, parts = detach_parts(self.raw_data, store.min_size)
+        if not parts:
+            self.model.update(detached=True)
+            return False
+        stored = []
+        try:
+            for part in parts:
+                stored.append(store.put(part.attachment))
+            self._replace_data(data, [
+                ModelRawPart(index=part.index, offset=part.offset,
+                             url=attachment.url,
+                             content_hash=attachment.content_hash,
+                             size=attachment.size,
+                             line_length=part.line_length,
+                             newline=part.newline, suffix=part.suffix)
+                for part, attachment in zip(parts, stored)])
+        except Exception:
+            for attachment in stored:
+                store.release(attachment.content_hash)
+            raise
+        log.info('Detached {} attachments of raw message {}, {} bytes '
+                 'stored instead of {}'.format(len(parts), self.raw_msg_id,
+                                               len(data),
+                                               self.model.raw_size))
+        return True
+
+    def _replace_data(self, data, parts):
+        """Store data without detached parts in place of raw data."""
+        previous = self._object_location() if self.in_object_store \
+            else None
+        max_size = int(Configuration('global').
+                       get('object_store.db_size_limit'))
+        if len(data) > max_size:
+            bucket = Configuration('global'). \
+                get('object_store.buckets.raw_messages')
+            name = '{}.detached'.format(self.model.raw_msg_id)
+            get_object_store().put(bucket, name, io.BytesIO(data),
+                                   len(data), 'message/rfc822')
+            codec, encoded, uri = None, b'', build_uri(bucket, name)
+        else:
+            codec, encoded = self.encode(data)
+            uri = None
+        try:
+            self.model.update(raw_data=encoded, codec=codec, uri=uri,
+                              detached=True, detached_parts=parts)
+        except Exception:
+            if uri:
+                get_object_store().remove(*parse_uri(uri))
+            raise
+        if previous:
+            get_object_store().remove(*previous)
+
+    @classmethod
+    def mark_migrated(cls, name=LINK_MIGRATION):
+        """Record that a migration of raw messages storage is done."""
+        ModelRawMigration.create(name=name,
+                                 date_done=datetime.datetime.now(tz=pytz.utc))
+
+    @classmethod
+    def is_migrated(cls, name=LINK_MIGRATION):
+        """Return True if a migration of raw messages storage is done."""
+        return ModelRawMigration.filter(name=name).first() is not None
+
+    @classmethod
+    def _scan(cls, model, *columns):
+        query = 'SELECT {} FROM {}'.format(', '.join(columns),
+                                           model.column_family_name())
+        statement = SimpleStatement(query, fetch_size=1000)
+        return connection.get_session().execute(statement)
+
+    @classmethod
+    def collect(cls, grace_period=DEFAULT_GRACE_PERIOD, dry_run=False):
+        """
+        Delete raw messages not referenced by any user message.
+
+        Raw messages written less than grace_period seconds ago are kept,
+        they may be under delivery. Reference counts are not trusted
+        alone: messages are scanned for raw messages they reference, and
+        missing links are created instead of deleting them.
+        Refuse to run until existing messages have been linked to their
+        raw message by migrate_raw. Return list of deleted raw_msg_id.
+
+        Only messages deleted through Message.delete_db unlink their raw
+        message: a message deleted by another way (the Go backend does
+        not implement message deletion yet) keeps its raw message
+        referenced, so it is never collected.
+        """
+        if not cls.is_migrated():
+            raise Exception('Raw messages migration not done, '
+                            'run migrate_raw first')
+        limit = (time.time() - grace_period) * 1000000
+        candidates = set()
+        for raw_msg_id, written in cls._scan(ModelRaw, 'raw_msg_id',
+                                             'writetime(raw_size)'):
+            if written and written > limit:
+                continue
+            if cls.refcount(raw_msg_id) == 0:
+                candidates.add(raw_msg_id)
+        if not candidates:
+            return []
+
+        for user_id, message_id, raw_msg_id in \
+                cls._scan(ModelMessage, 'user_id', 'message_id',
+                          'raw_msg_id'):
+            if raw_msg_id not in candidates:
+                continue
+            log.warn('Raw message {} referenced by message {} without link'.
+                     format(raw_msg_id, message_id))
+            candidates.discard(raw_msg_id)
+            if not dry_run:
+                UserRawLookup.link(user_id, raw_msg_id, message_id)
+
+        deleted = []
+        for raw_msg_id in candidates:
+            # may have been linked by a delivery since scanned
+            if cls.refcount(raw_msg_id) > 0:
+                continue
+            log.info('Deleting unreferenced raw message {}'.
+                     format(raw_msg_id))
+            if not dry_run:
+                try:
+                    cls.get(raw_msg_id).delete()
+                except NotFound:
+                    continue
+            deleted.append(raw_msg_id)
+        return deleted
 
     @classmethod
     def get(cls, raw_msg_id):
         """
-        Get raw message from db or ObjectStorage service
+        Get raw message from db.
+
+        Data stored in object store is not read here but when raw_data
+        is accessed, or incrementally using stream() or open().
 
         :param raw_msg_id:
         :return: a RawMessage or NotFound exception
         """
         try:
-            raw_msg = super(RawMessage, cls).get(raw_msg_id)
-        except NotFound:
-            return NotFound
-
-        if raw_msg.raw_data == "" and raw_msg.uri != "":
-            # means raw message data have been stored in object store
-            # need to retrieve raw_data from it
-            minioConf = Configuration("global").get("object_store")
-            minioClient = Minio(minioConf["endpoint"],
-                                access_key=minioConf["access_key"],
-                                secret_key=minioConf["secret_key"],
-                                secure=False,
-                                region=minioConf["location"])
-            try:
-                resp = minioClient.get_object(
-                    minioConf["buckets"]["raw_messages"],
-                    raw_msg_id)
-            except ResponseError as exc:
-                log.warn(exc)
-                return NotFound
-            # resp is a urllib3.response.HTTPResponse class
+            return super(RawMessage, cls).get(raw_msg_id)
+        except Exception as exc:
+            log.warn(exc)
+            raise NotFound
+
+    @property
+    def in_object_store(self):
+        """True if raw data is too large and stored in object store."""
+        return not self.model.raw_data and bool(self.model.uri)
+
+    def _object_location(self):
+        """Return (bucket, name) of raw data in object store."""
+        try:
+            return parse_uri(self.model.uri)
+        except ValueError:
+            bucket = Configuration('global'). \
+                get('object_store.buckets.raw_messages')
+            return bucket, str(self.model.raw_msg_id)
+
+    @cached_property
+    def raw_data(self):
+        """Raw message content, fully read in memory."""
+        if self.in_object_store:
+            bucket, name = self._object_location()
             try:
-                raw_msg.raw_data = resp.data
+                data = get_object_store().read(bucket, name)
             except Exception as exc:
                 log.warn(exc)
-                return NotFound
+                raise NotFound
+        else:
+            data = decode(self.model.raw_data, self.model.codec)
+        if self.model.detached_parts:
+            store = get_object_store()
+            data = attach_parts(data, self.model.detached_parts,
+                                lambda url: store.read(*parse_uri(url)))
+        return data
+
+    def stream(self, offset=0, length=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Iterate over chunks of raw content, or of a range of it."""
+        if self.in_object_store and not self.model.detached_parts:
+            bucket, name = self._object_location()
+            return get_object_store().iter_chunks(bucket, name,
+                                                  offset=offset,
+                                                  length=length,
+                                                  chunk_size=chunk_size)
+        end = offset + length if length is not None else None
+        return iter([self.raw_data[offset:end]])
 
-        return raw_msg
+    def open(self, offset=0, length=None):
+        """Return a file like object to read raw content or a range of it."""
+        if self.in_object_store and not self.model.detached_parts:
+            bucket, name = self._object_location()
+            return get_object_store().open(bucket, name, offset=offset,
+                                           length=length)
+        end = offset + length if length is not None else None
+        return io.BytesIO(self.raw_data[offset:end])
 
     @classmethod
     def get_for_user(cls, user_id, raw_msg_id):
@@ -132,7 +395,7 @@ class RawMessage(BaseCore):
         :param: raw_msg_id is a string
         :return: a RawMessage or None
         """
-        if not UserRawLookup.belongs_to_user(user_id, raw_msg_id):
+        if not UserRawLookup.lookup(user_id, raw_msg_id):
             return None
         try:
             return cls.get(raw_msg_id)
@@ -141,7 +404,7 @@ class RawMessage(BaseCore):
 
     def parse(self):
         """Parse raw message to get a formatted object."""
-        return MailMessage(self)
+        return MailMessage(self.raw_data)
 
 
 class UserRawLookup(BaseUserCore):
@@ -149,3 +412,43 @@ class UserRawLookup(BaseUserCore):
 
     _model_class = ModelUserRawLookup
     _pkey_name = 'raw_msg_id'
+
+    @classmethod
+    def lookup(cls, user_id, raw_msg_id):
+        """Return lookup of a raw message for an user, or None."""
+        obj = cls._model_class.filter(user_id=user_id,
+                                      raw_msg_id=raw_msg_id).first()
+        return cls(obj) if obj else None
+
+    @classmethod
+    def link(cls, user_id, raw_msg_id, message_id):
+        """
+        Link a raw message to the user message created from it.
+
+        Return False if raw message was already linked for this user,
+        otherwise reference count of raw message is incremented.
+        """
+        try:
+            cls._model_class.if_not_exists(). \
+                create(user_id=user_id, raw_msg_id=raw_msg_id,
+                       message_id=message_id)
+        except LWTException:
+            return False
+        RawMessage.incr_refcount(raw_msg_id)
+        return True
+
+    @classmethod
+    def unlink(cls, user_id, raw_msg_id):
+        """Remove link of an user to a raw message."""
+        obj = cls._model_class.filter(user_id=user_id,
+                                      raw_msg_id=raw_msg_id).first()
+        if obj:
+            obj.delete()
+            RawMessage.incr_refcount(raw_msg_id, -1)
+
+
+def content_hash(raw):
+    """Return sha256 hex digest of a raw message."""
+    if isinstance(raw, unicode):
+        raw = raw.encode('utf-8')
+    return hashlib.sha256(raw).hexdigest()
@@ -18,7 +18,8 @@ class MessageAttachment(ObjectJsonDictifiable):
         'is_inline': types.BooleanType,
         'size': types.IntType,
         'url': types.StringType,
-        'mime_boundary': types.StringType
+        'mime_boundary': types.StringType,
+        'content_hash': types.StringType
     }
 
     _model_class = ModelMessageAttachment
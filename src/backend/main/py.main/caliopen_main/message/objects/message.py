@@ -19,7 +19,7 @@ from ..store import Message as ModelMessage
 from ..store import IndexedMessage
 from ..parameters.message import Message as ParamMessage
 from ..parameters.draft import Draft
-from ..core import RawMessage
+from ..core import RawMessage, UserRawLookup
 from .attachment import MessageAttachment
 from .external_references import ExternalReferences
 from caliopen_main.user.objects.identities import Identity
@@ -28,6 +28,7 @@ from schematics.types import UUIDType
 from caliopen_main.message.parameters.participant import \
     Participant as IndexedParticipant
 from caliopen_main.common import errors as err
+from caliopen_main.discussion.core import DiscussionSummary
 
 import logging
 
@@ -88,6 +89,30 @@ class Message(ObjectIndexable):
         msg = RawMessage.get_for_user(self.user_id, self.raw_msg_id)
         return json.loads(msg.json_rep)
 
+    def delete_db(self, **options):
+        """
+        Delete message from db.
+
+        Reference to its raw message is released.
+        """
+        db = self._db
+        error = super(Message, self).delete_db(**options)
+        if error is None and db is not None:
+            if db.raw_msg_id:
+                UserRawLookup.unlink(db.user_id, db.raw_msg_id)
+        return error
+
+    def delete_index(self, **options):
+        """Delete message from index, then update its discussion summary."""
+        discussion_id = self.discussion_id or \
+            getattr(self._index, 'discussion_id', None)
+        super(Message, self).delete_index(**options)
+        try:
+            DiscussionSummary(self.user_id).refresh(discussion_id)
+        except Exception as exc:
+            log.warn('Update of discussion {} summary failed: {}'.
+                     format(discussion_id, exc))
+
     @classmethod
     def create_draft(cls, user_id=None, **params):
         """
@@ -130,6 +155,7 @@ class Message(ObjectIndexable):
         except Exception as exc:
             log.warn(exc)
             raise exc
+        DiscussionSummary(message.user_id).add_message(message)
         return message
 
     def patch_draft(self, patch, **options):
@@ -204,12 +230,20 @@ class Message(ObjectIndexable):
 
         validated_params["current_state"] = current_state
 
+        discussion_id = self.discussion_id
         try:
             self.apply_patch(validated_params, **options)
         except Exception as exc:
             log.info("apply_patch() failed with error : {}".format(exc))
             raise exc
 
+        if options.get("index"):
+            # index is refreshed, summaries are computed from it
+            summaries = DiscussionSummary(self.user_id)
+            summaries.refresh(self.discussion_id)
+            if discussion_id != self.discussion_id:
+                summaries.refresh(discussion_id)
+
     @classmethod
     def by_discussion_id(cls, user, discussion_id, min_pi, max_pi,
                          order=None, limit=None, offset=0):
@@ -219,16 +253,15 @@ class Message(ObjectIndexable):
                                       limit=limit,
                                       offset=offset,
                                       sort="-date_insert")
-        messages = []
         if res.hits:
-            for x in res.hits:
-                try:
-                    obj = cls(user.user_id, message_id=x.meta.id)
-                    obj.get_db()
-                    obj.unmarshall_db()
+            ids = [x.meta.id for x in res.hits]
+            messages = []
+            for msg_id, obj in zip(ids, cls.get_many(user, ids)):
+                if obj is None:
+                    log.warn('Message {} not found for user {}'.
+                             format(msg_id, user.user_id))
+                else:
                     messages.append(obj)
-                except Exception as exc:
-                    log.warn(exc)
             return {'hits': messages, 'total': res.hits.total}
         else:
             raise NotFound
@@ -13,6 +13,7 @@ class Attachment(Model):
     size = IntType()
     url = StringType()  # objectsStore uri for temporary file (draft) or boundary reference for mime-part attachment
     mime_boundary = StringType()  # for attachments embedded in raw messages
+    content_hash = StringType()  # sha256 of content stored in objectsStore
 
     class Options:
         serialize_when_none = False
@@ -11,9 +11,13 @@ must be defined outside of this one.
 
 import logging
 import base64
+import quopri
+import re
+from cStringIO import StringIO
 from itertools import groupby
 from mailbox import Message
 from email.header import decode_header
+from email.parser import HeaderParser, Parser
 import datetime
 import pytz
 from email.utils import parsedate_tz, mktime_tz, getaddresses
@@ -21,21 +25,28 @@ from email.utils import parsedate_tz, mktime_tz, getaddresses
 import zope.interface
 
 from caliopen_main.common.helpers.normalize import clean_email_address
+from caliopen_main.common.helpers.decorators import cached_property
 from caliopen_main.common.interfaces import (IAttachmentParser, IMessageParser,
                                              IParticipantParser)
 
 log = logging.getLogger(__name__)
 
+_headers_end = re.compile(r'\r?\n\r?\n')
+
 
 class MailAttachment(object):
     """Mail part structure."""
 
     zope.interface.implements(IAttachmentParser)
 
-    def __init__(self, part):
+    def __init__(self, part, mime_boundary=""):
         """
         Extract attachment attributes from a mail part
+
+        Payload is decoded only when data is accessed or written
+        using write_to().
         """
+        self.part = part
         self.content_type = part.get_content_type()
         self.filename = part.get_filename()
         content_disposition = part.get("Content-Disposition")
@@ -54,18 +65,41 @@ class MailAttachment(object):
                 raise Exception('Too many charset %r for %s' %
                                 (charsets, part.get_payload()))
             self.charset = charsets[0]
-            if 'Content-Transfer-Encoding' in part.keys():
-                if part.get('Content-Transfer-Encoding') == 'base64':
+        self.mime_boundary = mime_boundary or ""
+
+    @cached_property
+    def data(self):
+        """Attachment payload, decoded for text parts."""
+        data = self.part.get_payload()
+        if self.can_index:
+            if 'Content-Transfer-Encoding' in self.part.keys():
+                if self.part.get('Content-Transfer-Encoding') == 'base64':
                     data = base64.b64decode(data)
             if self.charset:
                 data = data.decode(self.charset, 'replace'). \
                     encode('utf-8')
-        boundary = part.get("Mime-Boundary", failobj="")
-        if boundary is not "":
-            self.mime_boundary = boundary
+        return data
+
+    def write_to(self, output):
+        """
+        Write payload decoded from its transfer encoding into output.
+
+        Base64 and quoted-printable payloads are decoded line by line,
+        so no decoded copy of the whole payload is kept in memory.
+        """
+        payload = self.part.get_payload()
+        if not payload:
+            return
+        encoding = self.part.get('Content-Transfer-Encoding', '')
+        encoding = encoding.strip().lower()
+        if isinstance(payload, unicode):
+            payload = payload.encode('utf-8')
+        if encoding == 'base64':
+            base64.decode(StringIO(payload), output)
+        elif encoding == 'quoted-printable':
+            quopri.decode(StringIO(payload), output)
         else:
-            self.mime_boundary = ""
-        self.data = data
+            output.write(payload)
 
     @classmethod
     def is_attachment(cls, part):
@@ -113,7 +147,13 @@ class MailMessage(object):
     Mail message structure.
 
     Got a mail in raw rfc2822 format, parse it to
-    resolve all recipients emails, parts and group headers
+    resolve all recipients emails, parts and group headers.
+
+    Mail is parsed in two phases: only headers are parsed at creation,
+    which is enough for participants, references or headers analysis.
+    MIME structure is parsed when mail, attachments or bodies are first
+    accessed, and bodies are decoded only when read. Each derived property
+    is computed once then cached.
     """
 
     zope.interface.implements(IMessageParser)
@@ -121,8 +161,6 @@ class MailMessage(object):
     recipient_headers = ['From', 'To', 'Cc', 'Bcc']
     message_type = 'email'
     warnings = []
-    body_html = ""
-    body_plain = ""
 
     def get_bodies(self):
         """
@@ -132,6 +170,8 @@ class MailMessage(object):
         """
         body_html = ""
         body_plain = ""
+        self.body_html = ""
+        self.body_plain = ""
 
         def to_utf8(input, charset):
             """
@@ -203,35 +243,58 @@ class MailMessage(object):
             self.body_plain = self.mail.get_payload(decode=True)
 
     def __init__(self, raw_data):
-        """Parse an RFC2822,5322 mail message."""
+        """Parse headers of an RFC2822,5322 mail message."""
         self.raw = raw_data
         try:
-            self.mail = Message(raw_data)
+            self.header_mail = HeaderParser().parsestr(raw_data)
+        except Exception as exc:
+            log.error('Parse message headers failed %s' % exc)
+            raise exc
+
+    @cached_property
+    def mail(self):
+        """Mail message with its parsed MIME structure."""
+        try:
+            mail = Message(self.raw)
         except Exception as exc:
             log.error('Parse message failed %s' % exc)
             raise exc
-        if self.mail.defects:
+        if mail.defects:
             # XXX what to do ?
-            log.warn('Defects on parsed mail %r' % self.mail.defects)
-            self.warning = self.mail.defects
+            log.warn('Defects on parsed mail %r' % mail.defects)
+            self.warning = mail.defects
+        return mail
+
+    @cached_property
+    def body_html(self):
+        """Html body, decoded on first access."""
         self.get_bodies()
+        return self.__dict__['body_html']
 
-    @property
+    @cached_property
+    def body_plain(self):
+        """Plain text body, decoded on first access."""
+        self.get_bodies()
+        return self.__dict__['body_plain']
+
+    @cached_property
     def subject(self):
         """Mail subject."""
-        s = decode_header(self.mail.get('Subject'))
+        s = decode_header(self.header_mail.get('Subject'))
         charset = s[0][1]
         if charset is not None:
             return s[0][0].decode(charset, "replace").encode("utf-8", "replace")
         else:
             return s[0][0]
 
-    @property
+    @cached_property
     def size(self):
         """Get mail size in bytes."""
-        return len(self.mail.as_string())
+        if isinstance(self.raw, unicode):
+            return len(self.raw.encode('utf-8'))
+        return len(self.raw)
 
-    @property
+    @cached_property
     def external_references(self):
         """Return mail references to be used as external references.
 
@@ -241,9 +304,9 @@ class MailMessage(object):
             references
         headers' strings are pruned to extract email addresses only.
         """
-        ext_id = self.mail.get('Message-Id')
-        parent_id = self.mail.get('In-Reply-To')
-        ref = self.mail.get_all("References")
+        ext_id = self.header_mail.get('Message-Id')
+        parent_id = self.header_mail.get('In-Reply-To')
+        ref = self.header_mail.get_all("References")
         ref_addr = getaddresses(ref) if ref else None
         ref_ids = [address[1] for address in ref_addr] if ref_addr else []
 
@@ -253,52 +316,57 @@ class MailMessage(object):
                 if parent_id else None,
             'ancestors_ids': ref_ids}
 
-    @property
+    @cached_property
     def date(self):
         """Get UTC date from a mail message."""
-        mail_date = self.mail.get('Date')
+        mail_date = self.header_mail.get('Date')
         if mail_date:
             tmp_date = parsedate_tz(mail_date)
             return datetime.datetime.fromtimestamp(mktime_tz(tmp_date))
         log.debug('No date on mail using now (UTC)')
         return datetime.datetime.now(tz=pytz.utc)
 
-    @property
+    @cached_property
     def participants(self):
         """Mail participants."""
         participants = []
         for header in self.recipient_headers:
             addrs = []
             participant_type = header.capitalize()
-            if self.mail.get(header):
-                if ',' in self.mail.get(header):
-                    addrs.extend(self.mail.get(header).split(','))
+            value = self.header_mail.get(header)
+            if value:
+                if ',' in value:
+                    addrs.extend(value.split(','))
                 else:
-                    addrs.append(self.mail.get(header))
+                    addrs.append(value)
             for addr in addrs:
                 participant = MailParticipant(participant_type, addr)
                 participants.append(participant)
         return participants
 
-    @property
+    @cached_property
     def attachments(self):
         """
         Extract parts which we consider as attachments.
         See is_attachment() func.
         """
+        if self.header_mail.get_content_maintype() not in ('multipart',
+                                                            'message'):
+            # no need to parse MIME structure
+            return []
         if not self.mail.is_multipart():
             return []
         attchs = []
-        for p in walk_with_boundary(self.mail, ""):
+        for p, boundary in walk_with_boundary(self.mail, ""):
             if not p.is_multipart():
                 if MailAttachment.is_attachment(p):
-                    attchs.append(MailAttachment(p))
+                    attchs.append(MailAttachment(p, boundary))
         return attchs
 
-    @property
+    @cached_property
     def extra_parameters(self):
         """Mail message extra parameters."""
-        lists = self.mail.get_all("List-ID")
+        lists = self.header_mail.get_all("List-ID")
         lists_addr = getaddresses(lists) if lists else None
         lists_ids = [address[1] for address in lists_addr] if lists_addr else []
         return {'lists': lists_ids}
@@ -306,15 +374,16 @@ class MailMessage(object):
     def lookup_discussion_sequence(self, *args, **kwargs):
         """Return list of lookup type, value from a mail message."""
         seq = []
+        refs = self.external_references
 
         # first from thread logic :
         # try to link message to external thread's root message-id
-        if len(self.external_references["ancestors_ids"]) > 0:
-            seq.append(("thread", self.external_references["ancestors_ids"][0]))
-        elif self.external_references["parent_id"]:
-            seq.append(("thread", self.external_references["parent_id"]))
-        elif self.external_references["message_id"]:
-            seq.append(("thread", self.external_references["message_id"]))
+        if len(refs["ancestors_ids"]) > 0:
+            seq.append(("thread", refs["ancestors_ids"][0]))
+        elif refs["parent_id"]:
+            seq.append(("thread", refs["parent_id"]))
+        elif refs["message_id"]:
+            seq.append(("thread", refs["message_id"]))
 
         # then list lookup
         for list_id in self.extra_parameters.get('lists', []):
@@ -329,7 +398,7 @@ class MailMessage(object):
         return seq
 
     # Others parameters specific for mail message
-    @property
+    @cached_property
     def headers(self):
         """
         Extract all headers into list.
@@ -343,17 +412,65 @@ class MailMessage(object):
 
         # Group multiple value for same headers into a dict of list
         headers = {}
-        data = sorted(self.mail.items(), key=keyfunc)
+        data = sorted(self.header_mail.items(), key=keyfunc)
         for k, g in groupby(data, key=keyfunc):
             headers[k] = [x[1] for x in g]
         return headers
 
 
 def walk_with_boundary(mailMessage, boundary):
-    mailMessage.add_header("Mime-Boundary", boundary)
-    yield mailMessage
+    """
+    Walk a message parts, yield each part with its parent boundary.
+
+    Parts are not modified, so the message can still be serialized
+    as received.
+    """
+    yield mailMessage, boundary
     if mailMessage.is_multipart():
         subboundary = mailMessage.get_boundary("")
         for subpart in mailMessage.get_payload():
-            for subsubpart in walk_with_boundary(subpart, subboundary):
-                yield subsubpart
+            for item in walk_with_boundary(subpart, subboundary):
+                yield item
+
+
+def walk_part_bodies(raw, start=0, end=None, boundary=""):
+    """
+    Walk leaf parts of a raw mail, with location of their body in raw.
+
+    Yield (part, boundary, body_start, body_end) for each non multipart
+    part, in walk_with_boundary order. Body offsets delimit the transfer
+    encoded body in raw, excluding the line break before next boundary
+    delimiter, so that body can be cut out of raw and put back later.
+    """
+    end = len(raw) if end is None else end
+    if raw.startswith('\r\n', start) or raw.startswith('\n', start):
+        # no headers
+        header_end = start
+        body_start = raw.index('\n', start) + 1
+    else:
+        match = _headers_end.search(raw, start, end)
+        header_end = match.start() if match else end
+        body_start = match.end() if match else end
+    headers = HeaderParser().parsestr(raw[start:header_end])
+    maintype = headers.get_content_maintype()
+    subboundary = headers.get_boundary()
+    if maintype == 'multipart' and subboundary:
+        delimiter = re.compile(r'(\r?\n)?^--{}(--)?[ \t]*\r?$'.
+                               format(re.escape(subboundary)), re.M)
+        part_start = None
+        for match in delimiter.finditer(raw, body_start, end):
+            if part_start is not None:
+                for item in walk_part_bodies(raw, part_start, match.start(),
+                                             subboundary):
+                    yield item
+            if match.group(2):
+                # close delimiter, epilogue follows
+                return
+            part_start = min(match.end() + 1, end)
+        return
+    if headers.get_content_type() == 'message/rfc822':
+        for item in walk_part_bodies(raw, body_start, end, ""):
+            yield item
+        return
+    part = Parser().parsestr(raw[start:end])
+    yield part, boundary, body_start, end
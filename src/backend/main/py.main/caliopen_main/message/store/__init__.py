@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, print_function, unicode_literals
 
-from .attachment import MessageAttachment
+from .attachment import MessageAttachment, AttachmentRefcount
 from .attachment_index import IndexedMessageAttachment
 from .external_references import ExternalReferences
 from .external_references_index import IndexedExternalReferences
@@ -9,10 +9,14 @@ from .message import Message
 from .message_index import IndexedMessage
 from .participant import Participant
 from .participant_index import IndexedParticipant
-from .raw import RawMessage, UserRawLookup
+from .raw import (RawMessage, RawMessagePart, RawMessageHash,
+                  RawMessageRefcount, RawMessageMigration, UserRawLookup)
 
 __all__ = ['MessageAttachment', 'IndexedMessageAttachment',
-           'RawMessage', 'UserRawLookup',
+           'AttachmentRefcount',
+           'RawMessage', 'RawMessagePart', 'RawMessageHash',
+           'RawMessageRefcount',
+           'RawMessageMigration', 'UserRawLookup',
            'Message', 'IndexedMessage',
            'ExternalReferences', 'IndexedExternalReferences',
            'Participant', 'IndexedParticipant'
@@ -3,7 +3,7 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 from cassandra.cqlengine import columns
 
-from caliopen_storage.store import BaseUserType
+from caliopen_storage.store import BaseModel, BaseUserType
 
 
 class MessageAttachment(BaseUserType):
@@ -16,3 +16,12 @@ class MessageAttachment(BaseUserType):
     size = columns.Integer()
     url = columns.Text()  # objectsStore uri for temporary file (draft)
     mime_boundary = columns.Text()  # for attachments embedded in raw messages
+    content_hash = columns.Text()  # sha256 of content, objectsStore key
+
+
+class AttachmentRefcount(BaseModel):
+
+    """Number of raw messages referencing a stored attachment content."""
+
+    content_hash = columns.Text(primary_key=True)
+    refcount = columns.Counter()
@@ -18,3 +18,4 @@ class IndexedMessageAttachment(InnerObjectWrapper):
     size = Integer()
     url = Keyword()  # objectsStore uri for temporary file (draft)
     mime_boundary = Keyword()  # for attachments embedded in raw messages
+    content_hash = Keyword()
@@ -6,7 +6,20 @@ import uuid
 
 from cassandra.cqlengine import columns
 
-from caliopen_storage.store.model import BaseModel
+from caliopen_storage.store.model import BaseModel, BaseUserType
+
+
+class RawMessagePart(BaseUserType):
+    """Attachment cut out of a raw message, stored in object store."""
+
+    index = columns.Integer()  # of attachment in parsed message
+    offset = columns.BigInt()  # where to put it back into stored raw data
+    url = columns.Text()  # objectsStore uri of decoded content
+    content_hash = columns.Text()  # sha256 of decoded content
+    size = columns.BigInt()  # of decoded content
+    line_length = columns.Integer()  # of base64 encoded body
+    newline = columns.Text()
+    suffix = columns.Text()  # line breaks ending body
 
 
 class RawMessage(BaseModel):
@@ -14,8 +27,33 @@ class RawMessage(BaseModel):
 
     raw_msg_id = columns.UUID(primary_key=True, default=uuid.uuid4)
     raw_data = columns.Bytes()  # may be empty if data is too large to fit into cassandra
-    raw_size = columns.Integer()  # number of bytes in 'data' column
+    raw_size = columns.Integer()  # number of bytes of raw message, uncompressed
     uri = columns.Text()  # where object is stored if it was too large to fit into raw_data column
+    codec = columns.Text()  # compression codec of raw_data, none if empty
+    content_hash = columns.Text()  # sha256 of raw message, uncompressed
+    detached = columns.Boolean()  # attachments looked for, none if not yet
+    detached_parts = columns.List(columns.UserDefinedType(RawMessagePart))
+
+
+class RawMessageHash(BaseModel):
+    """Raw message stored for a content hash."""
+
+    content_hash = columns.Text(primary_key=True)
+    raw_msg_id = columns.UUID()
+
+
+class RawMessageRefcount(BaseModel):
+    """Number of user messages referencing a raw message."""
+
+    raw_msg_id = columns.UUID(primary_key=True)
+    refcount = columns.Counter()
+
+
+class RawMessageMigration(BaseModel):
+    """Migrations of raw messages storage run until completion."""
+
+    name = columns.Text(primary_key=True)
+    date_done = columns.DateTime()
 
 
 class UserRawLookup(BaseModel):
@@ -23,3 +61,4 @@ class UserRawLookup(BaseModel):
 
     user_id = columns.UUID(primary_key=True)
     raw_msg_id = columns.UUID(primary_key=True)
+    message_id = columns.UUID()  # user message created from raw message
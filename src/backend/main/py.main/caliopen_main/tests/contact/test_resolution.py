@@ -0,0 +1,193 @@
+"""Test contact resolution cache and batched lookups of addresses."""
+
+import unittest
+import os
+import uuid
+
+import mock
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+from caliopen_main.contact.core import (Contact, ContactResolutionCache,
+                                        contact_resolutions)
+from caliopen_main.contact.parameters import NewContact, NewEmail
+from caliopen_main.contact.store import Contact as ModelContact, \
+    ContactLookup as ModelContactLookup
+
+
+class MockUser(object):
+
+    def __init__(self, contact_id=None):
+        self.user_id = str(uuid.uuid4())
+        self.contact_id = contact_id
+
+
+class TestContactResolutionCache(unittest.TestCase):
+
+    @mock.patch('caliopen_main.contact.core.time.time')
+    def test_ttl(self, now):
+        now.return_value = 1000.0
+        cache = ContactResolutionCache(ttl=10)
+        cache.set('u1', {'a@x.org': 'c1', 'b@x.org': None})
+        now.return_value = 1009.0
+        self.assertEqual(cache.get('u1', ['a@x.org', 'b@x.org', 'c@x.org']),
+                         ({'a@x.org': 'c1', 'b@x.org': None}, ['c@x.org']))
+        now.return_value = 1011.0
+        self.assertEqual(cache.get('u1', ['a@x.org']), ({}, ['a@x.org']))
+
+    @mock.patch('caliopen_main.contact.core.time.time')
+    def test_ttl_not_extended(self, now):
+        now.return_value = 1000.0
+        cache = ContactResolutionCache(ttl=10)
+        cache.set('u1', {'a@x.org': 'c1'})
+        now.return_value = 1005.0
+        cache.set('u1', {'b@x.org': 'c2'})
+        now.return_value = 1011.0
+        self.assertEqual(cache.get('u1', ['b@x.org']), ({}, ['b@x.org']))
+
+    def test_lru_eviction(self):
+        cache = ContactResolutionCache(max_users=2)
+        cache.set('u1', {'a@x.org': 'c1'})
+        cache.set('u2', {'a@x.org': 'c2'})
+        # u1 becomes most recently used, u2 is evicted first
+        cache.get('u1', ['a@x.org'])
+        cache.set('u3', {'a@x.org': 'c3'})
+        self.assertEqual(cache.get('u2', ['a@x.org']), ({}, ['a@x.org']))
+        self.assertEqual(cache.get('u1', ['a@x.org']), ({'a@x.org': 'c1'}, []))
+        self.assertEqual(cache.get('u3', ['a@x.org']), ({'a@x.org': 'c3'}, []))
+
+    def test_invalidate(self):
+        cache = ContactResolutionCache()
+        user_id = uuid.uuid4()
+        cache.set(user_id, {'a@x.org': 'c1'})
+        cache.set('u2', {'a@x.org': 'c2'})
+        # ids as UUID or as string are the same user
+        cache.invalidate(str(user_id))
+        self.assertEqual(cache.get(user_id, ['a@x.org']), ({}, ['a@x.org']))
+        self.assertEqual(cache.get('u2', ['a@x.org']), ({'a@x.org': 'c2'}, []))
+
+    def test_disabled(self):
+        cache = ContactResolutionCache(ttl=0)
+        cache.set('u1', {'a@x.org': 'c1'})
+        self.assertEqual(cache.get('u1', ['a@x.org']), ({}, ['a@x.org']))
+
+
+def lookup_row(user, value, contact_id):
+    return ModelContactLookup(user_id=user.user_id, value=value,
+                              type='email', contact_ids=[contact_id])
+
+
+def load_contact(user, contact_id):
+    model = ModelContact._construct_instance({'user_id': user.user_id,
+                                              'contact_id': contact_id})
+    contact = Contact(model)
+    contact._user = user
+    return contact
+
+
+class TestContactInvalidation(unittest.TestCase):
+
+    def setUp(self):
+        self.user = MockUser()
+        self.patch = mock.patch.object(contact_resolutions, 'ttl', 60)
+        self.patch.start()
+        contact_resolutions.clear()
+        contact_resolutions.set(self.user.user_id, {'a@x.org': None})
+
+    def tearDown(self):
+        contact_resolutions.clear()
+        self.patch.stop()
+
+    def assertInvalidated(self):
+        self.assertEqual(contact_resolutions.get(self.user.user_id,
+                                                 ['a@x.org']),
+                         ({}, ['a@x.org']))
+
+    @mock.patch('caliopen_main.contact.core.RecipientIndexManager')
+    @mock.patch.object(ModelContact, 'create_index')
+    @mock.patch.object(Contact, '_save_many')
+    def test_create_many(self, save_many, create_index, recipients):
+        save_many.side_effect = lambda user, cores: [None] * len(cores)
+        param = NewContact()
+        email = NewEmail()
+        email.address = 'a@x.org'
+        param.emails = [email]
+        results = Contact.create_many(self.user, [param], mock.Mock())
+        self.assertIsNone(results[0][1])
+        self.assertInvalidated()
+
+    @mock.patch('caliopen_main.contact.core.ContactLookup.create')
+    def test_create_lookup(self, create):
+        contact = load_contact(self.user, uuid.uuid4())
+        contact._create_lookup('email', 'a@x.org')
+        self.assertInvalidated()
+
+    @mock.patch('caliopen_main.contact.core.RecipientIndexManager')
+    @mock.patch.object(ModelContact, 'delete')
+    def test_delete(self, delete, recipients):
+        contact = load_contact(self.user, uuid.uuid4())
+        contact.delete()
+        self.assertTrue(delete.called)
+        self.assertInvalidated()
+
+
+class TestLookupMany(unittest.TestCase):
+
+    def setUp(self):
+        self.user = MockUser()
+        self.contact_id = uuid.uuid4()
+        self.patch = mock.patch.object(contact_resolutions, 'ttl', 60)
+        self.patch.start()
+        contact_resolutions.clear()
+
+    def tearDown(self):
+        contact_resolutions.clear()
+        self.patch.stop()
+
+    def filter(self, user_id, value__in):
+        self.queries.append(value__in)
+        return [lookup_row(self.user, x, self.contact_id)
+                for x in value__in if x.startswith('known')]
+
+    def lookup_many(self, addresses):
+        contact = load_contact(self.user, self.contact_id)
+        with mock.patch('caliopen_main.contact.core.LOOKUP_IN_SIZE', 2), \
+                mock.patch.object(ModelContactLookup, 'filter',
+                                  side_effect=self.filter), \
+                mock.patch.object(Contact, 'get_many',
+                                  return_value=[contact]) as get_many:
+            return Contact.lookup_many(self.user, addresses), get_many
+
+    def test_in_queries_chunked(self):
+        self.queries = []
+        addresses = ['known1@x.org', 'known2@x.org', 'other1@x.org',
+                     'other2@x.org', 'other3@x.org']
+        result, get_many = self.lookup_many(addresses)
+        self.assertEqual(len(self.queries), 3)
+        self.assertTrue(all(len(x) <= 2 for x in self.queries))
+        self.assertEqual(sorted(sum(self.queries, [])), sorted(addresses))
+        # contacts are fetched once for all their addresses
+        get_many.assert_called_once_with(self.user, [self.contact_id],
+                                         concurrency=mock.ANY)
+        self.assertEqual(result['known1@x.org'].contact_id,
+                         str(self.contact_id))
+        self.assertIsNone(result['other1@x.org'])
+
+    def test_cached_addresses_not_queried(self):
+        self.queries = []
+        self.lookup_many(['known1@x.org', 'other1@x.org'])
+        self.queries = []
+        result, _ = self.lookup_many(['known1@x.org', 'other1@x.org',
+                                      'other2@x.org'])
+        self.assertEqual(self.queries, [['other2@x.org']])
+        self.assertEqual(result['known1@x.org'].contact_id,
+                         str(self.contact_id))
+        self.assertIsNone(result['other1@x.org'])
@@ -0,0 +1,112 @@
+"""Test contacts returned from index and from storage are the same."""
+
+import datetime
+import json
+import unittest
+import os
+import uuid
+
+import mock
+import pytz
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+from caliopen_main.contact import returns
+from caliopen_main.contact.core import Contact
+from caliopen_main.contact.store import Contact as ModelContact
+from caliopen_main.contact.store.contact import (Email as ModelEmail,
+                                                 Phone as ModelPhone,
+                                                 PublicKey as ModelPublicKey)
+from caliopen_main.contact.store.contact_index import IndexedContact
+from caliopen_main.pi.objects import PIModel
+
+
+class MockUser(object):
+
+    user_id = uuid.uuid4()
+
+
+class FakeWriter(object):
+    """Bulk index writer keeping indexed documents."""
+
+    def __init__(self):
+        self.documents = []
+
+    def index(self, document):
+        self.documents.append(document)
+
+
+class TestBuildContacts(unittest.TestCase):
+
+    def setUp(self):
+        self.user = MockUser()
+        date = datetime.datetime(2017, 6, 1, 10, 20, 30, tzinfo=pytz.utc)
+        self.model = ModelContact(
+            user_id=self.user.user_id,
+            contact_id=uuid.uuid4(),
+            date_insert=date,
+            date_update=date + datetime.timedelta(days=1),
+            given_name='John',
+            family_name='Doe',
+            title='John Doe',
+            emails=[ModelEmail(address='john@doe.org', is_primary=True,
+                               type='work'),
+                    ModelEmail(address='jd@home.org', label='home')],
+            phones=[ModelPhone(number='+33 1 02 03 04 05',
+                               normalized_number='+33102030405',
+                               type='home')],
+            pi=PIModel(technic=10, comportment=20, context=30, version=1,
+                       date_update=date),
+            privacy_features={'is_internal': 'False'},
+            tags=['friend'])
+        self.key = ModelPublicKey(user_id=self.user.user_id,
+                                  contact_id=self.model.contact_id,
+                                  name='work key',
+                                  date_insert=date,
+                                  expire_date=date.replace(year=2020),
+                                  type='gpg', size=4096,
+                                  key='-----BEGIN PGP PUBLIC KEY BLOCK-----',
+                                  fingerprint='0123456789ABCDEF')
+
+    def _hit(self):
+        """Return contact document as found by a search."""
+        writer = FakeWriter()
+        self.model.create_index(writer=writer)
+        document = writer.documents[0]
+        source = json.loads(json.dumps(document.to_dict(),
+                                       default=lambda x: x.isoformat()))
+        return IndexedContact.from_es({'_index': str(self.user.user_id),
+                                       '_type': IndexedContact.doc_type,
+                                       '_id': str(self.model.contact_id),
+                                       '_source': source})
+
+    def _build(self, from_index):
+        hits = [self._hit()]
+        with mock.patch.object(returns, 'index_has_contact_fields',
+                               return_value=from_index), \
+                mock.patch.object(Contact, 'get_many',
+                                  return_value=[Contact(self.model)]), \
+                mock.patch.object(ModelPublicKey, 'find_many',
+                                  return_value=[[self.key]]):
+            contacts = returns.build_contacts(self.user, hits)
+        self.assertEqual(len(contacts), 1)
+        return contacts[0].serialize()
+
+    maxDiff = None
+
+    def test_same_serialization(self):
+        from_index = self._build(True)
+        from_storage = self._build(False)
+        self.assertEqual(from_index, from_storage)
+        self.assertEqual(len(from_index['emails']), 2)
+        self.assertEqual(len(from_index['phones']), 1)
+        self.assertEqual(from_index['public_keys'][0]['fingerprint'],
+                         '0123456789ABCDEF')
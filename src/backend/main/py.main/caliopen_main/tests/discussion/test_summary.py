@@ -0,0 +1,89 @@
+"""Test conditional updates of discussions summaries."""
+
+import unittest
+import os
+import uuid
+
+import mock
+from cassandra.cqlengine.query import LWTException
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+# import cycle of discussion core is resolved from message parameters
+import caliopen_main.message.parameters
+from caliopen_main.discussion.core.summary import (DiscussionSummary,
+                                                   MAX_CHANGE_ATTEMPTS)
+from caliopen_main.discussion.store.discussion import \
+    Discussion as ModelDiscussion
+
+
+def stored(user_id, discussion_id, total_count, version):
+    return ModelDiscussion._construct_instance({
+        'user_id': user_id,
+        'discussion_id': discussion_id,
+        'total_count': total_count,
+        'summary_version': version})
+
+
+class TestSummaryChange(unittest.TestCase):
+
+    def setUp(self):
+        self.user_id = uuid.uuid4()
+        self.discussion_id = uuid.uuid4()
+        self.summaries = DiscussionSummary(self.user_id)
+        # rows read by each attempt
+        self.rows = []
+        self.saved = []
+
+    def load(self, discussion_id):
+        return self.rows.pop(0)
+
+    def save(self, discussion, conflicts):
+        def save():
+            self.saved.append((discussion._conditional[0].value,
+                               discussion.total_count))
+            if len(self.saved) <= conflicts:
+                raise LWTException({})
+            return discussion
+        return save
+
+    def change(self, conflicts):
+        def increment(discussion):
+            discussion.total_count += 1
+
+        def load(discussion_id):
+            discussion = self.load(discussion_id)
+            discussion.save = self.save(discussion, conflicts)
+            return discussion
+
+        with mock.patch.object(self.summaries, '_load', side_effect=load):
+            return self.summaries._change(self.discussion_id, increment)
+
+    def test_saved_if_not_changed(self):
+        self.rows = [stored(self.user_id, self.discussion_id, 1, 10)]
+        discussion = self.change(conflicts=0)
+        self.assertEqual(self.saved, [(10, 2)])
+        self.assertEqual(discussion.summary_version, 11)
+
+    def test_change_applied_again_on_conflict(self):
+        # another process counted a message between read and write
+        self.rows = [stored(self.user_id, self.discussion_id, 1, 10),
+                     stored(self.user_id, self.discussion_id, 2, 11)]
+        discussion = self.change(conflicts=1)
+        self.assertEqual(self.saved, [(10, 2), (11, 3)])
+        self.assertEqual(discussion.total_count, 3)
+        self.assertEqual(discussion.summary_version, 12)
+
+    def test_give_up(self):
+        self.rows = [stored(self.user_id, self.discussion_id, 1, x)
+                     for x in range(MAX_CHANGE_ATTEMPTS)]
+        self.assertIsNone(self.change(conflicts=MAX_CHANGE_ATTEMPTS))
+        self.assertEqual(len(self.saved), MAX_CHANGE_ATTEMPTS)
@@ -0,0 +1,201 @@
+"""Test storage of received attachments out of raw messages."""
+
+import hashlib
+import os
+import unittest
+import uuid
+
+from cStringIO import StringIO
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import mock
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+from caliopen_main.message.core import RawMessage, AttachmentStore
+from caliopen_main.message.core.attachment import (AttachmentRefcount,
+                                                   attach_parts, detach_parts)
+from caliopen_main.message.store import (RawMessage as ModelRaw,
+                                         RawMessageHash as ModelRawHash)
+
+
+def build_mail(*attachments):
+    """Build a mail with (content, disposition) attachments."""
+    msg = MIMEMultipart()
+    msg['Subject'] = 'attachments'
+    msg.attach(MIMEText('body'))
+    for i, (content, disposition) in enumerate(attachments):
+        part = MIMEApplication(content)
+        part.add_header('Content-Disposition', disposition,
+                        filename='file{}.bin'.format(i))
+        msg.attach(part)
+    return msg.as_string()
+
+
+class FakeObjectStore(object):
+
+    def __init__(self):
+        self.objects = {}
+        self.fail_on = None
+
+    def put(self, bucket, name, data, length, content_type):
+        if name == self.fail_on:
+            raise IOError('object store unavailable')
+        self.objects[(bucket, name)] = data.read()
+
+    def read(self, bucket, name):
+        return self.objects[(bucket, name)]
+
+    def stat(self, bucket, name):
+        return None
+
+    def remove(self, bucket, name):
+        del self.objects[(bucket, name)]
+
+
+class Part(object):
+    """Detached part as stored with raw message."""
+
+    def __init__(self, part, contents):
+        self.offset = part.offset
+        self.line_length = part.line_length
+        self.newline = part.newline
+        self.suffix = part.suffix
+        content = StringIO()
+        part.attachment.write_to(content)
+        self.url = hashlib.sha256(content.getvalue()).hexdigest()
+        contents[self.url] = content.getvalue()
+
+
+class TestDetachParts(unittest.TestCase):
+
+    def round_trip(self, raw, min_size=1024):
+        data, parts = detach_parts(raw, min_size)
+        contents = {}
+        stored = [Part(x, contents) for x in parts]
+        self.assertEqual(attach_parts(data, stored, contents.get), raw)
+        return data, parts
+
+    def test_round_trip(self):
+        big = os.urandom(40000)
+        raw = build_mail((os.urandom(100), 'attachment'),
+                         (big, 'attachment'), (big[:5000], 'attachment'))
+        for newline in ('\n', '\r\n'):
+            data, parts = self.round_trip(raw.replace('\n', newline))
+            self.assertEqual([x.index for x in parts], [1, 2])
+            self.assertEqual(parts[0].newline, newline)
+            self.assertLess(len(data), 2000)
+
+    def test_small_and_inline_kept(self):
+        raw = build_mail((os.urandom(100), 'attachment'),
+                         (os.urandom(4000), 'inline'))
+        self.assertEqual(detach_parts(raw, 1024), (raw, []))
+
+    def test_irregular_base64_kept(self):
+        raw = build_mail((os.urandom(4000), 'attachment'))
+        lines = raw.split('\n')
+        # one shorter line in the middle of the body
+        index = max(i for i, x in enumerate(lines) if len(x) == 76) - 2
+        lines[index:index + 2] = [lines[index][:40],
+                                  lines[index][40:] + lines[index + 1]]
+        raw = '\n'.join(lines)
+        self.assertEqual(detach_parts(raw, 1024), (raw, []))
+
+
+def update_model(model, **kwargs):
+    for key, value in kwargs.items():
+        setattr(model, key, value)
+
+
+class TestRawMessageDetach(unittest.TestCase):
+
+    def setUp(self):
+        self.object_store = FakeObjectStore()
+        self.store = AttachmentStore(self.object_store, 'attachments',
+                                     min_size=1024)
+        patches = [
+            mock.patch('caliopen_main.message.core.raw.get_object_store',
+                       return_value=self.object_store),
+            mock.patch('caliopen_main.message.core.raw.get_attachment_store',
+                       return_value=self.store),
+            mock.patch.object(RawMessage, '_claim_detach',
+                              return_value=True),
+            mock.patch.object(ModelRaw, 'update', autospec=True,
+                              side_effect=update_model),
+            mock.patch.object(AttachmentRefcount, 'incr')]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.incr = AttachmentRefcount.incr
+
+    def new_raw(self, raw):
+        codec, data = RawMessage.encode(raw)
+        model = ModelRaw(raw_msg_id=uuid.uuid4(), raw_data=data,
+                         raw_size=len(raw), codec=codec,
+                         content_hash='hash')
+        return RawMessage(model)
+
+    def test_detach(self):
+        content = os.urandom(40000)
+        raw = build_mail((content, 'attachment'))
+        msg = self.new_raw(raw)
+        self.assertTrue(msg.detach_attachments())
+        digest = hashlib.sha256(content).hexdigest()
+        self.assertEqual(self.object_store.read('attachments', digest),
+                         content)
+        self.incr.assert_called_once_with(digest)
+        part = msg.model.detached_parts[0]
+        self.assertEqual((part.index, part.content_hash, part.size),
+                         (0, digest, len(content)))
+        self.assertEqual(part.url, 's3://attachments/{}'.format(digest))
+        self.assertTrue(msg.model.detached)
+        self.assertLess(len(msg.model.raw_data), 2000)
+        # read back as it was received
+        reloaded = RawMessage(msg.model)
+        self.assertEqual(reloaded.raw_data, raw)
+        self.assertEqual(''.join(reloaded.stream(10, 100)), raw[10:110])
+
+        # references are released with raw message
+        self.incr.reset_mock()
+        with mock.patch.object(ModelRawHash, 'filter'), \
+                mock.patch.object(ModelRaw, 'delete'):
+            reloaded.delete()
+        self.incr.assert_called_once_with(digest, -1)
+
+    def test_detached_once(self):
+        msg = self.new_raw(build_mail((os.urandom(4000), 'attachment')))
+        msg.model.detached = False
+        self.assertFalse(msg.detach_attachments())
+        self.assertFalse(RawMessage._claim_detach.called)
+        self.assertEqual(self.object_store.objects, {})
+
+    def test_failure_releases_references(self):
+        first, second = os.urandom(4000), os.urandom(4000)
+        raw = build_mail((first, 'attachment'), (second, 'attachment'))
+        msg = self.new_raw(raw)
+        data = msg.model.raw_data
+        self.object_store.fail_on = hashlib.sha256(second).hexdigest()
+        self.assertRaises(IOError, msg.detach_attachments)
+        digests = [hashlib.sha256(x).hexdigest() for x in (first, second)]
+        self.assertEqual(self.incr.call_args_list,
+                         [mock.call(digests[0]), mock.call(digests[1]),
+                          mock.call(digests[1], -1),
+                          mock.call(digests[0], -1)])
+        # raw message is kept whole
+        self.assertEqual(msg.model.raw_data, data)
+        self.assertFalse(msg.model.detached_parts)
+        self.assertEqual(RawMessage(msg.model).raw_data, raw)
+
+
+if __name__ == '__main__':
+    unittest.main()
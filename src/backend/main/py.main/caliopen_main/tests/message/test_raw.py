@@ -0,0 +1,122 @@
+"""Test garbage collection of unreferenced raw messages."""
+
+import os
+import time
+import unittest
+import uuid
+
+import mock
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+from caliopen_main.message.core import RawMessage, UserRawLookup
+from caliopen_main.message.store import (RawMessage as ModelRaw,
+                                         Message as ModelMessage)
+
+GRACE = 3600
+
+
+def written(age):
+    """Cassandra writetime of a row written age seconds ago."""
+    return int((time.time() - age) * 1000000)
+
+
+class TestCollect(unittest.TestCase):
+
+    def setUp(self):
+        self.raws = []
+        self.messages = []
+        self.refcounts = {}
+        self.deleted = []
+        patches = [
+            mock.patch.object(RawMessage, 'is_migrated', return_value=True),
+            mock.patch.object(RawMessage, '_scan', side_effect=self.scan),
+            mock.patch.object(RawMessage, 'refcount',
+                              side_effect=self.refcount),
+            mock.patch.object(RawMessage, 'get', side_effect=self.get),
+            mock.patch.object(UserRawLookup, 'link')]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def scan(self, model, *columns):
+        if model is ModelRaw:
+            return iter(self.raws)
+        self.assertIs(model, ModelMessage)
+        return iter(self.messages)
+
+    def refcount(self, raw_msg_id):
+        counts = self.refcounts.get(raw_msg_id, [0])
+        return counts.pop(0) if len(counts) > 1 else counts[0]
+
+    def get(self, raw_msg_id):
+        raw = mock.Mock()
+        raw.delete.side_effect = lambda: self.deleted.append(raw_msg_id)
+        return raw
+
+    def test_refused_before_migration(self):
+        RawMessage.is_migrated.return_value = False
+        self.assertRaises(Exception, RawMessage.collect)
+        self.assertFalse(RawMessage._scan.called)
+
+    def test_grace_period(self):
+        old, recent, unknown = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        self.raws = [(old, written(2 * GRACE)), (recent, written(60)),
+                     (unknown, None)]
+        deleted = RawMessage.collect(grace_period=GRACE)
+        self.assertEqual(sorted(deleted), sorted([old, unknown]))
+        self.assertEqual(sorted(self.deleted), sorted([old, unknown]))
+        # refcount of young raw messages is not even read
+        self.assertNotIn(mock.call(recent),
+                         RawMessage.refcount.call_args_list)
+
+    def test_referenced_kept(self):
+        raw_msg_id = uuid.uuid4()
+        self.raws = [(raw_msg_id, written(2 * GRACE))]
+        self.refcounts[raw_msg_id] = [2]
+        self.assertEqual(RawMessage.collect(grace_period=GRACE), [])
+        # nothing to delete, messages are not scanned
+        self.assertEqual(RawMessage._scan.call_count, 1)
+
+    def test_relink_without_lookup(self):
+        linked, orphan = uuid.uuid4(), uuid.uuid4()
+        user_id, message_id = uuid.uuid4(), uuid.uuid4()
+        self.raws = [(linked, written(2 * GRACE)),
+                     (orphan, written(2 * GRACE))]
+        self.messages = [(user_id, message_id, linked),
+                         (uuid.uuid4(), uuid.uuid4(), uuid.uuid4())]
+        deleted = RawMessage.collect(grace_period=GRACE)
+        self.assertEqual(deleted, [orphan])
+        UserRawLookup.link.assert_called_once_with(user_id, linked,
+                                                   message_id)
+
+    def test_dry_run(self):
+        linked, orphan = uuid.uuid4(), uuid.uuid4()
+        self.raws = [(linked, written(2 * GRACE)),
+                     (orphan, written(2 * GRACE))]
+        self.messages = [(uuid.uuid4(), uuid.uuid4(), linked)]
+        deleted = RawMessage.collect(grace_period=GRACE, dry_run=True)
+        self.assertEqual(deleted, [orphan])
+        self.assertFalse(UserRawLookup.link.called)
+        self.assertEqual(self.deleted, [])
+
+    def test_refcount_checked_before_delete(self):
+        raw_msg_id = uuid.uuid4()
+        self.raws = [(raw_msg_id, written(2 * GRACE))]
+        # linked by a delivery after the scan
+        self.refcounts[raw_msg_id] = [0, 1]
+        self.assertEqual(RawMessage.collect(grace_period=GRACE), [])
+        self.assertEqual(self.deleted, [])
+        self.assertEqual(RawMessage.refcount.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+"""Test changes tracking of storable objects."""
+
+import unittest
+import os
+import types
+import uuid
+
+import mock
+from cassandra.cqlengine import columns
+from elasticsearch_dsl import Keyword
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+from caliopen_storage.store.model import BaseModel, BaseIndexDocument
+from caliopen_main.common.objects.base import ObjectIndexable
+
+
+class ModelItem(BaseModel):
+
+    user_id = columns.UUID(primary_key=True)
+    item_id = columns.UUID(primary_key=True)
+    name = columns.Text()
+    tags = columns.List(columns.Text)
+    infos = columns.Map(columns.Text, columns.Text)
+
+
+class IndexedItem(BaseIndexDocument):
+
+    name = Keyword()
+    tags = Keyword()
+
+    class Meta:
+        doc_type = 'indexed_item'
+
+
+class Item(ObjectIndexable):
+
+    _attrs = {
+        'user_id': uuid.UUID,
+        'item_id': uuid.UUID,
+        'name': types.StringType,
+        'tags': [types.StringType],
+        'infos': types.DictType,
+    }
+
+    _model_class = ModelItem
+    _index_class = IndexedItem
+    _pkey_name = 'item_id'
+
+
+def load_item():
+    user_id = uuid.uuid4()
+    model = ModelItem._construct_instance({'user_id': user_id,
+                                           'item_id': uuid.uuid4(),
+                                           'name': 'item',
+                                           'tags': ['inbox'],
+                                           'infos': {'a': '1'}})
+    item = Item(user_id)
+    item._db = model
+    item.unmarshall_db()
+    return item
+
+
+class TestChanges(unittest.TestCase):
+
+    def test_not_loaded(self):
+        self.assertIsNone(Item(uuid.uuid4()).changed_attributes)
+
+    def test_loaded(self):
+        self.assertEqual(load_item().changed_attributes, set())
+
+    def test_set_attribute(self):
+        item = load_item()
+        item.name = 'other'
+        self.assertEqual(item.changed_attributes, set(['name']))
+
+    def test_list_modified_in_place(self):
+        item = load_item()
+        item.tags.append('spam')
+        self.assertEqual(item.changed_attributes, set(['tags']))
+
+    def test_dict_modified_in_place(self):
+        item = load_item()
+        item.infos['a'] = '2'
+        self.assertEqual(item.changed_attributes, set(['infos']))
+
+    def test_mark_changed(self):
+        item = load_item()
+        item.mark_changed('name')
+        self.assertEqual(item.changed_attributes, set(['name']))
+
+    def test_marshall_db_in_place_change(self):
+        item = load_item()
+        item.tags.append('spam')
+        item.marshall_db()
+        changed = item._db.get_changed_columns()
+        self.assertEqual(changed, ['tags'])
+        self.assertEqual(item._db.tags, ['inbox', 'spam'])
+
+    def test_update_index_in_place_change(self):
+        item = load_item()
+        item.tags.remove('inbox')
+        item.infos.clear()
+        writer = mock.Mock()
+        item.update_index(writer=writer)
+        doc, fields = writer.update.call_args[0]
+        # infos is not indexed
+        self.assertEqual(fields, {'tags': []})
+        self.assertEqual(doc.meta.id, item.item_id)
+
+    def test_snapshot_on_first_read(self):
+        item = load_item()
+        self.assertEqual(item._clean, {})
+        with mock.patch.object(Item, '_snapshot') as snapshot:
+            item.name
+            item.marshall_dict()
+            self.assertFalse(snapshot.called)
+            item.tags
+            item.tags
+        snapshot.assert_called_once_with(mock.ANY, 'tags')
+
+    def test_unread_marshalled(self):
+        item = load_item()
+        self.assertEqual(item.marshall_dict()['tags'], ['inbox'])
+        self.assertEqual(item.marshall_dict()['infos'], {'a': '1'})
+        self.assertEqual(item.keys().count('tags'), 1)
+
+    def test_set_unread_attribute(self):
+        item = load_item()
+        item.tags = ['spam']
+        self.assertEqual(item.tags, ['spam'])
+        self.assertEqual(item.changed_attributes, set(['tags']))
+
+    def test_unknown_attribute(self):
+        self.assertRaises(AttributeError, getattr, load_item(), 'unknown')
+
+    def test_clear_changes(self):
+        item = load_item()
+        item.tags.append('spam')
+        item.clear_changes()
+        self.assertEqual(item.changed_attributes, set())
@@ -3,7 +3,11 @@
 import unittest
 import os
 
+from cStringIO import StringIO
 from datetime import datetime
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
 from zope.interface.verify import verifyObject
 
 from caliopen_storage.config import Configuration
@@ -17,7 +21,7 @@ else:
 Configuration.load(conf_file, 'global')
 
 from caliopen_main.common.interfaces import IMessageParser
-from caliopen_main.message.parsers.mail import MailMessage
+from caliopen_main.message.parsers.mail import MailMessage, walk_part_bodies
 
 
 def load_mail(filename):
@@ -54,5 +58,57 @@ class TestMailFormat(unittest.TestCase):
         self.assertEqual(mail.subject, 'crypted content')
         self.assertTrue(isinstance(mail.date, datetime))
 
+    def test_properties_parsed_once(self):
+        """Test derived properties are computed once."""
+        data = load_mail('pgp_crypted_1.eml')
+        mail = MailMessage(data)
+        self.assertIs(mail.attachments, mail.attachments)
+        self.assertIs(mail.external_references, mail.external_references)
+        self.assertEqual(mail.size, len(data))
+
+    def test_attachment_write_to(self):
+        """Test attachment payload is decoded without altering parts."""
+        content = os.urandom(4096)
+        msg = MIMEMultipart()
+        msg['Subject'] = 'attachment'
+        msg.attach(MIMEText('body'))
+        part = MIMEApplication(content)
+        part.add_header('Content-Disposition', 'attachment',
+                        filename='random.bin')
+        msg.attach(part)
+        mail = MailMessage(msg.as_string())
+        self.assertEqual(len(mail.attachments), 1)
+        attachment = mail.attachments[0]
+        self.assertFalse(attachment.is_inline)
+        self.assertEqual(attachment.mime_boundary, msg.get_boundary())
+        output = StringIO()
+        attachment.write_to(output)
+        self.assertEqual(output.getvalue(), content)
+        self.assertNotIn('Mime-Boundary', mail.mail.as_string())
+
+
+    def test_walk_part_bodies(self):
+        """Test location of leaf parts bodies in a raw mail."""
+        msg = MIMEMultipart()
+        alternative = MIMEMultipart('alternative')
+        alternative.attach(MIMEText('plain'))
+        alternative.attach(MIMEText('<p>html</p>', 'html'))
+        msg.attach(alternative)
+        msg.attach(MIMEApplication(os.urandom(1000)))
+        for raw in (msg.as_string(), msg.as_string().replace('\n', '\r\n')):
+            mail = MailMessage(raw)
+            leaves = [x for x in mail.mail.walk() if not x.is_multipart()]
+            found = list(walk_part_bodies(raw))
+            self.assertEqual([x[0].get_content_type() for x in found],
+                             [x.get_content_type() for x in leaves])
+            self.assertEqual([x[1] for x in found],
+                             [alternative.get_boundary()] * 2 +
+                             [msg.get_boundary()])
+            for (part, _, start, end), leaf in zip(found, leaves):
+                self.assertEqual(raw[start:end].rstrip('\r\n'),
+                                 leaf.get_payload().rstrip('\r\n'))
+                self.assertTrue(raw[end:].lstrip('\r\n').startswith('--'))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -18,7 +18,7 @@ Configuration.load(conf_file, 'global')
 
 #from caliopen_main.interfaces import IMessageParser
 from caliopen_main.contact.parameters import NewContact
-from caliopen_main.contact.parsers import parse_vcard
+from caliopen_main.contact.parsers import parse_vcard, iter_vcards
 
 def load_vcard(filename):
 
@@ -59,5 +59,29 @@ class TestVcardFormat(unittest.TestCase):
         for i in contact.ims:
             self.assertIsNotNone(i.type)
 
+
+class TestVcardStream(unittest.TestCase):
+
+    def test_stream_multi_vcard(self):
+        data = load_vcard('multi.vcf')
+        expected = len(list(vobject.readComponents(data)))
+        parsed = list(iter_vcards(data.splitlines(True)))
+        self.assertEqual(len(parsed), expected)
+        for contact, error in parsed:
+            self.assertIsNone(error)
+            self.assertIsInstance(contact, NewContact)
+
+    def test_stream_invalid_vcard(self):
+        first = load_vcard('vcard1.vcf')
+        second = load_vcard('vcard2.vcf')
+        invalid = 'BEGIN:VCARD\nVERSION:3.0\nFN;\nEND:VCARD\n'
+        data = first + invalid + second
+        parsed = list(iter_vcards(data.splitlines(True)))
+        self.assertEqual(len(parsed), 3)
+        self.assertIsNotNone(parsed[0].contact)
+        self.assertIsNone(parsed[1].contact)
+        self.assertIsNotNone(parsed[1].error)
+        self.assertIsNotNone(parsed[2].contact)
+
 if __name__ == '__main__':
     unittest.main()
@@ -8,17 +8,17 @@ import datetime
 import pytz
 
 from caliopen_storage.config import Configuration
-from elasticsearch import Elasticsearch
 from caliopen_storage.core import core_registry
+from caliopen_storage.helpers.connection import get_index_connection
 from caliopen_main.user.objects.settings import Settings as ObjectSettings
+from caliopen_main.contact.store import IndexedRecipient
 
 log = logging.getLogger(__name__)
 
 
 def setup_index(user):
     """Creates user index and setups mappings."""
-    url = Configuration('global').get('elasticsearch.url')
-    client = Elasticsearch(url)
+    client = get_index_connection()
 
     # Creates a versioned index with our custom analyzers, tokenizers, etc.
     log.debug('Creating index for user {}'.format(user.user_id))
@@ -87,6 +87,8 @@ def setup_index(user):
             if hasattr(idx_kls, "build_mapping"):
                 log.debug('Init index for {}'.format(idx_kls))
                 idx_kls.create_mapping(user.user_id)
+    # recipients suggestion documents are not related to a core
+    IndexedRecipient.create_mapping(user.user_id)
 
 
 def setup_system_tags(user):
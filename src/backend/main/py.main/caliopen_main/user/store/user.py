@@ -7,10 +7,10 @@ import logging
 import uuid
 
 from cassandra.cqlengine import columns
-from elasticsearch import Elasticsearch
 from elasticsearch.client.indices import IndicesClient
 
 from caliopen_storage.config import Configuration
+from caliopen_storage.helpers.connection import get_index_connection
 from caliopen_storage.store.model import BaseModel
 from caliopen_main.pi.objects import PIModel
 
@@ -102,7 +102,7 @@ class IndexUser(object):
     def create(cls, user, **kwargs):
         """Create user index."""
         # Create index for user
-        client = Elasticsearch(cls.__url__)
+        client = get_index_connection(cls.__url__)
         indice = IndicesClient(client)
         if indice.exists(index=user.user_id):
             if 'delete_existing' in kwargs and kwargs['delete_existing']:
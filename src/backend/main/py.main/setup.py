@@ -31,6 +31,7 @@ extras_require = {
         'coverage',
         'docker-py',
         'freezegun',
+        'mock',
         'nose'
     ],
 }
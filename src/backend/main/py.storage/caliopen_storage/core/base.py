@@ -12,9 +12,14 @@ import logging
 
 from ..exception import NotFound
 from ..core.registry import core_registry
+from ..store.model import (DEFAULT_CONCURRENCY, encode_cursor,
+                           decode_cursor)
 
 log = logging.getLogger(__name__)
 
+# number of objects of a page when paging without limit
+DEFAULT_PAGE_SIZE = 100
+
 
 class CoreMetaClass(type):
 
@@ -55,11 +60,23 @@ class BaseCore(object):
     def get(cls, key):
         """Get a core object by key."""
         params = {cls._pkey_name: key}
-        obj = cls._model_class.get(**params)
+        obj = cls._model_class.get_cached(**params)
         if obj:
             return cls(obj)
         raise NotFound('%s #%s not found' % (cls._model_class.__name__, key))
 
+    @classmethod
+    def get_many(cls, keys, concurrency=DEFAULT_CONCURRENCY):
+        """
+        Get many core objects by key, fetched concurrently.
+
+        Return a list in same order than keys, with None for each key
+        not found. Raise error of first failed query.
+        """
+        params = [{cls._pkey_name: key} for key in keys]
+        objs = cls._model_class.get_many(params, concurrency=concurrency)
+        return [cls(x) if x is not None else None for x in objs]
+
     def save(self):
         """Save a core object."""
         return self.model.save()
@@ -115,44 +132,76 @@ class BaseUserCore(BaseCore):
     def get(cls, user, obj_id):
         """Get a core object belong to user, with model related id."""
         param = {cls._pkey_name: obj_id}
-        obj = cls._model_class.get(user_id=user.user_id, **param)
+        obj = cls._model_class.get_cached(user_id=user.user_id, **param)
         if obj:
             return cls(obj)
         raise NotFound('%s #%s not found for user %s' %
                        (cls.__class__.name, obj_id, user.user_id))
 
+    @classmethod
+    def get_many(cls, user, obj_ids, concurrency=DEFAULT_CONCURRENCY):
+        """
+        Get many core objects belong to user, fetched concurrently.
+
+        Return a list in same order than obj_ids, with None for each id
+        not found. Raise error of first failed query.
+        """
+        params = [{'user_id': user.user_id, cls._pkey_name: x}
+                  for x in obj_ids]
+        objs = cls._model_class.get_many(params, concurrency=concurrency)
+        return [cls(x) if x is not None else None for x in objs]
+
     @classmethod
     def get_by_user_id(cls, user_id, obj_id):
         """Get a core object belong to user, with model related id."""
         param = {cls._pkey_name: obj_id}
-        obj = cls._model_class.get(user_id=user_id, **param)
+        obj = cls._model_class.get_cached(user_id=user_id, **param)
         if obj:
             return cls(obj)
         raise NotFound('%s #%s not found for user %s' %
                        (cls.__class__.name, obj_id, user_id))
 
     @classmethod
-    def find(cls, user, filters=None, limit=None, offset=0, count=False):
+    def find(cls, user, filters=None, limit=None, offset=0, count=False,
+             cursor=None, total=True):
         """
         Find core objects that belong to an user.
 
         can only use columns part of primary key
+
+        When a cursor is given (empty one for first page) objects are fetched
+        using cassandra native paging, only one page of limit objects is read
+        and result has a ``next_cursor`` key, None on last page.
+
+        In both modes total is the number of objects matching filters,
+        computed by a count query that can be avoided with total=False.
         """
+        params = {'user_id': user.user_id}
+        params.update(filters or {})
+        if count:
+            return cls._model_class.filter(**params).count()
+        if cursor is not None:
+            paging_state = decode_cursor(cursor)
+            models, next_state = cls._model_class. \
+                fetch_page(limit or DEFAULT_PAGE_SIZE, paging_state, **params)
+            return {'objects': [cls(x) for x in models],
+                    'next_cursor': encode_cursor(next_state),
+                    'total': cls.count(user, filters) if total else None}
+
         q = cls._model_class.filter(user_id=user.user_id)
         if not filters:
             objs = q
         else:
             objs = q.filter(**filters)
-        if count:
-            return objs.count()
         if limit or offset:
             objs = objs[offset:(limit+offset)]
 
-        return {'objects': [cls(x) for x in objs], 'total': len(q)}
+        return {'objects': [cls(x) for x in objs],
+                'total': cls.count(user, filters) if total else None}
 
     @classmethod
     def count(cls, user, filters=None):
-        """Count core objects that belong to an user."""
+        """Count core objects that belong to an user, server side."""
         return cls.find(user, filters, count=True)
 
     @classmethod
@@ -11,6 +11,13 @@ class NotFound(Exception):
     pass
 
 
+class InvalidCursor(ValueError):
+
+    """Exception when a pagination cursor can not be decoded."""
+
+    pass
+
+
 class CredentialException(Exception):
 
     """
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Caliopen compression codecs for data stored in database.
+
+Codec name is stored alongside compressed data, so that data written
+with any codec, or without compression (empty codec name), can be read.
+lz4 codec is available only if lz4 package is installed.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import zlib
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+DEFAULT_MIN_SIZE = 512  # bytes, smaller data is not worth compressing
+
+
+class UnknownCodec(ValueError):
+    """Raised when a codec is not known or not available."""
+
+    pass
+
+
+class ZlibCodec(object):
+    """zlib (deflate) codec, good ratio on mails."""
+
+    name = 'zlib'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class Lz4Codec(object):
+    """lz4 frame codec, faster with a lower ratio."""
+
+    name = 'lz4'
+
+    def __init__(self, level=0):
+        self.level = level
+
+    def compress(self, data):
+        return lz4_frame.compress(data, compression_level=self.level)
+
+    def decompress(self, data):
+        return lz4_frame.decompress(data)
+
+
+codecs = {'zlib': ZlibCodec}
+if lz4_frame is not None:
+    codecs['lz4'] = Lz4Codec
+
+
+def get_codec(name, **options):
+    """Return a codec instance by name, None for no compression."""
+    if not name or name == 'none':
+        return None
+    try:
+        return codecs[name](**options)
+    except KeyError:
+        raise UnknownCodec('Compression codec {} is not available'.
+                           format(name))
+
+
+def encode(data, codec, min_size=DEFAULT_MIN_SIZE):
+    """
+    Compress data with codec.
+
+    Return a (codec name, data) tuple, data is kept as is when
+    too small or when compression does not reduce its size.
+    """
+    if codec is None or not data or len(data) < min_size:
+        return None, data
+    compressed = codec.compress(data)
+    if len(compressed) >= len(data):
+        return None, data
+    return codec.name, compressed
+
+
+def decode(data, codec_name):
+    """Decompress data encoded with codec_name."""
+    if not codec_name or not data:
+        return data
+    return get_codec(codec_name).decompress(data)
@@ -1,10 +1,28 @@
 # -*- coding: utf-8 -*-
 """Caliopen storage session helpers."""
 
+import os
+import threading
+import logging
+
 from cassandra.cqlengine.connection import setup as setup_cassandra
 from elasticsearch import Elasticsearch
 from ..config import Configuration
 
+log = logging.getLogger(__name__)
+
+# elasticsearch client options that can be set in configuration,
+# with their default values.
+INDEX_CLIENT_OPTIONS = {
+    'maxsize': 10,
+    'timeout': 10,
+    'max_retries': 3,
+    'retry_on_timeout': False,
+    'sniff_on_start': False,
+    'sniff_on_connection_fail': False,
+    'sniffer_timeout': None,
+}
+
 
 def connect_storage():
     """Connect to storage engines."""
@@ -23,7 +41,80 @@ def connect_storage():
                     **kwargs)
 
 
-def get_index_connection():
+class IndexClientRegistry(object):
+    """
+    Process wide registry of elasticsearch clients, one per url.
+
+    An elasticsearch client hold its own http connection pools, so it must
+    be shared by all index accesses of a process. Registry is reset when
+    used from a forked process, as sockets must not be shared between
+    a parent and its children (pre-forking WSGI server, listener workers).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._clients = {}
+        self.opened = 0
+        self.reused = 0
+
+    def _check_fork(self):
+        """Drop clients inherited from a parent process."""
+        pid = os.getpid()
+        if pid != self._pid:
+            log.debug('Process forked ({} -> {}), reset index clients'.
+                      format(self._pid, pid))
+            self._pid = pid
+            self._clients = {}
+            self.opened = 0
+            self.reused = 0
+
+    @staticmethod
+    def client_options():
+        """Return elasticsearch client options from configuration."""
+        conf = Configuration('global').get('elasticsearch.client', {}) or {}
+        options = {}
+        for name, default in INDEX_CLIENT_OPTIONS.items():
+            options[name] = conf.get(name, default)
+        return options
+
+    def get(self, url=None):
+        """Return the shared elasticsearch client for url."""
+        if url is None:
+            url = Configuration('global').get('elasticsearch.url')
+        with self._lock:
+            self._check_fork()
+            client = self._clients.get(url)
+            if client is not None:
+                self.reused += 1
+                return client
+            client = Elasticsearch(url, **self.client_options())
+            self._clients[url] = client
+            self.opened += 1
+            log.debug('Opened new index client for {}'.format(url))
+            return client
+
+    def reset(self):
+        """Forget all known clients."""
+        with self._lock:
+            self._clients = {}
+            self.opened = 0
+            self.reused = 0
+
+    @property
+    def stats(self):
+        """Usage counters of the registry for current process."""
+        with self._lock:
+            self._check_fork()
+            return {'pid': self._pid,
+                    'clients': len(self._clients),
+                    'opened': self.opened,
+                    'reused': self.reused}
+
+
+index_clients = IndexClientRegistry()
+
+
+def get_index_connection(url=None):
     """Return a connection to index store."""
-    url = Configuration('global').get('elasticsearch.url')
-    return Elasticsearch(url)
+    return index_clients.get(url)
@@ -116,6 +116,9 @@ class ReturnIndexObject(BaseReturnObject):
             else:
                 idx_key = k
             attr = entry.get(idx_key, cls._default.get(idx_key))
-            setattr(obj, k, attr)
+            if attr is None and v is not None:
+                setattr(obj, k, v)
+            else:
+                setattr(obj, k, attr)
         obj.validate()
         return obj
@@ -1,7 +1,14 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, print_function, unicode_literals
-from .model import BaseModel, BaseIndexDocument, BaseUserType
+from .model import (BaseModel, BaseIndexDocument, BaseUserType,
+                    token_ranges)
+from .bulk import BulkIndexWriter
+from .cache import model_caches, LocalCache, SharedCache
+from .object_store import get_object_store, parse_uri, build_uri
 
 __all__ = [
-    'BaseModel', 'BaseIndexDocument', 'BaseUserType',
+    'BaseModel', 'BaseIndexDocument', 'BaseUserType', 'token_ranges',
+    'BulkIndexWriter',
+    'model_caches', 'LocalCache', 'SharedCache',
+    'get_object_store', 'parse_uri', 'build_uri',
 ]
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""Caliopen buffered writer for index bulk operations."""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from elasticsearch.helpers import expand_action
+
+from ..config import Configuration
+from ..helpers.connection import get_index_connection
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_DOCS = 500
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_MAX_INTERVAL = 5.0  # seconds
+
+BulkItemResult = namedtuple('BulkItemResult',
+                            ['op_type', 'index', 'id', 'ok', 'status',
+                             'error'])
+
+
+class BulkIndexWriter(object):
+    """
+    Queue index, update and delete actions and send them using _bulk api.
+
+    Queued actions are sent when one of the limits is reached (number of
+    documents, size in bytes of the request, time since the first queued
+    action) or when :meth:`flush` is explicitly called. The time limit is
+    also checked by a timer, so that actions of an idle writer are sent
+    too. Use it as a context manager to be sure that remaining actions are
+    sent::
+
+        with BulkIndexWriter() as writer:
+            for obj in objects:
+                obj.marshall_index()
+                obj.save_index(writer=writer)
+        errors = writer.errors
+
+    Failed actions are kept in the ``errors`` attribute, and result of
+    each action is passed to ``on_result``. Read ``errors`` to know which
+    actions failed: :meth:`flush` only returns results of the actions it
+    sent, the timer may have sent some of them. Once :meth:`flush`
+    returns, all actions queued before are sent, including those of a
+    request sent concurrently by the timer.
+    """
+
+    def __init__(self, client=None, max_docs=None, max_bytes=None,
+                 max_interval=None, refresh=None, on_result=None):
+        conf = Configuration('global').get('elasticsearch.bulk', {}) or {}
+        self.client = client or get_index_connection()
+        self.max_docs = max_docs or conf.get('max_docs', DEFAULT_MAX_DOCS)
+        self.max_bytes = max_bytes or conf.get('max_bytes', DEFAULT_MAX_BYTES)
+        if max_interval is None:
+            max_interval = conf.get('max_interval', DEFAULT_MAX_INTERVAL)
+        self.max_interval = max_interval
+        self.refresh = refresh
+        self.on_result = on_result
+        self.errors = []
+        self.sent = 0
+        self._lock = threading.Lock()
+        # held while sending, an on_result callback may queue actions
+        self._send_lock = threading.RLock()
+        self._timer = None
+        self._reset()
+
+    def _reset(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._actions = []
+        self._lines = []
+        self._size = 0
+        self._first_queued = None
+
+    def _start_timer(self):
+        """Flush queued actions max_interval seconds after the first one."""
+        self._timer = threading.Timer(self.max_interval, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            log.exception('Timed flush of bulk actions failed')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+        return False
+
+    def __len__(self):
+        return len(self._actions)
+
+    def _should_flush(self):
+        if len(self._actions) >= self.max_docs:
+            return True
+        if self._size >= self.max_bytes:
+            return True
+        if self.max_interval and self._first_queued is not None:
+            elapsed = time.time() - self._first_queued
+            return elapsed >= self.max_interval
+        return False
+
+    def add(self, action):
+        """
+        Queue a raw bulk action.
+
+        action is a dict as accepted by ``elasticsearch.helpers.bulk``,
+        with ``_op_type``, ``_index``, ``_type``, ``_id`` and a ``_source``
+        (or ``doc`` for an update).
+        """
+        serializer = self.client.transport.serializer
+        header, data = expand_action(action)
+        lines = [serializer.dumps(header)]
+        if data is not None:
+            lines.append(serializer.dumps(data))
+        size = sum(len(x) + 1 for x in lines)
+        with self._lock:
+            if self._first_queued is None:
+                self._first_queued = time.time()
+                if self.max_interval:
+                    self._start_timer()
+            self._actions.append(header)
+            self._lines.extend(lines)
+            self._size += size
+            must_flush = self._should_flush()
+        if must_flush:
+            return self.flush()
+        return []
+
+    def index(self, doc):
+        """Queue the full (re)indexation of a DocType instance."""
+        doc.full_clean()
+        action = doc.to_dict(include_meta=True)
+        action['_op_type'] = 'index'
+        return self.add(action)
+
+    def update(self, doc, fields):
+        """Queue a partial update of a DocType instance with fields."""
+        meta = doc.to_dict(include_meta=True)
+        meta.pop('_source', None)
+        meta['_op_type'] = 'update'
+        meta['_source'] = {'doc': fields}
+        return self.add(meta)
+
+    def delete(self, doc):
+        """Queue the deletion of a DocType instance."""
+        meta = doc.to_dict(include_meta=True)
+        meta.pop('_source', None)
+        meta['_op_type'] = 'delete'
+        return self.add(meta)
+
+    def flush(self):
+        """
+        Send all queued actions, return a list of BulkItemResult.
+
+        Wait for a request sent concurrently (by the timer) to be done.
+        """
+        with self._send_lock:
+            with self._lock:
+                actions, lines = self._actions, self._lines
+                self._reset()
+            if not actions:
+                return []
+            return self._send(actions, lines)
+
+    def _send(self, actions, lines):
+        """Send a bulk request of actions, return their results."""
+        params = {}
+        if self.refresh is not None:
+            params['refresh'] = self.refresh
+        body = '\n'.join(lines) + '\n'
+        try:
+            resp = self.client.bulk(body=body, **params)
+            items = [x.popitem() for x in resp['items']]
+        except Exception as exc:
+            log.error('Bulk request of {} actions failed: {}'.
+                      format(len(actions), exc))
+            status = getattr(exc, 'status_code', None)
+            items = [(x.keys()[0], {'status': status, 'error': str(exc)})
+                     for x in actions]
+
+        results = []
+        for header, (op_type, item) in zip(actions, items):
+            meta = header[op_type]
+            status = item.get('status')
+            ok = isinstance(status, int) and 200 <= status < 300
+            result = BulkItemResult(op_type,
+                                    meta.get('_index', item.get('_index')),
+                                    meta.get('_id', item.get('_id')),
+                                    ok, status, item.get('error'))
+            if not ok:
+                log.warn('Bulk {} failed for {}/{}: {}'.
+                         format(op_type, result.index, result.id,
+                                result.error))
+                self.errors.append(result)
+            if self.on_result:
+                self.on_result(result)
+            results.append(result)
+        self.sent += len(results)
+        log.debug('Bulk request sent {} actions'.format(len(results)))
+        return results
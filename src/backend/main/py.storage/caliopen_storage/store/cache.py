@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Caliopen read-through cache of model records.
+
+Cache is enabled per model class using ``cache.models`` configuration key::
+
+    cache:
+        backend: local
+        max_size: 10000
+        ttl: 60
+        models:
+            User:
+                ttl: 300
+
+Records are cached as a dict of column values, a new model instance is
+built on each hit. Entries are invalidated when a record is saved, updated
+or deleted using its model instance, in the current process only with the
+local backend: no model is cached by default, as records are also written
+by other processes (and by go services) that can not invalidate it.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import copy
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from ..config import Configuration
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 10000
+DEFAULT_TTL = 60  # seconds
+
+
+class CacheStats(object):
+    """Usage counters of a cache."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def to_dict(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'sets': self.sets,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+                'hit_ratio': self.hit_ratio}
+
+
+class CacheBackend(object):
+    """
+    Interface of cache backends.
+
+    A backend store values by string keys, it must return None
+    for a missing or expired key.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self.stats = CacheStats()
+
+    def get(self, key):
+        """Return value stored for key or None."""
+        raise NotImplementedError
+
+    def set(self, key, value):
+        """Store value for key."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Remove key from cache."""
+        raise NotImplementedError
+
+    def clear(self):
+        """Remove all keys from cache."""
+        raise NotImplementedError
+
+
+class LocalCache(CacheBackend):
+    """
+    In process cache backend, bounded by size and time to live.
+
+    Least recently used entries are evicted first. Values are copied
+    when stored and returned so cached ones can not be altered.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL):
+        super(LocalCache, self).__init__(ttl)
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            expire, value = entry
+            if expire and expire < time.time():
+                self.stats.evictions += 1
+                return None
+            # re-insert as most recently used
+            self._entries[key] = entry
+        return copy.deepcopy(value)
+
+    def set(self, key, value):
+        expire = time.time() + self.ttl if self.ttl else None
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expire, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SharedCache(CacheBackend):
+    """
+    Cache backend shared between processes using a key/value store client.
+
+    client must implement ``get(key)``, ``set(key, value, ttl)`` and
+    ``delete(key)``, as memcached or redis clients do with a thin adapter.
+    Values are pickled, errors of the store are logged and handled as a
+    cache miss.
+    """
+
+    def __init__(self, client, ttl=DEFAULT_TTL, prefix='caliopen:'):
+        super(SharedCache, self).__init__(ttl)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        try:
+            data = self.client.get(self.prefix + key)
+        except Exception as exc:
+            log.warn('Shared cache get of {} failed: {}'.format(key, exc))
+            return None
+        return pickle.loads(data) if data is not None else None
+
+    def set(self, key, value):
+        try:
+            self.client.set(self.prefix + key,
+                            pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                            self.ttl)
+        except Exception as exc:
+            log.warn('Shared cache set of {} failed: {}'.format(key, exc))
+
+    def delete(self, key):
+        try:
+            self.client.delete(self.prefix + key)
+        except Exception as exc:
+            log.warn('Shared cache delete of {} failed: {}'.format(key, exc))
+
+    def clear(self):
+        log.warn('Clear of a shared cache is not supported')
+
+
+class ModelCache(object):
+    """Cache of records of one model class, keyed by their primary key."""
+
+    def __init__(self, model_class, backend):
+        self.model_class = model_class
+        self.backend = backend
+        self._keys = list(model_class._primary_keys.keys())
+
+    @property
+    def stats(self):
+        return self.backend.stats
+
+    def _key(self, values):
+        """Return cache key for primary key values, None if incomplete."""
+        parts = [self.model_class.__name__]
+        for name in self._keys:
+            value = values.get(name)
+            if value is None:
+                return None
+            parts.append('{}'.format(value))
+        return ':'.join(parts)
+
+    def get(self, **keys):
+        """Return a model instance for primary key values or None."""
+        if len(keys) != len(self._keys):
+            return None
+        key = self._key(keys)
+        if key is None:
+            return None
+        values = self.backend.get(key)
+        if values is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return self.model_class._construct_instance(values)
+
+    def _model_key(self, model):
+        return self._key({x: getattr(model, x) for x in self._keys})
+
+    def set(self, model):
+        """Cache a model instance."""
+        key = self._model_key(model)
+        if key is None:
+            return
+        values = {col.db_field_name: getattr(model, name)
+                  for name, col in model._columns.items()}
+        self.backend.set(key, values)
+        self.stats.sets += 1
+
+    def invalidate(self, model):
+        """Remove a model instance from cache."""
+        key = self._model_key(model)
+        if key is not None:
+            self.backend.delete(key)
+            self.stats.invalidations += 1
+
+
+class ModelCacheRegistry(object):
+    """
+    Registry of model caches.
+
+    Caches are built on first use from configuration, extra backends
+    can be declared with :meth:`register_backend`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._caches = {}
+        self._backends = {'local': LocalCache}
+
+    def register_backend(self, name, factory):
+        """
+        Declare a backend, factory is called with max_size and ttl.
+
+        Use it to plug a SharedCache::
+
+            model_caches.register_backend(
+                'redis', lambda max_size, ttl: SharedCache(client, ttl=ttl))
+        """
+        with self._lock:
+            self._backends[name] = factory
+            self._caches = {}
+
+    def _build(self, model_class):
+        conf = Configuration('global').get('cache', {}) or {}
+        models = conf.get('models') or {}
+        if model_class.__name__ not in models:
+            return None
+        options = dict(conf)
+        options.update(models[model_class.__name__] or {})
+        name = options.get('backend', 'local')
+        factory = self._backends.get(name)
+        if factory is None:
+            log.error('Unknown cache backend {}'.format(name))
+            return None
+        backend = factory(max_size=options.get('max_size', DEFAULT_MAX_SIZE),
+                          ttl=options.get('ttl', DEFAULT_TTL))
+        log.debug('Cache {} enabled for {}'.format(name, model_class.__name__))
+        return ModelCache(model_class, backend)
+
+    def get(self, model_class):
+        """Return cache of model class, None when not enabled."""
+        try:
+            return self._caches[model_class]
+        except KeyError:
+            pass
+        with self._lock:
+            if model_class not in self._caches:
+                self._caches[model_class] = self._build(model_class)
+            return self._caches[model_class]
+
+    def invalidate(self, model):
+        """Remove a model instance from its cache, if any."""
+        cache = self.get(model.__class__)
+        if cache is not None:
+            cache.invalidate(model)
+
+    def reset(self):
+        """Drop all caches."""
+        with self._lock:
+            self._caches = {}
+
+    def stats(self):
+        """Return statistics of enabled caches by model name."""
+        return {kls.__name__: cache.stats.to_dict()
+                for kls, cache in self._caches.items() if cache is not None}
+
+
+model_caches = ModelCacheRegistry()
@@ -56,8 +56,13 @@ class IndexedModelMixin(object):
         else:
             setattr(idx, col_name, col_value)
 
-    def create_index(self, **extras):
-        """Translate a model object into an indexed document."""
+    def create_index(self, writer=None, **extras):
+        """
+        Translate a model object into an indexed document.
+
+        When a BulkIndexWriter is given, indexation is queued into it
+        instead of being done immediately.
+        """
         if not self._index_class:
             return False
         idx = self._index_class()
@@ -71,7 +76,10 @@ class IndexedModelMixin(object):
                 self._process_column(desc, idx)
         for k, v in extras.items():
             setattr(idx, k, v)
-        idx.save(using=idx.client())
+        if writer is not None:
+            writer.index(idx)
+        else:
+            idx.save(using=idx.client())
         return True
 
     def update_index(self, object_id, changed_columns):
@@ -1,20 +1,91 @@
 # -*- coding: utf-8 -*-
 """Caliopen cassandra base model classes."""
 from __future__ import absolute_import, print_function, unicode_literals
+import base64
 import logging
 
+import cassandra
+from cassandra import InvalidRequest
+from cassandra.concurrent import execute_concurrent_with_args
+from cassandra.cqlengine.connection import get_session
 from cassandra.cqlengine.models import Model
 from cassandra.cqlengine.query import DoesNotExist
 from cassandra.cqlengine.usertype import UserType
+from cassandra.protocol import ProtocolException
+from cassandra.query import SimpleStatement
 
-from elasticsearch import Elasticsearch
 from elasticsearch_dsl import DocType
 
 from ..config import Configuration
-from ..exception import NotFound
+from ..helpers.connection import get_index_connection
+from ..exception import NotFound, InvalidCursor
+from .cache import model_caches
 
 log = logging.getLogger(__name__)
 
+# default number of concurrent queries for multi keys fetch
+DEFAULT_CONCURRENCY = Configuration('global').get('cassandra.concurrency', 50)
+# rows fetched by each page of a token range scan
+DEFAULT_SCAN_FETCH_SIZE = 1000
+# tokens of murmur3 partitioner, min token is never the one of a key
+MIN_TOKEN = -2 ** 63
+MAX_TOKEN = 2 ** 63 - 1
+# driver version whose private api is used to resume native paging
+PAGING_DRIVER_VERSION = '3.4.1'
+
+
+def token_ranges(splits):
+    """Split token ring into splits contiguous (start, end] ranges."""
+    step = (MAX_TOKEN - MIN_TOKEN) // splits
+    bounds = [MIN_TOKEN + i * step for i in range(splits)] + [MAX_TOKEN]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def execute_page(session, statement, size, paging_state=None):
+    """
+    Execute a cqlengine select statement for one page of size rows.
+
+    session.execute does not take a paging state in cassandra-driver 3.4.1,
+    it is set on the response future before its request is sent, using
+    private driver api. Other driver versions are refused until this code
+    is checked against them.
+
+    :return: tuple (result of page, paging state of next page or None)
+    """
+    if cassandra.__version__ != PAGING_DRIVER_VERSION:
+        raise RuntimeError('Native paging needs cassandra-driver {}, '
+                           'found {}'.format(PAGING_DRIVER_VERSION,
+                                             cassandra.__version__))
+    simple = SimpleStatement(str(statement), fetch_size=size)
+    future = session._create_response_future(simple,
+                                             statement.get_context(),
+                                             False, None,
+                                             session.default_timeout)
+    future._protocol_handler = session.client_protocol_handler
+    if paging_state:
+        future._paging_state = paging_state
+        future.message.paging_state = paging_state
+    future.send_request()
+    result = future.result()
+    return result, future._paging_state
+
+
+def encode_cursor(paging_state):
+    """Return an opaque url safe cursor for a cassandra paging state."""
+    if not paging_state:
+        return None
+    return base64.urlsafe_b64encode(paging_state).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Return cassandra paging state of a cursor, None for first page."""
+    if not cursor:
+        return None
+    try:
+        return base64.urlsafe_b64decode(str(cursor))
+    except (TypeError, ValueError, UnicodeEncodeError) as exc:
+        raise InvalidCursor('Invalid cursor {!r}: {}'.format(cursor, exc))
+
 
 class BaseModel(Model):
     """Cassandra base model."""
@@ -31,7 +102,7 @@ class BaseModel(Model):
         obj = super(BaseModel, cls).create(**attrs)
         if obj._index_class:
             extras = kwargs.get('_indexed_extra', {})
-            obj.create_index(**extras)
+            obj.create_index(writer=kwargs.get('_index_writer'), **extras)
         return obj
 
     @classmethod
@@ -44,6 +115,141 @@ class BaseModel(Model):
         except:
             raise
 
+    @classmethod
+    def get_cached(cls, **kwargs):
+        """Get a record, using cache of model class when enabled."""
+        cache = model_caches.get(cls)
+        if cache is None:
+            return cls.get(**kwargs)
+        obj = cache.get(**kwargs)
+        if obj is None:
+            obj = cls.get(**kwargs)
+            cache.set(obj)
+        return obj
+
+    def save(self):
+        """Save record and remove it from cache."""
+        result = super(BaseModel, self).save()
+        model_caches.invalidate(self)
+        return result
+
+    def update(self, **values):
+        """Update record and remove it from cache."""
+        result = super(BaseModel, self).update(**values)
+        model_caches.invalidate(self)
+        return result
+
+    def delete(self):
+        """Delete record and remove it from cache."""
+        result = super(BaseModel, self).delete()
+        model_caches.invalidate(self)
+        return result
+
+    @classmethod
+    def _get_many_statement(cls, names):
+        """Return prepared select statement on a tuple of column names."""
+        cache = cls.__dict__.get('_get_many_statements')
+        if cache is None:
+            cache = {}
+            setattr(cls, '_get_many_statements', cache)
+        if names not in cache:
+            where = ' AND '.join('"{}" = ?'.format(
+                cls._columns[x].db_field_name) for x in names)
+            query = 'SELECT * FROM {} WHERE {}'. \
+                format(cls.column_family_name(), where)
+            cache[names] = get_session().prepare(query)
+        return cache[names]
+
+    @classmethod
+    def get_many(cls, keys, concurrency=DEFAULT_CONCURRENCY):
+        """
+        Get many records concurrently.
+
+        :param keys: list of dict with primary key values of each record
+        :param concurrency: maximum number of queries running at same time
+        :return: list of model instances in same order than keys,
+                 None for records not found.
+        :raise: error of first failed query
+        """
+        return [rows[0] if rows else None
+                for rows in cls.find_many(keys, concurrency=concurrency)]
+
+    @classmethod
+    def find_many(cls, keys, concurrency=DEFAULT_CONCURRENCY):
+        """
+        Run many select queries concurrently.
+
+        :param keys: list of dict with values of same primary key columns
+        :param concurrency: maximum number of queries running at same time
+        :return: list of list of model instances in same order than keys
+        :raise: error of first failed query, once all queries are done
+        """
+        if not keys:
+            return []
+        names = tuple(sorted(keys[0].keys()))
+        statement = cls._get_many_statement(names)
+        params = [[cls._columns[x].to_database(key[x]) for x in names]
+                  for key in keys]
+        results = execute_concurrent_with_args(get_session(), statement,
+                                               params,
+                                               concurrency=concurrency,
+                                               raise_on_first_error=False)
+        objs = []
+        errors = []
+        for key, (success, rows) in zip(keys, results):
+            if not success:
+                log.warn('Fetch of {} {} failed: {}'.
+                         format(cls.__name__, key, rows))
+                errors.append(rows)
+                continue
+            objs.append([cls._construct_instance(x) for x in rows])
+        if errors:
+            raise errors[0]
+        return objs
+
+    @classmethod
+    def fetch_page(cls, size, paging_state=None, **filters):
+        """
+        Fetch one page of records matching filters using native paging.
+
+        Cassandra only read the requested page, paging_state returned by
+        a previous call is used to fetch the following one.
+
+        :param size: maximum number of records to return
+        :param paging_state: paging state of page to fetch, None for first one
+        :return: tuple (list of model instances, paging state of next page
+                 or None when there is no more page)
+        :raise: InvalidCursor if cassandra rejects paging_state
+        """
+        query = cls.filter(**filters) if filters else cls.all()
+        statement = query.limit(None)._select_query()
+        try:
+            result, next_state = execute_page(get_session(), statement,
+                                              size, paging_state)
+        except (ProtocolException, InvalidRequest) as exc:
+            if not paging_state:
+                raise
+            # a well formed cursor that is not a paging state of this query
+            raise InvalidCursor('Invalid paging state: {}'.format(exc))
+        objs = [cls._construct_instance(x) for x in result.current_rows]
+        return objs, next_state
+
+    @classmethod
+    def scan_token_range(cls, start, end, fetch_size=DEFAULT_SCAN_FETCH_SIZE):
+        """
+        Iterate over records of partitions with token in (start, end].
+
+        Records are read by pages of fetch_size using native paging, in
+        token order, only one page is kept in memory.
+        """
+        keys = ', '.join('"{}"'.format(x.db_field_name)
+                         for x in cls._partition_keys.values())
+        query = 'SELECT * FROM {0} WHERE token({1}) > %s ' \
+                'AND token({1}) <= %s'.format(cls.column_family_name(), keys)
+        statement = SimpleStatement(query, fetch_size=fetch_size)
+        for row in get_session().execute(statement, (start, end)):
+            yield cls._construct_instance(row)
+
     @classmethod
     def filter(cls, **kwargs):
         """Filter storable objects."""
@@ -63,8 +269,8 @@ class BaseIndexDocument(DocType):
 
     @classmethod
     def client(cls):
-        """Return an elasticsearch client."""
-        return Elasticsearch(cls.__url__)
+        """Return the shared elasticsearch client."""
+        return get_index_connection(cls.__url__)
 
     @classmethod
     def create_mapping(cls, user_id):
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+Caliopen object store access.
+
+One client, with its http connection pool, is shared by each process. It is
+configured by ``object_store`` configuration key::
+
+    object_store:
+        endpoint: minio.dev.caliopen.org:9090
+        access_key: ...
+        secret_key: ...
+        location: eu-fr-localhost
+        client:
+            maxsize: 10
+            timeout: 30
+            retries: 3
+        disk_cache:
+            path: /var/cache/caliopen/objects
+            max_size: 1073741824
+            buckets:
+                - caliopen-raw-messages
+
+Objects can be read as an iterator of chunks, as a file like object or
+fully buffered, optionally for a range of bytes. Objects of buckets listed
+in ``disk_cache.buckets`` are kept in a bounded local disk cache once fully
+read.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import errno
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import urlparse
+
+import urllib3
+from minio import Minio
+from minio.error import MinioError, NoSuchKey
+
+from ..config import Configuration
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# object store client options that can be set in configuration,
+# with their default values.
+OBJECT_STORE_CLIENT_OPTIONS = {
+    'maxsize': 10,
+    'timeout': 30,
+    'retries': 3,
+}
+
+
+def parse_uri(uri):
+    """Return (bucket, name) of an object store uri (s3://bucket/name)."""
+    url = urlparse.urlsplit(uri)
+    if url.scheme != 's3' or not url.netloc:
+        raise ValueError('Invalid object store uri {}'.format(uri))
+    return url.netloc, url.path.lstrip('/')
+
+
+def build_uri(bucket, name):
+    """Return object store uri of an object."""
+    return 's3://{}/{}'.format(bucket, name)
+
+
+class DiskCache(object):
+    """
+    Bounded local disk cache of objects.
+
+    Least recently read objects are removed first when max_size
+    (in bytes) is reached.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._size = None
+        try:
+            os.makedirs(path)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+    def _path(self, bucket, name):
+        key = hashlib.sha1('{}/{}'.format(bucket, name).encode('utf-8'))
+        return os.path.join(self.path, key.hexdigest())
+
+    def _entries(self):
+        entries = []
+        for filename in os.listdir(self.path):
+            if filename.startswith('.'):
+                continue
+            path = os.path.join(self.path, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+        return entries
+
+    @property
+    def size(self):
+        """Size of cached objects in bytes."""
+        with self._lock:
+            if self._size is None:
+                self._size = sum(x[1] for x in self._entries())
+            return self._size
+
+    def open(self, bucket, name):
+        """Return cached object opened for reading, None if not cached."""
+        path = self._path(bucket, name)
+        try:
+            f = io.open(path, 'rb')
+        except IOError:
+            return None
+        # mark as recently used
+        os.utime(path, None)
+        return f
+
+    def writer(self):
+        """Return a temporary file to write an object to cache."""
+        return tempfile.NamedTemporaryFile(dir=self.path, prefix='.',
+                                           delete=False)
+
+    def commit(self, bucket, name, tmp):
+        """Move a written temporary file into cache."""
+        size = os.path.getsize(tmp.name)
+        if size > self.max_size:
+            os.unlink(tmp.name)
+            return
+        path = self._path(bucket, name)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(x[1] for x in self._entries())
+            if os.path.exists(path):
+                self._size -= os.path.getsize(path)
+            os.rename(tmp.name, path)
+            self._size += size
+            if self._size > self.max_size:
+                self._evict()
+
+    def discard(self, tmp):
+        """Remove a temporary file not fully written."""
+        try:
+            os.unlink(tmp.name)
+        except OSError:
+            pass
+
+    def remove(self, bucket, name):
+        """Remove an object from cache."""
+        path = self._path(bucket, name)
+        try:
+            size = os.path.getsize(path)
+            os.unlink(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size -= size
+
+    def _evict(self):
+        for atime, size, path in sorted(self._entries()):
+            if self._size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            self._size -= size
+
+
+class ObjectStore(object):
+    """Access to object store using a pooled minio client."""
+
+    def __init__(self, client, cache=None, cached_buckets=None):
+        self.client = client
+        self.cache = cache
+        self.cached_buckets = set(cached_buckets or [])
+
+    @classmethod
+    def from_config(cls):
+        """Build an object store from configuration."""
+        conf = Configuration('global').get('object_store') or {}
+        options = dict(OBJECT_STORE_CLIENT_OPTIONS)
+        options.update(conf.get('client') or {})
+        retries = urllib3.Retry(total=options['retries'],
+                                backoff_factor=0.2,
+                                status_forcelist=[500, 502, 503, 504])
+        http_client = urllib3.PoolManager(
+            maxsize=options['maxsize'],
+            timeout=urllib3.Timeout(connect=options['timeout'],
+                                    read=options['timeout']),
+            retries=retries)
+        client = Minio(conf['endpoint'],
+                       access_key=conf['access_key'],
+                       secret_key=conf['secret_key'],
+                       secure=conf.get('secure', False),
+                       region=conf.get('location'),
+                       http_client=http_client)
+        cache_conf = conf.get('disk_cache') or {}
+        cache = None
+        if cache_conf.get('path'):
+            cache = DiskCache(cache_conf['path'],
+                              cache_conf.get('max_size', 1024 * 1024 * 1024))
+        return cls(client, cache=cache,
+                   cached_buckets=cache_conf.get('buckets'))
+
+    def _is_cached(self, bucket):
+        return self.cache is not None and bucket in self.cached_buckets
+
+    def _get(self, bucket, name, offset=0, length=None):
+        """Return http response of an object, for a range if any."""
+        if offset or length:
+            return self.client.get_partial_object(bucket, name, offset,
+                                                  length or 0)
+        return self.client.get_object(bucket, name)
+
+    def _open_cached(self, bucket, name, offset=0, length=None):
+        """Return object opened from disk cache, None if not cached."""
+        if not self._is_cached(bucket):
+            return None
+        f = self.cache.open(bucket, name)
+        if f is None:
+            return None
+        f.seek(offset)
+        if length is None:
+            return f
+        with f:
+            return io.BytesIO(f.read(length))
+
+    def open(self, bucket, name, offset=0, length=None):
+        """
+        Return a file like object to read an object.
+
+        Content is read from the network as it is consumed, caller must
+        close the returned object.
+        """
+        f = self._open_cached(bucket, name, offset, length)
+        if f is not None:
+            return f
+        return self._get(bucket, name, offset, length)
+
+    def iter_chunks(self, bucket, name, offset=0, length=None,
+                    chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Iterate over chunks of an object.
+
+        A full read of an object of a cached bucket fill the disk cache.
+        """
+        f = self._open_cached(bucket, name, offset, length)
+        tmp = None
+        if f is None:
+            f = self._get(bucket, name, offset, length)
+            if self._is_cached(bucket) and not offset and length is None:
+                tmp = self.cache.writer()
+        done = False
+        try:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                if tmp is not None:
+                    tmp.write(chunk)
+                yield chunk
+            done = True
+            if tmp is not None:
+                tmp.close()
+                self.cache.commit(bucket, name, tmp)
+                tmp = None
+        finally:
+            if tmp is not None:
+                tmp.close()
+                self.cache.discard(tmp)
+            if hasattr(f, 'release_conn'):
+                # connection goes back to pool only if response was
+                # fully read, otherwise it must be closed
+                if not done:
+                    f.close()
+                f.release_conn()
+            else:
+                f.close()
+
+    def read(self, bucket, name, offset=0, length=None):
+        """Read an object, or a range of it, fully in memory."""
+        return b''.join(self.iter_chunks(bucket, name, offset, length))
+
+    def stat(self, bucket, name):
+        """Return object metadata, None if object does not exist."""
+        try:
+            return self.client.stat_object(bucket, name)
+        except NoSuchKey:
+            return None
+        except MinioError as exc:
+            # HEAD responses have no body to detail the error
+            if getattr(exc, 'code', None) in ('NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def exists(self, bucket, name):
+        """Check if an object exists."""
+        return self.stat(bucket, name) is not None
+
+    def put(self, bucket, name, data, length,
+            content_type='application/octet-stream'):
+        """Store an object, data is a file like object."""
+        return self.client.put_object(bucket, name, data, length,
+                                      content_type)
+
+    def list(self, bucket, prefix=''):
+        """Iterate over objects of a bucket."""
+        return self.client.list_objects(bucket, prefix=prefix,
+                                        recursive=True)
+
+    def remove(self, bucket, name):
+        """Remove an object."""
+        self.client.remove_object(bucket, name)
+        if self._is_cached(bucket):
+            self.cache.remove(bucket, name)
+
+
+class ObjectStoreRegistry(object):
+    """
+    Process wide registry of the object store.
+
+    As for index clients, object store is rebuilt when used from a forked
+    process, so that http connections are not shared between processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._store = None
+
+    def get(self):
+        """Return the shared object store of current process."""
+        with self._lock:
+            pid = os.getpid()
+            if pid != self._pid:
+                self._pid = pid
+                self._store = None
+            if self._store is None:
+                self._store = ObjectStore.from_config()
+                log.debug('Opened object store client')
+            return self._store
+
+    def reset(self):
+        """Forget current object store."""
+        with self._lock:
+            self._store = None
+
+
+object_stores = ObjectStoreRegistry()
+
+
+def get_object_store():
+    """Return the object store of current process."""
+    return object_stores.get()
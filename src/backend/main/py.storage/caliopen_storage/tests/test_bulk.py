@@ -0,0 +1,151 @@
+"""Test buffered bulk index writer."""
+
+import unittest
+import os
+import threading
+import time
+
+from elasticsearch.serializer import JSONSerializer
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+from caliopen_storage.store.bulk import BulkIndexWriter
+
+
+class MockTransport(object):
+
+    serializer = JSONSerializer()
+
+
+class MockClient(object):
+    """Elasticsearch client recording bulk requests."""
+
+    transport = MockTransport()
+
+    def __init__(self, statuses=None, error=None, blocked=None):
+        self.requests = []
+        self.statuses = statuses or {}
+        self.error = error
+        self.blocked = blocked
+
+    def bulk(self, body, **params):
+        lines = [self.transport.serializer.loads(x)
+                 for x in body.strip().split('\n')]
+        self.requests.append(lines)
+        if self.blocked:
+            self.blocked.wait(5)
+        if self.error:
+            raise self.error
+        items = []
+        for line in lines:
+            if not line.keys()[0] in ('index', 'update', 'delete'):
+                continue
+            op_type, meta = line.items()[0]
+            status = self.statuses.get(meta['_id'], 200)
+            item = {'_id': meta['_id'], 'status': status}
+            if status >= 300:
+                item['error'] = {'type': 'mapper_parsing_exception'}
+            items.append({op_type: item})
+        return {'items': items}
+
+
+def action(doc_id, op_type='index'):
+    return {'_op_type': op_type, '_index': 'user', '_type': 'doc',
+            '_id': doc_id, '_source': {'value': doc_id}}
+
+
+class TestBulkIndexWriter(unittest.TestCase):
+
+    def test_flush_on_max_docs(self):
+        client = MockClient()
+        writer = BulkIndexWriter(client=client, max_docs=3, max_interval=0)
+        self.assertEqual(writer.add(action('1')), [])
+        self.assertEqual(writer.add(action('2')), [])
+        results = writer.add(action('3'))
+        self.assertEqual([x.id for x in results], ['1', '2', '3'])
+        self.assertTrue(all(x.ok for x in results))
+        self.assertEqual(len(client.requests), 1)
+        self.assertEqual(len(writer), 0)
+
+    def test_flush_on_max_bytes(self):
+        client = MockClient()
+        writer = BulkIndexWriter(client=client, max_bytes=100,
+                                 max_interval=0)
+        writer.add(action('1'))
+        self.assertEqual(client.requests, [])
+        writer.add(action('2'))
+        self.assertEqual(len(client.requests), 1)
+
+    def test_flush_on_max_interval(self):
+        client = MockClient()
+        writer = BulkIndexWriter(client=client, max_interval=0.05)
+        writer.add(action('1'))
+        # writer is idle, timer must send queued action
+        deadline = time.time() + 2
+        while not client.requests and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(client.requests), 1)
+        self.assertEqual(writer.sent, 1)
+        self.assertEqual(len(writer), 0)
+
+    def test_context_manager_flush(self):
+        client = MockClient()
+        with BulkIndexWriter(client=client, max_interval=0) as writer:
+            writer.add(action('1'))
+            writer.add(action('2', op_type='delete'))
+        self.assertEqual(len(client.requests), 1)
+        self.assertEqual(writer.sent, 2)
+
+    def test_item_errors(self):
+        client = MockClient(statuses={'2': 400})
+        writer = BulkIndexWriter(client=client, max_interval=0)
+        seen = []
+        writer.on_result = seen.append
+        writer.add(action('1'))
+        writer.add(action('2'))
+        results = writer.flush()
+        self.assertEqual([x.ok for x in results], [True, False])
+        self.assertEqual(len(seen), 2)
+        self.assertEqual([x.id for x in writer.errors], ['2'])
+        self.assertEqual(writer.errors[0].status, 400)
+
+    def test_request_error(self):
+        client = MockClient(error=Exception('connection refused'))
+        writer = BulkIndexWriter(client=client, max_interval=0)
+        writer.add(action('1'))
+        writer.add(action('2'))
+        results = writer.flush()
+        self.assertFalse(any(x.ok for x in results))
+        self.assertEqual(len(writer.errors), 2)
+        self.assertIn('connection refused', writer.errors[0].error)
+
+    def test_flush_waits_timed_request(self):
+        blocked = threading.Event()
+        client = MockClient(statuses={'1': 400}, blocked=blocked)
+        writer = BulkIndexWriter(client=client, max_interval=0.05)
+        writer.add(action('1'))
+        deadline = time.time() + 2
+        while not client.requests and time.time() < deadline:
+            time.sleep(0.01)
+        # timer request is in flight when flush is called
+        self.assertEqual(len(client.requests), 1)
+        flushed = []
+        flusher = threading.Thread(target=lambda: flushed.append(
+            writer.flush()))
+        flusher.start()
+        flusher.join(0.1)
+        self.assertTrue(flusher.is_alive())
+        blocked.set()
+        flusher.join(2)
+        self.assertEqual(flushed, [[]])
+        # failure of the timed request is only known from errors
+        self.assertEqual([x.id for x in writer.errors], ['1'])
+        self.assertEqual(writer.sent, 1)
@@ -0,0 +1,126 @@
+"""Test read-through cache of model records."""
+
+import unittest
+import os
+import uuid
+
+import mock
+from cassandra.cqlengine import columns
+from cassandra.cqlengine.models import Model
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+from caliopen_storage.store.model import BaseModel
+from caliopen_storage.store.cache import (LocalCache, ModelCache,
+                                          ModelCacheRegistry, model_caches)
+
+
+class CachedItem(BaseModel):
+
+    user_id = columns.UUID(primary_key=True)
+    name = columns.Text(primary_key=True)
+    tags = columns.List(columns.Text)
+
+
+class TestLocalCache(unittest.TestCase):
+
+    @mock.patch('caliopen_storage.store.cache.time.time')
+    def test_ttl(self, now):
+        now.return_value = 1000.0
+        cache = LocalCache(ttl=10)
+        cache.set('a', 1)
+        now.return_value = 1009.0
+        self.assertEqual(cache.get('a'), 1)
+        now.return_value = 1011.0
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats.evictions, 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_eviction(self):
+        cache = LocalCache(max_size=2, ttl=0)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # a becomes most recently used, b is evicted first
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats.evictions, 1)
+
+    def test_values_are_copied(self):
+        cache = LocalCache()
+        value = {'tags': ['inbox']}
+        cache.set('a', value)
+        value['tags'].append('spam')
+        cached = cache.get('a')
+        self.assertEqual(cached, {'tags': ['inbox']})
+        cached['tags'].append('spam')
+        self.assertEqual(cache.get('a'), {'tags': ['inbox']})
+
+    def test_delete(self):
+        cache = LocalCache()
+        cache.set('a', 1)
+        cache.delete('a')
+        self.assertIsNone(cache.get('a'))
+
+
+class TestModelCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ModelCache(CachedItem, LocalCache())
+        self.item = CachedItem(user_id=uuid.uuid4(), name='inbox',
+                               tags=['a'])
+
+    def test_get_set(self):
+        keys = {'user_id': self.item.user_id, 'name': 'inbox'}
+        self.assertIsNone(self.cache.get(**keys))
+        self.cache.set(self.item)
+        cached = self.cache.get(**keys)
+        self.assertEqual(cached.tags, ['a'])
+        self.assertEqual(self.cache.stats.hits, 1)
+        self.assertEqual(self.cache.stats.misses, 1)
+
+    def test_partial_key(self):
+        self.cache.set(self.item)
+        self.assertIsNone(self.cache.get(user_id=self.item.user_id))
+
+    def test_invalidate(self):
+        self.cache.set(self.item)
+        self.cache.invalidate(self.item)
+        self.assertIsNone(self.cache.get(user_id=self.item.user_id,
+                                         name='inbox'))
+        self.assertEqual(self.cache.stats.invalidations, 1)
+
+
+class TestModelCaches(unittest.TestCase):
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(ModelCacheRegistry().get(CachedItem))
+
+    def test_get_cached_and_invalidation_on_write(self):
+        cache = ModelCache(CachedItem, LocalCache())
+        item = CachedItem(user_id=uuid.uuid4(), name='inbox', tags=['a'])
+        keys = {'user_id': item.user_id, 'name': 'inbox'}
+        with mock.patch.dict(model_caches._caches, {CachedItem: cache}), \
+                mock.patch.object(Model, 'get',
+                                  return_value=item) as get, \
+                mock.patch.object(Model, 'save'), \
+                mock.patch.object(Model, 'delete'):
+            CachedItem.get_cached(**keys)
+            CachedItem.get_cached(**keys)
+            self.assertEqual(get.call_count, 1)
+            item.save()
+            self.assertIsNone(cache.get(**keys))
+            CachedItem.get_cached(**keys)
+            self.assertEqual(get.call_count, 2)
+            item.delete()
+            self.assertIsNone(cache.get(**keys))
@@ -0,0 +1,74 @@
+"""Test compression codecs of data stored in database."""
+
+import os
+import unittest
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+from caliopen_storage.helpers.compression import (codecs, get_codec, encode,
+                                                  decode, UnknownCodec,
+                                                  lz4_frame)
+
+MAIL = b'Received: from mx.example.org\r\nSubject: test\r\n\r\n' + \
+    b'Some text of a mail, repeated.\r\n' * 100
+
+
+class TestCompression(unittest.TestCase):
+
+    def test_round_trip(self):
+        for name in codecs:
+            codec = get_codec(name)
+            codec_name, data = encode(MAIL, codec, min_size=10)
+            self.assertEqual(codec_name, name)
+            self.assertLess(len(data), len(MAIL))
+            self.assertEqual(decode(data, codec_name), MAIL)
+
+    def test_options(self):
+        codec = get_codec('zlib', level=1)
+        self.assertEqual(codec.level, 1)
+        codec_name, data = encode(MAIL, codec)
+        self.assertEqual(decode(data, codec_name), MAIL)
+
+    @unittest.skipIf(lz4_frame is None, 'lz4 package not installed')
+    def test_lz4(self):
+        codec_name, data = encode(MAIL, get_codec('lz4'))
+        self.assertEqual(codec_name, 'lz4')
+        self.assertEqual(decode(data, 'lz4'), MAIL)
+
+    def test_no_compression(self):
+        self.assertIsNone(get_codec(None))
+        self.assertIsNone(get_codec('none'))
+        self.assertEqual(encode(MAIL, None), (None, MAIL))
+
+    def test_kept_as_is(self):
+        codec = get_codec('zlib')
+        # too small to be worth it
+        self.assertEqual(encode(b'short', codec), (None, b'short'))
+        # not reduced by compression
+        data = os.urandom(2048)
+        self.assertEqual(encode(data, codec), (None, data))
+
+    def test_unknown_codec(self):
+        self.assertRaises(UnknownCodec, get_codec, 'brotli')
+        self.assertRaises(UnknownCodec, decode, b'data', 'brotli')
+        # still a ValueError for callers not knowing it
+        self.assertTrue(issubclass(UnknownCodec, ValueError))
+
+    def test_rows_without_codec(self):
+        # rows written before compression, or by go services
+        self.assertEqual(decode(MAIL, None), MAIL)
+        self.assertEqual(decode(MAIL, ''), MAIL)
+        self.assertIsNone(decode(None, 'zlib'))
+        self.assertEqual(decode(b'', 'zlib'), b'')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+"""Test cursor based pagination of user core objects."""
+
+import unittest
+import os
+import uuid
+
+import mock
+from cassandra.cqlengine import columns
+from cassandra.protocol import ProtocolException
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+from caliopen_storage.exception import InvalidCursor
+from caliopen_storage.store import model as model_module
+from caliopen_storage.store.model import (BaseModel, encode_cursor,
+                                          decode_cursor)
+from caliopen_storage.core.base import BaseUserCore
+
+
+class PagedItem(BaseModel):
+
+    user_id = columns.UUID(primary_key=True)
+    item_id = columns.UUID(primary_key=True)
+
+
+class CorePagedItem(BaseUserCore):
+
+    _model_class = PagedItem
+    _pkey_name = 'item_id'
+
+
+class MockUser(object):
+
+    user_id = uuid.uuid4()
+
+
+class TestCursor(unittest.TestCase):
+
+    def test_round_trip(self):
+        state = b'\x00\x10\xff\x7f paging'
+        cursor = encode_cursor(state)
+        self.assertNotIn('/', cursor)
+        self.assertEqual(decode_cursor(cursor), state)
+
+    def test_first_and_last_page(self):
+        self.assertIsNone(decode_cursor(''))
+        self.assertIsNone(decode_cursor(None))
+        self.assertIsNone(encode_cursor(None))
+
+    def test_invalid_cursor(self):
+        for cursor in ('abc', u'\xe9t\xe9'):
+            self.assertRaises(InvalidCursor, decode_cursor, cursor)
+
+
+class TestFindCursor(unittest.TestCase):
+
+    def test_find_page(self):
+        user = MockUser()
+        model = PagedItem(user_id=user.user_id, item_id=uuid.uuid4())
+        with mock.patch.object(PagedItem, 'fetch_page',
+                               return_value=([model], b'next')) as fetch:
+            result = CorePagedItem.find(user, limit=1, cursor='',
+                                        total=False)
+        fetch.assert_called_once_with(1, None, user_id=user.user_id)
+        self.assertEqual([x.model for x in result['objects']], [model])
+        self.assertEqual(decode_cursor(result['next_cursor']), b'next')
+        self.assertIsNone(result['total'])
+
+    def test_find_last_page(self):
+        user = MockUser()
+        with mock.patch.object(PagedItem, 'fetch_page',
+                               return_value=([], None)):
+            result = CorePagedItem.find(user, cursor=encode_cursor(b'x'),
+                                        total=False)
+        self.assertIsNone(result['next_cursor'])
+
+    def test_find_invalid_cursor(self):
+        with mock.patch.object(PagedItem, 'fetch_page') as fetch:
+            self.assertRaises(InvalidCursor, CorePagedItem.find, MockUser(),
+                              cursor='not a cursor')
+        self.assertFalse(fetch.called)
+
+    def _fetch_page(self, error, paging_state):
+        session = mock.Mock()
+        future = session._create_response_future.return_value
+        future.result.side_effect = error
+        with mock.patch('caliopen_storage.store.model.get_session',
+                        return_value=session):
+            return PagedItem.fetch_page(10, paging_state,
+                                        user_id=uuid.uuid4())
+
+    def test_rejected_paging_state(self):
+        error = ProtocolException(0x000A, 'Invalid value for the paging '
+                                          'state', None)
+        self.assertRaises(InvalidCursor, self._fetch_page, error, b'bogus')
+
+    def test_error_of_first_page(self):
+        error = ProtocolException(0x000A, 'Protocol error', None)
+        self.assertRaises(ProtocolException, self._fetch_page, error, None)
+
+    def test_unsupported_driver_version(self):
+        with mock.patch.object(model_module.cassandra, '__version__',
+                               '3.5.0'):
+            self.assertRaises(RuntimeError, self._fetch_page, None, None)
+
+    def test_same_total_with_cursor_and_offset(self):
+        user = MockUser()
+        filters = {'item_id': uuid.uuid4()}
+        model = PagedItem(user_id=user.user_id, item_id=filters['item_id'])
+        query = mock.Mock()
+        query.filter.return_value = [model]
+        with mock.patch.object(CorePagedItem, 'count',
+                               return_value=1) as count, \
+                mock.patch.object(PagedItem, 'filter',
+                                  return_value=query), \
+                mock.patch.object(PagedItem, 'fetch_page',
+                                  return_value=([model], None)):
+            paged = CorePagedItem.find(user, filters, limit=10, cursor='')
+            sliced = CorePagedItem.find(user, filters, limit=10)
+        self.assertEqual(paged['total'], 1)
+        self.assertEqual(sliced['total'], 1)
+        self.assertEqual(count.call_args_list,
+                         [mock.call(user, filters)] * 2)
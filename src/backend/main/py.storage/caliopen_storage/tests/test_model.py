@@ -0,0 +1,73 @@
+"""Test concurrent fetch of many records."""
+
+import unittest
+import os
+import uuid
+
+import mock
+from cassandra import ReadTimeout
+from cassandra.cqlengine import columns
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+from caliopen_storage.store import model
+from caliopen_storage.store.model import BaseModel
+
+
+class ManyItem(BaseModel):
+
+    user_id = columns.UUID(primary_key=True)
+    item_id = columns.UUID(primary_key=True)
+
+
+class TestGetMany(unittest.TestCase):
+
+    def setUp(self):
+        self.user_id = uuid.uuid4()
+        self.ids = [uuid.uuid4() for x in range(3)]
+        self.keys = [{'user_id': self.user_id, 'item_id': x}
+                     for x in self.ids]
+
+    def _fetch(self, method, results):
+        with mock.patch.object(ManyItem, '_get_many_statement'), \
+                mock.patch.object(model, 'get_session'), \
+                mock.patch.object(model, 'execute_concurrent_with_args',
+                                  return_value=results) as execute:
+            found = getattr(ManyItem, method)(self.keys)
+        params = execute.call_args[0][2]
+        self.assertEqual(params, [[x['item_id'], self.user_id]
+                                  for x in self.keys])
+        return found
+
+    def _row(self, item_id):
+        return {'user_id': self.user_id, 'item_id': item_id}
+
+    def test_get_many(self):
+        results = [(True, [self._row(self.ids[0])]),
+                   (True, []),
+                   (True, [self._row(self.ids[2])])]
+        found = self._fetch('get_many', results)
+        self.assertEqual(found[0].item_id, self.ids[0])
+        self.assertIsNone(found[1])
+        self.assertEqual(found[2].item_id, self.ids[2])
+
+    def test_failed_query_raises(self):
+        error = ReadTimeout('timeout')
+        results = [(True, [self._row(self.ids[0])]),
+                   (False, error),
+                   (True, [])]
+        for method in ('get_many', 'find_many'):
+            with self.assertRaises(ReadTimeout) as ctx:
+                self._fetch(method, results)
+            self.assertIs(ctx.exception, error)
+
+    def test_no_keys(self):
+        self.assertEqual(ManyItem.find_many([]), [])
@@ -0,0 +1,189 @@
+"""Test object store disk cache and process wide registry."""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+from caliopen_storage.store import object_store
+from caliopen_storage.store.object_store import (DiskCache, ObjectStore,
+                                                 ObjectStoreRegistry)
+
+
+class FakeResponse(io.BytesIO):
+    """Minio http response, released to its pool."""
+
+    released = False
+
+    def release_conn(self):
+        self.released = True
+
+
+class FakeMinio(object):
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.requests = []
+
+    def get_object(self, bucket, name):
+        self.requests.append((bucket, name, 0, None))
+        return FakeResponse(self.objects[(bucket, name)])
+
+    def get_partial_object(self, bucket, name, offset, length):
+        self.requests.append((bucket, name, offset, length))
+        data = self.objects[(bucket, name)]
+        end = offset + length if length else None
+        return FakeResponse(data[offset:end])
+
+    def remove_object(self, bucket, name):
+        del self.objects[(bucket, name)]
+
+
+class TestDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = DiskCache(self.path, 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def put(self, name, data, atime):
+        tmp = self.cache.writer()
+        tmp.write(data)
+        tmp.close()
+        self.cache.commit('bucket', name, tmp)
+        path = self.cache._path('bucket', name)
+        if os.path.exists(path):
+            os.utime(path, (atime, atime))
+
+    def cached(self):
+        return sorted(x for x in ('a', 'b', 'c', 'd')
+                      if os.path.exists(self.cache._path('bucket', x)))
+
+    def test_lru_eviction(self):
+        self.put('a', b'a' * 40, 1000)
+        self.put('b', b'b' * 40, 2000)
+        self.assertEqual(self.cache.size, 80)
+        # a is read, b becomes the least recently used
+        with self.cache.open('bucket', 'a') as f:
+            self.assertEqual(f.read(), b'a' * 40)
+        self.put('c', b'c' * 40, 3000)
+        self.assertEqual(self.cached(), ['a', 'c'])
+        self.assertEqual(self.cache.size, 80)
+
+    def test_evicted_by_size(self):
+        self.put('a', b'a' * 30, 1000)
+        self.put('b', b'b' * 30, 2000)
+        self.put('c', b'c' * 30, 3000)
+        # 70 bytes over max_size, the three oldest objects are removed
+        self.put('d', b'd' * 80, 4000)
+        self.assertEqual(self.cached(), ['d'])
+        self.assertEqual(self.cache.size, 80)
+
+    def test_evicted_until_max_size(self):
+        self.put('a', b'a' * 30, 1000)
+        self.put('b', b'b' * 30, 2000)
+        self.put('c', b'c' * 30, 3000)
+        self.put('d', b'd' * 70, 4000)
+        self.assertEqual(self.cached(), ['c', 'd'])
+        self.assertEqual(self.cache.size, 100)
+
+    def test_too_large_not_cached(self):
+        self.put('a', b'a' * 101, 1000)
+        self.assertEqual(self.cached(), [])
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_size_read_from_disk(self):
+        self.put('a', b'a' * 40, 1000)
+        self.put('a', b'a' * 20, 1000)
+        self.assertEqual(self.cache.size, 20)
+        # a new process finds objects on disk
+        self.assertEqual(DiskCache(self.path, 100).size, 20)
+        self.cache.remove('bucket', 'a')
+        self.assertEqual(self.cache.size, 0)
+
+
+class TestObjectStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.data = b''.join(chr(x) for x in range(256))
+        self.client = FakeMinio({('raws', 'r1'): self.data,
+                                 ('other', 'o1'): self.data})
+        self.store = ObjectStore(self.client,
+                                 cache=DiskCache(self.path, 1024),
+                                 cached_buckets=['raws'])
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_full_read_fills_cache(self):
+        self.assertEqual(self.store.read('raws', 'r1', 10, 5),
+                         self.data[10:15])
+        # ranged reads are not cached
+        self.assertIsNone(self.store.cache.open('raws', 'r1'))
+        chunks = self.store.iter_chunks('raws', 'r1', chunk_size=100)
+        self.assertEqual(b''.join(chunks), self.data)
+        self.assertEqual(self.store.read('raws', 'r1', 10, 5),
+                         self.data[10:15])
+        self.assertEqual(self.store.read('raws', 'r1', 250), self.data[250:])
+        self.assertEqual(len(self.client.requests), 2)
+
+    def test_bucket_not_cached(self):
+        self.store.read('other', 'o1')
+        self.store.read('other', 'o1')
+        self.assertEqual(len(self.client.requests), 2)
+
+    def test_removed_from_cache(self):
+        self.store.read('raws', 'r1')
+        self.store.remove('raws', 'r1')
+        self.assertIsNone(self.store.cache.open('raws', 'r1'))
+
+    def test_interrupted_read_not_cached(self):
+        chunks = self.store.iter_chunks('raws', 'r1', chunk_size=100)
+        next(chunks)
+        chunks.close()
+        self.assertIsNone(self.store.cache.open('raws', 'r1'))
+        self.assertEqual(os.listdir(self.path), [])
+
+
+class TestObjectStoreRegistry(unittest.TestCase):
+
+    @mock.patch.object(ObjectStore, 'from_config',
+                       side_effect=lambda: object())
+    def test_rebuilt_after_fork(self, from_config):
+        registry = ObjectStoreRegistry()
+        store = registry.get()
+        self.assertIs(registry.get(), store)
+        with mock.patch.object(object_store.os, 'getpid',
+                               return_value=os.getpid() + 1):
+            forked = registry.get()
+            self.assertIsNot(forked, store)
+            self.assertIs(registry.get(), forked)
+        self.assertEqual(from_config.call_count, 2)
+
+    @mock.patch.object(ObjectStore, 'from_config',
+                       side_effect=lambda: object())
+    def test_reset(self, from_config):
+        registry = ObjectStoreRegistry()
+        store = registry.get()
+        registry.reset()
+        self.assertIsNot(registry.get(), store)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,11 +21,12 @@ requires = [
     'cassandra-driver==3.4.1',
     'schematics',
     'simplejson',
+    'minio',
     ]
 
 extras_require = {
     'dev': [],
-    'test': ['nose', 'coverage', 'freezegun', 'docker-py'],
+    'test': ['nose', 'coverage', 'freezegun', 'docker-py', 'mock'],
 }
 
 
@@ -13,9 +13,12 @@ from caliopen_storage.config import Configuration
 from caliopen_storage.helpers.connection import connect_storage
 from caliopen_cli.commands import (shell, import_email,
                                    setup_storage, create_user,
-                                   import_vcard, dump_model, dump_indexes,
+                                   import_vcard, dump_model, load_model,
+                                   dump_indexes,
                                    inject_email, basic_compute, migrate_index,
-                                   import_reserved_names)
+                                   import_reserved_names, migrate_raw,
+                                   garbage_collect, rebuild_discussions,
+                                   rebuild_recipients)
 
 logging.basicConfig(level=logging.INFO)
 
@@ -33,6 +36,15 @@ def main(args=sys.argv):
     sp_import.add_argument('-e', dest='email')
     sp_import.add_argument('--contact-probability', dest='contact_probability',
                            default=1.0)
+    sp_import.add_argument('--batch-size', dest='batch_size', type=int,
+                           default=50,
+                           help='number of messages delivered at once')
+    sp_import.add_argument('--workers', dest='workers', type=int,
+                           help='number of worker processes, 0 to import '
+                                'in main process (default: cpu count)')
+    sp_import.add_argument('--checkpoint', dest='checkpoint',
+                           help='file where import position is saved, '
+                                'to resume an interrupted import')
 
     sp_import_vcard = subparsers.add_parser('import_vcard',
                                             help='import vcard')
@@ -60,8 +72,24 @@ def main(args=sys.argv):
 
     sp_dump = subparsers.add_parser('dump')
     sp_dump.set_defaults(func=dump_model)
-    sp_dump.add_argument('-m', dest='model', help='model to dump')
+    sp_dump.add_argument('-m', dest='model',
+                         help='model to dump (contact, message, user '
+                              'or a model class name)')
     sp_dump.add_argument('-o', dest='output_path', help='output path')
+    sp_dump.add_argument('--splits', dest='splits', type=int,
+                         help='number of token ranges')
+    sp_dump.add_argument('-j', dest='jobs', type=int,
+                         help='number of ranges dumped at same time')
+    sp_dump.add_argument('-z', dest='compress', action='store_true',
+                         help='gzip dump files')
+
+    sp_load = subparsers.add_parser('load', help='load dump files')
+    sp_load.set_defaults(func=load_model)
+    sp_load.add_argument('-i', dest='input_path', help='dump path')
+    sp_load.add_argument('-m', dest='model',
+                         help='model to load (default all dumped ones)')
+    sp_load.add_argument('-j', dest='jobs', type=int,
+                         help='number of files loaded at same time')
 
     sp_dump_index = subparsers.add_parser('dump_index')
     sp_dump_index.set_defaults(func=dump_indexes)
@@ -71,6 +99,19 @@ def main(args=sys.argv):
     sp_migrate_index.set_defaults(func=migrate_index)
     sp_migrate_index.add_argument('-s', dest='input_script',
                                   help='python script to execute against index')
+    sp_migrate_index.add_argument('-j', dest='jobs', type=int,
+                                  help='number of concurrent reindex tasks')
+    sp_migrate_index.add_argument('--slices', dest='slices', type=int,
+                                  help='number of slices of a reindex task')
+    sp_migrate_index.add_argument('--rate', dest='rate', type=float,
+                                  help='documents per second of all tasks')
+    sp_migrate_index.add_argument('--retries', dest='retries', type=int,
+                                  help='attempts of a failed index')
+    sp_migrate_index.add_argument('--journal', dest='journal',
+                                  help='file to keep progress to resume')
+    sp_migrate_index.add_argument('--dry-run', dest='dry_run',
+                                  action='store_true',
+                                  help='only compute migration statistics')
 
     sp_inject = subparsers.add_parser('inject')
     sp_inject.set_defaults(func=inject_email)
@@ -91,6 +132,31 @@ def main(args=sys.argv):
     sp_reserved.set_defaults(func=import_reserved_names)
     sp_reserved.add_argument('-i', dest='input_file', help='csv file')
 
+    sp_migrate_raw = subparsers.add_parser(
+        'migrate_raw', help='Link messages to content addressed raw messages')
+    sp_migrate_raw.set_defaults(func=migrate_raw)
+
+    sp_gc = subparsers.add_parser('gc', help='Remove unreferenced contents')
+    sp_gc.set_defaults(func=garbage_collect)
+    sp_gc.add_argument('-t', dest='target', default='all',
+                       choices=['all', 'raws', 'attachments'])
+    sp_gc.add_argument('--grace', dest='grace_period', type=int,
+                       help='keep contents younger than this (seconds)')
+    sp_gc.add_argument('--dry-run', dest='dry_run', action='store_true',
+                       help='only list contents to remove')
+
+    sp_discussions = subparsers.add_parser(
+        'rebuild_discussions', help='Rebuild discussions summaries')
+    sp_discussions.set_defaults(func=rebuild_discussions)
+    sp_discussions.add_argument('-u', dest='username',
+                                help='only rebuild for this user')
+
+    sp_recipients = subparsers.add_parser(
+        'rebuild_recipients', help='Rebuild recipients suggestion index')
+    sp_recipients.set_defaults(func=rebuild_recipients)
+    sp_recipients.add_argument('-u', dest='username',
+                               help='only rebuild for this user')
+
     kwargs = parser.parse_args(args[1:])
     kwargs = vars(kwargs)
 
@@ -5,8 +5,13 @@ from .import_email import import_email
 from .inject_email import inject_email
 from .import_vcard import import_vcard
 from .dump_model import dump_model
+from .load_model import load_model
 from .dump_indexes_mappings import dump_indexes
 from .migrate_index import migrate_index
 from .compute import basic_compute
 from .reserved_names import import_reserved_names
+from .migrate_raw import migrate_raw
+from .gc import garbage_collect
+from .rebuild_discussions import rebuild_discussions
+from .rebuild_recipients import rebuild_recipients
 
@@ -1,38 +1,140 @@
+"""
+Dump cassandra models as newline delimited json files.
 
-from caliopen_storage.helpers.json import json, JSONEncoder
-
-
-def dump_model(model, output_path, **kwargs):
-    # Discover base core classes
-    from caliopen_main.user.core import User
-    from caliopen_storage.core import core_registry
-    _exports = {
-        'contact': ['Contact', 'Organization', 'PostalAddress', 'Email', 'IM',
-                    'Ohone', 'PublicKey', 'SocialIdentity'],
-        'message': ['Message', 'Thread'],
-        'user':    ['User', 'UserTag', 'FilterRule'],
-    }
-    for obj in _exports[model]:
-        kls = core_registry.get(obj)
-        if not kls:
-            raise Exception('core class %s not found in registry' % obj)
-        output_file = '%s/%s.json' % (output_path, obj.lower())
-        dump_model_class(kls, output_file)
-
-
-def dump_model_class(kls, output_file):
-    """Dump a model class into output file."""
-    records = kls._model_class.objects.all()
-    data = []
-    for rec in records:
-        d = {}
-        for k in rec._columns.keys():
-            attr = getattr(rec, k)
-            if hasattr(attr, 'to_python'):
-                d[k] = attr.to_python()
-            else:
-                d[k] = attr
-        data.append(d)
-    with open(output_file, 'w') as f:
-        f.write(json.dumps(data, cls=JSONEncoder,
-                           indent=4, sort_keys=True))
+Token ring is split into ranges scanned in parallel, each range is
+streamed into its own file (<output_path>/<Model>/<range>.ndjson, .gz
+when compressed), renamed once the range is fully written. Dumping again
+into same output path resumes it: ranges already written are skipped.
+Dumps are restored by the load command.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import json
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+from caliopen_cli.progress import ThroughputMeter
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SPLITS = 64
+DEFAULT_JOBS = 4
+
+_exports = {
+    'contact': ['Contact', 'ContactLookup', 'PublicKey'],
+    'message': ['Message', 'Discussion', 'DiscussionListLookup',
+                'DiscussionThreadLookup', 'RawMessage', 'RawMessageHash',
+                'RawMessageRefcount', 'RawMessageMigration',
+                'UserRawLookup', 'AttachmentRefcount'],
+    'user': ['User', 'UserName', 'LocalIdentity', 'RemoteIdentity',
+             'UserTag', 'FilterRule', 'Settings', 'Device',
+             'DevicePublicKey'],
+}
+
+
+def model_classes():
+    """Return cassandra model classes by name."""
+    from caliopen_storage.store import BaseModel
+    # Make discovery happen
+    from caliopen_main.user.core import User, Device
+    from caliopen_main.contact.objects.contact import Contact
+    from caliopen_main.message.objects.message import Message
+    from caliopen_main.message.core import AttachmentRefcount
+    from caliopen_main.message.store import RawMessageHash
+
+    classes = {}
+
+    def walk(kls):
+        for sub in kls.__subclasses__():
+            if not sub.__abstract__:
+                classes[sub.__name__] = sub
+            walk(sub)
+
+    walk(BaseModel)
+    return classes
+
+
+def resolve_models(model):
+    """Return model classes of a model group or of a model class name."""
+    classes = model_classes()
+    names = _exports.get(model, [model])
+    for name in names:
+        if name not in classes:
+            raise Exception('model class %s not found' % name)
+    return [classes[x] for x in names]
+
+
+def range_path(output_dir, index, compress):
+    return os.path.join(output_dir, '{:05d}.ndjson{}'.
+                        format(index, '.gz' if compress else ''))
+
+
+def dump_range(kls, output_dir, index, token_range, compress, meter):
+    """Stream records of a token range into its file."""
+    from caliopen_cli.ndjson import encode_record, open_file
+
+    path = range_path(output_dir, index, compress)
+    if os.path.exists(path):
+        log.debug('Range {} of {} already dumped'.format(index, kls.__name__))
+        return 0
+    tmp_path = '{}.part'.format(path)
+    count = 0
+    with open_file(tmp_path, 'w', compress) as f:
+        for record in kls.scan_token_range(*token_range):
+            f.write(encode_record(record))
+            count += 1
+            if count % 1000 == 0:
+                meter.add(1000)
+    meter.add(count % 1000)
+    os.rename(tmp_path, path)
+    return count
+
+
+def dump_model_class(kls, output_path, splits=DEFAULT_SPLITS,
+                     jobs=DEFAULT_JOBS, compress=False):
+    """Dump a model class into its output directory."""
+    from caliopen_storage.store import token_ranges
+
+    output_dir = os.path.join(output_path, kls.__name__)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    manifest = {'model': kls.__name__,
+                'table': kls.column_family_name(include_keyspace=False),
+                'splits': splits,
+                'compress': compress}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous = json.load(f)
+        if previous != manifest:
+            raise Exception('{} is a dump with other options ({}), remove '
+                            'it or use same options'.
+                            format(output_dir, previous))
+    else:
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f)
+
+    meter = ThroughputMeter('Dump of {}'.format(kls.__name__))
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    try:
+        futures = [executor.submit(dump_range, kls, output_dir, i, r,
+                                   compress, meter)
+                   for i, r in enumerate(token_ranges(splits))]
+        count = sum(x.result() for x in futures)
+    finally:
+        executor.shutdown()
+    meter.summary()
+    return count
+
+
+def dump_model(model, output_path, splits=None, jobs=None, compress=False,
+               **kwargs):
+    """Dump records of a model group (or a model class) into output_path."""
+    for kls in resolve_models(model):
+        log.info('Dumping {}'.format(kls.__name__))
+        dump_model_class(kls, output_path,
+                         splits=splits or DEFAULT_SPLITS,
+                         jobs=jobs or DEFAULT_JOBS,
+                         compress=compress)
@@ -0,0 +1,41 @@
+"""Remove stored contents no more referenced by any message."""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+def garbage_collect(target, grace_period=None, dry_run=False, **kwargs):
+    """
+    Remove unreferenced raw messages and attachments.
+
+    Raw messages of messages deleted through the Go backend are never
+    unlinked, so never collected (see RawMessage.collect).
+    """
+    from caliopen_main.message.core import RawMessage, get_attachment_store
+
+    action = 'Found' if dry_run else 'Removed'
+    if target in ('raws', 'all'):
+        if not RawMessage.is_migrated():
+            log.error('Messages are not all linked to their raw message, '
+                      'gc refused until migrate_raw has been run')
+            return
+        params = {'dry_run': dry_run}
+        if grace_period is not None:
+            params['grace_period'] = grace_period
+        removed = RawMessage.collect(**params)
+        log.info('{} {} unreferenced raw messages'.
+                 format(action, len(removed)))
+    if target in ('attachments', 'all'):
+        # deleted raw messages released their attachments
+        store = get_attachment_store()
+        if not store:
+            log.warn('No attachments bucket configured in object_store')
+            return
+        if grace_period is not None:
+            store.grace_period = grace_period
+        removed = store.collect(dry_run=dry_run)
+        log.info('{} {} unreferenced attachments'.
+                 format(action, len(removed)))
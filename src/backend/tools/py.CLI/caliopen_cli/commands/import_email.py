@@ -3,87 +3,342 @@ This script parse mail from a mbox or maildir format and import them.
 
 User must be created before import
 
+Mailbox is read as a stream of raw messages, dispatched to a pool of
+worker processes that store, parse, qualify and deliver them by batches.
+Messages of a thread (same first reference) are always dispatched to the
+same worker, in mailbox order, so that a discussion is created and
+summarized by a single worker. Participants addresses to create contacts
+for are selected by the reader, each one is sent once with the first
+message using it, so that a contact is created by a single worker.
+
+With a checkpoint file, an interrupted import resumes where it stopped:
+messages read again are deduplicated by their raw message content hash.
+Failed messages are kept in the checkpoint and imported again on resume.
 """
 from __future__ import absolute_import, print_function, unicode_literals
 
 import os
-from random import random
+import re
 import logging
+import multiprocessing
+import zlib
+from Queue import Empty, Full
+from random import random
 
-from email import message_from_file
+from email.parser import HeaderParser
 from mailbox import mbox, Maildir
 
-from caliopen_storage.exception import NotFound
+from caliopen_cli.progress import Checkpoint, ThroughputMeter
 
 log = logging.getLogger(__name__)
 
+# seconds a worker waits for messages before delivering a partial batch
+WORKER_IDLE_DELAY = 2.0
 
-def import_email(email, import_path, format, contact_probability,
-                 **kwargs):
-    """Import emails for an user."""
-    from caliopen_main.user.core import User
-    from caliopen_main.contact.core import Contact, ContactLookup
-    from caliopen_main.message.parsers.mail import MailMessage
-    from caliopen_main.contact.parameters import NewContact, NewEmail
-    from caliopen_nats.delivery import UserMessageDelivery
-    from caliopen_main.message.core import RawMessage
-    from caliopen_storage.config import Configuration
+_headers_end = re.compile(r'\r?\n\r?\n')
 
-    max_size = int(Configuration("global").get("object_store.db_size_limit"))
 
+def iter_mailbox(import_path, format):
+    """Yield (key, raw data) of messages of a mailbox, in a stable order."""
     if format == 'maildir':
-        emails = Maildir(import_path, factory=message_from_file)
-        mode = 'maildir'
+        emails = Maildir(import_path, factory=None)
+        for key in sorted(emails.iterkeys()):
+            yield key, emails.get_string(key)
+    elif os.path.isdir(import_path):
+        files = [f for f in sorted(os.listdir(import_path)) if
+                 os.path.isfile(os.path.join(import_path, f))]
+        for f in files:
+            log.debug('Importing mail from file {}'.format(f))
+            with open(os.path.join(import_path, f)) as fh:
+                yield f, fh.read()
     else:
-        if os.path.isdir(import_path):
-            mode = 'mbox_directory'
-            emails = {}
-            files = [f for f in os.listdir(import_path) if
-                     os.path.isfile(os.path.join(import_path, f))]
-            for f in files:
-                try:
-                    log.debug('Importing mail from file {}'.format(f))
-                    with open('%s/%s' % (import_path, f)) as fh:
-                        emails[f] = message_from_file(fh)
-                except Exception as exc:
-                    log.error('Error importing email {}'.format(exc))
-        else:
-            mode = 'mbox'
-            emails = mbox(import_path)
+        emails = mbox(import_path, factory=None)
+        for key in emails.iterkeys():
+            yield key, emails.get_string(key)
 
-    user = User.by_local_identity(email)
 
-    log.info("Processing mode %s" % mode)
-
-    for key, data in emails.iteritems():
-        # Prevent creating message too large to fit in db.
-        # (should use inject cmd for large messages)
-        size = len(data.as_string())
-        if size > max_size:
-            log.warn("Message too large to fit into db. \
-            Please, use 'inject' cmd for importing large emails.")
-            continue
-
-        raw = RawMessage.create(data.as_string())
-        log.debug('Created raw message {}'.format(raw.raw_msg_id))
-        message = MailMessage(data.as_string())
-        dice = random()
-        if dice <= contact_probability:
-            for participant in message.participants:
+def thread_key(key, raw_data):
+    """Return the first reference of a message thread, parsing headers."""
+    headers = HeaderParser().parsestr(_headers_end.split(raw_data, 1)[0])
+    references = (headers.get('References') or '').split()
+    if references:
+        return references[0]
+    in_reply_to = (headers.get('In-Reply-To') or '').split()
+    if in_reply_to:
+        return in_reply_to[0]
+    return (headers.get('Message-ID') or '').strip() or str(key)
+
+
+class ContactSelector(object):
+    """Select participants addresses to create contacts for, only once."""
+
+    def __init__(self, contact_probability):
+        self.contact_probability = contact_probability
+        self.seen = set()
+
+    def select(self, raw_data):
+        """Return new participants addresses of a message to create."""
+        from caliopen_main.message.parsers.mail import MailMessage
+
+        if random() > self.contact_probability:
+            return []
+        try:
+            participants = MailMessage(raw_data).participants
+        except Exception as exc:
+            log.warn('Parsing of participants failed: {}'.format(exc))
+            return []
+        addresses = set(x.address for x in participants
+                        if x.address and '@' in x.address)
+        addresses.difference_update(self.seen)
+        self.seen.update(addresses)
+        return sorted(addresses)
+
+
+class BatchImporter(object):
+    """Store and deliver batches of raw messages for an user."""
+
+    def __init__(self, user_id):
+        from caliopen_main.user.core import User
+        from caliopen_nats.delivery import UserMessageDelivery
+        from caliopen_storage.config import Configuration
+        from caliopen_storage.store import BulkIndexWriter
+
+        self.user = User.get(user_id)
+        self.max_size = int(Configuration("global").
+                            get("object_store.db_size_limit"))
+        self.writer = BulkIndexWriter()
+        self.processor = UserMessageDelivery(self.user,
+                                             index_writer=self.writer)
+
+    def _create_contacts(self, addresses):
+        """Create contacts of participants addresses without one."""
+        from caliopen_main.contact.core import Contact
+        from caliopen_main.contact.parameters import NewContact, NewEmail
+
+        known = Contact.lookup_many(self.user, addresses)
+        params = []
+        for address in sorted(x for x in known if known[x] is None):
+            log.info('Creating contact %s' % address)
+            contact_param = NewContact()
+            contact_param.family_name = address.split('@')[0]
+            e_mail = NewEmail()
+            e_mail.address = address
+            contact_param.emails = [e_mail]
+            params.append(contact_param)
+        for core, error in Contact.create_many(self.user, params,
+                                               self.writer):
+            if error is not None:
+                log.error('Creation of contact failed: {}'.format(error))
+
+    def process(self, items):
+        """
+        Import a list of (position, key, raw data, addresses).
+
+        Addresses are the participants to create contacts for. Return the
+        positions of failed messages, all other messages are done (indexed
+        too) when it returns.
+        """
+        from caliopen_main.message.core import RawMessage
+
+        failed = []
+        positions = []
+        raw_msg_ids = []
+        addresses = set()
+        # errors of previous batches
+        known_errors = len(self.writer.errors)
+        for position, key, raw_data, new_addresses in items:
+            addresses.update(new_addresses)
+            # Prevent creating message too large to fit in db, once
+            # compressed (should use inject cmd for large messages)
+            encoded = RawMessage.encode(raw_data)
+            if len(encoded[1]) > self.max_size:
+                log.warn("Message {} too large to fit into db. Please, use "
+                         "'inject' cmd for importing large emails.".
+                         format(key))
+                failed.append(position)
+                continue
+            try:
+                raw = RawMessage.create(raw_data, encoded=encoded)
+                log.debug('Created raw message {}'.format(raw.raw_msg_id))
+            except Exception as exc:
+                log.error('Import of message {} failed: {}'.format(key, exc))
+                failed.append(position)
+                continue
+            positions.append(position)
+            raw_msg_ids.append(raw.raw_msg_id)
+        if addresses:
+            self._create_contacts(sorted(addresses))
+        results = self.processor.process_batch(raw_msg_ids)
+        # messages must be indexed before being marked as done
+        self.writer.flush()
+        not_indexed = {x.id: x.error
+                       for x in self.writer.errors[known_errors:]}
+        for position, result in zip(positions, results):
+            error = result.error
+            if not error and str(result.message.message_id) in not_indexed:
+                error = 'Indexation failed: {}'. \
+                    format(not_indexed[str(result.message.message_id)])
+            if error:
+                log.error('Delivery of raw {} failed: {}'.
+                          format(result.raw_msg_id, error))
+                failed.append(position)
+            else:
+                log.debug('Created message {}'.
+                          format(result.message.message_id))
+        return failed
+
+
+def _worker(user_id, batch_size, tasks, results):
+    """Worker process: import messages of its tasks queue by batches."""
+    from caliopen_storage.helpers.connection import connect_storage
+
+    # connections of parent process must not be shared
+    connect_storage()
+    importer = BatchImporter(user_id)
+    batch = []
+    stop = False
+    while not stop:
+        idle = False
+        try:
+            item = tasks.get(timeout=WORKER_IDLE_DELAY)
+            if item is None:
+                stop = True
+            else:
+                batch.append(item)
+        except Empty:
+            idle = True
+        if batch and (stop or idle or len(batch) >= batch_size):
+            try:
+                failed = importer.process(batch)
+            except Exception:
+                log.exception('Import of a batch failed')
+                failed = [x[0] for x in batch]
+            results.put(([x[0] for x in batch], failed))
+            batch = []
+    results.put(None)
+
+
+class MailboxImport(object):
+    """Dispatch messages of a mailbox to worker processes."""
+
+    def __init__(self, user_id, workers, batch_size, contact_probability,
+                 checkpoint):
+        self.user_id = user_id
+        self.workers = workers
+        self.batch_size = batch_size
+        self.contact_probability = contact_probability
+        self.checkpoint = checkpoint
+        self.meter = ThroughputMeter('Import')
+
+    def _done(self, positions, failed):
+        failed = set(failed)
+        for position in positions:
+            self.checkpoint.done(position, failed=position in failed)
+        self.meter.add(len(positions), len(failed))
+
+    def _run_inline(self, messages):
+        importer = BatchImporter(self.user_id)
+        batch = []
+        for item in messages:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._done([x[0] for x in batch], importer.process(batch))
+                batch = []
+        if batch:
+            self._done([x[0] for x in batch], importer.process(batch))
+
+    def _drain(self, results, block=False):
+        """Account results of workers, return number of stopped ones."""
+        stopped = 0
+        while True:
+            try:
+                result = results.get(timeout=1) if block \
+                    else results.get_nowait()
+            except Empty:
+                return stopped
+            if result is None:
+                stopped += 1
+            else:
+                self._done(*result)
+            block = False
+
+    def _run_workers(self, messages):
+        results = multiprocessing.Queue()
+        queues = []
+        processes = []
+        for i in range(self.workers):
+            tasks = multiprocessing.Queue(maxsize=self.batch_size * 2)
+            args = (self.user_id, self.batch_size, tasks, results)
+            process = multiprocessing.Process(target=_worker, args=args)
+            process.daemon = True
+            process.start()
+            queues.append(tasks)
+            processes.append(process)
+        for item in messages:
+            position, key, raw_data, addresses = item
+            index = zlib.crc32(thread_key(key, raw_data)) % self.workers
+            while True:
                 try:
-                    ContactLookup.get(user, participant.address)
-                except NotFound:
-                    log.info('Creating contact %s' % participant.address)
-                    name, domain = participant.address.split('@')
-                    contact_param = NewContact()
-                    contact_param.family_name = name
-                    if participant.address:
-                        e_mail = NewEmail()
-                        e_mail.address = participant.address
-                        contact_param.emails = [e_mail]
-                    Contact.create(user, contact_param)
-        log.info('No contact associated to raw {} '.format(raw.raw_msg_id))
-
-        processor = UserMessageDelivery(user)
-        obj_message = processor.process_raw(raw.raw_msg_id)
-        log.info('Created message {}'.format(obj_message.message_id))
+                    queues[index].put(item, timeout=1)
+                    break
+                except Full:
+                    self._drain(results)
+                    if not processes[index].is_alive():
+                        raise Exception('Import worker {} stopped'.
+                                        format(index))
+            self._drain(results)
+        for tasks in queues:
+            tasks.put(None)
+        running = self.workers
+        while running:
+            running -= self._drain(results, block=True)
+            if not any(x.is_alive() for x in processes):
+                running -= self._drain(results)
+                break
+        for process in processes:
+            process.join()
+
+    def run(self, import_path, format):
+        start = self.checkpoint.load()
+        retried = set(self.checkpoint.failed)
+        previous = dict(self.checkpoint.state)
+        if retried:
+            log.info('Import again {} failed messages'.format(len(retried)))
+        contacts = ContactSelector(self.contact_probability)
+
+        def messages():
+            for position, (key, raw_data) in \
+                    enumerate(iter_mailbox(import_path, format)):
+                if position >= start or position in retried:
+                    yield (position, key, raw_data,
+                           contacts.select(raw_data))
+
+        try:
+            if self.workers:
+                self._run_workers(messages())
+            else:
+                self._run_inline(messages())
+        finally:
+            # counts of all runs of an import
+            processed = previous.get('processed', 0) + self.meter.processed
+            self.checkpoint.save(processed=processed,
+                                 failed=len(self.checkpoint.failed))
+            self.meter.summary()
+
+
+def import_email(email, import_path, format, contact_probability,
+                 batch_size=50, workers=None, checkpoint=None, **kwargs):
+    """Import emails for an user."""
+    from caliopen_main.user.core import User
+
+    user = User.by_local_identity(email)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    log.info('Importing {} ({}) with {} workers'.
+             format(import_path, format, workers))
+    key = '{}:{}:{}'.format(user.user_id, format,
+                            os.path.abspath(import_path))
+    importer = MailboxImport(user.user_id, workers, batch_size,
+                             float(contact_probability),
+                             Checkpoint(checkpoint, key))
+    importer.run(import_path, format)
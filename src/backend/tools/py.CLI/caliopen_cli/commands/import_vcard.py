@@ -1,24 +1,31 @@
-def import_vcard(username, directory, file_vcard, **kwargs):
+# -*- coding: utf-8 -*-
+"""Import vcards as contacts of an user."""
+from __future__ import absolute_import, print_function, unicode_literals
+
 
-    from caliopen_main.contact.parameters import NewContact
+def import_vcard(username, directory, file_vcard, **kwargs):
 
-    from caliopen_main.contact.core import Contact as CoreContact
     from caliopen_main.user.core.user import User as CoreUser
 
-    from caliopen_main.contact.parsers import parse_vcards
-    from caliopen_main.contact.parsers import read_file, read_directory
+    from caliopen_main.contact.importer import ContactImporter
+    from caliopen_main.contact.parsers import (iter_vcard_files,
+                                               iter_vcard_directory)
 
     vcards = []
 
     if directory:
-        vcards = read_directory(directory)
+        vcards = iter_vcard_directory(directory)
 
     if file_vcard:
-        vcards = read_file(file_vcard, True)
+        vcards = iter_vcard_files([file_vcard])
 
     user = CoreUser.by_name(username)
 
-    new_contacts = parse_vcards(vcards)
+    def progress(report):
+        print('{} vcards read, {} contacts created, {} failed'.
+              format(report.total, report.created, report.failed))
 
-    for i in new_contacts:
-        CoreContact.create(user, i)
+    report = ContactImporter(user, on_progress=progress).import_vcards(vcards)
+    for error in report.errors:
+        print('vcard #{position} failed during {stage}: {message}'.
+              format(**error))
@@ -0,0 +1,100 @@
+"""
+Load newline delimited json files of the dump command into cassandra.
+
+Files of a model are loaded in parallel. Records of a file are in token
+order, consecutive records of a partition are written with one unlogged
+batch. Loading is idempotent, except for counter models (refcounts) whose
+values are added to existing ones.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import json
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+from caliopen_cli.progress import ThroughputMeter
+
+log = logging.getLogger(__name__)
+
+# maximum number of records of a batch
+DEFAULT_BATCH_SIZE = 100
+
+
+def save_batch(kls, records):
+    """Save records of a partition with one batch."""
+    from cassandra.cqlengine.query import BatchQuery, BatchType
+
+    batch_type = BatchType.Counter if kls._has_counter else \
+        BatchType.Unlogged
+    with BatchQuery(batch_type=batch_type) as batch:
+        for record in records:
+            record.batch(batch).save()
+
+
+def load_file(kls, path, batch_size, meter):
+    """Load records of a dump file, return number of loaded records."""
+    from caliopen_cli.ndjson import decode_record, open_file
+
+    keys = list(kls._partition_keys.keys())
+    count = 0
+    batch = []
+    partition = None
+    with open_file(path) as f:
+        for line in f:
+            record = decode_record(kls, line.decode('utf-8'))
+            key = [getattr(record, x) for x in keys]
+            if batch and (key != partition or len(batch) >= batch_size):
+                save_batch(kls, batch)
+                meter.add(len(batch))
+                batch = []
+            partition = key
+            batch.append(record)
+            count += 1
+    if batch:
+        save_batch(kls, batch)
+        meter.add(len(batch))
+    log.debug('Loaded {} records from {}'.format(count, path))
+    return count
+
+
+def load_model_class(kls, input_dir, jobs, batch_size=DEFAULT_BATCH_SIZE):
+    """Load dump files of a model class."""
+    files = sorted(os.path.join(input_dir, x) for x in os.listdir(input_dir)
+                   if x.endswith('.ndjson') or x.endswith('.ndjson.gz'))
+    meter = ThroughputMeter('Load of {}'.format(kls.__name__))
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    try:
+        futures = [executor.submit(load_file, kls, x, batch_size, meter)
+                   for x in files]
+        count = sum(x.result() for x in futures)
+    finally:
+        executor.shutdown()
+    meter.summary()
+    return count
+
+
+def load_model(input_path, model=None, jobs=None, **kwargs):
+    """Load dumps of input_path, all dumped models or only model ones."""
+    from caliopen_cli.commands.dump_model import (model_classes,
+                                                  resolve_models, DEFAULT_JOBS)
+
+    if model:
+        names = [x.__name__ for x in resolve_models(model)]
+    else:
+        names = sorted(x for x in os.listdir(input_path) if
+                       os.path.exists(os.path.join(input_path, x,
+                                                   'manifest.json')))
+    classes = model_classes()
+    for name in names:
+        input_dir = os.path.join(input_path, name)
+        with open(os.path.join(input_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+        dumped = [x for x in os.listdir(input_dir)
+                  if x.endswith('.ndjson') or x.endswith('.ndjson.gz')]
+        if len(dumped) < manifest['splits']:
+            log.warn('Dump of {} is not complete, {} ranges missing'.
+                     format(name, manifest['splits'] - len(dumped)))
+        log.info('Loading {} into table {}'.format(name, manifest['table']))
+        load_model_class(classes[name], input_dir, jobs or DEFAULT_JOBS)
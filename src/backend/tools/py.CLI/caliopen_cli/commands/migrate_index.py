@@ -3,6 +3,7 @@
 # migrate_index will load the script at the given path
 # this script must implement a class named "IndexMigrator"
 # with a method "run(elasticsearch_client)"
+# or with the steps run concurrently by caliopen_cli.index_migration
 
 from __future__ import absolute_import, print_function, unicode_literals
 
@@ -10,24 +11,51 @@ import logging
 import imp
 import os
 
-from elasticsearch import Elasticsearch
 from caliopen_storage.config import Configuration
+from caliopen_cli.index_migration import (MigrationRunner, DEFAULT_JOBS,
+                                          DEFAULT_SLICES, DEFAULT_RETRIES)
+from caliopen_cli.progress import Journal
+from caliopen_storage.helpers.connection import get_index_connection
 
 log = logging.getLogger(__name__)
 logging.basicConfig(level=logging.WARN)
 
 
-def migrate_index(**kwargs):
-    Migrator = load_from_file(kwargs["input_script"])
+def migrate_index(input_script, jobs=None, slices=None, rate=None,
+                  retries=None, journal=None, dry_run=False, **kwargs):
+    Migrator = load_from_file(input_script)
     if Migrator:
         url = Configuration('global').get('elasticsearch.url')
         mappings_version = Configuration('global').get(
             'elasticsearch.mappings_version')
         if url and mappings_version:
-            client = Elasticsearch(url)
+            client = get_index_connection(url)
             migration = Migrator(client=client,
                                  mappings_version=mappings_version)
-            migration.run()
+            if not hasattr(migration, 'migration_target'):
+                if dry_run:
+                    log.warn('Script has no migration steps, no dry run')
+                    return
+                migration.run()
+                return
+            key = '{}:{}'.format(os.path.basename(input_script),
+                                 mappings_version)
+            runner = MigrationRunner(client, migration,
+                                     Journal(journal, key),
+                                     jobs=jobs or DEFAULT_JOBS,
+                                     slices=slices or DEFAULT_SLICES,
+                                     rate=rate,
+                                     retries=DEFAULT_RETRIES
+                                     if retries is None else retries)
+            runner.journal.load()
+            indexes = runner.plan()
+            runner.statistics(indexes)
+            if dry_run:
+                return
+            failed = runner.run(indexes)
+            if failed:
+                log.error('Migration of {} indexes failed: {}'.
+                          format(len(failed), ', '.join(sorted(failed))))
 
 
 def load_from_file(filepath):
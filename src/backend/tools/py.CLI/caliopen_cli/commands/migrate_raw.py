@@ -0,0 +1,59 @@
+"""
+Migrate raw messages to content addressed storage.
+
+Compute content hash of raw messages stored without it, reference one
+raw message by content and link user messages to it, so that duplicate
+raw messages can be removed by the gc command.
+Migration can be run many times, already linked messages are skipped.
+Its completion is recorded, gc refuses to run before.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+def migrate_raw(**kwargs):
+    """Link user messages to content addressed raw messages."""
+    from caliopen_storage.helpers.connection import get_index_connection
+    from caliopen_main.message.core import RawMessage, UserRawLookup
+    from caliopen_main.message.store import (RawMessage as ModelRaw,
+                                             Message as ModelMessage,
+                                             IndexedMessage)
+
+    # raw_msg_id of duplicate raw messages to the one referenced
+    duplicates = {}
+    hashed = 0
+    for model in ModelRaw.all():
+        raw = RawMessage(model)
+        if not model.content_hash:
+            hashed += 1
+        canonical = raw.canonical()
+        if canonical.model.raw_msg_id != model.raw_msg_id:
+            duplicates[model.raw_msg_id] = canonical.model.raw_msg_id
+    log.info('Hashed {} raw messages, found {} duplicates'.
+             format(hashed, len(duplicates)))
+
+    client = get_index_connection()
+    doc_type = IndexedMessage._doc_type.name
+    linked = 0
+    for message in ModelMessage.all():
+        if not message.raw_msg_id:
+            continue
+        raw_msg_id = duplicates.get(message.raw_msg_id, message.raw_msg_id)
+        if raw_msg_id != message.raw_msg_id:
+            message.update(raw_msg_id=raw_msg_id)
+            try:
+                client.update(index=str(message.user_id), doc_type=doc_type,
+                              id=str(message.message_id),
+                              body={'doc': {'raw_msg_id': str(raw_msg_id)}})
+            except Exception as exc:
+                log.warn('Update of indexed message {} failed: {}'.
+                         format(message.message_id, exc))
+        if UserRawLookup.link(message.user_id, raw_msg_id,
+                              message.message_id):
+            linked += 1
+    log.info('Linked {} messages to their raw message'.format(linked))
+    RawMessage.mark_migrated()
@@ -0,0 +1,31 @@
+"""
+Rebuild discussions summaries from indexed messages.
+
+Summaries are maintained when messages are delivered, changed or
+deleted, this command computes them again from indexed messages, for
+messages indexed before, after an index migration or to repair them.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+def rebuild_discussions(username=None, **kwargs):
+    """Rebuild discussions summaries of an user, or of all users."""
+    from caliopen_storage.store import BulkIndexWriter
+    from caliopen_main.user.core import User
+    from caliopen_main.user.store import User as ModelUser
+    from caliopen_main.discussion.core import DiscussionSummary
+
+    if username:
+        user_ids = [User.by_name(username).user_id]
+    else:
+        user_ids = [x.user_id for x in ModelUser.all()]
+    for user_id in user_ids:
+        with BulkIndexWriter() as writer:
+            count = DiscussionSummary(user_id, writer=writer).rebuild()
+        log.info('Rebuilt {} discussions of user {} ({} errors)'.
+                 format(count, user_id, len(writer.errors)))
@@ -0,0 +1,33 @@
+"""
+Rebuild recipients suggestion index from contacts and messages.
+
+Recipients are maintained when messages are delivered and contacts
+changed, this command indexes them again for existing users or to
+repair them.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+def rebuild_recipients(username=None, **kwargs):
+    """Rebuild recipients suggestion index of an user, or of all users."""
+    from caliopen_storage.store import BulkIndexWriter
+    from caliopen_main.user.core import User
+    from caliopen_main.user.store import User as ModelUser
+    from caliopen_main.contact.store import RecipientIndexManager
+
+    if username:
+        users = [User.by_name(username)]
+    else:
+        users = [User(x) for x in ModelUser.all()]
+    for user in users:
+        with BulkIndexWriter() as writer:
+            contacts, messages = RecipientIndexManager(user.user_id). \
+                rebuild(writer, exclude_contact=user.contact_id)
+        log.info('Indexed recipients of {} contacts and {} messages of user '
+                 '{} ({} errors)'.format(contacts, messages, user.user_id,
+                                         len(writer.errors)))
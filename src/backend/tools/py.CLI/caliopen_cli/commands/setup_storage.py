@@ -13,6 +13,7 @@ def setup_storage(settings=None):
     from caliopen_main.user.core import User, Device
     from caliopen_main.contact.objects.contact import Contact
     from caliopen_main.message.objects.message import Message
+    from caliopen_main.message.core import AttachmentRefcount
     from caliopen_main.common.objects.tag import ResourceTag
 
     from cassandra.cqlengine.management import sync_table, \
@@ -27,3 +28,20 @@ def setup_storage(settings=None):
         if hasattr(kls._model_class, 'pk'):
             # XXX find a better way to detect model from udt
             sync_table(kls._model_class)
+    # models without core class
+    from caliopen_main.message.store import (RawMessageHash,
+                                             RawMessageRefcount,
+                                             RawMessageMigration)
+    for kls in (RawMessageHash, RawMessageRefcount, RawMessageMigration):
+        log.info('Creating cassandra model %s' % kls.__name__)
+        sync_table(kls)
+
+    # object store bucket of received attachments, others are created by
+    # go services
+    from caliopen_main.message.core import get_attachment_store
+    store = get_attachment_store()
+    if store and not store.store.client.bucket_exists(store.bucket):
+        log.info('Creating object store bucket %s' % store.bucket)
+        store.store.client.make_bucket(
+            store.bucket,
+            location=Configuration('global').get('object_store.location'))
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Run index migrations of a migrator script concurrently.
+
+Each index is migrated in steps: a new index is created by the migrator,
+filled by an asynchronous (and sliced) reindex task of elasticsearch,
+then the migrator swaps the alias to the new index and deletes the old
+one. Up to `jobs` reindex tasks run at the same time, all sharing a global
+throughput (documents per second), tasks being rethrottled each time
+their number changes.
+
+Steps reached by each index are written into a journal: an interrupted
+migration resumes where it stopped, following running reindex tasks
+(they go on server side, a task started just before an interruption is
+found by its description) and retrying failed indexes.
+
+A migrator script is run this way when its IndexMigrator implements:
+    - migration_target(index): return (alias, new index) or None to skip
+    - create_new_index(new_index)
+    - swap(alias, index, new_index): move alias and delete old index
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+import time
+
+from elasticsearch.exceptions import NotFoundError
+
+from caliopen_cli.progress import ThroughputMeter
+
+log = logging.getLogger(__name__)
+
+DEFAULT_JOBS = 4
+DEFAULT_SLICES = 2
+DEFAULT_RETRIES = 3
+# seconds between two polls of reindex tasks
+POLL_INTERVAL = 2.0
+# seconds before first retry of a failed index, doubled at each attempt
+RETRY_DELAY = 10.0
+
+PENDING = 'pending'
+REINDEXING = 'reindexing'
+COPIED = 'copied'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class MigrationRunner(object):
+    """Migrate indexes with a migrator, following steps in a journal."""
+
+    def __init__(self, client, migrator, journal, jobs=DEFAULT_JOBS,
+                 slices=DEFAULT_SLICES, rate=None, retries=DEFAULT_RETRIES):
+        self.client = client
+        self.migrator = migrator
+        self.journal = journal
+        self.jobs = jobs
+        self.slices = slices
+        self.rate = rate
+        self.retries = retries
+        self.meter = ThroughputMeter('Reindex')
+        self.running = {}
+        self.queue = []
+        self._throttled = set()
+        self._copied = {}
+
+    def plan(self):
+        """Return indexes to migrate, with their journal item set up."""
+        indexes = []
+        for index in sorted(self.client.indices.get('_all')):
+            item = self.journal.items.get(index)
+            if item is None:
+                target = self.migrator.migration_target(index)
+                if target is None:
+                    continue
+                item = self.journal.get(index)
+                item.update(state=PENDING, alias=target[0],
+                            new_index=target[1], attempts=0)
+            elif item['state'] == FAILED:
+                # new run, retry it
+                item.update(state=PENDING, attempts=0)
+            indexes.append(index)
+        self.journal.save()
+        return indexes
+
+    def statistics(self, indexes):
+        """Return and log statistics of a migration, without running it."""
+        stats = self.client.indices.stats(index='_all', metric='docs,store')
+        stats = stats['indices']
+        states = {}
+        docs = 0
+        size = 0
+        for index in indexes:
+            state = self.journal.items[index]['state']
+            states[state] = states.get(state, 0) + 1
+            if state == DONE or index not in stats:
+                continue
+            primaries = stats[index]['primaries']
+            docs += primaries['docs']['count']
+            size += primaries['store']['size_in_bytes']
+            log.info('{} -> {}: {} documents'.
+                     format(index, self.journal.items[index]['new_index'],
+                            primaries['docs']['count']))
+        result = {'indexes': len(indexes), 'states': states,
+                  'documents': docs, 'size': size}
+        if self.rate:
+            result['estimated_duration'] = docs / float(self.rate)
+        log.info('Migration of {} indexes ({}), {} documents to copy, '
+                 '{:.1f} MB{}'.
+                 format(len(indexes), states, docs, size / 1048576.0,
+                        ', at least {:.0f}s at {}/s'.
+                        format(result['estimated_duration'], self.rate)
+                        if self.rate else ''))
+        return result
+
+    def _params(self, count):
+        """Reindex parameters of a task with count tasks running."""
+        params = {}
+        if self.rate:
+            params['requests_per_second'] = \
+                float(self.rate) / max(count, 1)
+        return params
+
+    def _throttle(self):
+        """Share global rate between running tasks."""
+        tasks = set(self.running.values())
+        if not self.rate or tasks == self._throttled:
+            return
+        self._throttled = tasks
+        params = self._params(len(tasks))
+        for index, task in self.running.items():
+            try:
+                self.client.reindex_rethrottle(task_id=task, params=params)
+            except Exception as exc:
+                log.warn('Rethrottle of {} failed: {}'.format(index, exc))
+
+    def _failed(self, index, error):
+        item = self.journal.get(index)
+        attempts = item.get('attempts', 0) + 1
+        self.running.pop(index, None)
+        # a copied index only needs its swap to be retried
+        state = COPIED if item['state'] == COPIED else PENDING
+        if attempts > self.retries:
+            log.error('Migration of {} failed: {}'.format(index, error))
+            self.journal.update(index, state=FAILED, attempts=attempts,
+                                error=str(error), task=None)
+            return
+        delay = RETRY_DELAY * 2 ** (attempts - 1)
+        log.warn('Migration of {} failed ({}), retry in {:.0f}s'.
+                 format(index, error, delay))
+        self.journal.update(index, state=state, attempts=attempts,
+                            error=str(error), task=None,
+                            retry_at=time.time() + delay)
+        self.queue.append(index)
+
+    def _start(self, index):
+        """Start migration of an index, its reindex task or its swap."""
+        item = self.journal.get(index)
+        alias, new_index = item['alias'], item['new_index']
+        if item['state'] == COPIED:
+            return self._swap(index)
+        try:
+            if self.client.indices.exists(index=new_index):
+                if self.client.indices.exists_alias(index=new_index,
+                                                    name=alias):
+                    # swapped by a run not journaled
+                    self.journal.update(index, state=COPIED)
+                    return self._swap(index)
+                task = self._find_task(index, new_index)
+                if task:
+                    # started by an interrupted run, not journaled
+                    log.info('Following reindex task {} of {}'.
+                             format(task, index))
+                    self.journal.update(index, state=REINDEXING, task=task)
+                    self.running[index] = task
+                    return
+                # left by a failed attempt
+                self.client.indices.delete(index=new_index)
+            self.migrator.create_new_index(new_index)
+            params = self._params(len(self.running) + 1)
+            if self.slices > 1:
+                params['slices'] = self.slices
+            params['wait_for_completion'] = 'false'
+            body = {'source': {'index': index}, 'dest': {'index': new_index}}
+            task = self.client.reindex(body=body, params=params)['task']
+        except Exception as exc:
+            return self._failed(index, exc)
+        log.info('Reindexing {} into {} (task {})'.
+                 format(index, new_index, task))
+        self.journal.update(index, state=REINDEXING, task=task)
+        self.running[index] = task
+
+    def _find_task(self, index, new_index):
+        """Return id of a running reindex task of index, None if none."""
+        tasks = self.client.tasks.list(actions='*reindex', detailed=True)
+        source = 'reindex from [{}]'.format(index)
+        dest = ' to [{}]'.format(new_index)
+        for node in tasks.get('nodes', {}).values():
+            for task_id, task in node.get('tasks', {}).items():
+                description = task.get('description', '')
+                # slices of a task have a parent
+                if 'parent_task_id' not in task and \
+                        description.startswith(source) and \
+                        description.endswith(dest):
+                    return task_id
+        return None
+
+    def _count(self, index, status):
+        """Account documents copied since last poll of a task."""
+        copied = status.get('created', 0) + status.get('updated', 0)
+        self.meter.add(max(copied - self._copied.get(index, 0), 0))
+        self._copied[index] = copied
+        return copied
+
+    def _poll(self, index):
+        task = self.running[index]
+        try:
+            result = self.client.tasks.get(task_id=task)
+        except NotFoundError:
+            return self._failed(index, 'reindex task {} lost'.format(task))
+        except Exception as exc:
+            log.warn('Poll of task {} failed: {}'.format(task, exc))
+            return
+        if not result.get('completed'):
+            self._count(index, result['task'].get('status', {}))
+            return
+        del self.running[index]
+        response = result.get('response', {})
+        if 'error' in result:
+            return self._failed(index, result['error'])
+        if response.get('failures'):
+            return self._failed(index, response['failures'][0])
+        copied = self._count(index, response)
+        self.journal.update(index, state=COPIED, task=None, documents=copied)
+        self._swap(index)
+
+    def _swap(self, index):
+        item = self.journal.get(index)
+        try:
+            self.migrator.swap(item['alias'], index, item['new_index'])
+        except Exception as exc:
+            return self._failed(index, exc)
+        log.info('Migrated {} into {}'.format(index, item['new_index']))
+        self.journal.update(index, state=DONE, error=None)
+
+    def _next(self):
+        """Return next index ready to be started, None if none."""
+        now = time.time()
+        for index in self.queue:
+            if self.journal.get(index).get('retry_at', 0) <= now:
+                self.queue.remove(index)
+                return index
+        return None
+
+    def run(self, indexes):
+        """Migrate indexes, return journal items of failed ones."""
+        for index in indexes:
+            item = self.journal.get(index)
+            if item['state'] == REINDEXING:
+                log.info('Following reindex task {} of {}'.
+                         format(item['task'], index))
+                self.running[index] = item['task']
+            elif item['state'] != DONE:
+                self.queue.append(index)
+        try:
+            while self.queue or self.running:
+                while len(self.running) < self.jobs:
+                    index = self._next()
+                    if index is None:
+                        break
+                    self._start(index)
+                self._throttle()
+                time.sleep(POLL_INTERVAL)
+                for index in list(self.running):
+                    self._poll(index)
+        finally:
+            self.journal.save()
+            self.meter.summary()
+        return {index: item for index, item in self.journal.items.items()
+                if item['state'] == FAILED}
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Newline delimited json encoding of cassandra records.
+
+Each record is a json object on its own line, keyed by column name.
+Values are encoded according to their column type, so that a record can
+be decoded back to a model instance without loss (uuid, datetime with
+microseconds, blob, user defined types and collections). Json object
+keys are strings, map keys are decoded back according to their column.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import base64
+import datetime
+import decimal
+import gzip
+import io
+import uuid
+
+import pytz
+from cassandra.cqlengine import columns
+
+from caliopen_storage.helpers.json import json
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_value(column, value):
+    """Encode a column value into a json compatible one."""
+    if value is None:
+        return None
+    if isinstance(column, columns.UserDefinedType):
+        return {name: encode_value(col, value[name])
+                for name, col in column.user_type._fields.items()}
+    if isinstance(column, (columns.List, columns.Set)):
+        return [encode_value(column.value_col, x) for x in value]
+    if isinstance(column, columns.Map):
+        return {encode_value(column.key_col, k):
+                encode_value(column.value_col, v) for k, v in value.items()}
+    if isinstance(column, columns.UUID):
+        return str(value)
+    if isinstance(column, columns.DateTime):
+        if value.tzinfo is not None:
+            value = value.astimezone(pytz.utc).replace(tzinfo=None)
+        return value.strftime(DATETIME_FORMAT)
+    if isinstance(column, columns.Blob):
+        return base64.b64encode(value).decode('ascii')
+    return value
+
+
+def decode_key(column, key):
+    """Decode a map key, given as a string whatever its column type."""
+    if isinstance(column, (columns.Integer, columns.VarInt)):
+        return int(key)
+    if isinstance(column, columns.BaseFloat):
+        return float(key)
+    if isinstance(column, columns.Decimal):
+        return decimal.Decimal(key)
+    if isinstance(column, columns.Boolean):
+        return key == 'true'
+    return decode_value(column, key)
+
+
+def decode_value(column, value):
+    """Decode a json value into a column value."""
+    if value is None:
+        return None
+    if isinstance(column, columns.UserDefinedType):
+        fields = column.user_type._fields
+        return column.user_type(**{name: decode_value(fields[name], v)
+                                   for name, v in value.items()
+                                   if name in fields})
+    if isinstance(column, columns.List):
+        return [decode_value(column.value_col, x) for x in value]
+    if isinstance(column, columns.Set):
+        return set(decode_value(column.value_col, x) for x in value)
+    if isinstance(column, columns.Map):
+        return {decode_key(column.key_col, k):
+                decode_value(column.value_col, v) for k, v in value.items()}
+    if isinstance(column, columns.UUID):
+        return uuid.UUID(value)
+    if isinstance(column, columns.DateTime):
+        return datetime.datetime.strptime(value, DATETIME_FORMAT)
+    if isinstance(column, columns.Blob):
+        return base64.b64decode(value)
+    return value
+
+
+def encode_record(record):
+    """Return the json line of a model instance, utf-8 encoded."""
+    data = {name: encode_value(column, getattr(record, name))
+            for name, column in record._columns.items()}
+    return (json.dumps(data, sort_keys=True) + '\n').encode('utf-8')
+
+
+def decode_record(model_class, line):
+    """Return a model instance from its json line."""
+    data = json.loads(line)
+    columns_ = model_class._columns
+    return model_class(**{name: decode_value(columns_[name], value)
+                          for name, value in data.items()
+                          if name in columns_})
+
+
+def open_file(path, mode='r', compress=None):
+    """
+    Open a dump file in binary mode.
+
+    File is gzip compressed if compress is true or, when not given, if it
+    is named with .gz extension.
+    """
+    if compress is None:
+        compress = path.endswith('.gz')
+    if compress:
+        return gzip.open(path, mode + 'b')
+    return io.open(path, mode + 'b')
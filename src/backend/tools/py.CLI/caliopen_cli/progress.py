@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Progress helpers of long running commands.
+
+A Checkpoint keeps on disk the position reached by a command, so that it
+can be resumed after an interruption. A Journal keeps the state of each
+item of a command processing items out of order. A ThroughputMeter logs
+processed items per second.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# seconds between two saves of a checkpoint or two logs of throughput
+DEFAULT_INTERVAL = 10.0
+
+
+class Checkpoint(object):
+    """
+    Position of a command saved in a json file.
+
+    Items are numbered from 0 in reading order, they can be done out of
+    order by parallel workers: saved position is the low watermark, all
+    items before it are done. Items done with a failure are kept apart,
+    to be processed again on resume. A checkpoint is only resumed by a
+    command with same key (same user and source for an import).
+    """
+
+    def __init__(self, path, key, interval=DEFAULT_INTERVAL):
+        self.path = path
+        self.key = key
+        self.interval = interval
+        self.position = 0
+        self.state = {}
+        self.failed = set()
+        self._done = set()
+        self._saved_at = time.time()
+
+    def load(self):
+        """Load saved position, return it (0 when nothing to resume)."""
+        if not self.path or not os.path.exists(self.path):
+            return self.position
+        with open(self.path) as fh:
+            data = json.load(fh)
+        if data.get('key') != self.key:
+            log.warn('Checkpoint {} is for {}, ignore it'.
+                     format(self.path, data.get('key')))
+            return self.position
+        self.position = data['position']
+        self.state = data.get('state', {})
+        self.failed = set(data.get('failed', []))
+        log.info('Resume from position {}'.format(self.position))
+        return self.position
+
+    def done(self, position, failed=False):
+        """Mark item at position as done, save checkpoint from time to time."""
+        if failed:
+            self.failed.add(position)
+        else:
+            self.failed.discard(position)
+        if position >= self.position:
+            self._done.add(position)
+            while self.position in self._done:
+                self._done.remove(self.position)
+                self.position += 1
+        if time.time() - self._saved_at >= self.interval:
+            self.save()
+
+    def save(self, **state):
+        """Write checkpoint atomically, with extra state values."""
+        self.state.update(state)
+        self._saved_at = time.time()
+        if not self.path:
+            return
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as fh:
+            json.dump({'key': self.key, 'position': self.position,
+                       'failed': sorted(self.failed),
+                       'state': self.state}, fh)
+        os.rename(tmp_path, self.path)
+
+
+class Journal(object):
+    """
+    States of items of a command saved in a json file.
+
+    Each item (keyed by name) has a dict of values, like its processing
+    step. As for a Checkpoint, a journal is only resumed by a command with
+    same key.
+    """
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.items = {}
+
+    def load(self):
+        """Load saved items, return them (empty when nothing to resume)."""
+        if not self.path or not os.path.exists(self.path):
+            return self.items
+        with open(self.path) as fh:
+            data = json.load(fh)
+        if data.get('key') != self.key:
+            log.warn('Journal {} is for {}, ignore it'.
+                     format(self.path, data.get('key')))
+            return self.items
+        self.items = data.get('items', {})
+        log.info('Resume journal of {} items'.format(len(self.items)))
+        return self.items
+
+    def get(self, name):
+        return self.items.setdefault(name, {})
+
+    def update(self, name, **values):
+        """Update values of an item and save journal."""
+        self.get(name).update(values)
+        self.save()
+
+    def save(self):
+        """Write journal atomically."""
+        if not self.path:
+            return
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as fh:
+            json.dump({'key': self.key, 'items': self.items}, fh,
+                      indent=1, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+
+class ThroughputMeter(object):
+    """Count processed items and log their rate per second, thread safe."""
+
+    def __init__(self, name, interval=DEFAULT_INTERVAL):
+        self.name = name
+        self.interval = interval
+        self.processed = 0
+        self.failed = 0
+        self.started = time.time()
+        self._logged_at = self.started
+        self._logged_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        elapsed = time.time() - self.started
+        return self.processed / elapsed if elapsed else 0.0
+
+    def add(self, count=1, failed=0):
+        """Count processed items (failed ones included)."""
+        with self._lock:
+            self.processed += count
+            self.failed += failed
+            now = time.time()
+            if now - self._logged_at < self.interval:
+                return
+            current = (self.processed - self._logged_count) / \
+                (now - self._logged_at)
+            log.info('{}: {} processed, {} failed, {:.1f}/s '
+                     '(last {:.0f}s: {:.1f}/s)'.
+                     format(self.name, self.processed, self.failed,
+                            self.rate, now - self._logged_at, current))
+            self._logged_at = now
+            self._logged_count = self.processed
+
+    def summary(self):
+        """Log final counts and rate."""
+        log.info('{}: {} processed, {} failed in {:.1f}s, {:.1f}/s'.
+                 format(self.name, self.processed, self.failed,
+                        time.time() - self.started, self.rate))
@@ -0,0 +1,169 @@
+"""Test checkpoint and dispatch of a mailbox import."""
+
+import importlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+from caliopen_cli.progress import Checkpoint
+
+# module is shadowed by its command function in commands package
+import_email = importlib.import_module('caliopen_cli.commands.import_email')
+
+
+def mail(sender, *recipients):
+    return 'From: {}\nTo: {}\nSubject: test\n\nbody\n'. \
+        format(sender, ', '.join(recipients))
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'checkpoint.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_low_watermark(self):
+        checkpoint = Checkpoint(None, 'key')
+        checkpoint.done(2)
+        checkpoint.done(3)
+        self.assertEqual(checkpoint.position, 0)
+        checkpoint.done(0)
+        self.assertEqual(checkpoint.position, 1)
+        checkpoint.done(1)
+        self.assertEqual(checkpoint.position, 4)
+
+    def test_failed_kept(self):
+        checkpoint = Checkpoint(self.path, 'key')
+        checkpoint.done(0)
+        checkpoint.done(1, failed=True)
+        checkpoint.done(2)
+        # failed items do not hold the position back
+        self.assertEqual(checkpoint.position, 3)
+        checkpoint.save(processed=3)
+
+        resumed = Checkpoint(self.path, 'key')
+        self.assertEqual(resumed.load(), 3)
+        self.assertEqual(resumed.failed, {1})
+        self.assertEqual(resumed.state, {'processed': 3})
+        # retried with success, before saved position
+        resumed.done(1)
+        self.assertEqual(resumed.failed, set())
+        self.assertEqual(resumed.position, 3)
+
+    def test_key_mismatch(self):
+        checkpoint = Checkpoint(self.path, 'user1:mbox:/tmp/a')
+        checkpoint.done(0, failed=True)
+        checkpoint.save()
+        other = Checkpoint(self.path, 'user2:mbox:/tmp/a')
+        self.assertEqual(other.load(), 0)
+        self.assertEqual(other.failed, set())
+
+    def test_saved_from_time_to_time(self):
+        checkpoint = Checkpoint(self.path, 'key', interval=0)
+        checkpoint.done(0)
+        self.assertEqual(Checkpoint(self.path, 'key').load(), 1)
+
+
+class TestContactSelector(unittest.TestCase):
+
+    @mock.patch.object(import_email, 'random', return_value=0.0)
+    def test_addresses_selected_once(self, random):
+        selector = import_email.ContactSelector(0.5)
+        self.assertEqual(selector.select(mail('a@x.org', 'b@x.org')),
+                         ['a@x.org', 'b@x.org'])
+        self.assertEqual(selector.select(mail('b@x.org', 'c@x.org',
+                                              'a@x.org')),
+                         ['c@x.org'])
+
+    @mock.patch.object(import_email, 'random', return_value=0.9)
+    def test_probability(self, random):
+        selector = import_email.ContactSelector(0.5)
+        self.assertEqual(selector.select(mail('a@x.org', 'b@x.org')), [])
+        self.assertEqual(selector.seen, set())
+
+
+class FakeImporter(object):
+    """BatchImporter failing messages of given positions."""
+
+    batches = []
+    failing = set()
+
+    def __init__(self, user_id):
+        pass
+
+    def process(self, items):
+        positions = [x[0] for x in items]
+        self.batches.append(positions)
+        return [x for x in positions if x in self.failing]
+
+
+class TestMailboxImport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'checkpoint.json')
+        FakeImporter.batches = []
+        FakeImporter.failing = set()
+        messages = [('key{}'.format(i), mail('a@x.org', 'b@x.org'))
+                    for i in range(6)]
+        patches = [
+            mock.patch.object(import_email, 'BatchImporter', FakeImporter),
+            mock.patch.object(import_email, 'iter_mailbox',
+                              side_effect=lambda *args: iter(messages))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_import(self):
+        checkpoint = Checkpoint(self.path, 'key')
+        importer = import_email.MailboxImport('user', 0, 2, 0.0, checkpoint)
+        importer.run('mbox', 'mbox')
+        return checkpoint
+
+    def test_resume(self):
+        FakeImporter.failing = {1, 4}
+        checkpoint = self.run_import()
+        self.assertEqual(FakeImporter.batches, [[0, 1], [2, 3], [4, 5]])
+        self.assertEqual(checkpoint.position, 6)
+        self.assertEqual(checkpoint.failed, {1, 4})
+
+        # failed messages only are imported again
+        FakeImporter.batches = []
+        FakeImporter.failing = {4}
+        checkpoint = self.run_import()
+        self.assertEqual(FakeImporter.batches, [[1, 4]])
+        self.assertEqual(checkpoint.failed, {4})
+        self.assertEqual(checkpoint.state['processed'], 8)
+
+    def test_resume_from_position(self):
+        checkpoint = Checkpoint(self.path, 'key')
+        checkpoint.position = 3
+        checkpoint.failed = {1}
+        checkpoint.save()
+        checkpoint = self.run_import()
+        self.assertEqual(FakeImporter.batches, [[1, 3], [4, 5]])
+        self.assertEqual(checkpoint.position, 6)
+        self.assertEqual(checkpoint.failed, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+"""Test concurrent index migrations following a journal."""
+
+import os
+import unittest
+
+import mock
+from elasticsearch.exceptions import NotFoundError
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+from caliopen_cli import index_migration
+from caliopen_cli.index_migration import (MigrationRunner, PENDING,
+                                          REINDEXING, COPIED, DONE, FAILED,
+                                          RETRY_DELAY)
+from caliopen_cli.progress import Journal
+
+
+class FakeClock(object):
+    """Replace time module, sleeping only moves time forward."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.now += delay
+
+
+class FakeIndices(object):
+
+    def __init__(self, names):
+        self.names = set(names)
+        self.aliases = {}
+        self.deleted = []
+
+    def get(self, index):
+        return {x: {} for x in self.names}
+
+    def exists(self, index):
+        return index in self.names
+
+    def exists_alias(self, index, name):
+        return self.aliases.get(name) == index
+
+    def delete(self, index):
+        self.names.discard(index)
+        self.deleted.append(index)
+
+
+class FakeTasks(object):
+
+    def __init__(self):
+        # results returned by successive get, then a completed task
+        self.results = []
+        self.running = {}
+
+    def get(self, task_id):
+        if self.results:
+            result = self.results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return {'completed': True, 'response': {'created': 3}}
+
+    def list(self, actions=None, detailed=None):
+        return {'nodes': {'node1': {'tasks': self.running}}}
+
+
+class FakeClient(object):
+
+    def __init__(self, names):
+        self.indices = FakeIndices(names)
+        self.tasks = FakeTasks()
+        self.reindexed = []
+
+    def reindex(self, body, params):
+        self.reindexed.append(body)
+        return {'task': 'node1:{}'.format(len(self.reindexed))}
+
+    def reindex_rethrottle(self, task_id, params):
+        pass
+
+
+class FakeMigrator(object):
+
+    def __init__(self, client, swap_failures=0):
+        self.client = client
+        self.swap_failures = swap_failures
+        self.created = []
+        self.swapped = []
+
+    def migration_target(self, index):
+        return 'alias-{}'.format(index), '{}-v2'.format(index)
+
+    def create_new_index(self, new_index):
+        self.created.append(new_index)
+        self.client.indices.names.add(new_index)
+
+    def swap(self, alias, index, new_index):
+        if self.swap_failures:
+            self.swap_failures -= 1
+            raise Exception('alias update failed')
+        self.swapped.append((alias, index, new_index))
+
+
+class TestMigrationRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patch = mock.patch.object(index_migration, 'time', self.clock)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.client = FakeClient(['idx'])
+        self.migrator = FakeMigrator(self.client)
+        self.journal = Journal(None, 'test')
+
+    def runner(self, **kwargs):
+        return MigrationRunner(self.client, self.migrator, self.journal,
+                               **kwargs)
+
+    def journaled(self, state, **values):
+        values.update(state=state, alias='alias-idx', new_index='idx-v2')
+        self.journal.get('idx').update(values)
+
+    def test_migration(self):
+        runner = self.runner()
+        self.assertEqual(runner.plan(), ['idx'])
+        self.assertEqual(runner.run(['idx']), {})
+        self.assertEqual(self.migrator.swapped,
+                         [('alias-idx', 'idx', 'idx-v2')])
+        self.assertEqual(self.journal.items['idx']['state'], DONE)
+        self.assertEqual(self.journal.items['idx']['documents'], 3)
+
+    def test_resume_running_task(self):
+        self.journaled(REINDEXING, task='node1:42', attempts=0)
+        self.client.tasks.results = [
+            {'completed': False, 'task': {'status': {'created': 1}}}]
+        self.assertEqual(self.runner().run(['idx']), {})
+        # task is followed, not started again
+        self.assertEqual(self.client.reindexed, [])
+        self.assertEqual(self.migrator.created, [])
+        self.assertEqual(self.journal.items['idx']['state'], DONE)
+
+    def test_follow_task_not_journaled(self):
+        # interrupted after reindex started, before journal update
+        self.journaled(PENDING, attempts=0)
+        self.client.indices.names.add('idx-v2')
+        self.client.tasks.running = {
+            'node1:7': {'description': 'reindex from [idx] to [idx-v2]'},
+            'node1:8': {'description': 'reindex from [idx] to [idx-v2]',
+                        'parent_task_id': 'node1:7'}}
+        self.assertEqual(self.runner().run(['idx']), {})
+        self.assertEqual(self.client.indices.deleted, [])
+        self.assertEqual(self.client.reindexed, [])
+        self.assertEqual(self.journal.items['idx']['state'], DONE)
+
+    def test_failed_attempt_cleaned(self):
+        self.journaled(PENDING, attempts=0)
+        self.client.indices.names.add('idx-v2')
+        self.client.tasks.running = {
+            'node1:7': {'description': 'reindex from [other] to [idx-v2]'}}
+        self.assertEqual(self.runner().run(['idx']), {})
+        self.assertEqual(self.client.indices.deleted, ['idx-v2'])
+        self.assertEqual(len(self.client.reindexed), 1)
+
+    def test_retry_swap_of_copied_index(self):
+        self.journaled(COPIED, attempts=0)
+        self.migrator.swap_failures = 1
+        self.assertEqual(self.runner().run(['idx']), {})
+        self.assertEqual(self.client.reindexed, [])
+        self.assertEqual(len(self.migrator.swapped), 1)
+        item = self.journal.items['idx']
+        self.assertEqual((item['state'], item['attempts']), (DONE, 1))
+
+    def test_exponential_backoff(self):
+        retries = []
+
+        def update(name, **values):
+            if values.get('retry_at'):
+                retries.append(values['retry_at'] - self.clock.now)
+            self.journal.get(name).update(values)
+
+        self.journal.update = update
+        self.client.tasks.results = [NotFoundError(404, 'lost')] * 4
+        self.journaled(PENDING, attempts=0)
+        failed = self.runner(retries=3).run(['idx'])
+        self.assertEqual(retries, [RETRY_DELAY, RETRY_DELAY * 2,
+                                   RETRY_DELAY * 4])
+        self.assertEqual(failed['idx']['state'], FAILED)
+        self.assertEqual(failed['idx']['attempts'], 4)
+        self.assertEqual(len(self.client.reindexed), 4)
+
+    def test_failed_index_reset(self):
+        self.journaled(FAILED, attempts=4, error='lost')
+        runner = self.runner()
+        self.assertEqual(runner.plan(), ['idx'])
+        item = self.journal.items['idx']
+        self.assertEqual((item['state'], item['attempts']), (PENDING, 0))
+        self.assertEqual(runner.run(['idx']), {})
+        self.assertEqual(self.journal.items['idx']['state'], DONE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""Test ndjson encoding of records of dump and load commands."""
+
+import datetime
+import importlib
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+
+import mock
+import pytz
+from cassandra.cqlengine import columns
+from cassandra.cqlengine.models import Model
+from cassandra.cqlengine.usertype import UserType
+
+from caliopen_storage.config import Configuration
+
+if 'CALIOPEN_BASEDIR' in os.environ:
+    conf_file = '{}/src/backend/configs/caliopen.yaml.template'. \
+                format(os.environ['CALIOPEN_BASEDIR'])
+else:
+    conf_file = '../../../../configs/caliopen.yaml.template'
+
+Configuration.load(conf_file, 'global')
+
+from caliopen_cli.ndjson import encode_record, decode_record, open_file
+from caliopen_cli.progress import ThroughputMeter
+
+# module is shadowed by its command function in commands package
+load_model = importlib.import_module('caliopen_cli.commands.load_model')
+
+
+class DumpedAddress(UserType):
+
+    address_id = columns.UUID()
+    label = columns.Text()
+    date_insert = columns.DateTime()
+
+
+class DumpedItem(Model):
+
+    user_id = columns.UUID(primary_key=True)
+    item_id = columns.TimeUUID(primary_key=True)
+    date_insert = columns.DateTime()
+    date_update = columns.DateTime()
+    raw = columns.Blob()
+    size = columns.BigInt()
+    score = columns.Double()
+    address = columns.UserDefinedType(DumpedAddress)
+    addresses = columns.List(columns.UserDefinedType(DumpedAddress))
+    tags = columns.Set(columns.Text)
+    by_uuid = columns.Map(columns.UUID, columns.DateTime)
+    by_int = columns.Map(columns.Integer, columns.Text)
+    by_float = columns.Map(columns.Float, columns.Boolean)
+    by_flag = columns.Map(columns.Boolean, columns.Integer)
+
+
+class DumpedCount(Model):
+
+    raw_msg_id = columns.Text(primary_key=True)
+    refcount = columns.Counter()
+
+
+def round_trip(record):
+    line = encode_record(record)
+    assert line.endswith(b'\n') and line.count(b'\n') == 1
+    return decode_record(type(record), line.decode('utf-8'))
+
+
+class TestNdjson(unittest.TestCase):
+
+    def test_scalars(self):
+        naive = datetime.datetime(2018, 3, 1, 12, 30, 15, 123456)
+        aware = pytz.timezone('Europe/Paris').localize(naive)
+        item = DumpedItem(user_id=uuid.uuid4(), item_id=uuid.uuid1(),
+                          date_insert=naive, date_update=aware,
+                          raw=b'\x00\xff\x10 raw', size=2 ** 40,
+                          score=0.25)
+        decoded = round_trip(item)
+        self.assertEqual(decoded.user_id, item.user_id)
+        self.assertEqual(decoded.item_id, item.item_id)
+        self.assertEqual(decoded.date_insert, naive)
+        # stored as utc, as cassandra returns it
+        self.assertEqual(decoded.date_update,
+                         aware.astimezone(pytz.utc).replace(tzinfo=None))
+        self.assertEqual(decoded.raw, b'\x00\xff\x10 raw')
+        self.assertEqual(decoded.size, 2 ** 40)
+        self.assertEqual(decoded.score, 0.25)
+        self.assertIsNone(decoded.address)
+
+    def test_user_defined_types(self):
+        date = datetime.datetime(2018, 3, 1, 12, 30, 15, 1)
+        address = DumpedAddress(address_id=uuid.uuid4(), label=u'h\xf4me',
+                                date_insert=date)
+        item = DumpedItem(user_id=uuid.uuid4(), item_id=uuid.uuid1(),
+                          address=address, addresses=[address, address])
+        decoded = round_trip(item)
+        self.assertEqual(decoded.address, address)
+        self.assertIsInstance(decoded.address.address_id, uuid.UUID)
+        self.assertEqual(decoded.address.date_insert, date)
+        self.assertEqual(decoded.addresses, [address, address])
+
+    def test_collections(self):
+        key = uuid.uuid4()
+        date = datetime.datetime(2018, 3, 1, 12, 30, 15, 42)
+        item = DumpedItem(user_id=uuid.uuid4(), item_id=uuid.uuid1(),
+                          tags={u'inbox', u'\xe9t\xe9'},
+                          by_uuid={key: date},
+                          by_int={1: u'one', -2: u'minus two'},
+                          by_float={0.5: True, 2.0: False},
+                          by_flag={True: 1, False: 0})
+        decoded = round_trip(item)
+        self.assertEqual(decoded.tags, {u'inbox', u'\xe9t\xe9'})
+        # json keys are strings, decoded back according to key column
+        self.assertEqual(decoded.by_uuid, {key: date})
+        self.assertEqual(decoded.by_int, {1: u'one', -2: u'minus two'})
+        self.assertEqual(decoded.by_float, {0.5: True, 2.0: False})
+        self.assertEqual(decoded.by_flag, {True: 1, False: 0})
+
+    def test_counter(self):
+        count = DumpedCount(raw_msg_id='abc', refcount=3)
+        self.assertEqual(round_trip(count).refcount, 3)
+
+
+class TestLoadFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @mock.patch.object(load_model, 'save_batch')
+    def test_batches_by_partition(self, save_batch):
+        users = [uuid.uuid4(), uuid.uuid4()]
+        items = [DumpedItem(user_id=users[0], item_id=uuid.uuid1())
+                 for _ in range(3)] + \
+                [DumpedItem(user_id=users[1], item_id=uuid.uuid1())]
+        path = os.path.join(self.tmp_dir, 'DumpedItem-0.ndjson.gz')
+        with open_file(path, 'w') as f:
+            for item in items:
+                f.write(encode_record(item))
+        count = load_model.load_file(DumpedItem, path, 2,
+                                     ThroughputMeter('test'))
+        self.assertEqual(count, 4)
+        batches = [[x.item_id for x in call[0][1]]
+                   for call in save_batch.call_args_list]
+        self.assertEqual(batches, [[items[0].item_id, items[1].item_id],
+                                   [items[2].item_id],
+                                   [items[3].item_id]])